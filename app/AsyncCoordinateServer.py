@@ -0,0 +1,468 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+from utils.AdmissionControl import AdmissionRejected
+from utils.GPTTools import ToolCallStreamFilter, ToolCallParseError
+from utils.LazyComponent import LazyComponent, resolve
+from utils.Telemetry import METRICS_CONTENT_TYPE, telemetry
+
+# The async server shares its components and conversation state with the Flask
+# server, so both can be run side by side against the same configuration.
+# The module is referenced (rather than importing names) so that replacing a
+# component on `core` is picked up here as well.
+import app.CoordinateServer as core
+
+# --- FastAPI App Initialization ---
+# Run with: uvicorn app.AsyncCoordinateServer:app --host 0.0.0.0 --port 8000
+# (or `uvicorn --factory app.AsyncCoordinateServer:create_app` to warm up at startup).
+# The routes live on a router; `create_app` (at the bottom) builds the app around it.
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+# --- Helper Functions ---
+# The conversation store (SQLite, MongoDB), the prompt files and the tool-result
+# shaper block, so they are called on worker threads rather than on the event loop.
+
+def _start_turn(conversation_id: Optional[str], user_messages: list) -> str:
+    """
+    Picks up prompt changes, opens the conversation and stores the new user
+    messages; returns the conversation ID. Run on a worker thread.
+    """
+    core._refresh_system_prompt()
+    conversation_id = core._get_or_create_conversation(conversation_id)
+    core.conversation_store.append(conversation_id, user_messages)
+    return conversation_id
+
+
+async def _abuild_turn_components():
+    """
+    Builds the components a chat turn uses on the event loop (admission, the
+    tool speculator and with it the tool executor, the LM wrapper) on a worker
+    thread, if the warm-up has not built them yet.
+    """
+    unbuilt = [component for component in (core.admission, core.tool_speculator, core.lm_wrapper)
+               if isinstance(component, LazyComponent)]
+    if unbuilt:
+        await asyncio.to_thread(lambda: [resolve(component) for component in unbuilt])
+
+
+async def _aparse_tool_calls(conversation_id: str, llm_response_text: str) -> tuple:
+    """
+    Async version of `_parse_tool_calls`.
+    """
+    try:
+        with telemetry.span("parse"):
+            return llm_response_text, core.parsing_utils.tool_calls_parsing(llm_response_text)
+    except ToolCallParseError as e:
+        logger.warning("%s. Asking the model to correct the tool call.", e, extra={"tool": e.tool_name})
+        with telemetry.span("reask", tool=e.tool_name):
+            reask_messages = await asyncio.to_thread(core._reask_messages, conversation_id, llm_response_text, e)
+            llm_response_text = await core.lm_wrapper.aget_completion(reask_messages)
+    try:
+        with telemetry.span("parse"):
+            return llm_response_text, core.parsing_utils.tool_calls_parsing(llm_response_text)
+    except ToolCallParseError as e:
+        return core._invalid_tool_call_message(e), []
+
+
+async def _aget_completion(messages: list) -> tuple:
+    """
+    Async version of `_get_completion`; speculative calls run as tasks.
+    """
+    if not core.tool_speculator.enabled:
+        return await core.lm_wrapper.aget_completion(messages=messages), None
+    run, deltas = core.tool_speculator.start(asynchronous=True), []
+    async for delta in core.lm_wrapper.astream_completion(messages):
+        deltas.append(delta)
+        run.feed(delta)
+    run.finish()
+    return "".join(deltas), run
+
+
+async def _aexecute_tools(tool_calls: list, run=None) -> list:
+    """
+    Async version of `_execute_tools`.
+    """
+    logger.info("Executing %d tool call(s)", len(tool_calls), extra={"tools": core._tool_names(tool_calls)})
+    with telemetry.span("tools", count=len(tool_calls)):
+        if run:
+            return await run.aexecute_tools(tool_calls)
+        return await core.tool_executor.aexecute_tools(tool_calls)
+
+
+async def _ahandle_tool_call_loop(conversation_id: str, initial_llm_response: str, run=None) -> dict:
+    """
+    Async version of `_handle_tool_call_loop`: the tool calls and the summary
+    completion are awaited so the event loop can serve other conversations meanwhile.
+    """
+    llm_response_text = initial_llm_response
+
+    for _ in range(core.MAX_TOOL_STEPS):
+        llm_response_text, tool_calls = await _aparse_tool_calls(conversation_id, llm_response_text)
+
+        if not tool_calls:
+            # Not a tool call, just return the response
+            return {"role": "assistant", "content": llm_response_text}
+
+        # 1. Execute all tools of this response concurrently
+        tool_results = await _aexecute_tools(tool_calls, run)
+
+        # 2. Append the tool interactions to history
+        await asyncio.to_thread(core._record_tool_interactions, conversation_id, llm_response_text, tool_calls,
+                                tool_results)
+
+        # 3. Call LLM again to get a natural language summary (or further tool calls)
+        logger.debug("Tools executed. Getting summary from LLM...")
+        with telemetry.span("summary"):
+            messages = await asyncio.to_thread(core.conversation_store.get_messages, conversation_id)
+            llm_response_text, run = await _aget_completion(messages)
+
+    if core._has_tool_calls(llm_response_text):
+        llm_response_text = core._tool_step_limit_message()
+
+    # 4. Return the final, summarized response
+    return {"role": "assistant", "content": llm_response_text}
+
+
+async def _aacquire_slot(request: Request, priority: str):
+    """
+    Async version of `_acquire_slot`.
+    """
+    with telemetry.span("admission", priority=priority):
+        client_address = request.client.host if request.client else ""
+        return await core.admission.aacquire(priority, core._rate_limit_key(request.headers, client_address))
+
+
+def _admission_rejection(error: AdmissionRejected) -> JSONResponse:
+    body, headers = core._admission_rejection(error)
+    return JSONResponse(body, status_code=error.status, headers=headers)
+
+
+async def _astream_chat(conversation_id: str, slot=None):
+    """
+    Async version of `_stream_chat`, yielding the same Server-Sent Events.
+    """
+    try:
+        with telemetry.span("request", endpoint="/api/chat/stream", conversation_id=conversation_id):
+            async for event in _astream_chat_turn(conversation_id):
+                yield event
+    finally:
+        if slot is not None:
+            slot.release()
+
+
+async def _astream_chat_turn(conversation_id: str):
+    yield core._sse_event("conversation", {"conversation_id": conversation_id})
+
+    for step in range(core.MAX_TOOL_STEPS + 1):
+        # 1. Stream the completion; it is shown only if it is not a tool call
+        stream_filter = ToolCallStreamFilter()
+        run = core.tool_speculator.start(asynchronous=True) if core.tool_speculator.enabled else None
+        with telemetry.span("completion" if step == 0 else "summary"):
+            messages = await asyncio.to_thread(core.conversation_store.get_messages, conversation_id)
+            async for delta in core.lm_wrapper.astream_completion(messages):
+                if run:
+                    run.feed(delta)
+                visible = stream_filter.feed(delta)
+                if visible:
+                    yield core._sse_event("delta", {"content": visible})
+            if run:
+                run.finish()
+            visible = stream_filter.finish()
+            if visible:
+                yield core._sse_event("delta", {"content": visible})
+
+        llm_response_text, tool_calls = await _aparse_tool_calls(conversation_id, stream_filter.text)
+        if not tool_calls:
+            if stream_filter.is_tool_call:
+                # The tool call could not be corrected; nothing of it was shown yet
+                yield core._sse_event("delta", {"content": llm_response_text})
+            break
+        if step == core.MAX_TOOL_STEPS:
+            llm_response_text = core._tool_step_limit_message()
+            yield core._sse_event("delta", {"content": llm_response_text})
+            break
+
+        # 2. Execute the tools of this response concurrently, then loop for the summary
+        for tool_call in tool_calls:
+            yield core._sse_event("tool_call", tool_call)
+        tool_results = await _aexecute_tools(tool_calls, run)
+        await asyncio.to_thread(core._record_tool_interactions, conversation_id, llm_response_text, tool_calls,
+                                tool_results)
+        logger.debug("Tools executed. Streaming summary from LLM...")
+
+    assistant_response = {"role": "assistant", "content": llm_response_text}
+    await asyncio.to_thread(core.conversation_store.append, conversation_id, [assistant_response])
+    yield core._sse_event("done", {"conversation_id": conversation_id, "response": assistant_response})
+
+
+# --- Request Metrics ---
+
+class RequestMetricsMiddleware:
+    """
+    Records every request in the telemetry metrics once its response starts.
+    A plain ASGI middleware, so streamed responses pass through untouched.
+    """
+
+    def __init__(self, asgi_app):
+        self.app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        # Logging and telemetry are set up with the config, on the first request at the latest.
+        # A config that cannot be loaded is reported by `/api/ready`; health and readiness still answer.
+        try:
+            resolve(core.config)
+        except Exception:
+            pass
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                headers = dict(message.get("headers") or [])
+                request_bytes = dict(scope.get("headers") or []).get(b"content-length")
+                response_bytes = headers.get(b"content-length")
+                telemetry.record_request(route.path if route is not None else "unmatched", scope["method"],
+                                         message["status"], time.perf_counter() - started,
+                                         int(request_bytes) if request_bytes else None,
+                                         int(response_bytes) if response_bytes else None)
+            await send(message)
+
+        await self.app(scope, receive, send_and_record)
+
+
+# --- Startup and Readiness ---
+
+# Held here until done, so the event loop does not drop the task
+_warm_up_tasks = set()
+
+
+async def _awarm_up():
+    """
+    Async version of `_warm_up`: the components are built on a thread, and
+    the connections are opened in the pools of the async clients.
+    """
+    try:
+        await asyncio.to_thread(core._build_components)
+        await core.tool_executor.awarm_up()
+        await core.lm_wrapper.awarm_up(prefill=core._warm_up_prefill())
+    except Exception as e:
+        core._finish_warm_up(e)
+    else:
+        core._finish_warm_up()
+
+
+def start_warm_up() -> dict:
+    """
+    Async version of `start_warm_up`; the warm-up runs as a task of the event loop.
+    """
+    if core._begin_warm_up():
+        task = asyncio.get_running_loop().create_task(_awarm_up())
+        _warm_up_tasks.add(task)
+        task.add_done_callback(_warm_up_tasks.discard)
+    return core._readiness()
+
+
+# --- API Endpoints ---
+
+@router.post("/api/chat")
+async def chat_endpoint(request: Request):
+    """
+    Handles chat requests, manages conversation history, and orchestrates LLM tool usage.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or "messages" not in data:
+        return JSONResponse({"error": "Invalid request body, 'messages' field is required."}, status_code=400)
+
+    user_messages = data["messages"]
+    await _abuild_turn_components()
+    priority = core.admission.classify(request.headers.get("X-Priority"), user_messages)
+    try:
+        slot = await _aacquire_slot(request, priority)
+    except AdmissionRejected as e:
+        return _admission_rejection(e)
+
+    with slot, telemetry.span("request", endpoint="/api/chat", priority=priority) as span:
+        # Add new user messages to the history
+        conversation_id = await asyncio.to_thread(_start_turn, data.get("conversation_id"), user_messages)
+        span.set(conversation_id=conversation_id)
+        full_history = await asyncio.to_thread(core.conversation_store.get_messages, conversation_id)
+
+        # --- LLM and Tool Execution ---
+        with telemetry.span("completion"):
+            llm_response_text, run = await _aget_completion(full_history)
+        assistant_response = await _ahandle_tool_call_loop(conversation_id, llm_response_text, run)
+
+        # Append the final assistant's response to history
+        await asyncio.to_thread(core.conversation_store.append, conversation_id, [assistant_response])
+
+        # Serialized here rather than by FastAPI, so that it is part of the trace
+        with telemetry.span("response"):
+            return JSONResponse({
+                "conversation_id": conversation_id,
+                "response": assistant_response
+            }, headers={"X-Conversation-Id": conversation_id})
+
+
+@router.post("/api/chat/stream")
+async def chat_stream_endpoint(request: Request):
+    """
+    Server-Sent-Events variant of `/api/chat` that streams the response tokens.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or "messages" not in data:
+        return JSONResponse({"error": "Invalid request body, 'messages' field is required."}, status_code=400)
+
+    await _abuild_turn_components()
+    try:
+        slot = await _aacquire_slot(request, core.admission.classify(request.headers.get("X-Priority"),
+                                                                     data["messages"]))
+    except AdmissionRejected as e:
+        return _admission_rejection(e)
+
+    try:
+        conversation_id = await asyncio.to_thread(_start_turn, data.get("conversation_id"), data["messages"])
+    except BaseException:
+        # The stream never starts, so nothing else would release the slot
+        slot.release()
+        raise
+
+    # The slot is released when the stream ends; the background task covers a
+    # stream that never started
+    return StreamingResponse(
+        _astream_chat(conversation_id, slot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Conversation-Id": conversation_id},
+        background=BackgroundTask(slot.release),
+    )
+
+
+@router.get("/api/health")
+async def health():
+    """
+    Liveness probe; answers at once, before any component is built.
+    """
+    return {"status": "ok", "pid": os.getpid()}
+
+
+@router.get("/api/ready")
+async def ready():
+    """
+    Readiness probe: 200 once every component is built and the connections to
+    the model server and the Go server are open, else 503. A cold server
+    starts its warm-up here, and a failed one tries again.
+    """
+    readiness = start_warm_up()
+    return JSONResponse(readiness, status_code=200 if readiness["status"] == "ready" else 503)
+
+
+@router.get("/api/stats")
+async def get_stats():
+    """
+    Returns runtime statistics of the server's components.
+    """
+    return await asyncio.to_thread(_stats)
+
+
+def _stats() -> dict:
+    return {
+        "tool_executor": core.tool_executor.get_stats(),
+        "conversation_store": core.conversation_store.get_stats(),
+        "lm_wrapper": core.lm_wrapper.get_stats(),
+        "prompt_builder": core.prompt_builder.get_stats(),
+        "tool_parsing": core.parsing_utils.get_stats(),
+        "telemetry": telemetry.get_stats(),
+        "admission": core.admission.get_stats(),
+        "tool_results": core.tool_result_shaper.get_stats(),
+        "speculative_tools": core.tool_speculator.get_stats(),
+    }
+
+
+@router.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: request counts and latency, time per pipeline stage and
+    per tool, token counts, payload sizes, and admission queue depth and waits.
+    """
+    return Response(telemetry.render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+@router.get("/api/conversations")
+async def get_conversations_list(request: Request):
+    """
+    Returns one page of conversation summaries (ID, start time, last activity
+    and title), as `{"conversations": [...], "next_cursor": ...}`.
+    """
+    try:
+        page = await asyncio.to_thread(core._list_conversations, request.query_params)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return StreamingResponse(core._stream_json(page, "conversations"), media_type="application/json")
+
+
+@router.get("/api/conversations/{conversation_id}")
+async def get_conversation_history(conversation_id: str, request: Request):
+    """
+    Returns a range of a conversation's messages (`since`, `limit`), with
+    tool results left out unless `include_tool_results=true`.
+    """
+    try:
+        history = await asyncio.to_thread(core._history_range, conversation_id, request.query_params)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if history is None:
+        return JSONResponse({"error": "Conversation not found."}, status_code=404)
+
+    return StreamingResponse(core._stream_json(history, "messages"), media_type="application/json")
+
+
+@router.get("/api/conversations/{conversation_id}/tool_results/{ref}")
+async def get_full_tool_result(conversation_id: str, ref: str):
+    """
+    Returns the full result of a tool call whose shaped version in the
+    history carries `ref`.
+    """
+    full_result = await asyncio.to_thread(core.tool_result_shaper.get_full_result, conversation_id, ref)
+    if full_result is None:
+        return JSONResponse({"error": "Tool result not found."}, status_code=404)
+    return full_result
+
+
+def create_app(config_path: Optional[str] = None, warm_up: bool = True) -> FastAPI:
+    """
+    Builds the FastAPI app; the arguments are those of the Flask server's
+    `create_app`. With `warm_up`, the warm-up starts with the server.
+    """
+    if config_path:
+        core._config_path = str(config_path)
+
+    @asynccontextmanager
+    async def lifespan(_app):
+        if warm_up:
+            start_warm_up()
+        yield
+
+    asgi_app = FastAPI(title="CoordinateServer (async)", lifespan=lifespan)
+    asgi_app.include_router(router)
+    asgi_app.add_middleware(RequestMetricsMiddleware)
+    return asgi_app
+
+
+app = create_app(warm_up=False)
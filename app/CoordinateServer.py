@@ -1,20 +1,30 @@
-import uuid
-import datetime
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, g, request, jsonify
 from flask.wrappers import Response
 
+from utils import load_config
+from utils.LazyComponent import LazyComponent, component_status, resolve
+from utils.AdmissionControl import AdmissionRejected, create_admission_controller
 from utils.LMWrapper import LMWrapper
 from utils.ToolExecutor import ToolExecutor
-from utils.GPTTools import PromptBuilder, GPTParsingUtils
+from utils.ToolResultShaper import ToolResultShaper
+from utils.ToolSpeculation import ToolSpeculator
+from utils.ConversationStore import create_conversation_store
+from utils.GPTTools import PromptBuilder, GPTParsingUtils, ToolCallStreamFilter, ToolCallParseError
+from utils.Telemetry import METRICS_CONTENT_TYPE, configure_logging, telemetry
 
 import json
+import logging
+import threading
+import time
+from typing import Optional
 
 import os
 from dotenv import load_dotenv
 load_dotenv()
 
 # --- Flask App Initialization ---
-app = Flask(__name__)
+# The routes live on a blueprint; `create_app` (at the bottom) builds the app around it
+api = Blueprint("api", __name__)
 GO_SERVER_URL = os.getenv("GO_SERVER_URL")
 
 # --- Server Configuration & Initialization ---
@@ -32,76 +42,501 @@ When a user gives a command, you should first determine which tool(s) to use.
 Then, respond with the appropriate tool call in the specified format. If no tool is needed, respond in natural language.
 """
 
-# In-memory storage for chat histories
-# In a production environment, you would replace this with a database (e.g., Redis, MongoDB).
-# We will create a ChatHistory class to store the chat history later.
-chat_histories: dict = {}
+# Page sizes of the conversation listing and of the history endpoint (in messages)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+DEFAULT_HISTORY_LIMIT = 200
+MAX_HISTORY_LIMIT = 1000
 
+# Maximum number of tool-call rounds per chat turn. Each round runs every tool call
+# of one model response in parallel and then asks the model again, so chained
+# calls (e.g. find dirty panels, then dispatch to them) are possible.
+MAX_TOOL_STEPS = 5
 
 # Initialize the core components
-# NOTE: The following lines assume that LMWrapper() can be initialized without arguments
-# and will be refactored later to load its configuration from files.
-tool_executor = ToolExecutor(go_server_base_url=GO_SERVER_URL)
-prompt_builder = PromptBuilder(base_prompt_template=SYSTEM_PROMPT_TEMPLATE)
-lm_wrapper = LMWrapper()
+# Every component is built on first use (see utils/LazyComponent.py), so importing
+# this module stays cheap and `/api/health` answers at once; `/api/ready` (or
+# `create_app()`) builds them ahead of the first chat instead.
+logger = logging.getLogger(__name__)
+# The configure.json the components are built from; `create_app` can point it elsewhere
+_config_path: Optional[str] = None
+
+
+def _build_config() -> dict:
+    loaded = load_config(_config_path)
+    # Structured, level-controlled logging plus request tracing and /metrics (see "telemetry")
+    configure_logging(loaded.get("telemetry"))
+    telemetry.configure(loaded.get("telemetry"))
+    return loaded
+
+
+def _build_tool_executor() -> ToolExecutor:
+    return ToolExecutor(go_server_base_url=GO_SERVER_URL, config=config.get("go_server"),
+                        cache_config=config.get("tool_cache"), fleet_config=config.get("fleet_state"))
+
+
+def _build_lm_wrapper() -> LMWrapper:
+    wrapper = LMWrapper(config_path=_config_path)
+    wrapper.set_system_prompt(prompt_builder.build_system_prompt())
+    wrapper.set_tools(prompt_builder.get_tools())
+    logger.info("System prompt initialized")
+    return wrapper
+
+
+config = LazyComponent("config", _build_config, globals())
+# Chat histories live in the store selected by the "conversation_store" config section
+# (bounded in-memory LRU by default; SQLite or MongoDB to persist and share them).
+conversation_store = LazyComponent("conversation_store",
+                                   lambda: create_conversation_store(config.get("conversation_store")), globals())
+tool_executor = LazyComponent("tool_executor", _build_tool_executor, globals())
+# Runs read-only tool calls while the model is still writing its reply (see "speculative_tools")
+tool_speculator = LazyComponent("tool_speculator", lambda: ToolSpeculator.from_config(
+    resolve(tool_executor), config.get("speculative_tools")), globals())
+prompt_builder = LazyComponent("prompt_builder", lambda: PromptBuilder(
+    base_prompt_template=SYSTEM_PROMPT_TEMPLATE, **config.get("prompt", {})), globals())
+lm_wrapper = LazyComponent("lm_wrapper", _build_lm_wrapper, globals())
 parsing_utils = GPTParsingUtils()
+# Bounds the chat turns running against the model at once, queueing the rest by
+# priority, and rate-limits each API key (see "admission")
+admission = LazyComponent("admission", lambda: create_admission_controller(config.get("admission")), globals())
+# Projects, limits and aggregates tool results before they enter the history,
+# as declared per tool in tools.json (see "tool_results")
+tool_result_shaper = LazyComponent("tool_result_shaper", lambda: ToolResultShaper.from_config(
+    config.get("tool_results"), prompt_builder.get_tools(), estimator=lm_wrapper.token_estimator), globals())
 
-
-# Set the system prompt for the LMWrapper instance
-# NOTE: This assumes we will add a `set_system_prompt` method to LMWrapper
-system_prompt = prompt_builder.build_system_prompt()
-lm_wrapper.set_system_prompt(system_prompt)
-print("--- System Prompt Initialized ---")
+# In build order, which `/api/ready` reports
+_COMPONENTS = [config, conversation_store, tool_executor, tool_speculator, prompt_builder, lm_wrapper, admission,
+               tool_result_shaper]
 
 
 # --- Helper Functions ---
+# These are shared with the async server in `app/AsyncCoordinateServer.py`.
+
+def _refresh_system_prompt() -> None:
+    """
+    Picks up changes to tools.json. While nothing changed, PromptBuilder returns
+    the very same cached string, so the prompt prefix stays byte-identical.
+    A change also recompiles the tool-argument validators.
+    """
+    prompt = prompt_builder.build_system_prompt()
+    if prompt is not lm_wrapper.system_prompt:
+        lm_wrapper.set_system_prompt(prompt)
+        lm_wrapper.set_tools(prompt_builder.get_tools())
+        tool_executor.set_tools(prompt_builder.get_tools())
+        tool_result_shaper.set_tools(prompt_builder.get_tools())
+
+
+def _rate_limit_key(headers, client_address: str) -> str:
+    """
+    The key a request is rate-limited by: its API key (X-API-Key or a bearer
+    token), else the client's address.
+    """
+    key = headers.get("X-API-Key")
+    if not key:
+        authorization = headers.get("Authorization", "")
+        if authorization.lower().startswith("bearer "):
+            key = authorization[7:].strip()
+    return key or client_address or "anonymous"
+
+
+def _admission_rejection(error: AdmissionRejected) -> tuple:
+    """
+    The body and headers of a 429/503 answer to a request that was not admitted.
+    """
+    return {"error": error.message, "reason": error.reason}, {"Retry-After": str(error.retry_after)}
+
+
+def _acquire_slot(priority: str):
+    """
+    Waits for an in-flight slot for a chat turn; raises AdmissionRejected.
+    """
+    with telemetry.span("admission", priority=priority):
+        return admission.acquire(priority, _rate_limit_key(request.headers, request.remote_addr))
+
 
-def _handle_tool_call_loop(conversation_id: str, initial_llm_response: str) -> dict:
+def _get_or_create_conversation(conversation_id: str) -> str:
     """
-    Handles the logic for executing a tool call, sending the result back to the LLM,
+    Returns the given conversation ID if it is known, otherwise starts a new
+    conversation and returns its freshly generated ID.
+    """
+    if not conversation_id or not conversation_store.exists(conversation_id):
+        conversation_id = conversation_store.create()
+    return conversation_id
+
+
+def _record_tool_interactions(conversation_id: str, llm_response: str, tool_calls: list, tool_results: list) -> None:
+    """
+    Appends the assistant's tool calls and the results of all of them to the
+    conversation history as one batch, each result shaped as its tool declares.
+    """
+    # First, the assistant's decision to call the tools
+    messages = [{
+        "role": "assistant",
+        "content": llm_response
+    }]
+    # Then, the result of each tool execution, in call order
+    for tool_call, tool_result in zip(tool_calls, tool_results):
+        content = tool_result_shaper.shape(conversation_id, tool_call["tool_name"], tool_result)
+        telemetry.record_payload("tool_result", len(content))
+        messages.append({
+            "role": "tool",
+            "name": tool_call["tool_name"],
+            "content": content
+        })
+    conversation_store.append(conversation_id, messages)
+
+
+def _reask_messages(conversation_id: str, llm_response: str, error: ToolCallParseError) -> list:
+    """
+    The history plus the malformed reply and a request to repeat the call with
+    valid arguments. Neither is stored in the conversation.
+    """
+    return conversation_store.get_messages(conversation_id) + [
+        {"role": "assistant", "content": llm_response},
+        {"role": "user", "content": f"Your call to the tool '{error.tool_name}' could not be used: its arguments "
+                                    f"are not a valid JSON object. Repeat the tool call with valid JSON arguments."},
+    ]
+
+
+def _invalid_tool_call_message(error: ToolCallParseError) -> str:
+    return f"Error: The model produced an invalid call to '{error.tool_name}' twice: {error}"
+
+
+def _parse_tool_calls(conversation_id: str, llm_response_text: str) -> tuple:
+    """
+    Returns the response text and its tool calls. If the arguments of a call
+    are malformed beyond repair, the model is asked once to correct them and
+    its corrected response replaces the malformed one.
+    """
+    try:
+        with telemetry.span("parse"):
+            return llm_response_text, parsing_utils.tool_calls_parsing(llm_response_text)
+    except ToolCallParseError as e:
+        logger.warning("%s. Asking the model to correct the tool call.", e, extra={"tool": e.tool_name})
+        with telemetry.span("reask", tool=e.tool_name):
+            llm_response_text = lm_wrapper.get_completion(_reask_messages(conversation_id, llm_response_text, e))
+    try:
+        with telemetry.span("parse"):
+            return llm_response_text, parsing_utils.tool_calls_parsing(llm_response_text)
+    except ToolCallParseError as e:
+        return _invalid_tool_call_message(e), []
+
+
+def _has_tool_calls(llm_response_text: str) -> bool:
+    try:
+        return bool(parsing_utils.tool_calls_parsing(llm_response_text))
+    except ToolCallParseError:
+        return True
+
+
+def _tool_names(tool_calls: list) -> list:
+    return [call["tool_name"] for call in tool_calls]
+
+
+def _tool_step_limit_message() -> str:
+    return f"Error: Stopped after {MAX_TOOL_STEPS} rounds of tool calls without a final answer."
+
+
+def _get_completion(messages: list) -> tuple:
+    """
+    Returns the completion of `messages` and its SpeculativeRun. With
+    speculative tools on, the completion is streamed and the read-only tool
+    calls in it are started as soon as their arguments are complete;
+    otherwise the run is None.
+    """
+    if not tool_speculator.enabled:
+        return lm_wrapper.get_completion(messages=messages), None
+    run, deltas = tool_speculator.start(), []
+    for delta in lm_wrapper.stream_completion(messages):
+        deltas.append(delta)
+        run.feed(delta)
+    run.finish()
+    return "".join(deltas), run
+
+
+def _execute_tools(tool_calls: list, run=None) -> list:
+    """
+    Executes the tool calls of one response concurrently, using the results
+    of the calls `run` already started speculatively.
+    """
+    logger.info("Executing %d tool call(s)", len(tool_calls), extra={"tools": _tool_names(tool_calls)})
+    with telemetry.span("tools", count=len(tool_calls)):
+        return run.execute_tools(tool_calls) if run else tool_executor.execute_tools(tool_calls)
+
+
+def _handle_tool_call_loop(conversation_id: str, initial_llm_response: str, run=None) -> dict:
+    """
+    Handles the logic for executing tool calls, sending the results back to the LLM,
     and getting a final natural language response.
+    Every tool call in a response is executed in parallel, and the LLM is asked
+    again until it stops calling tools or MAX_TOOL_STEPS rounds have run.
+    `run` holds the tool calls started speculatively during the first completion.
     Returns the final assistant message dictionary.
     """
-    tool_call = parsing_utils.tool_usage_parsing(initial_llm_response)
+    llm_response_text = initial_llm_response
 
-    if not tool_call:
-        # Not a tool call, just return the original response
-        return {"role": "assistant", "content": initial_llm_response}
+    for _ in range(MAX_TOOL_STEPS):
+        llm_response_text, tool_calls = _parse_tool_calls(conversation_id, llm_response_text)
 
-    # --- It is a tool call, so execute the full loop ---
-    
-    # 1. Execute the tool
-    tool_name = tool_call['tool_name']
-    parameters = tool_call['parameters']
-    print(f"Executing tool: {tool_name} with params: {parameters}")
-    tool_result = tool_executor.execute_tool(tool_name, parameters)
+        if not tool_calls:
+            # Not a tool call, just return the response
+            return {"role": "assistant", "content": llm_response_text}
 
-    # 2. Append the tool interaction to history
-    # First, the assistant's decision to call the tool
-    chat_histories[conversation_id]["messages"].append({
-        "role": "assistant",
-        "content": initial_llm_response
-    })
-    # Second, the result of the tool execution
-    chat_histories[conversation_id]["messages"].append({
-        "role": "tool",
-        "name": tool_name,
-        "content": json.dumps(tool_result, ensure_ascii=False)
-    })
+        # 1. Execute all tools of this response concurrently
+        tool_results = _execute_tools(tool_calls, run)
 
-    # 3. Call LLM again to get a natural language summary
-    print("Tool executed. Getting summary from LLM...")
-    final_llm_response_text = lm_wrapper.get_completion(
-        messages=chat_histories[conversation_id]["messages"]
-    )
+        # 2. Append the tool interactions to history
+        _record_tool_interactions(conversation_id, llm_response_text, tool_calls, tool_results)
+
+        # 3. Call LLM again to get a natural language summary (or further tool calls)
+        logger.debug("Tools executed. Getting summary from LLM...")
+        with telemetry.span("summary"):
+            llm_response_text, run = _get_completion(conversation_store.get_messages(conversation_id))
+
+    if _has_tool_calls(llm_response_text):
+        llm_response_text = _tool_step_limit_message()
 
     # 4. Return the final, summarized response
-    return {"role": "assistant", "content": final_llm_response_text}
+    return {"role": "assistant", "content": llm_response_text}
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """
+    Formats one Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_chat(conversation_id: str):
+    """
+    Streaming version of a chat turn, yielding Server-Sent Events:
+    `conversation` first, then `delta` events with the visible text, a
+    `tool_call` event for every tool that is run, and finally `done` with the
+    full assistant message. Tool-call text is buffered and never sent as a delta.
+    """
+    with telemetry.span("request", endpoint="/api/chat/stream", conversation_id=conversation_id):
+        yield from _stream_chat_turn(conversation_id)
+
+
+def _stream_chat_turn(conversation_id: str):
+    yield _sse_event("conversation", {"conversation_id": conversation_id})
+
+    for step in range(MAX_TOOL_STEPS + 1):
+        # 1. Stream the completion; it is shown only if it is not a tool call
+        stream_filter = ToolCallStreamFilter()
+        run = tool_speculator.start() if tool_speculator.enabled else None
+        with telemetry.span("completion" if step == 0 else "summary"):
+            for delta in lm_wrapper.stream_completion(conversation_store.get_messages(conversation_id)):
+                if run:
+                    run.feed(delta)
+                visible = stream_filter.feed(delta)
+                if visible:
+                    yield _sse_event("delta", {"content": visible})
+            if run:
+                run.finish()
+            visible = stream_filter.finish()
+            if visible:
+                yield _sse_event("delta", {"content": visible})
+
+        llm_response_text, tool_calls = _parse_tool_calls(conversation_id, stream_filter.text)
+        if not tool_calls:
+            if stream_filter.is_tool_call:
+                # The tool call could not be corrected; nothing of it was shown yet
+                yield _sse_event("delta", {"content": llm_response_text})
+            break
+        if step == MAX_TOOL_STEPS:
+            llm_response_text = _tool_step_limit_message()
+            yield _sse_event("delta", {"content": llm_response_text})
+            break
+
+        # 2. Execute the tools of this response concurrently, then loop for the summary
+        for tool_call in tool_calls:
+            yield _sse_event("tool_call", tool_call)
+        tool_results = _execute_tools(tool_calls, run)
+        _record_tool_interactions(conversation_id, llm_response_text, tool_calls, tool_results)
+        logger.debug("Tools executed. Streaming summary from LLM...")
+
+    assistant_response = {"role": "assistant", "content": llm_response_text}
+    conversation_store.append(conversation_id, [assistant_response])
+    yield _sse_event("done", {"conversation_id": conversation_id, "response": assistant_response})
+
+
+def _int_param(args, name: str, default: int, minimum: int, maximum: Optional[int] = None) -> int:
+    value = args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer.")
+    if number < minimum or (maximum is not None and number > maximum):
+        raise ValueError(f"'{name}' must be between {minimum} and {maximum}." if maximum is not None
+                         else f"'{name}' must be at least {minimum}.")
+    return number
+
+
+def _list_conversations(args) -> dict:
+    """
+    Builds one page of the conversation listing from the query parameters
+    `sort` (start_time or last_activity), `order` (asc or desc), `limit` and
+    `cursor` (the `next_cursor` of the previous page). Raises ValueError.
+    """
+    return conversation_store.list_page(sort=args.get("sort", "start_time"), order=args.get("order", "asc"),
+                                        limit=_int_param(args, "limit", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE),
+                                        cursor=args.get("cursor") or None)
+
+
+def _without_tool_payload(message: dict) -> dict:
+    if message.get("role") != "tool":
+        return message
+    summary = {key: value for key, value in message.items() if key != "content"}
+    summary["content_omitted"] = True
+    summary["content_length"] = len(str(message.get("content", "")))
+    return summary
+
+
+def _history_range(conversation_id: str, args) -> Optional[dict]:
+    """
+    The messages of a conversation from index `since`, at most `limit` of
+    them, with tool results reduced to their size unless
+    `include_tool_results` is set. None for an unknown conversation.
+    Raises ValueError.
+    """
+    since = _int_param(args, "since", 0, 0)
+    limit = _int_param(args, "limit", DEFAULT_HISTORY_LIMIT, 1, MAX_HISTORY_LIMIT)
+    include_tool_results = str(args.get("include_tool_results", "")).lower() in ("1", "true", "yes")
+    history = conversation_store.get_range(conversation_id, since, limit)
+    if history is None:
+        return None
+    messages = history["messages"]
+    if not include_tool_results:
+        messages = [_without_tool_payload(message) for message in messages]
+    end = since + len(messages)
+    return {"conversation_id": conversation_id, "start_time": history["start_time"], "total": history["total"],
+            "since": since, "next_since": end if end < history["total"] else None, "messages": messages}
+
+
+def _stream_json(document: dict, list_key: str):
+    """
+    Yields `document` as JSON text with the items of its `list_key` list
+    encoded one at a time and sent in chunks of about 16 KB, so the response
+    is never built as one string.
+    """
+    head = json.dumps({key: value for key, value in document.items() if key != list_key}, ensure_ascii=False)
+    yield head[:-1] + (", " if len(head) > 2 else "") + json.dumps(list_key) + ": ["
+    chunk, size = [], 0
+    for i, item in enumerate(document[list_key]):
+        piece = ("," if i else "") + json.dumps(item, ensure_ascii=False)
+        chunk.append(piece)
+        size += len(piece)
+        if size >= 16384:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    yield "".join(chunk) + "]}"
+
+
+# --- Startup and Readiness ---
+# Shared with the async server, which runs the connection warm-up on its event loop.
+
+_warm_up_lock = threading.Lock()
+_warm_up_state = {"status": "cold", "error": None, "seconds": None}
+
+
+def _begin_warm_up() -> bool:
+    """
+    Claims the warm-up unless it is running or done; a failed one is retried.
+    """
+    with _warm_up_lock:
+        if _warm_up_state["status"] in ("warming_up", "ready"):
+            return False
+        # The error of a failed warm-up stays in the report until the retry is done
+        _warm_up_state.update(status="warming_up", started=time.perf_counter())
+        return True
+
+
+def _finish_warm_up(error: Optional[Exception] = None) -> None:
+    with _warm_up_lock:
+        _warm_up_state["seconds"] = time.perf_counter() - _warm_up_state.pop("started")
+        _warm_up_state["status"] = "failed" if error else "ready"
+        _warm_up_state["error"] = f"{type(error).__name__}: {error}" if error else None
+    if error:
+        logger.error("Warm-up failed: %s", _warm_up_state["error"])
+    else:
+        logger.info("Warm-up finished in %.0f ms", _warm_up_state["seconds"] * 1000)
+
+
+def _build_components() -> None:
+    for component in _COMPONENTS:
+        resolve(component)
+
+
+def _warm_up_prefill() -> bool:
+    return bool(config.get("startup", {}).get("prefill", False))
+
+
+def _warm_up() -> None:
+    """
+    Builds every component, then opens the connections to the Go server and
+    the model server (and runs the prefill completion if configured).
+    """
+    try:
+        _build_components()
+        tool_executor.warm_up()
+        lm_wrapper.warm_up(prefill=_warm_up_prefill())
+    except Exception as e:
+        _finish_warm_up(e)
+    else:
+        _finish_warm_up()
+
+
+def start_warm_up() -> dict:
+    """
+    Starts the warm-up on a background thread unless it is running or done,
+    and returns the readiness report.
+    """
+    if _begin_warm_up():
+        threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+    return _readiness()
+
+
+def _readiness() -> dict:
+    with _warm_up_lock:
+        state = dict(_warm_up_state)
+    report = {"status": state["status"], "pid": os.getpid(),
+              "components": {component._lazy_name: component_status(component) for component in _COMPONENTS}}
+    if state["seconds"] is not None:
+        report["warm_up_ms"] = round(state["seconds"] * 1000, 1)
+    if state["error"]:
+        report["error"] = state["error"]
+    return report
+
+
+# --- Request Metrics ---
+
+@api.before_app_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    # Logging and telemetry are set up with the config, on the first request at the latest.
+    # A config that cannot be loaded is reported by `/api/ready`; health and readiness still answer.
+    try:
+        resolve(config)
+    except Exception:
+        pass
+
+
+@api.after_app_request
+def _record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    response_bytes = None if response.is_streamed else response.calculate_content_length()
+    telemetry.record_request(endpoint, request.method, response.status_code,
+                             time.perf_counter() - g.get("request_started", time.perf_counter()),
+                             request.content_length, response_bytes)
+    return response
 
 
 # --- API Endpoints ---
 
-@app.route("/api/chat", methods=['POST'])
+@api.route("/api/chat", methods=['POST'])
 def chat_endpoint():
     """
     Handles chat requests, manages conversation history, and orchestrates LLM tool usage.
@@ -113,57 +548,180 @@ def chat_endpoint():
     user_messages = data["messages"]
     conversation_id = data.get("conversation_id")
 
-    # --- Conversation Management ---
-    if not conversation_id or conversation_id not in chat_histories:
-        conversation_id = str(uuid.uuid4())
-        chat_histories[conversation_id] = {
-            "start_time": datetime.datetime.utcnow().isoformat(),
-            "messages": []
-        }
-
-    # Add new user messages to the history
-    chat_histories[conversation_id]["messages"].extend(user_messages)
-    full_history = chat_histories[conversation_id]["messages"]
-
-    # --- LLM and Tool Execution ---
-    # NOTE: Assumes LMWrapper's get_completion is updated to handle message lists
-    llm_response_text = lm_wrapper.get_completion(messages=full_history)
-    assistant_response = _handle_tool_call_loop(conversation_id, llm_response_text)
-
-    # Append the final assistant's response to history
-    chat_histories[conversation_id]["messages"].append(assistant_response)
-    
+    priority = admission.classify(request.headers.get("X-Priority"), user_messages)
+    try:
+        slot = _acquire_slot(priority)
+    except AdmissionRejected as e:
+        body, headers = _admission_rejection(e)
+        return jsonify(body), e.status, headers
+
+    with slot, telemetry.span("request", endpoint="/api/chat", priority=priority) as span:
+        # --- Conversation Management ---
+        _refresh_system_prompt()
+        conversation_id = _get_or_create_conversation(conversation_id)
+        span.set(conversation_id=conversation_id)
+
+        # Add new user messages to the history
+        conversation_store.append(conversation_id, user_messages)
+        full_history = conversation_store.get_messages(conversation_id)
+
+        # --- LLM and Tool Execution ---
+        # NOTE: Assumes LMWrapper's get_completion is updated to handle message lists
+        with telemetry.span("completion"):
+            llm_response_text, run = _get_completion(full_history)
+        assistant_response = _handle_tool_call_loop(conversation_id, llm_response_text, run)
+
+        # Append the final assistant's response to history
+        conversation_store.append(conversation_id, [assistant_response])
+
+        with telemetry.span("response"):
+            return jsonify({
+                "conversation_id": conversation_id,
+                "response": assistant_response
+            }), 200, {"X-Conversation-Id": conversation_id}
+
+@api.route("/api/chat/stream", methods=['POST'])
+def chat_stream_endpoint():
+    """
+    Server-Sent-Events variant of `/api/chat` that streams the response tokens.
+    """
+    data = request.get_json()
+    if not data or "messages" not in data:
+        return jsonify({"error": "Invalid request body, 'messages' field is required."}), 400
+
+    try:
+        slot = _acquire_slot(admission.classify(request.headers.get("X-Priority"), data["messages"]))
+    except AdmissionRejected as e:
+        body, headers = _admission_rejection(e)
+        return jsonify(body), e.status, headers
+
+    try:
+        _refresh_system_prompt()
+        conversation_id = _get_or_create_conversation(data.get("conversation_id"))
+        conversation_store.append(conversation_id, data["messages"])
+    except BaseException:
+        # The stream never starts, so nothing else would release the slot
+        slot.release()
+        raise
+
+    response = Response(
+        _stream_chat(conversation_id),
+        mimetype="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Conversation-Id": conversation_id},
+    )
+    # The slot is held until the stream ends, also if the client goes away before it starts
+    response.call_on_close(slot.release)
+    return response
+
+
+@api.route("/api/health", methods=['GET'])
+def health():
+    """
+    Liveness probe; answers at once, before any component is built.
+    """
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+
+@api.route("/api/ready", methods=['GET'])
+def ready():
+    """
+    Readiness probe: 200 once every component is built and the connections to
+    the model server and the Go server are open, else 503. A cold server
+    starts its warm-up here, and a failed one tries again.
+    """
+    readiness = start_warm_up()
+    return jsonify(readiness), 200 if readiness["status"] == "ready" else 503
+
+
+@api.route("/api/stats", methods=['GET'])
+def get_stats():
+    """
+    Returns runtime statistics of the server's components.
+    """
     return jsonify({
-        "conversation_id": conversation_id,
-        "response": assistant_response
+        "tool_executor": tool_executor.get_stats(),
+        "conversation_store": conversation_store.get_stats(),
+        "lm_wrapper": lm_wrapper.get_stats(),
+        "prompt_builder": prompt_builder.get_stats(),
+        "tool_parsing": parsing_utils.get_stats(),
+        "telemetry": telemetry.get_stats(),
+        "admission": admission.get_stats(),
+        "tool_results": tool_result_shaper.get_stats(),
+        "speculative_tools": tool_speculator.get_stats(),
     })
 
-@app.route("/api/conversations", methods=['GET'])
+
+@api.route("/metrics", methods=['GET'])
+def metrics():
+    """
+    Prometheus metrics: request counts and latency, time per pipeline stage and
+    per tool, token counts, payload sizes, and admission queue depth and waits.
+    """
+    return Response(telemetry.render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
+@api.route("/api/conversations", methods=['GET'])
 def get_conversations_list():
     """
-    Returns a list of all conversations with basic metadata.
+    Returns one page of conversation summaries (ID, start time, last activity
+    and title), as `{"conversations": [...], "next_cursor": ...}`.
     """
-    conv_list = [
-        {
-            "id": conv_id,
-            "start_time": details["start_time"],
-            "title": details["messages"][0]["content"] if details["messages"] else "Empty Conversation"
-        }
-        for conv_id, details in chat_histories.items()
-    ]
-    return jsonify(conv_list)
+    try:
+        page = _list_conversations(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(_stream_json(page, "conversations"), content_type="application/json")
 
 
-@app.route("/api/conversations/<string:conversation_id>", methods=['GET'])
+@api.route("/api/conversations/<string:conversation_id>", methods=['GET'])
 def get_conversation_history(conversation_id):
     """
-    Returns the full message history for a specific conversation.
+    Returns a range of a conversation's messages (`since`, `limit`), with
+    tool results left out unless `include_tool_results=true`.
     """
-    history = chat_histories.get(conversation_id)
-    if not history:
+    try:
+        history = _history_range(conversation_id, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if history is None:
         return jsonify({"error": "Conversation not found."}), 404
 
-    return jsonify(history)
+    return Response(_stream_json(history, "messages"), content_type="application/json")
+
+
+@api.route("/api/conversations/<string:conversation_id>/tool_results/<string:ref>", methods=['GET'])
+def get_full_tool_result(conversation_id, ref):
+    """
+    Returns the full result of a tool call whose shaped version in the
+    history carries `ref`.
+    """
+    full_result = tool_result_shaper.get_full_result(conversation_id, ref)
+    if full_result is None:
+        return jsonify({"error": "Tool result not found."}), 404
+    return jsonify(full_result)
+
+
+def create_app(config_path: Optional[str] = None, warm_up: bool = True) -> Flask:
+    """
+    Builds the Flask app. `config_path` selects the configure.json the
+    components are built from; they are shared by every app of the process,
+    so it only counts before they are built. With `warm_up`, they are built
+    and connected in the background right away rather than on the first
+    request (or the first `/api/ready` probe); the module-level `app` is
+    built without it, so importing this module starts nothing.
+    """
+    global _config_path
+    if config_path:
+        _config_path = str(config_path)
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(api)
+    if warm_up:
+        start_warm_up()
+    return flask_app
+
+
+app = create_app(warm_up=False)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,492 @@
+import argparse
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import statistics
+import time
+from collections import Counter
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from utils import CONFIG_PATH, load_config
+from utils.ConversationStore import create_conversation_store
+from utils.GPTTools import GPTParsingUtils, PromptBuilder, ToolCallParseError
+from utils.LMWrapper import LMWrapper
+from utils.ToolCache import ToolResultCache
+
+# --- Offline replay and evaluation ---
+# Replays recorded conversations (one JSON object with "messages" per line, as
+# written by `export`) against the model and scores the tool calls it makes.
+# Run with: python -m app.ReplayEvaluator run --input conversations.jsonl --checkpoint run.jsonl
+#
+# Every assistant reply of a recording is one case: the model gets the history
+# before the reply (recorded tool results included, so no Go server is needed)
+# and its tool calls are compared with the recorded ones. Cases run through
+# LMWrapper and GPTParsingUtils like a chat turn, `concurrency` at a time, and
+# are checkpointed as they finish, so an interrupted run resumes where it stopped.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLAY_CONFIG = {
+    "concurrency": 8,
+    # "all" assistant replies, or only the "user" ones (those answering a user message)
+    "turns": "all",
+}
+PERCENTILES = (50, 90, 95, 99)
+
+# The recorded reply of the case being replayed, for RecordedBackend
+_recorded_reply: contextvars.ContextVar[str] = contextvars.ContextVar("recorded_reply", default="")
+
+
+class RecordedBackend:
+    """
+    A stand-in for the model that answers every case with its recorded reply,
+    after `latency` seconds. Replaying against it scores 100% unless the
+    recordings hold tool calls the parser rejects, so it checks a dataset and
+    measures the engine's own overhead without a model server.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def chat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        time.sleep(self.latency)
+        return _recorded_reply.get()
+
+    async def achat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        await asyncio.sleep(self.latency)
+        return _recorded_reply.get()
+
+    def stream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> Iterator[str]:
+        yield self.chat(messages, system_prompt)
+
+    async def astream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        yield await self.achat(messages, system_prompt)
+
+
+# --- Cases and scoring ---
+
+def read_conversations(path: Path) -> Iterator[Dict]:
+    """
+    Yields the conversations of a JSONL file one line at a time. Lines that
+    are not a JSON object with "messages" are skipped with a warning.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                conversation = json.loads(line)
+            except ValueError as e:
+                logger.warning("Skipping line %d of %s: %s", line_number, path, e)
+                continue
+            if not isinstance(conversation, dict) or not isinstance(conversation.get("messages"), list):
+                logger.warning("Skipping line %d of %s: no 'messages' list", line_number, path)
+                continue
+            conversation.setdefault("conversation_id", conversation.get("id") or f"line-{line_number}")
+            yield conversation
+
+
+def iter_cases(conversations: Iterator[Dict], parsing_utils: GPTParsingUtils, turns: str = "all",
+               system_message: Optional[str] = None) -> Iterator[Dict]:
+    """
+    The cases of the conversations: every assistant reply that follows a user
+    message (or, with `turns="all"`, also one that follows tool results),
+    with the history before it and the tool calls it made. Replies whose
+    recorded tool calls cannot be parsed are not cases.
+    """
+    for conversation in conversations:
+        messages = conversation["messages"]
+        for index, message in enumerate(messages):
+            if message.get("role") != "assistant" or index == 0:
+                continue
+            previous = messages[index - 1].get("role")
+            if previous != "user" and not (turns == "all" and previous == "tool"):
+                continue
+            reply = message.get("content") or ""
+            try:
+                expected = parsing_utils.tool_calls_parsing(reply)
+            except ToolCallParseError:
+                logger.debug("Skipping %s:%d, its recorded tool call is malformed",
+                             conversation["conversation_id"], index)
+                continue
+            history = messages[:index]
+            if system_message:
+                history = [{"role": "system", "content": system_message}] + history
+            yield {"case": f"{conversation['conversation_id']}:{index}", "history": history, "reply": reply,
+                   "expected": expected}
+
+
+def _call_key(call: Dict) -> tuple:
+    return call["tool_name"], tuple(sorted(ToolResultCache.normalize(call["parameters"]).items()))
+
+
+def score(expected: List[Dict], predicted: List[Dict]) -> Dict:
+    """
+    Compares the predicted tool calls with the expected ones, ignoring their
+    order. Arguments are compared as ToolResultCache normalizes them (unset
+    ones dropped, values as lower-case strings).
+    """
+    expected_names = Counter(call["tool_name"] for call in expected)
+    predicted_names = Counter(call["tool_name"] for call in predicted)
+    matched_args = Counter(_call_key(call) for call in expected) & Counter(_call_key(call) for call in predicted)
+    argument_matches = Counter()
+    for (tool_name, _), count in matched_args.items():
+        argument_matches[tool_name] += count
+    return {
+        "decision_ok": bool(expected) == bool(predicted),
+        "names_ok": expected_names == predicted_names,
+        "exact": expected_names == predicted_names and sum(matched_args.values()) == len(expected),
+        "name_matches": dict(expected_names & predicted_names),
+        "argument_matches": dict(argument_matches),
+    }
+
+
+class ReplayMetrics:
+    """
+    Accuracy and latency over the case results, from this run and from a
+    resumed checkpoint alike.
+    """
+
+    def __init__(self):
+        self.cases = 0
+        self.resumed = 0
+        self.counts = Counter()
+        self.tools: Dict[str, Counter] = {}
+        self.latencies: List[float] = []
+
+    def add(self, result: Dict, resumed: bool = False):
+        self.cases += 1
+        self.resumed += resumed
+        self.counts.update(decision_ok=result["decision_ok"], names_ok=result["names_ok"], exact=result["exact"],
+                           parse_errors=result.get("parse_error") is not None,
+                           expected_calls=len(result["expected"]), predicted_calls=len(result["predicted"]),
+                           tool_cases=bool(result["expected"]))
+        for call in result["expected"]:
+            self.tools.setdefault(call["tool_name"], Counter())["expected"] += 1
+        for call in result["predicted"]:
+            self.tools.setdefault(call["tool_name"], Counter())["predicted"] += 1
+        for tool_name, count in result["name_matches"].items():
+            self.tools[tool_name]["name_matches"] += count
+        for tool_name, count in result["argument_matches"].items():
+            self.tools[tool_name]["argument_matches"] += count
+        self.latencies.append(result["latency_ms"])
+
+    def report(self) -> Dict:
+        def ratio(part, whole):
+            return round(part / whole, 4) if whole else 0.0
+
+        argument_matches = sum(tool["argument_matches"] for tool in self.tools.values())
+        name_matches = sum(tool["name_matches"] for tool in self.tools.values())
+        ordered = sorted(self.latencies)
+        latency = {f"p{p}": round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 1)
+                   for p in PERCENTILES} if ordered else {}
+        if ordered:
+            latency.update(mean=round(statistics.mean(ordered), 1), max=round(ordered[-1], 1))
+        return {
+            "cases": self.cases,
+            "resumed": self.resumed,
+            "accuracy": {
+                # Whether a tool was called at all, when one should have been
+                "decision": ratio(self.counts["decision_ok"], self.cases),
+                # The same tools, as many times each
+                "tool_names": ratio(self.counts["names_ok"], self.cases),
+                # Recorded calls matched by a call with the same tool and arguments
+                "arguments": ratio(argument_matches, self.counts["expected_calls"]),
+                "tool_call_recall": ratio(name_matches, self.counts["expected_calls"]),
+                "tool_call_precision": ratio(name_matches, self.counts["predicted_calls"]),
+                # Exactly the recorded calls
+                "exact": ratio(self.counts["exact"], self.cases),
+            },
+            "cases_with_tool_calls": self.counts["tool_cases"],
+            "parse_errors": self.counts["parse_errors"],
+            "tools": {name: {key: tool[key] for key in ("expected", "predicted", "name_matches", "argument_matches")}
+                      for name, tool in sorted(self.tools.items())},
+            "latency_ms": latency,
+        }
+
+
+# --- Checkpoints ---
+
+def run_fingerprint(settings: Dict, prompt_builder: PromptBuilder) -> str:
+    """
+    Identifies what a checkpoint was run with: the input, the configuration,
+    the model or stub, and the tools file and prompt template of
+    `prompt_builder`, defaults included.
+    """
+    digest = hashlib.sha256()
+    for key in sorted(settings):
+        value = settings[key]
+        digest.update(f"{key}={value}\n".encode())
+        if key == "config" and value and Path(value).is_file():
+            digest.update(Path(value).read_bytes())
+    # The contents, so an edited prompt or tools file starts a new run
+    tools_path = prompt_builder.tools_config_path
+    digest.update(f"tools={tools_path}\n".encode())
+    digest.update(tools_path.read_bytes() if tools_path.is_file() else b"")
+    digest.update(f"template={prompt_builder.base_prompt_template}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def load_checkpoint(path: Path, fingerprint: str, metrics: ReplayMetrics) -> set:
+    """
+    Adds the results of an earlier run to `metrics` and returns their case IDs.
+    Refuses a checkpoint of a run with other settings; its results would
+    not be comparable.
+    """
+    done = set()
+    if not path.exists():
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short when the earlier run was killed
+                continue
+            if "run" in entry:
+                if entry["run"] != fingerprint:
+                    raise SystemExit(f"{path} was written by a run with other settings "
+                                     f"({entry['run']} != {fingerprint}); use another checkpoint file.")
+                continue
+            if entry["case"] not in done:
+                done.add(entry["case"])
+                metrics.add(entry, resumed=True)
+    return done
+
+
+# --- Engine ---
+
+class ReplayEvaluator:
+    """
+    Runs the cases through LMWrapper and GPTParsingUtils with a bounded pool
+    of `concurrency` workers. Cases are read lazily and queued at most two
+    per worker, so memory stays flat however large the input is.
+    """
+
+    def __init__(self, lm_wrapper: LMWrapper, concurrency: int = 8, checkpoint: Optional[Path] = None,
+                 fingerprint: str = ""):
+        self.lm_wrapper = lm_wrapper
+        self.parsing_utils = GPTParsingUtils()
+        self.concurrency = max(1, concurrency)
+        self.checkpoint = checkpoint
+        self.fingerprint = fingerprint
+        self.metrics = ReplayMetrics()
+        self.model_errors = 0
+        self.skipped = 0
+        self._checkpoint_file = None
+
+    async def _evaluate(self, case: Dict) -> Optional[Dict]:
+        _recorded_reply.set(case["reply"])
+        started = time.perf_counter()
+        text = await self.lm_wrapper.aget_completion(case["history"])
+        latency_ms = (time.perf_counter() - started) * 1000
+        if text.startswith("Error: "):
+            # Not checkpointed, so a resumed run tries the case again
+            self.model_errors += 1
+            logger.warning("Case %s failed: %s", case["case"], text)
+            return None
+        parse_error = None
+        try:
+            predicted = self.parsing_utils.tool_calls_parsing(text)
+        except ToolCallParseError as e:
+            predicted, parse_error = [], str(e)
+        return {"case": case["case"], "expected": case["expected"], "predicted": predicted,
+                "parse_error": parse_error, "latency_ms": round(latency_ms, 2),
+                **score(case["expected"], predicted)}
+
+    def _record(self, result: Dict):
+        self.metrics.add(result)
+        if self._checkpoint_file:
+            self._checkpoint_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            self._checkpoint_file.flush()
+
+    async def run(self, cases: Iterator[Dict], limit: Optional[int] = None) -> Dict:
+        done = load_checkpoint(self.checkpoint, self.fingerprint, self.metrics) if self.checkpoint else set()
+        if done:
+            logger.info("Resuming: %d cases done already", len(done))
+        if self.checkpoint:
+            new_file = not self.checkpoint.exists()
+            self._checkpoint_file = open(self.checkpoint, "a", encoding="utf-8")
+            if new_file:
+                self._checkpoint_file.write(json.dumps({"run": self.fingerprint}) + "\n")
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        evaluated = 0
+
+        async def worker():
+            nonlocal evaluated
+            while True:
+                case = await queue.get()
+                if case is None:
+                    return
+                try:
+                    result = await self._evaluate(case)
+                except Exception as e:
+                    self.model_errors += 1
+                    logger.warning("Case %s failed: %s", case["case"], e)
+                    result = None
+                if result:
+                    self._record(result)
+                    evaluated += 1
+
+        started = time.perf_counter()
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            queued = 0
+            for case in cases:
+                if case["case"] in done:
+                    self.skipped += 1
+                    continue
+                if limit is not None and queued >= limit:
+                    break
+                await queue.put(case)
+                queued += 1
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await self.lm_wrapper.aclose()
+            if self._checkpoint_file:
+                self._checkpoint_file.close()
+                self._checkpoint_file = None
+        elapsed = time.perf_counter() - started
+
+        report = self.metrics.report()
+        report["run"] = {"evaluated": evaluated, "skipped_done": self.skipped, "model_errors": self.model_errors,
+                         "elapsed_s": round(elapsed, 3),
+                         "cases_per_second": round(evaluated / elapsed, 2) if elapsed else 0.0,
+                         "concurrency": self.concurrency}
+        return report
+
+
+def build_prompt_builder(config: Dict, tools_path: Optional[Path] = None,
+                         template_path: Optional[Path] = None) -> PromptBuilder:
+    """
+    The PromptBuilder of a replay: the template of `template_path` (else the
+    server's template) and the tools of `tools_path` (else the configured
+    tools.json).
+    """
+    if template_path:
+        template = Path(template_path).read_text(encoding="utf-8")
+    else:
+        from app.CoordinateServer import SYSTEM_PROMPT_TEMPLATE
+        template = SYSTEM_PROMPT_TEMPLATE
+    prompt_options = dict(config.get("prompt", {}))
+    if tools_path:
+        prompt_options["tools_config_path"] = tools_path
+    return PromptBuilder(base_prompt_template=template, **prompt_options)
+
+
+def build_lm_wrapper(config_path: Path, prompt_builder: PromptBuilder,
+                     stub_latency: Optional[float] = None) -> LMWrapper:
+    """
+    The LMWrapper of a replay: configured from `config_path`, with the system
+    prompt and tools of `prompt_builder`. With `stub_latency`, the model is
+    replaced by a RecordedBackend.
+    """
+    lm_wrapper = LMWrapper(config_path=config_path)
+    if stub_latency is not None:
+        lm_wrapper.backend = RecordedBackend(stub_latency)
+    # Every case must reach the model (or its recorded reply): a cached answer,
+    # possibly from another run sharing the cache's file, would be scored instead
+    lm_wrapper.completion_cache = None
+    lm_wrapper.set_system_prompt(prompt_builder.build_system_prompt())
+    lm_wrapper.set_tools(prompt_builder.get_tools())
+    return lm_wrapper
+
+
+def export_conversations(config: Dict, output: Path) -> int:
+    """
+    Writes every conversation of the configured store to `output`, one JSON
+    object per line; returns how many were written.
+    """
+    store = create_conversation_store(config.get("conversation_store"))
+    written, cursor = 0, None
+    with open(output, "w", encoding="utf-8") as f:
+        while True:
+            page = store.list_page(sort="start_time", order="asc", limit=500, cursor=cursor)
+            for summary in page["conversations"]:
+                f.write(json.dumps({"conversation_id": summary["id"], "start_time": summary["start_time"],
+                                    "messages": store.get_messages(summary["id"])}, ensure_ascii=False) + "\n")
+                written += 1
+            cursor = page.get("next_cursor")
+            if not cursor:
+                return written
+
+
+def print_report(report: Dict):
+    accuracy, run = report["accuracy"], report["run"]
+    print(f"cases: {report['cases']} ({report['resumed']} from the checkpoint), "
+          f"{report['cases_with_tool_calls']} with tool calls; parse errors: {report['parse_errors']}, "
+          f"model errors: {run['model_errors']}")
+    print(f"throughput: {run['cases_per_second']} cases/s over {run['elapsed_s']} s "
+          f"({run['evaluated']} cases, concurrency {run['concurrency']})")
+    print("accuracy: " + ", ".join(f"{key} {value:.1%}" for key, value in accuracy.items()))
+    print("latency ms: " + ", ".join(f"{key} {value}" for key, value in report["latency_ms"].items()))
+    print(f"{'tool':<34}{'expected':>10}{'predicted':>11}{'names ok':>10}{'args ok':>9}")
+    for name, tool in report["tools"].items():
+        print(f"{name:<34}{tool['expected']:>10}{tool['predicted']:>11}{tool['name_matches']:>10}"
+              f"{tool['argument_matches']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays recorded conversations and scores the model's tool calls.")
+    parser.add_argument("--config", default=str(CONFIG_PATH), help="configure.json to read")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="replay a JSONL file of conversations")
+    run.add_argument("--input", type=Path, required=True, help="JSONL file, one conversation per line")
+    run.add_argument("--tools", type=Path, help="tools.json variant (default: config/tools.json)")
+    run.add_argument("--template", type=Path, help="system prompt template with {tool_definitions}")
+    run.add_argument("--system-prompt", help="name of a config/system-prompt.json entry, sent as a system message")
+    run.add_argument("--stub", action="store_true", help="answer with the recorded replies instead of the model")
+    run.add_argument("--stub-latency", type=float, default=0.0, help="seconds per stubbed completion")
+    run.add_argument("--concurrency", type=int, help="cases in flight (replay.concurrency)")
+    run.add_argument("--turns", choices=["all", "user"], help="assistant replies to replay (replay.turns)")
+    run.add_argument("--limit", type=int, help="replay at most this many new cases")
+    run.add_argument("--checkpoint", type=Path, help="per-case results; a rerun with the same file resumes")
+    run.add_argument("--json", type=Path, help="write the report to this file")
+    export = commands.add_parser("export", help="write the configured conversation store to JSONL")
+    export.add_argument("--output", type=Path, required=True)
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+
+    config = load_config(args.config)
+    if args.command == "export":
+        print(f"{export_conversations(config, args.output)} conversations written to {args.output}")
+        return
+
+    settings = {**DEFAULT_REPLAY_CONFIG, **config.get("replay", {})}
+    settings.update({key: value for key, value in (("concurrency", args.concurrency), ("turns", args.turns))
+                     if value is not None})
+    system_message = None
+    if args.system_prompt:
+        prompts = json.loads((Path(__file__).parent.parent / "config" / "system-prompt.json").read_text(encoding="utf-8"))
+        system_message = prompts[args.system_prompt]
+
+    prompt_builder = build_prompt_builder(config, args.tools, args.template)
+    fingerprint = run_fingerprint({"input": args.input.resolve(), "config": args.config,
+                                   "system_prompt": args.system_prompt, "turns": settings["turns"],
+                                   "stub": args.stub}, prompt_builder)
+    lm_wrapper = build_lm_wrapper(Path(args.config), prompt_builder,
+                                  stub_latency=args.stub_latency if args.stub else None)
+    evaluator = ReplayEvaluator(lm_wrapper, concurrency=settings["concurrency"], checkpoint=args.checkpoint,
+                                fingerprint=fingerprint)
+    cases = iter_cases(read_conversations(args.input), evaluator.parsing_utils, turns=settings["turns"],
+                       system_message=system_message)
+    report = asyncio.run(evaluator.run(cases, limit=args.limit))
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+
+from utils import CONFIG_PATH, load_config
+
+# --- Scale-out entry point ---
+# Runs `workers.count` server processes (Flask or async) on consecutive ports
+# behind an affinity router that keeps each conversation on one worker.
+# Run with: python -m app.WorkerSupervisor --workers 4 --port 8000
+#
+# With more than one worker, state that must be seen by all of them is moved to
+# SQLite files under `workers.shared_state`: the conversation store (unless a
+# shared backend is configured already), the completion cache and the tool
+# result cache, whose invalidations after a dispatch reach every worker. The
+# in-process fleet snapshot cannot be shared, so `fleet_state` is turned off,
+# and the admission limits are divided between the workers.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS_CONFIG = {
+    "count": 1,
+    "server": "async",
+    "host": "0.0.0.0",
+    "port": 8000,
+    "shared_state": "data/shared",
+    "affinity": True,
+    "affinity_entries": 100000,
+    "drain_timeout": 30.0,
+    "health_interval": 1.0,
+    "startup_timeout": 60.0,
+}
+
+# Not forwarded by the router in either direction
+HOP_BY_HOP = {b"connection", b"keep-alive", b"transfer-encoding", b"upgrade", b"proxy-connection", b"te",
+              b"trailer", b"host"}
+
+
+def worker_config(config: dict, workers: dict) -> dict:
+    """
+    The configure.json the workers run with: with several workers, the state
+    kept in process memory by default is moved to files they share.
+    """
+    config = copy.deepcopy(config)
+    if workers["count"] < 2:
+        return config
+    shared = Path(workers["shared_state"])
+
+    store = config.setdefault("conversation_store", {})
+    if store.get("backend", "memory") == "memory":
+        store["backend"] = "sqlite"
+        store["sqlite"] = {**store.get("sqlite", {}), "path": str(shared / "conversations.db")}
+    tool_cache = config.setdefault("tool_cache", {})
+    if tool_cache.get("enabled", True) and not tool_cache.get("shared_path"):
+        tool_cache["shared_path"] = str(shared / "tool_cache.db")
+    completion_cache = config.get("completion_cache")
+    if completion_cache and completion_cache.get("enabled", True) and not completion_cache.get("disk_path"):
+        completion_cache["disk_path"] = str(shared / "completions.db")
+    # The fleet snapshot lives in each worker, so a dispatch in one would leave
+    # the others answering reads from their stale copy
+    fleet_state = config.get("fleet_state")
+    if fleet_state and fleet_state.get("enabled"):
+        logger.warning("fleet_state is turned off with %d workers: its snapshot is not shared", workers["count"])
+        fleet_state["enabled"] = False
+    # Admission and rate limits are enforced by each worker; every one gets its share
+    config.setdefault("admission", {})["workers"] = workers["count"]
+    return config
+
+
+def _run_worker(kind: str, host: str, port: int, config_path: str, drain_timeout: float):
+    """
+    Serves one worker; the target of the worker processes. Its components are
+    built from `config_path` and warmed up as soon as the server starts.
+    """
+    os.environ["COORDINATE_CONFIG"] = config_path
+    # `utils` was imported along with this module, before the variable was set
+    import utils
+    utils.CONFIG_PATH = Path(config_path)
+    if kind == "flask":
+        from werkzeug.serving import make_server
+        from app.CoordinateServer import create_app
+        # One health check per second would otherwise fill the log
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server(host, port, create_app(config_path), threaded=True)
+        # The router drains a worker before stopping it, so a plain shutdown is enough
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+        server.serve_forever()
+    else:
+        import uvicorn
+        uvicorn.run("app.AsyncCoordinateServer:create_app", factory=True, host=host, port=port,
+                    log_level="warning", timeout_graceful_shutdown=int(drain_timeout))
+
+
+class Worker:
+    def __init__(self, index: int, port: int):
+        # Workers only listen on the loopback interface; the router is the public endpoint
+        self.index = index
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.process: Optional[multiprocessing.Process] = None
+        self.ready = False
+        self.draining = False
+        self.in_flight = 0
+        self.requests = 0
+        self.restarts = 0
+
+    def get_stats(self) -> dict:
+        return {"index": self.index, "port": self.port, "pid": self.process.pid if self.process else None,
+                "ready": self.ready, "draining": self.draining, "in_flight": self.in_flight,
+                "requests": self.requests, "restarts": self.restarts}
+
+
+class WorkerSupervisor:
+    """
+    Starts the workers, restarts any that die, and drains them on shutdown:
+    a draining worker gets no new requests and is stopped once the requests
+    it is serving have finished (or `drain_timeout` has passed).
+    """
+
+    def __init__(self, config: dict, workers: Optional[dict] = None):
+        self.workers_config = {**DEFAULT_WORKERS_CONFIG, **(config.get("workers") or {}), **(workers or {})}
+        if self.workers_config["server"] not in ("flask", "async"):
+            raise ValueError(f"Unsupported worker server: {self.workers_config['server']}")
+        self.config = worker_config(config, self.workers_config)
+        port = self.workers_config["port"]
+        self.workers = [Worker(i, port + 1 + i) for i in range(max(1, self.workers_config["count"]))]
+        self.config_path: Optional[str] = None
+        self._context = multiprocessing.get_context("spawn")
+        self._stopping = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def _prepare_shared_state(self):
+        """
+        Writes the workers' config and creates the shared databases once, so that
+        the workers do not race on schema creation and migrations.
+        """
+        shared = Path(self.workers_config["shared_state"])
+        shared.mkdir(parents=True, exist_ok=True)
+        self.config_path = str(shared / "workers-configure.json")
+        with open(self.config_path, "w", encoding="utf-8") as f:
+            json.dump(self.config, f, indent=2)
+        if len(self.workers) > 1:
+            from utils.ConversationStore import create_conversation_store
+            from utils.ToolCache import ToolResultCache
+            create_conversation_store(self.config.get("conversation_store"))
+            if self.config["tool_cache"].get("shared_path"):
+                ToolResultCache(shared_path=self.config["tool_cache"]["shared_path"])
+
+    def _spawn(self, worker: Worker):
+        worker.ready = False
+        worker.process = self._context.Process(
+            target=_run_worker, daemon=True,
+            args=(self.workers_config["server"], "127.0.0.1", worker.port, self.config_path,
+                  self.workers_config["drain_timeout"]))
+        worker.process.start()
+
+    @staticmethod
+    def _check(worker: Worker) -> bool:
+        # Readiness rather than liveness: a worker still warming up gets no traffic yet
+        try:
+            return httpx.get(f"{worker.base_url}/api/ready", timeout=2).status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def start(self):
+        """
+        Starts every worker at once (their imports and component setup overlap)
+        and waits until they are all ready.
+        """
+        self._prepare_shared_state()
+        for worker in self.workers:
+            self._spawn(worker)
+        deadline = time.monotonic() + self.workers_config["startup_timeout"]
+        pending = list(self.workers)
+        while pending and time.monotonic() < deadline:
+            for worker in list(pending):
+                if self._check(worker):
+                    worker.ready = True
+                    pending.remove(worker)
+            time.sleep(0.05)
+        if pending:
+            logger.warning("Workers not ready after startup: %s", [w.index for w in pending])
+        self._monitor = threading.Thread(target=self._watch, name="worker-monitor", daemon=True)
+        self._monitor.start()
+
+    def _watch(self):
+        while not self._stopping.wait(self.workers_config["health_interval"]):
+            for worker in self.workers:
+                if worker.draining or self._stopping.is_set():
+                    continue
+                if not worker.process.is_alive():
+                    logger.warning("Worker %d exited (code %s), restarting", worker.index, worker.process.exitcode)
+                    worker.restarts += 1
+                    self._spawn(worker)
+                    continue
+                worker.ready = self._check(worker)
+
+    def drain(self):
+        """
+        Stops routing to the workers, waits for their requests to finish and
+        stops them.
+        """
+        self._stopping.set()
+        for worker in self.workers:
+            worker.draining = True
+        deadline = time.monotonic() + self.workers_config["drain_timeout"]
+        while any(w.in_flight for w in self.workers) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for worker in self.workers:
+            if worker.process and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process:
+                worker.process.join(max(0.0, deadline - time.monotonic()) + 5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+            worker.ready = False
+
+    def available(self) -> List[Worker]:
+        return [w for w in self.workers if w.ready and not w.draining]
+
+
+class AffinityRouter:
+    """
+    ASGI reverse proxy in front of the workers. A conversation is sent to the
+    worker that created it (learned from the X-Conversation-Id response
+    header), falling back to rendezvous hashing of its ID when that worker is
+    unavailable or unknown; requests without a conversation go to the worker
+    with the fewest requests in flight.
+    """
+
+    def __init__(self, supervisor: WorkerSupervisor):
+        self.supervisor = supervisor
+        self.affinity_enabled = supervisor.workers_config["affinity"]
+        self.max_entries = supervisor.workers_config["affinity_entries"]
+        self._affinity: "OrderedDict[str, int]" = OrderedDict()
+        self._client: Optional[httpx.AsyncClient] = None
+        self.stats = {"requests": 0, "affinity_hits": 0, "hashed": 0, "unrouted": 0, "rejected": 0,
+                      "retried": 0}
+
+    # --- Routing ---
+
+    @staticmethod
+    def _conversation_id(path: str, body: bytes, content_type: str) -> Optional[str]:
+        if path.startswith("/api/conversations/"):
+            return path[len("/api/conversations/"):].split("/")[0] or None
+        if body and "json" in content_type:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return None
+            if isinstance(data, dict) and data.get("conversation_id"):
+                return str(data["conversation_id"])
+        return None
+
+    @staticmethod
+    def _rendezvous(conversation_id: str, workers: List[Worker]) -> Worker:
+        # Highest hash of (conversation, worker) wins: only the conversations of a
+        # worker that goes away move when the set of workers changes
+        return max(workers, key=lambda w: hashlib.blake2b(f"{conversation_id}:{w.index}".encode(),
+                                                            digest_size=8).digest())
+
+    def choose(self, conversation_id: Optional[str], exclude: Optional[Worker] = None) -> Optional[Worker]:
+        workers = [w for w in self.supervisor.available() if w is not exclude]
+        if not workers:
+            return None
+        if conversation_id is None or not self.affinity_enabled:
+            self.stats["unrouted"] += 1
+            return min(workers, key=lambda w: (w.in_flight, w.requests))
+        index = self._affinity.get(conversation_id)
+        if index is not None:
+            worker = self.supervisor.workers[index]
+            if worker in workers:
+                self._affinity.move_to_end(conversation_id)
+                self.stats["affinity_hits"] += 1
+                return worker
+        self.stats["hashed"] += 1
+        return self._rendezvous(conversation_id, workers)
+
+    def _remember(self, conversation_id: str, worker: Worker):
+        self._affinity[conversation_id] = worker.index
+        self._affinity.move_to_end(conversation_id)
+        while len(self._affinity) > self.max_entries:
+            self._affinity.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        routed = self.stats["affinity_hits"] + self.stats["hashed"]
+        return {**self.stats, "affinity_entries": len(self._affinity),
+                "affinity_hit_rate": round(self.stats["affinity_hits"] / routed, 3) if routed else 0.0,
+                "workers": [w.get_stats() for w in self.supervisor.workers]}
+
+    # --- ASGI ---
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if scope["path"] == "/api/router/stats":
+            await self._respond(send, 200, self.get_stats())
+            return
+
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+        headers = [(k, v) for k, v in scope["headers"] if k.lower() not in HOP_BY_HOP]
+        content_type = dict(scope["headers"]).get(b"content-type", b"").decode("latin-1")
+        conversation_id = self._conversation_id(scope["path"], body, content_type)
+        self.stats["requests"] += 1
+
+        worker = self.choose(conversation_id)
+        for attempt in range(2):
+            if worker is None:
+                self.stats["rejected"] += 1
+                await self._respond(send, 503, {"error": "No worker is available, try again shortly."},
+                                    [(b"retry-after", b"1")])
+                return
+            if await self._forward(worker, scope, headers, body, conversation_id, send):
+                return
+            # Nothing was sent to the client yet: the worker is down, try another one
+            worker.ready = False
+            self.stats["retried"] += 1
+            worker = self.choose(conversation_id, exclude=worker) if attempt == 0 else None
+
+    async def _forward(self, worker: Worker, scope, headers, body: bytes, conversation_id: Optional[str],
+                       send) -> bool:
+        """
+        Proxies the request to `worker`, streaming the response back. Returns
+        False if the worker could not be reached before any response was sent.
+        """
+        url = f"{worker.base_url}{scope['path']}"
+        if scope.get("query_string"):
+            url += "?" + scope["query_string"].decode("latin-1")
+        worker.in_flight += 1
+        worker.requests += 1
+        started = False
+        try:
+            request = self._client.build_request(scope["method"], url, headers=headers, content=body)
+            response = await self._client.send(request, stream=True)
+            try:
+                learned = response.headers.get("x-conversation-id") or conversation_id
+                if learned and self.affinity_enabled and response.status_code < 500:
+                    self._remember(learned, worker)
+                await send({"type": "http.response.start", "status": response.status_code,
+                            "headers": [(k, v) for k, v in response.headers.raw if k.lower() not in HOP_BY_HOP]})
+                started = True
+                async for chunk in response.aiter_raw():
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                await send({"type": "http.response.body", "body": b""})
+            finally:
+                await response.aclose()
+        except httpx.TransportError as e:
+            if not started:
+                return False
+            # The worker went away mid-response; the client sees a truncated body
+            logger.warning("Worker %d failed during a response: %s", worker.index, e)
+        finally:
+            worker.in_flight -= 1
+        return True
+
+    @staticmethod
+    async def _respond(send, status: int, document: dict, headers: Optional[list] = None):
+        body = json.dumps(document).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode())] + (headers or [])})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # No overall timeout: streamed answers last as long as the model takes
+                self._client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=5.0),
+                                                 limits=httpx.Limits(max_connections=None,
+                                                                     max_keepalive_connections=64))
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # Runs once the router has stopped accepting connections and its open
+                # requests have finished (uvicorn re-raises SIGTERM right after)
+                await asyncio.to_thread(self.supervisor.drain)
+                await self._client.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def serve(config_path: Optional[str] = None, workers: Optional[dict] = None):
+    """
+    Starts the workers and serves the router until SIGINT/SIGTERM; the router
+    then stops accepting connections, lets open requests finish and drains the
+    workers (in its lifespan shutdown).
+    """
+    import uvicorn
+
+    supervisor = WorkerSupervisor(load_config(config_path), workers)
+    supervisor.start()
+    router = AffinityRouter(supervisor)
+    settings = supervisor.workers_config
+    logger.info("Routing %s:%d to %d %s workers", settings["host"], settings["port"], len(supervisor.workers),
+                settings["server"])
+    server = uvicorn.Server(uvicorn.Config(router, host=settings["host"], port=settings["port"],
+                                           log_level="warning", lifespan="on",
+                                           timeout_graceful_shutdown=int(settings["drain_timeout"])))
+    try:
+        asyncio.run(server.serve())
+    finally:
+        # Only has work left if the router failed before its shutdown
+        supervisor.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the CoordinateServer workers behind an affinity router.")
+    parser.add_argument("--config", default=str(CONFIG_PATH), help="configure.json to read")
+    parser.add_argument("--workers", type=int, help="number of worker processes (workers.count)")
+    parser.add_argument("--server", choices=["flask", "async"], help="server the workers run (workers.server)")
+    parser.add_argument("--host", help="address the router listens on (workers.host)")
+    parser.add_argument("--port", type=int, help="router port; the workers use the ports after it (workers.port)")
+    args = parser.parse_args()
+    overrides = {key: value for key, value in (("count", args.workers), ("server", args.server),
+                                               ("host", args.host), ("port", args.port)) if value is not None}
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    serve(args.config, overrides)
+
+
+if __name__ == "__main__":
+    main()
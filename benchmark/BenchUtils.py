@@ -0,0 +1,103 @@
+"""
+Helpers shared by the benchmark scripts: latency statistics and running the
+CoordinateServer (Flask or async) in a child process against fake backends.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import re
+import statistics
+import sys
+import time
+
+import httpx
+
+from benchmark.FakeServers import free_port
+
+STAGE_SUM = re.compile(r'coordinate_stage_seconds_(sum|count)\{stage="(\w+)"\} (\S+)')
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors: int, elapsed: float) -> dict:
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+    }
+
+
+def stage_breakdown(metrics_text: str) -> dict:
+    """
+    Mean milliseconds per pipeline stage, from the server's `/metrics` text.
+    """
+    totals = {}
+    for kind, stage, value in STAGE_SUM.findall(metrics_text):
+        totals.setdefault(stage, {})[kind] = float(value)
+    return {stage: round(t["sum"] / t["count"] * 1000, 2) for stage, t in totals.items() if t.get("count")}
+
+
+def rss_mb(pid: int) -> float:
+    """
+    Resident memory of a process in MB, read from /proc (0.0 where that is unavailable).
+    """
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return 0.0
+
+
+def _serve(kind: str, port: int, go_url: str, config_path: str):
+    """
+    Runs one of the servers under test; meant to be the target of a child process.
+    """
+    # The server modules read GO_SERVER_URL when they are imported
+    os.environ["GO_SERVER_URL"] = go_url
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.stdout = io.StringIO()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    if kind == "flask":
+        from werkzeug.serving import make_server
+        from app.CoordinateServer import create_app
+        make_server("127.0.0.1", port, create_app(config_path), threaded=True).serve_forever()
+    else:
+        import uvicorn
+        from app.AsyncCoordinateServer import create_app
+        uvicorn.run(create_app(config_path), host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_server(kind: str, go_url: str, config_path: str) -> tuple:
+    """
+    Starts the Flask (`kind="flask"`) or async server in a child process and
+    waits until it is ready (warmed up). Returns the process and the server's base URL.
+    """
+    port = free_port()
+    process = multiprocessing.Process(target=_serve, args=(kind, port, go_url, config_path), daemon=True)
+    process.start()
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/api/ready", timeout=1).status_code == 200:
+                break
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    return process, url
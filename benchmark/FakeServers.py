@@ -0,0 +1,626 @@
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import random
+import re
+import socket
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import uvicorn
+
+
+# Default model outputs, in the harmony format that GPTParsingUtils understands.
+DEFAULT_TOOL_CALL_OUTPUT = (
+    '<|channel|>commentary to=functions.find_panels <|constrain|>json'
+    '<|message|>{"cluster_id": 3, "status": "dirty"}'
+)
+DEFAULT_SUMMARY_OUTPUT = "There are 2 dirty panels in cluster 3: panel 4 and panel 7."
+
+
+def raw_harmony_completion(output: str) -> str:
+    """
+    `output` as a gpt-oss model completes a raw harmony prompt on `/v1/completions`:
+    an analysis message first, then the tool call or the final answer, with the
+    control tokens left in.
+    """
+    reply = f"{output}<|call|>" if output.startswith("<|channel|>") else \
+        f"<|channel|>final<|message|>{output}<|return|>"
+    return f"<|channel|>analysis<|message|>Working out which tool answers this.<|end|><|start|>assistant{reply}"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class SSEStream:
+    """
+    Returned from `FakeServer.handle` to answer with Server-Sent Events.
+    `events` is an async iterator of payloads (dicts are JSON-encoded).
+    """
+
+    def __init__(self, events: AsyncIterator):
+        self.events = events
+
+
+def split_tokens(text: str) -> List[str]:
+    """
+    Splits text into pseudo-tokens of roughly four characters, about the
+    granularity at which real servers stream deltas.
+    """
+    return [text[i:i + 4] for i in range(0, len(text), 4)] or [""]
+
+
+class FakeServer:
+    """
+    A minimal ASGI application served by uvicorn on a background thread.
+    Latency is simulated with `asyncio.sleep`, so a single fake can hold
+    thousands of requests in flight without becoming the bottleneck.
+
+    Subclasses implement `handle`, returning `(status, payload)` or
+    `(status, payload, headers)`.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.request_count = 0
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/"
+
+    async def handle(self, method: str, path: str, query: Dict[str, str], body: dict) -> Tuple[int, object]:
+        return 404, {"error": "not found"}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        raw = b""
+        while True:
+            message = await receive()
+            raw += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        self.request_count += 1
+        query = dict(parse_qsl(scope.get("query_string", b"").decode()))
+        body = json.loads(raw) if raw else {}
+        status, payload, *headers = await self.handle(scope["method"], scope["path"], query, body)
+        if isinstance(payload, SSEStream):
+            await self.send_sse(send, status, payload)
+        else:
+            await self.send_json(send, status, payload, headers[0] if headers else None)
+
+    @staticmethod
+    async def send_json(send, status: int, payload, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload).encode("utf-8")
+        extra = [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in (headers or {}).items()]
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())]
+            + extra,
+        })
+        await send({"type": "http.response.body", "body": data})
+
+    @staticmethod
+    async def send_sse(send, status: int, stream: "SSEStream"):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+        })
+        async for event in stream.events:
+            data = event if isinstance(event, str) else json.dumps(event)
+            await send({"type": "http.response.body", "body": f"data: {data}\n\n".encode("utf-8"),
+                        "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    def start(self) -> "FakeServer":
+        if not self.port:
+            self.port = free_port()
+        config = uvicorn.Config(self, host=self.host, port=self.port, log_level="warning",
+                                lifespan="off", backlog=4096)
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.should_exit = True
+            self._thread.join(timeout=5)
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _serve_forever(factory, kwargs, ready):
+    fake = factory(**kwargs).start()
+    ready.put(fake.port)
+    threading.Event().wait()
+
+
+def start_in_subprocess(factory, **kwargs):
+    """
+    Starts a fake server in its own process so that it does not compete for the
+    GIL with the code being benchmarked. Returns the process and a stopped
+    instance whose `port` (and URL properties) point at the running server.
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve_forever, args=(factory, kwargs, ready), daemon=True)
+    process.start()
+    handle = factory(**kwargs)
+    handle.port = ready.get(timeout=30)
+    return process, handle
+
+
+# --- Fake OpenAI-compatible LLM server ---
+
+class FakeLLMServer(FakeServer):
+    """
+    A local stand-in for an OpenAI-compatible `/v1/chat/completions` endpoint.
+    It answers a user turn with a canned tool call and a tool result with a
+    canned summary.
+
+    `latency` models prefill (time to first token) and `tokens_per_second`
+    the generation speed; `None` generates instantly. With
+    `prefill_tokens_per_second`, prefill also grows with the prompt size
+    (about four characters per token). With `prefix_cache`, a system prompt
+    that was seen before is not prefilled again, like the KV prefix cache of
+    llama.cpp/vLLM; it only hits for a byte-identical prompt. Requests with
+    `"stream": true` are answered with SSE chunks.
+
+    Faults can be injected: `error_rate` answers that share of requests with
+    HTTP 500, and `tail_rate` delays that share by an extra `tail_latency`
+    seconds (a straggling replica).
+
+    Requests with `tools` (native tool calling) get the tool calls back as
+    structured `tool_calls`; `malformed_rate` garbles the JSON arguments of
+    that share of tool-call replies beyond repair.
+
+    `scripted_outputs` maps keywords to replies: a user turn containing a
+    keyword (case-insensitive; the first match wins) is answered with its
+    reply instead of `tool_call_output`, so a conversation mix can exercise
+    different tools, and replies without a tool call.
+
+    `slots` limits how many sequences are decoded at once (like llama.cpp's
+    `--parallel`); further requests queue. `/v1/completions` with a list of
+    prompts is decoded as one batch in a single slot, taking the time of its
+    longest sequence times `1 + batch_overhead * (batch size - 1)`.
+    """
+
+    def __init__(self, latency: float = 0.05, tool_call_output: str = DEFAULT_TOOL_CALL_OUTPUT,
+                 summary_output: str = DEFAULT_SUMMARY_OUTPUT, tokens_per_second: Optional[float] = None,
+                 prefill_tokens_per_second: Optional[float] = None, prefix_cache: bool = False,
+                 error_rate: float = 0.0, tail_rate: float = 0.0, tail_latency: float = 0.0,
+                 slots: Optional[int] = None, batch_overhead: float = 0.1, malformed_rate: float = 0.0,
+                 scripted_outputs: Optional[Dict[str, str]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.tool_call_output = tool_call_output
+        self.summary_output = summary_output
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.prefix_cache = prefix_cache
+        self._cached_prefixes = set()
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.slots = slots
+        self.batch_overhead = batch_overhead
+        self._slot_semaphore: Optional[asyncio.Semaphore] = None
+        self.batch_sizes: List[int] = []
+        self.malformed_rate = malformed_rate
+        self.scripted_outputs = {k.lower(): v for k, v in (scripted_outputs or {}).items()}
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.base_url}v1/"
+
+    def respond(self, messages: List[Dict]) -> str:
+        if messages and messages[-1].get("role") == "tool":
+            return self.summary_output
+        output = self.scripted_output(messages)
+        if self.malformed_rate and random.random() < self.malformed_rate:
+            # A missing colon after the first key: no repair can guess the structure
+            return output.replace('":', '" ', 1)
+        return output
+
+    def scripted_output(self, messages: List[Dict]) -> str:
+        user_turn = next((str(m.get("content", "")).lower() for m in reversed(messages)
+                          if m.get("role") == "user"), "")
+        for keyword, output in self.scripted_outputs.items():
+            if keyword in user_turn:
+                return output
+        return self.tool_call_output
+
+    @staticmethod
+    def native_tool_calls(content: str) -> List[Dict]:
+        """
+        The harmony tool calls in `content` as OpenAI `tool_calls` entries.
+        """
+        calls = re.findall(r"to=(?:functions\.)?(\w+)[^<]*(?:<\|constrain\|>\w+)?<\|message\|>(.*?)"
+                           r"(?=<\|call\|>|<\|start\|>|<\|channel\|>|$)", content, re.DOTALL)
+        return [{"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": arguments}}
+                for i, (name, arguments) in enumerate(calls)]
+
+    def respond_to_prompt(self, prompt: str) -> str:
+        # The turn before the open assistant turn tells a tool result from a user message
+        turns = prompt.split("<|start|>")
+        last = turns[-2] if len(turns) > 1 else ""
+        return self.summary_output if last.startswith("functions.") else self.tool_call_output
+
+    def _slot(self):
+        if not self.slots:
+            return contextlib.nullcontext()
+        if self._slot_semaphore is None:
+            self._slot_semaphore = asyncio.Semaphore(self.slots)
+        return self._slot_semaphore
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    @staticmethod
+    def prompt_tokens(messages: List[Dict]) -> int:
+        return sum(len(str(message.get("content", ""))) for message in messages) // 4
+
+    def _cached_tokens(self, messages: List[Dict]) -> int:
+        if not self.prefix_cache or not messages or messages[0].get("role") != "system":
+            return 0
+        prefix = messages[0].get("content", "")
+        if prefix in self._cached_prefixes:
+            return self.prompt_tokens(messages[:1])
+        self._cached_prefixes.add(prefix)
+        return 0
+
+    def _prefill_delay(self, prompt_tokens: int) -> float:
+        extra = prompt_tokens / self.prefill_tokens_per_second if self.prefill_tokens_per_second else 0.0
+        if self.tail_rate and random.random() < self.tail_rate:
+            extra += self.tail_latency
+        return self.latency + extra
+
+    async def handle(self, method, path, query, body):
+        if method == "POST" and path.rstrip("/").endswith("/v1/completions"):
+            return await self.handle_completions(body)
+        if method != "POST" or not path.rstrip("/").endswith("/chat/completions"):
+            return 404, {"error": "not found"}
+        if self.error_rate and random.random() < self.error_rate:
+            await asyncio.sleep(self.latency)
+            return 500, {"error": {"message": "injected failure", "type": "server_error"}}
+
+        content = self.respond(body.get("messages", []))
+        tokens = split_tokens(content)
+        prompt_tokens = self.prompt_tokens(body.get("messages", []))
+        cached_tokens = self._cached_tokens(body.get("messages", []))
+        model = body.get("model", "fake-model")
+        completion_id = f"chatcmpl-fake-{self.request_count}"
+
+        tool_calls = self.native_tool_calls(content) if body.get("tools") else []
+        if body.get("stream"):
+            return 200, SSEStream(self._stream_chunks(completion_id, model, tokens, prompt_tokens - cached_tokens,
+                                                      tool_calls))
+
+        async with self._slot():
+            self.batch_sizes.append(1)
+            await asyncio.sleep(self._prefill_delay(prompt_tokens - cached_tokens) + len(tokens) * self._token_delay())
+        return 200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": None, "tool_calls": tool_calls} if tool_calls
+                else {"role": "assistant", "content": content},
+                "finish_reason": "tool_calls" if tool_calls else "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                      "total_tokens": prompt_tokens + len(tokens),
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+        }
+
+    async def handle_completions(self, body: dict):
+        prompts = body.get("prompt", "")
+        prompts = [prompts] if isinstance(prompts, str) else prompts
+        if self.error_rate and random.random() < self.error_rate:
+            await asyncio.sleep(self.latency)
+            return 500, {"error": {"message": "injected failure", "type": "server_error"}}
+
+        outputs = [self.respond_to_prompt(prompt) for prompt in prompts]
+        texts = [raw_harmony_completion(output) for output in outputs]
+        tokens = [len(split_tokens(text)) for text in texts]
+        prompt_tokens = [len(prompt) // 4 for prompt in prompts]
+        # The batch decodes together: as long as its longest sequence, plus a per-sequence overhead
+        single = max(self._prefill_delay(p) + n * self._token_delay() for p, n in zip(prompt_tokens, tokens))
+        async with self._slot():
+            self.batch_sizes.append(len(prompts))
+            await asyncio.sleep(single * (1 + self.batch_overhead * (len(prompts) - 1)))
+        return 200, {
+            "id": f"cmpl-fake-{self.request_count}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake-model"),
+            "choices": [{"index": i, "text": text, "finish_reason": "stop", "logprobs": None}
+                        for i, text in enumerate(texts)],
+            "usage": {"prompt_tokens": sum(prompt_tokens), "completion_tokens": sum(tokens),
+                      "total_tokens": sum(prompt_tokens) + sum(tokens)},
+        }
+
+    async def _stream_chunks(self, completion_id: str, model: str, tokens: List[str], prompt_tokens: int = 0,
+                             tool_calls: Optional[List[Dict]] = None):
+        # Native tool calls stream as the call's name, then its arguments in pieces
+        deltas = [{"content": token} for token in tokens] if not tool_calls else [
+            {"tool_calls": [{"index": i, **({"id": call["id"], "type": "function",
+                                             "function": {"name": call["function"]["name"], "arguments": ""}}
+                                            if j == 0 else {"function": {"arguments": piece}})}]}
+            for i, call in enumerate(tool_calls)
+            for j, piece in enumerate([""] + split_tokens(call["function"]["arguments"]))]
+        async with self._slot():
+            await asyncio.sleep(self._prefill_delay(prompt_tokens))
+            # Paced against the start, so the sleeps' overshoot does not add up over a long reply
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            for i, delta in enumerate(deltas):
+                if i:
+                    await asyncio.sleep(max(0.0, started + i * self._token_delay() - loop.time()))
+                yield {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                }
+        yield {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield "[DONE]"
+
+    def write_config(self, path, **overrides) -> str:
+        """
+        Writes a `configure.json` that points LMWrapper at this server.
+        """
+        config = {
+            "lm_api_url": self.api_url,
+            "provider": "local",
+            "api_key": "fake-key",
+            "model": "fake-model",
+            "request_options": {"temperature": 0.0, "max_tokens": 256, "stream": False},
+        }
+        config.update(overrides)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+        return str(path)
+
+
+# --- Fake Gemini server ---
+
+class FakeGeminiServer(FakeLLMServer):
+    """
+    A local stand-in for the Gemini `models/{model}:generateContent` and
+    `:streamGenerateContent?alt=sse` endpoints, answering like FakeLLMServer:
+    a user turn with the canned (or scripted) tool call, a tool result with
+    the summary. Tool results arrive as `functionResponse` parts (native tool
+    calling) or as user text starting with "Result of " (text tool calling);
+    `functionCall` parts are returned when the request declares tools.
+
+    `rate_limit_rate` answers that share of requests with 429 and a
+    `Retry-After` of `retry_after` seconds, `error_rate` with 503. GET /stats
+    returns the counters, including `without_tool_result`: requests whose
+    last turn was the model's own tool call, i.e. the tool result was lost.
+    """
+
+    def __init__(self, rate_limit_rate: float = 0.0, retry_after: float = 0.2, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.stats = {"requests": 0, "rate_limited": 0, "errors": 0, "function_responses": 0,
+                      "text_tool_results": 0, "without_tool_result": 0}
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.base_url}v1beta/"
+
+    def to_messages(self, contents: List[Dict]) -> List[Dict]:
+        """
+        The Gemini contents as chat messages, counting how tool results came in.
+        """
+        messages = []
+        for content in contents:
+            for part in content.get("parts", []):
+                if "functionResponse" in part:
+                    self.stats["function_responses"] += 1
+                    messages.append({"role": "tool", "content": json.dumps(part["functionResponse"]["response"])})
+                elif "functionCall" in part:
+                    messages.append({"role": "assistant", "content": json.dumps(part["functionCall"])})
+                elif str(part.get("text", "")).startswith("Result of "):
+                    self.stats["text_tool_results"] += 1
+                    messages.append({"role": "tool", "content": part["text"]})
+                else:
+                    role = "assistant" if content.get("role") == "model" else "user"
+                    messages.append({"role": role, "content": part.get("text", "")})
+        return messages
+
+    def _parts(self, content: str, native: bool) -> List[Dict]:
+        calls = self.native_tool_calls(content) if native else []
+        if calls:
+            return [{"functionCall": {"name": call["function"]["name"],
+                                      "args": json.loads(call["function"]["arguments"])}} for call in calls]
+        return [{"text": token} for token in split_tokens(content)]
+
+    async def handle(self, method, path, query, body):
+        if method == "GET" and path.rstrip("/") == "/stats":
+            return 200, self.stats
+        model, _, action = path.rstrip("/").rpartition("/")[2].partition(":")
+        if method != "POST" or action not in ("generateContent", "streamGenerateContent"):
+            return 404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}}
+        self.stats["requests"] += 1
+        if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return 429, {"error": {"code": 429, "message": "Resource has been exhausted",
+                                   "status": "RESOURCE_EXHAUSTED"}}, {"Retry-After": self.retry_after}
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            await asyncio.sleep(self.latency)
+            return 503, {"error": {"code": 503, "message": "injected failure", "status": "UNAVAILABLE"}}
+
+        contents = body.get("contents", [])
+        if contents and contents[-1].get("role") == "model":
+            self.stats["without_tool_result"] += 1
+        messages = self.to_messages(contents)
+        content = self.respond(messages)
+        system = "".join(p.get("text", "") for p in body.get("systemInstruction", {}).get("parts", []))
+        prompt_tokens = (len(system) + sum(len(str(m["content"])) for m in messages)) // 4
+        parts = self._parts(content, native=bool(body.get("tools")))
+        usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": len(split_tokens(content)),
+                 "totalTokenCount": prompt_tokens + len(split_tokens(content))}
+
+        if action == "streamGenerateContent":
+            return 200, SSEStream(self._stream_gemini(parts, usage, prompt_tokens))
+        async with self._slot():
+            await asyncio.sleep(self._prefill_delay(prompt_tokens) + len(parts) * self._token_delay())
+        if parts and "text" in parts[0]:
+            parts = [{"text": content}]
+        return 200, {"candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP",
+                                     "index": 0}],
+                     "usageMetadata": usage, "modelVersion": model}
+
+    async def _stream_gemini(self, parts: List[Dict], usage: Dict, prompt_tokens: int):
+        async with self._slot():
+            await asyncio.sleep(self._prefill_delay(prompt_tokens))
+            for i, part in enumerate(parts):
+                if i:
+                    await asyncio.sleep(self._token_delay())
+                chunk = {"candidates": [{"content": {"role": "model", "parts": [part]}, "index": 0}]}
+                if i == len(parts) - 1:
+                    chunk["candidates"][0]["finishReason"] = "STOP"
+                    chunk["usageMetadata"] = usage
+                yield chunk
+
+    def write_config(self, path, **overrides) -> str:
+        """
+        Writes a `configure.json` that points LMWrapper's Gemini backend at this server.
+        """
+        gemini = {"api_url": self.api_url, **overrides.pop("gemini", {})}
+        return super().write_config(path, provider="gemini", gemini=gemini, **overrides)
+
+
+# --- Fake Go coordination server ---
+
+class FakeGoServer(FakeServer):
+    """
+    A local stand-in for the Go coordination server, covering every endpoint
+    ToolExecutor calls. Data is generated deterministically from the cluster
+    and panel counts.
+
+    Dispatches to the clusters in `fail_clusters` are refused (409), to test
+    partial failures of batch tools. With `batch_endpoints`, the server also
+    takes `{"items": [...]}` on POST /api/drones/send/batch and
+    /api/maintenance_requests/batch and answers with one result per item.
+    `path_latency` overrides `latency` for single paths (e.g. a slow
+    "/api/panels"). GET /stats returns the request and dispatch counts.
+    """
+
+    def __init__(self, latency: float = 0.01, clusters: int = 10, panels_per_cluster: int = 20,
+                 drones: int = 5, fail_clusters=(), batch_endpoints: bool = False,
+                 path_latency: Optional[Dict[str, float]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.path_latency = path_latency or {}
+        self.fail_clusters = set(fail_clusters)
+        self.batch_endpoints = batch_endpoints
+        self.dispatches = 0
+        self.panels = [
+            {
+                "cluster_id": c,
+                "panel_id": p,
+                "status": "dirty" if (c * 31 + p) % 7 == 0 else "healthy",
+                "latest_status_time": "2025-05-15T09:00:00Z",
+            }
+            for c in range(1, clusters + 1)
+            for p in range(1, panels_per_cluster + 1)
+        ]
+        self.drones = [
+            {"drone_id": d, "destination": (d % clusters) + 1, "battery": 100.0 - d, "status": "available"}
+            for d in range(1, drones + 1)
+        ]
+
+    @property
+    def api_url(self) -> str:
+        return self.base_url
+
+    async def handle(self, method, path, query, body):
+        await asyncio.sleep(self.path_latency.get(path, self.latency))
+        if method == "GET":
+            if path == "/api/panels":
+                return 200, self.query_panels(query)
+            if path == "/api/maintenance_requests":
+                return 200, self.query_maintenance(query)
+            if path == "/api/drones":
+                return 200, self.query_drones(query)
+            if path == "/stats":
+                return 200, {"requests": self.request_count, "dispatches": self.dispatches}
+        elif method == "POST":
+            match = re.fullmatch(r"/api/drones/send/(\d+)", path)
+            if match:
+                return self.dispatch(int(match.group(1)))
+            items = (body or {}).get("items", [])
+            if self.batch_endpoints and path == "/api/drones/send/batch":
+                return 200, [self.dispatch(int(item["cluster_id"]))[1] for item in items]
+            if self.batch_endpoints and path == "/api/maintenance_requests/batch":
+                return 200, [self.query_maintenance({"clusterid": str(item["cluster_id"]),
+                                                     "panelid": str(item["panel_id"])}) for item in items]
+        return 404, {"error": "not found"}
+
+    def query_panels(self, query: Dict[str, str]) -> list:
+        rows = self.panels
+        if "clusterid" in query:
+            rows = [r for r in rows if str(r["cluster_id"]) == query["clusterid"]]
+        if "panelid" in query:
+            rows = [r for r in rows if str(r["panel_id"]) == query["panelid"]]
+        if "status" in query:
+            rows = [r for r in rows if r["status"] == query["status"]]
+        return rows
+
+    def query_maintenance(self, query: Dict[str, str]) -> list:
+        return [
+            {"cluster_id": int(query.get("clusterid", 0)), "panel_id": int(query.get("panelid", 0)),
+             "type": "cleaning", "date": "2025-04-30", "status": "completed"},
+            {"cluster_id": int(query.get("clusterid", 0)), "panel_id": int(query.get("panelid", 0)),
+             "type": "inspection", "date": "2025-05-10", "status": "completed"},
+        ]
+
+    def query_drones(self, query: Dict[str, str]) -> list:
+        rows = self.drones
+        if "droneid" in query:
+            rows = [r for r in rows if str(r["drone_id"]) == query["droneid"]]
+        if "destination" in query:
+            rows = [r for r in rows if str(r["destination"]) == query["destination"]]
+        return rows
+
+    def dispatch(self, cluster_id: int) -> Tuple[int, dict]:
+        if cluster_id in self.fail_clusters:
+            return 409, {"error": f"No drone available for cluster {cluster_id}."}
+        self.dispatches += 1
+        return 200, self.send_drone(cluster_id)
+
+    def send_drone(self, cluster_id: int) -> dict:
+        return {"status": "success", "message": f"Drone dispatched to cluster {cluster_id}."}
@@ -0,0 +1,131 @@
+"""
+Behavior of `/api/chat` under overload, with and without admission control.
+
+A fake LLM that decodes only `--llm-slots` sequences at once (like a single
+local model) is flooded with `--concurrency` clients. `--dispatch-share` of
+the requests ask for the "dispatch" priority class (X-Priority header), the
+rest for "browse"; one in four requests comes from a "noisy" API key. Runs:
+  * off: `"enabled": false`, every request goes straight to the model;
+  * admission: a bounded in-flight limit and queue;
+  * rate limit: the same, plus a token bucket per API key.
+Per priority class, the latency of the answered requests is reported, with
+the number of 429/503 rejections (and whether they carried Retry-After), and
+the mean queue wait read back from `/metrics`.
+
+Usage (from the repository root):
+    python -m benchmark.bench_admission --requests 300 --concurrency 64 --max-in-flight 4 --max-queue 16
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import start_server, summarize
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+
+QUEUE_WAIT = re.compile(r'coordinate_queue_wait_seconds_(sum|count)\{priority="(\w+)"\} (\S+)')
+
+
+def queue_wait_ms(metrics_text: str) -> dict:
+    totals = {}
+    for kind, priority, value in QUEUE_WAIT.findall(metrics_text):
+        totals.setdefault(priority, {})[kind] = float(value)
+    return {p: round(t["sum"] / t["count"] * 1000, 1) for p, t in totals.items() if t.get("count")}
+
+
+async def drive_priorities(url: str, total: int, concurrency: int, dispatch_share: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    plan = [("dispatch" if rng.random() < dispatch_share else "browse", "noisy" if i % 4 == 0 else f"key-{i % 7}")
+            for i in range(total)]
+    latencies = {"dispatch": [], "browse": []}
+    statuses, retry_after = {}, 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    body = {"messages": [{"role": "user", "content": "find all panels in cluster 3 that are dirty"}]}
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def one(priority: str, key: str):
+            nonlocal retry_after
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(url, json=body, headers={"X-Priority": priority, "X-API-Key": key})
+                except httpx.HTTPError:
+                    statuses["error"] = statuses.get("error", 0) + 1
+                    return
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+                if resp.status_code == 200:
+                    latencies[priority].append(time.perf_counter() - started)
+                elif "retry-after" in resp.headers:
+                    retry_after += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(priority, key) for priority, key in plan))
+        elapsed = time.perf_counter() - started
+
+    return {"statuses": {str(k): v for k, v in sorted(statuses.items(), key=str)}, "with_retry_after": retry_after,
+            "by_priority": {p: summarize(ls, 0, elapsed) for p, ls in latencies.items()},
+            "elapsed_s": round(elapsed, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--server", choices=["flask", "async"], default="async")
+    parser.add_argument("--dispatch-share", type=float, default=0.2)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=16)
+    parser.add_argument("--queue-timeout", type=float, default=5.0)
+    parser.add_argument("--rate", type=float, default=5.0, help="requests/sec per API key in the rate-limit run")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-slots", type=int, default=2)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.llm_latency, slots=args.llm_slots)
+    go_process, go = start_in_subprocess(FakeGoServer, latency=0.005)
+    workdir = Path(tempfile.mkdtemp())
+    admission = {"max_in_flight": args.max_in_flight, "max_queue": args.max_queue,
+                 "queue_timeout": args.queue_timeout}
+    settings = {
+        "off": {"enabled": False},
+        "admission": admission,
+        "rate limit": {**admission, "rate_limit": {"enabled": True, "requests_per_second": args.rate,
+                                                   "burst": args.rate}},
+    }
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'run':<12}{'priority':<10}{'ok':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, admission_config in settings.items():
+        config_path = llm.write_config(workdir / f"{name.replace(' ', '-')}.json", admission=admission_config)
+        process, base_url = start_server(args.server, go.api_url, config_path)
+        run = asyncio.run(drive_priorities(f"{base_url}/api/chat", args.requests, args.concurrency,
+                                           args.dispatch_share, seed=0))
+        run["queue_wait_ms"] = queue_wait_ms(httpx.get(f"{base_url}/metrics").text)
+        run["admission"] = httpx.get(f"{base_url}/api/stats").json()["admission"]
+        process.terminate()
+        results["runs"][name] = run
+        for priority, stats in run["by_priority"].items():
+            print(f"{name:<12}{priority:<10}{stats['requests']:>6}{stats['p50_ms']:>9}{stats['p95_ms']:>9}"
+                  f"{stats['p99_ms']:>9}")
+    llm_process.terminate()
+    go_process.terminate()
+
+    for name, run in results["runs"].items():
+        print(f"{name}: statuses {run['statuses']}, with Retry-After {run['with_retry_after']}, "
+              f"mean queue wait ms {run['queue_wait_ms']}, took {run['elapsed_s']} s")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
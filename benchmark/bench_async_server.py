@@ -0,0 +1,86 @@
+"""
+Compares the Flask `/api/chat` path with the async (FastAPI/uvicorn) one.
+
+Both servers are pointed at a local fake LLM and a fake Go server, then driven
+with the same number of concurrent clients. Reports requests/sec and latency
+percentiles for each.
+
+Usage (from the repository root):
+    python -m benchmark.bench_async_server --requests 500 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import start_server, summarize
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+
+
+async def drive(url: str, total: int, concurrency: int) -> dict:
+    """
+    Sends `total` single-turn chat requests to `url` with at most `concurrency` in flight.
+    """
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    body = {"messages": [{"role": "user", "content": "find all panels in cluster 3 that are dirty"}]}
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(url, json=body)
+                    resp.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+                except httpx.HTTPError:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return summarize(latencies, errors, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per fake completion")
+    parser.add_argument("--go-latency", type=float, default=0.01, help="seconds per fake Go call")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.llm_latency)
+    go_process, go = start_in_subprocess(FakeGoServer, latency=args.go_latency)
+    config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json")
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}}
+    for kind in ("flask", "async"):
+        process, base_url = start_server(kind, go.api_url, config_path)
+        url = f"{base_url}/api/chat"
+        asyncio.run(drive(url, min(20, args.requests), args.concurrency))  # warm-up
+        results[kind] = asyncio.run(drive(url, args.requests, args.concurrency))
+        process.terminate()
+    llm_process.terminate()
+    go_process.terminate()
+
+    print(f"{'path':<8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for kind in ("flask", "async"):
+        r = results[kind]
+        print(f"{kind:<8}{r['rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errors']:>8}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
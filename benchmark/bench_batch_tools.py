@@ -0,0 +1,101 @@
+"""
+Compares batch tools with one tool call per ID against the fake Go server.
+
+For `--ids` clusters (and one panel in each), three ways of doing the same
+work are timed, with the sync (`execute_tool`) and async (`aexecute_tool`)
+executors:
+  * single: `dispatch_drone_to_cluster` / `get_panel_maintenance_history`
+    once per ID, one after another (one model turn per ID before batch tools);
+  * fan-out: one `dispatch_drones_to_clusters` / `get_maintenance_history_batch`
+    call, sent as `--max-fanout` concurrent requests;
+  * endpoint: the same batch call sent to the server's batch endpoints.
+
+Dispatches to `--fail-clusters` are refused by the server, so the batch
+results show partial failures. The size of the tool result the model reads
+next is reported as JSON characters.
+
+Usage (from the repository root):
+    python -m benchmark.bench_batch_tools --ids 20 --max-fanout 8 --go-latency 0.05 --fail-clusters 3 7
+"""
+import argparse
+import asyncio
+import io
+import json
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from benchmark.FakeServers import FakeGoServer, start_in_subprocess
+from utils.ToolExecutor import ToolExecutor
+
+BATCH_ENDPOINTS = {"dispatch_drone_to_cluster": "api/drones/send/batch",
+                   "get_panel_maintenance_history": "api/maintenance_requests/batch"}
+
+
+def workloads(ids: int) -> dict:
+    clusters = list(range(1, ids + 1))
+    panels = [{"cluster_id": c, "panel_id": 1} for c in clusters]
+    return {
+        "dispatch": ("dispatch_drone_to_cluster", [{"cluster_id": c} for c in clusters],
+                     "dispatch_drones_to_clusters", {"cluster_ids": clusters}),
+        "maintenance": ("get_panel_maintenance_history", panels,
+                        "get_maintenance_history_batch", {"panels": panels}),
+    }
+
+
+def make_executor(go_url: str, max_fanout: int, endpoints: bool) -> ToolExecutor:
+    config = {"batch": {"max_fanout": max_fanout, "endpoints": BATCH_ENDPOINTS if endpoints else {}}}
+    with redirect_stdout(io.StringIO()):
+        return ToolExecutor(go_url, config=config, cache_config={"enabled": False})
+
+
+def measure(executor: ToolExecutor, calls: list, use_async: bool) -> dict:
+    before = executor.get_stats()["requests"]
+    started = time.perf_counter()
+    if use_async:
+        async def run():
+            return [await executor.aexecute_tool(name, arguments) for name, arguments in calls]
+        results = asyncio.run(run())
+    else:
+        results = [executor.execute_tool(name, arguments) for name, arguments in calls]
+    elapsed = time.perf_counter() - started
+    failed = sum(r.get("failed", 0) if "requested" in r else int("error" in r)
+                 for r in results if isinstance(r, dict))
+    return {"elapsed_ms": round(elapsed * 1000, 1), "go_requests": executor.get_stats()["requests"] - before,
+            "failed": failed, "result_chars": sum(len(json.dumps(r)) for r in results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ids", type=int, default=20)
+    parser.add_argument("--max-fanout", type=int, default=8)
+    parser.add_argument("--go-latency", type=float, default=0.05)
+    parser.add_argument("--fail-clusters", type=int, nargs="*", default=[3, 7])
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    go_process, go = start_in_subprocess(FakeGoServer, latency=args.go_latency, clusters=args.ids,
+                                         fail_clusters=args.fail_clusters, batch_endpoints=True)
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": []}
+    print(f"{'workload':<13}{'mode':<7}{'run':<10}{'ms':>9}{'go requests':>13}{'failed':>8}{'result chars':>14}")
+    for workload, (single, items, batch, batch_arguments) in workloads(args.ids).items():
+        runs = {"single": (False, [(single, item) for item in items]),
+                "fan-out": (False, [(batch, batch_arguments)]),
+                "endpoint": (True, [(batch, batch_arguments)])}
+        for mode in ("sync", "async"):
+            for name, (endpoints, calls) in runs.items():
+                executor = make_executor(go.api_url, args.max_fanout, endpoints)
+                run = {"workload": workload, "mode": mode, "run": name,
+                       **measure(executor, calls, use_async=mode == "async")}
+                results["runs"].append(run)
+                print(f"{workload:<13}{mode:<7}{name:<10}{run['elapsed_ms']:>9}{run['go_requests']:>13}"
+                      f"{run['failed']:>8}{run['result_chars']:>14}")
+    go_process.terminate()
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
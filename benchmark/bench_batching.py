@@ -0,0 +1,121 @@
+"""
+Throughput and latency of micro-batched completions against a local fake
+model server that decodes one sequence at a time (`--slots 1`) but gains
+from batches: a batch of b prompts takes `1 + batch_overhead * (b - 1)`
+times as long as one.
+
+`--concurrency` callers each send completions back to back through
+`LMWrapper.aget_completion` (or `get_completion` from threads with
+`--sync`, as the Flask server does), first unbatched and then with the
+"batching" section at every `--windows` value.
+
+Usage (from the repository root):
+    python -m benchmark.bench_batching --requests 400 --concurrency 32 --windows 2 5 10
+"""
+import argparse
+import asyncio
+import io
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from benchmark.BenchUtils import summarize
+from benchmark.FakeServers import FakeLLMServer, split_tokens, start_in_subprocess
+from utils.LLMRouter import is_model_error
+from utils.LMWrapper import LMWrapper
+
+MESSAGES = [{"role": "user", "content": "Which panels in cluster 3 are dirty?"}]
+
+
+async def run_async(lm_wrapper: LMWrapper, requests: int, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors, tokens = [], 0, 0
+
+    async def one():
+        nonlocal errors, tokens
+        async with semaphore:
+            started = time.perf_counter()
+            text = await lm_wrapper.aget_completion(MESSAGES)
+            if is_model_error(text):
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+                tokens += len(split_tokens(text))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, errors, tokens, time.perf_counter() - started
+
+
+def run_sync(lm_wrapper: LMWrapper, requests: int, concurrency: int) -> tuple:
+    def one(_):
+        started = time.perf_counter()
+        text = lm_wrapper.get_completion(MESSAGES)
+        return text, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = [latency for text, latency in results if not is_model_error(text)]
+    tokens = sum(len(split_tokens(text)) for text, _ in results if not is_model_error(text))
+    return latencies, len(results) - len(latencies), tokens, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--windows", type=float, nargs="+", default=[2.0, 5.0, 10.0], help="batching window_ms")
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02, help="prefill seconds per sequence")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--slots", type=int, default=1, help="sequences the fake server decodes at once")
+    parser.add_argument("--batch-overhead", type=float, default=0.1)
+    parser.add_argument("--sync", action="store_true", help="call get_completion from threads")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.latency,
+                                           tokens_per_second=args.tokens_per_second, slots=args.slots,
+                                           batch_overhead=args.batch_overhead)
+    scenarios = {"unbatched": None}
+    for window in args.windows:
+        # The fake server completes raw prompts the way a gpt-oss model does
+        scenarios[f"window {window:g} ms"] = {"enabled": True, "window_ms": window,
+                                              "max_batch_size": args.max_batch_size, "harmony": True}
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'scenario':<16}{'rps':>8}{'tok/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+          f"{'batch':>7}{'wait ms':>9}")
+    for name, batching in scenarios.items():
+        overrides = {"batching": batching} if batching else {}
+        config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json", **overrides)
+        with redirect_stdout(io.StringIO()):
+            lm_wrapper = LMWrapper(config_path=config_path)
+            lm_wrapper.set_system_prompt("You are a test assistant.")
+            if args.sync:
+                latencies, errors, tokens, elapsed = run_sync(lm_wrapper, args.requests, args.concurrency)
+            else:
+                latencies, errors, tokens, elapsed = asyncio.run(
+                    run_async(lm_wrapper, args.requests, args.concurrency))
+        run = summarize(latencies, errors, elapsed)
+        run["tokens_per_second"] = round(tokens / elapsed, 1)
+        stats = lm_wrapper.get_stats().get("batching", {})
+        run["batching"] = stats
+        results["runs"][name] = run
+        print(f"{name:<16}{run['rps']:>8}{run['tokens_per_second']:>9}{run['p50_ms']:>9}{run['p95_ms']:>9}"
+              f"{run['p99_ms']:>9}{run['errors']:>8}{stats.get('mean_batch_size', 1.0):>7}"
+              f"{stats.get('mean_wait_ms', 0.0):>9}")
+
+    llm_process.terminate()
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
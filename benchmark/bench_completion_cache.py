@@ -0,0 +1,93 @@
+"""
+Measures the completion cache on a canned-question workload.
+
+Operators ask the same few questions over and over. Each question is sent to `/api/chat` as a new conversation, once
+with the "completion_cache" disabled and once enabled. With the cache, a
+repeated question skips the model round trip that decides the tool call;
+the tool still runs live, so the Go server sees the same number of
+requests in both runs. The tool result cache is disabled to show that.
+The fake server's config runs at temperature 0, which the cache requires.
+
+Usage (from the repository root):
+    python -m benchmark.bench_completion_cache --requests 200 --questions 5
+"""
+import argparse
+import io
+import json
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import start_server, summarize
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+from benchmark.bench_parallel_tools import tool_call_text
+
+
+def question(i: int, questions: int) -> str:
+    return f"Which panels in cluster {i % questions + 1} are dirty?"
+
+
+def run(go_url: str, llm: FakeLLMServer, requests: int, questions: int, cache: dict, server: str) -> dict:
+    config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json", completion_cache=cache,
+                                   tool_cache={"enabled": False})
+    process, url = start_server(server, go_url, config_path)
+    latencies, errors = [], 0
+    try:
+        with httpx.Client(base_url=url, timeout=120) as client:
+            started = time.perf_counter()
+            for i in range(requests):
+                body = {"messages": [{"role": "user", "content": question(i, questions)}]}
+                sent = time.perf_counter()
+                response = client.post("/api/chat", json=body)
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - sent)
+            elapsed = time.perf_counter() - started
+            stats = client.get("/api/stats").json()
+    finally:
+        process.terminate()
+    result = summarize(latencies, errors, elapsed)
+    result["go_requests"] = stats["tool_executor"]["requests"]
+    result["completion_cache"] = stats["lm_wrapper"].get("completion_cache")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=5, help="distinct canned questions")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake completion")
+    parser.add_argument("--scope", choices=["tool_calls", "all"], default="tool_calls")
+    parser.add_argument("--server", choices=["flask", "async"], default="async")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    go_process, go = start_in_subprocess(FakeGoServer, latency=0.005)
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.latency, tool_call_output=tool_call_text(1))
+    with redirect_stdout(io.StringIO()):
+        runs = {
+            "cache off": run(go.api_url, llm, args.requests, args.questions, {"enabled": False}, args.server),
+            "cache on": run(go.api_url, llm, args.requests, args.questions,
+                            {"enabled": True, "scope": args.scope, "max_entries": 1024}, args.server),
+        }
+    go_process.terminate()
+    llm_process.terminate()
+
+    print(f"{'run':<10}{'p50 ms':>9}{'p95 ms':>9}{'mean ms':>9}{'go reqs':>9}{'hit rate':>10}{'saved s':>9}")
+    for name, result in runs.items():
+        cache = result["completion_cache"] or {}
+        print(f"{name:<10}{result['p50_ms']:>9}{result['p95_ms']:>9}{result['mean_ms']:>9}{result['go_requests']:>9}"
+              f"{cache.get('hit_rate', '-'):>10}{cache.get('latency_saved_s', '-'):>9}")
+
+    if args.json:
+        results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": runs}
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
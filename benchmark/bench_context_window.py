@@ -0,0 +1,105 @@
+"""
+Measures what context-window compaction saves over a long maintenance session.
+
+Each turn asks about panels, so every turn adds a tool call and a large
+`find_panels` result to the history. The session is run once with the
+"context_window" compaction enabled and once without it; for every turn the
+script reports the prompt tokens sent to the model, summed over the turn's
+completions and counted by the compactor's estimator, and the wall-clock
+latency of the `/api/chat` call.
+The fake LLM's prefill time grows with the prompt (`--prefill-tps`), as it
+does for a real model.
+
+Usage (from the repository root):
+    python -m benchmark.bench_context_window --turns 30 --budget 4000
+"""
+import argparse
+import io
+import json
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import start_server
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+from benchmark.bench_parallel_tools import tool_call_text
+
+
+def run_session(go_url: str, llm: FakeLLMServer, turns: int, context_window: dict, server: str) -> tuple:
+    config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json", context_window=context_window)
+    process, url = start_server(server, go_url, config_path)
+    per_turn = []
+    try:
+        with httpx.Client(base_url=url, timeout=120) as client:
+            conversation_id = None
+            previous = {"tokens_before": 0, "tokens_after": 0}
+            for turn in range(turns):
+                body = {"conversation_id": conversation_id,
+                        "messages": [{"role": "user", "content": f"Which panels of cluster {turn % 10 + 1} are dirty?"}]}
+                started = time.perf_counter()
+                response = client.post("/api/chat", json=body)
+                elapsed = time.perf_counter() - started
+                response.raise_for_status()
+                conversation_id = response.json()["conversation_id"]
+
+                stats = client.get("/api/stats").json()["lm_wrapper"]["context_window"]
+                sent = stats.get("tokens_after", 0) - previous["tokens_after"]
+                full = stats.get("tokens_before", 0) - previous["tokens_before"]
+                previous = stats
+                per_turn.append({"turn": turn + 1, "prompt_tokens_full": full, "prompt_tokens_sent": sent,
+                                 "latency_ms": round(elapsed * 1000, 1)})
+            final_stats = client.get("/api/stats").json()["lm_wrapper"]["context_window"]
+    finally:
+        process.terminate()
+    return per_turn, final_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--budget", type=int, default=4000, help="context_window.max_prompt_tokens")
+    parser.add_argument("--keep-recent-turns", type=int, default=3)
+    parser.add_argument("--panels", type=int, default=60, help="panels per cluster in the fake Go server")
+    parser.add_argument("--prefill-tps", type=float, default=4000.0, help="fake LLM prefill tokens/second")
+    parser.add_argument("--server", choices=["flask", "async"], default="async")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    go_process, go = start_in_subprocess(FakeGoServer, latency=0.005, panels_per_cluster=args.panels)
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=0.02, tool_call_output=tool_call_text(2),
+                                           prefill_tokens_per_second=args.prefill_tps)
+    compaction = {"enabled": True, "max_prompt_tokens": args.budget, "keep_recent_turns": args.keep_recent_turns,
+                  "max_tool_result_tokens": 256, "summary": {"enabled": True, "mode": "extractive"},
+                  "tokenizer": "o200k_base"}
+    # Disabled compaction still counts tokens, so the "full" prompt size is reported for both runs
+    no_compaction = compaction | {"max_prompt_tokens": 10 ** 9}
+
+    with redirect_stdout(io.StringIO()):
+        baseline, _ = run_session(go.api_url, llm, args.turns, no_compaction, args.server)
+        compacted, stats = run_session(go.api_url, llm, args.turns, compaction, args.server)
+    go_process.terminate()
+    llm_process.terminate()
+
+    print(f"{'turn':>4}{'full tokens':>13}{'sent tokens':>13}{'saved':>8}{'off ms':>9}{'on ms':>9}")
+    for off, on in zip(baseline, compacted):
+        print(f"{on['turn']:>4}{on['prompt_tokens_full']:>13}{on['prompt_tokens_sent']:>13}"
+              f"{on['prompt_tokens_full'] - on['prompt_tokens_sent']:>8}{off['latency_ms']:>9}{on['latency_ms']:>9}")
+    total_off = sum(turn["latency_ms"] for turn in baseline)
+    total_on = sum(turn["latency_ms"] for turn in compacted)
+    print(f"tokens saved: {stats['tokens_saved']} of {stats['tokens_before']} "
+          f"({stats['tokens_saved'] / max(1, stats['tokens_before']):.0%}), "
+          f"mean compaction {stats['mean_compaction_ms']} ms, "
+          f"session {total_off:.0f} ms -> {total_on:.0f} ms")
+
+    if args.json:
+        results = {"config": {k: v for k, v in vars(args).items() if k != "json"},
+                   "without_compaction": baseline, "with_compaction": compacted, "stats": stats}
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Load test for the conversation stores in `utils/ConversationStore.py`.
+
+Creates `--conversations` conversations with `--turns` user/assistant turns
+each (plus one tool result per turn), then reports for every backend:
+  * memory: Python heap growth (tracemalloc) scaled to 10k conversations,
+    and the database file size for SQLite;
+  * append latency: p50/p95/p99 of a single `append` call, measured on a
+    store that already holds all conversations;
+  * listing: building the whole conversation list vs. one page of 50
+    (`list_page`, the mean over the first 20 pages by last activity), and the
+    last 20 messages of a conversation (`get_range`) vs. its full history.
+
+The MongoDB backend is opt-in (`--backends ... mongodb`) and runs against
+mongomock unless `--mongo-uri` is given; mongomock's numbers say nothing about
+a real mongod.
+
+Usage (from the repository root):
+    python -m benchmark.bench_conversation_store --conversations 10000 --turns 5
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmark.BenchUtils import percentile
+from utils.ConversationStore import InMemoryConversationStore, MongoConversationStore, SQLiteConversationStore
+
+TOOL_RESULT = json.dumps([{"cluster_id": 3, "panel_id": i, "status": "dirty"} for i in range(5)])
+
+
+def turn_messages(turn: int) -> list:
+    return [
+        {"role": "user", "content": f"Which panels in cluster {turn} are dirty?"},
+        {"role": "assistant", "content": f"<|channel|>commentary to=functions.find_panels "
+                                         f"<|message|>{{\"cluster_id\": {turn}}}<|call|>"},
+        {"role": "tool", "name": "find_panels", "content": TOOL_RESULT},
+        {"role": "assistant", "content": f"Cluster {turn} has five dirty panels."},
+    ]
+
+
+def bench_store(name: str, factory, conversations: int, turns: int, samples: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = factory()
+
+    started = time.perf_counter()
+    ids = []
+    for _ in range(conversations):
+        conversation_id = store.create()
+        for turn in range(turns):
+            store.append(conversation_id, turn_messages(turn))
+        ids.append(conversation_id)
+    fill_seconds = time.perf_counter() - started
+
+    gc.collect()
+    heap_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    # Appends to random existing conversations, one message at a time like the servers do
+    latencies = []
+    for i in range(samples):
+        conversation_id = random.choice(ids)
+        started = time.perf_counter()
+        store.append(conversation_id, [{"role": "user", "content": f"follow-up {i}"}])
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    store.list_conversations()
+    list_all_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    cursor, pages = None, 0
+    while pages < 20:
+        page = store.list_page(sort="last_activity", order="desc", limit=50, cursor=cursor)
+        pages += 1
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    page_seconds = (time.perf_counter() - started) / pages
+    started = time.perf_counter()
+    for conversation_id in ids[:100]:
+        store.get(conversation_id)
+    history_seconds = (time.perf_counter() - started) / len(ids[:100])
+    started = time.perf_counter()
+    for conversation_id in ids[:100]:
+        store.get_range(conversation_id, max(0, 4 * turns - 20), 20)
+    range_seconds = (time.perf_counter() - started) / len(ids[:100])
+
+    result = {
+        "fill_s": round(fill_seconds, 2),
+        "heap_mb_per_10k": round(heap_bytes / conversations * 10000 / 2 ** 20, 2),
+        "append_p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "append_p95_us": round(percentile(latencies, 95) * 1e6, 1),
+        "append_p99_us": round(percentile(latencies, 99) * 1e6, 1),
+        "list_all_ms": round(list_all_seconds * 1000, 2),
+        "list_page_ms": round(page_seconds * 1000, 3),
+        "history_ms": round(history_seconds * 1000, 3),
+        "history_range_ms": round(range_seconds * 1000, 3),
+    }
+    if isinstance(store, SQLiteConversationStore):
+        size = sum(os.path.getsize(store.path + suffix) for suffix in ("", "-wal") if os.path.exists(store.path + suffix))
+        result["disk_mb_per_10k"] = round(size / conversations * 10000 / 2 ** 20, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=5, help="turns (4 messages each) per conversation")
+    parser.add_argument("--samples", type=int, default=5000, help="timed appends per backend")
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite"],
+                        choices=["memory", "sqlite", "mongodb"])
+    parser.add_argument("--mongo-uri", help="use a real mongod instead of mongomock")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp())
+    factories = {
+        "memory": lambda: InMemoryConversationStore(max_conversations=args.conversations),
+        "sqlite": lambda: SQLiteConversationStore(workdir / "conversations.db"),
+        "mongodb": lambda: (MongoConversationStore(uri=args.mongo_uri, database="bench_conversation_store")
+                            if args.mongo_uri else MongoConversationStore(mock=True)),
+    }
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'backend':>8}{'fill s':>9}{'heap MB/10k':>13}{'disk MB/10k':>13}"
+          f"{'p50 us':>9}{'p95 us':>9}{'p99 us':>9}")
+    for name in args.backends:
+        run = bench_store(name, factories[name], args.conversations, args.turns, args.samples)
+        results["runs"][name] = run
+        print(f"{name:>8}{run['fill_s']:>9}{run['heap_mb_per_10k']:>13}{run.get('disk_mb_per_10k', '-'):>13}"
+              f"{run['append_p50_us']:>9}{run['append_p95_us']:>9}{run['append_p99_us']:>9}")
+
+    print(f"{'backend':>8}{'list all ms':>13}{'page ms':>10}{'history ms':>12}{'range ms':>10}")
+    for name, run in results["runs"].items():
+        print(f"{name:>8}{run['list_all_ms']:>13}{run['list_page_ms']:>10}{run['history_ms']:>12}"
+              f"{run['history_range_ms']:>10}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Latency of the read tools answered from the fleet-state snapshot instead of a
+live call to the fake Go server.
+
+For every query in QUERIES, `--calls` calls are timed through
+`ToolExecutor.execute_tool` with the result cache disabled, once with live
+calls only and once with the "fleet_state" section enabled (after its first
+poll). Every snapshot answer is checked against the live result. Afterwards a
+dispatch marks the snapshot stale, and the reads that fall back to live calls
+until the next poll are counted.
+
+Usage (from the repository root):
+    python -m benchmark.bench_fleet_state --calls 200 --go-latency 0.02 --clusters 50 --drones 200
+"""
+import argparse
+import io
+import json
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from benchmark.BenchUtils import percentile, summarize
+from benchmark.FakeServers import FakeGoServer, start_in_subprocess
+from utils.ToolExecutor import ToolExecutor
+
+QUERIES = {
+    "drones: all": ("get_drone_status", {}),
+    "drones: by id": ("get_drone_status", {"drone_id": 7}),
+    "drones: by destination": ("get_drone_status", {"destination_cluster_id": 3}),
+    "panels: dirty": ("find_panels", {"status": "dirty"}),
+    "panels: by cluster": ("find_panels", {"cluster_id": 4}),
+    "panels: one": ("find_panels", {"cluster_id": 4, "panel_id": 2}),
+}
+
+
+def make_executor(go_url: str, fleet: bool, poll_interval: float) -> ToolExecutor:
+    fleet_config = {"enabled": fleet, "poll_interval": poll_interval}
+    with redirect_stdout(io.StringIO()):
+        executor = ToolExecutor(go_url, cache_config={"enabled": False}, fleet_config=fleet_config)
+    if fleet:
+        deadline = time.monotonic() + 10
+        while len(executor.fleet_state.get_stats()["sources"]) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    return executor
+
+
+def time_query(executor: ToolExecutor, tool_name: str, arguments: dict, calls: int) -> tuple:
+    latencies, result = [], None
+    started = time.perf_counter()
+    for _ in range(calls):
+        call_started = time.perf_counter()
+        result = executor.execute_tool(tool_name, arguments)
+        latencies.append(time.perf_counter() - call_started)
+    run = summarize(latencies, 0, time.perf_counter() - started)
+    run["p50_us"] = round(percentile(latencies, 50) * 1e6, 1)
+    return run, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--go-latency", type=float, default=0.02)
+    parser.add_argument("--clusters", type=int, default=50)
+    parser.add_argument("--panels-per-cluster", type=int, default=20)
+    parser.add_argument("--drones", type=int, default=200)
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    go_process, go = start_in_subprocess(FakeGoServer, latency=args.go_latency, clusters=args.clusters,
+                                         panels_per_cluster=args.panels_per_cluster, drones=args.drones)
+    live = make_executor(go.api_url, fleet=False, poll_interval=args.poll_interval)
+    fleet = make_executor(go.api_url, fleet=True, poll_interval=args.poll_interval)
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'query':<24}{'rows':>6}{'live p50 ms':>13}{'snapshot p50 us':>17}{'speedup':>9}{'match':>7}")
+    for name, (tool_name, arguments) in QUERIES.items():
+        live_run, live_result = time_query(live, tool_name, arguments, args.calls)
+        fleet_requests = fleet.get_stats()["requests"]
+        fleet_run, fleet_result = time_query(fleet, tool_name, arguments, args.calls)
+        run = {"tool": tool_name, "arguments": arguments, "rows": len(live_result), "live": live_run,
+               "snapshot": fleet_run, "go_requests": fleet.get_stats()["requests"] - fleet_requests,
+               "match": fleet_result == live_result}
+        run["speedup"] = round(live_run["p50_us"] / max(fleet_run["p50_us"], 0.1))
+        results["runs"][name] = run
+        print(f"{name:<24}{run['rows']:>6}{live_run['p50_ms']:>13}{fleet_run['p50_us']:>17}{run['speedup']:>9}"
+              f"{str(run['match']):>7}")
+
+    # A dispatch marks the drone and panel snapshots stale until the poller has fetched them again
+    fleet.execute_tool("dispatch_drone_to_cluster", {"cluster_id": 1})
+    fallbacks_before = fleet.get_stats()["fleet_state"]["tools"]["get_drone_status"]["stale"]
+    started = time.perf_counter()
+    while time.perf_counter() - started < 1.0:
+        fleet.execute_tool("get_drone_status", {"drone_id": 7})
+    stats = fleet.get_stats()["fleet_state"]
+    results["after_write"] = {"live_fallbacks": stats["tools"]["get_drone_status"]["stale"] - fallbacks_before,
+                              "fleet_state": stats}
+    print(f"after a dispatch: {results['after_write']['live_fallbacks']} drone reads went live "
+          f"until the next poll; refreshes: {stats['refreshes']}")
+
+    go_process.terminate()
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+The Gemini backend against a local fake Gemini endpoint, with injected faults.
+
+The Flask or async server is run with `"provider": "gemini"` pointed at a
+fake `generateContent` endpoint (and a fake Go server). Every turn is a
+tool call followed by a summary of the tool's result, so a turn should take
+exactly two model calls. Runs, for text and native tool calling:
+  * clean: no faults;
+  * faults: `--rate-limit-rate` of the calls answered with 429 + Retry-After
+    and `--error-rate` with 503, which the transport retries.
+Reported per run: turns/sec and latency, turns that ended in a model error,
+model calls per turn, calls whose tool result did not reach the model
+(should be 0), retries, connection reuse and the token counts taken from
+Gemini's `usageMetadata`.
+
+Usage (from the repository root):
+    python -m benchmark.bench_gemini --requests 200 --concurrency 16 --rate-limit-rate 0.1 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import start_server, summarize
+from benchmark.FakeServers import FakeGeminiServer, FakeGoServer, start_in_subprocess
+
+
+async def drive_turns(url: str, total: int, concurrency: int) -> dict:
+    """
+    Sends `total` single-turn chat requests and counts the answers that are
+    model errors separately from HTTP errors.
+    """
+    latencies, errors, model_errors = [], 0, 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    body = {"messages": [{"role": "user", "content": "find all panels in cluster 3 that are dirty"}]}
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def one():
+            nonlocal errors, model_errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(url, json=body)
+                    resp.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - started)
+                if str(resp.json()["response"].get("content", "")).startswith("Error:"):
+                    model_errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    run = summarize(latencies, errors, elapsed)
+    run["model_errors"] = model_errors
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--server", choices=["flask", "async"], default="async")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.1, help="share of calls answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After of the 429s (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="share of calls answered with 503")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    go_process, go = start_in_subprocess(FakeGoServer, latency=0.005)
+    workdir = Path(tempfile.mkdtemp())
+    faults = {"clean": {}, "faults": {"rate_limit_rate": args.rate_limit_rate, "retry_after": args.retry_after,
+                                      "error_rate": args.error_rate}}
+    retry = {"max_retries": 4, "backoff_base": 0.05, "backoff_max": 1.0}
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'run':<14}{'turns/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'failed':>8}{'calls/turn':>12}{'lost':>6}"
+          f"{'retries':>9}{'reuse':>7}")
+    for mode in ("text", "native"):
+        for name, fault_options in faults.items():
+            gemini_process, gemini = start_in_subprocess(FakeGeminiServer, latency=args.llm_latency,
+                                                          **fault_options)
+            config_path = gemini.write_config(workdir / f"{mode}-{name}.json", tool_calling={"mode": mode},
+                                              gemini={"retry": retry})
+            process, base_url = start_server(args.server, go.api_url, config_path)
+            run = asyncio.run(drive_turns(f"{base_url}/api/chat", args.requests, args.concurrency))
+            fake_stats = httpx.get(f"{gemini.base_url}stats").json()
+            transport = httpx.get(f"{base_url}/api/stats").json()["lm_wrapper"]["gemini"]
+            process.terminate()
+            gemini_process.terminate()
+
+            answered = fake_stats["requests"] - fake_stats["rate_limited"] - fake_stats["errors"]
+            run.update(fake=fake_stats, transport=transport,
+                       calls_per_turn=round(answered / args.requests, 2),
+                       failed=run["errors"] + run["model_errors"])
+            results["runs"][f"{mode} {name}"] = run
+            print(f"{mode + ' ' + name:<14}{run['rps']:>9}{run['p50_ms']:>9}{run['p95_ms']:>9}{run['failed']:>8}"
+                  f"{run['calls_per_turn']:>12}{fake_stats['without_tool_result']:>6}{transport['retries']:>9}"
+                  f"{transport['connection_reuse_ratio']:>7}")
+    go_process.terminate()
+
+    for name, run in results["runs"].items():
+        transport = run["transport"]
+        print(f"{name}: {transport['rate_limited']} rate-limited, {transport['connections_opened']} connections "
+              f"for {transport['requests']} requests, tokens reported {transport['prompt_tokens']} prompt / "
+              f"{transport['completion_tokens']} completion")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Exercises the multi-backend LLM router against several local fake
+OpenAI-compatible replicas with injected latency and faults.
+
+Scenarios (each sends `--requests` completions, `--concurrency` at a time,
+through `LMWrapper.aget_completion`):
+  * single: one healthy replica, no routing (the previous behaviour);
+  * balanced: three replicas, one of them a straggler (`--tail-rate` of its
+    requests take `--tail-latency` seconds longer);
+  * hedged: the same replicas with hedging at the 90th percentile;
+  * failover: three replicas, one answering every request with HTTP 500 and
+    one not running at all.
+
+Usage (from the repository root):
+    python -m benchmark.bench_llm_router --requests 400 --concurrency 16
+"""
+import argparse
+import asyncio
+import io
+import json
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from benchmark.BenchUtils import summarize
+from benchmark.FakeServers import FakeLLMServer, free_port, start_in_subprocess
+from utils.LLMRouter import is_model_error
+from utils.LMWrapper import LMWrapper
+
+
+async def run_load(lm_wrapper: LMWrapper, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+    messages = [{"role": "user", "content": "Status of cluster 3?"}]
+
+    async def one():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            text = await lm_wrapper.aget_completion(messages)
+            if is_model_error(text):
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def make_wrapper(template: FakeLLMServer, backends: list, routing: dict = None) -> LMWrapper:
+    overrides = {"backends": backends, "routing": routing or {}} if len(backends) > 1 else {
+        "lm_api_url": backends[0]["lm_api_url"], "client_options": {"max_retries": 0}}
+    config_path = template.write_config(Path(tempfile.mkdtemp()) / "configure.json", **overrides)
+    with redirect_stdout(io.StringIO()):
+        lm_wrapper = LMWrapper(config_path=config_path)
+        lm_wrapper.set_system_prompt("You are a test assistant.")
+    return lm_wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake completion")
+    parser.add_argument("--tail-rate", type=float, default=0.1, help="share of the straggler's slow requests")
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="extra seconds of a slow request")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    processes = []
+
+    def replica(**kwargs) -> dict:
+        process, server = start_in_subprocess(FakeLLMServer, latency=args.latency, tool_call_output="ok", **kwargs)
+        processes.append(process)
+        return {"name": f"replica-{len(processes)}", "lm_api_url": server.api_url, "_server": server}
+
+    healthy_a, healthy_b = replica(), replica()
+    straggler = replica(tail_rate=args.tail_rate, tail_latency=args.tail_latency)
+    failing = replica(error_rate=1.0)
+    down = {"name": "replica-down", "lm_api_url": f"http://127.0.0.1:{free_port()}/v1/"}
+    template = healthy_a["_server"]
+
+    def entries(*replicas):
+        return [{k: v for k, v in r.items() if not k.startswith("_")} for r in replicas]
+
+    scenarios = {
+        "single": make_wrapper(template, entries(healthy_a)),
+        "balanced": make_wrapper(template, entries(healthy_a, healthy_b, straggler)),
+        "hedged": make_wrapper(template, entries(healthy_a, healthy_b, straggler),
+                               {"hedge": {"enabled": True, "percentile": 90, "min_samples": 20}}),
+        "failover": make_wrapper(template, entries(healthy_a, failing, down),
+                                 {"failure_threshold": 3, "eject_seconds": 5.0}),
+    }
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'scenario':<10}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}  requests per backend")
+    for name, lm_wrapper in scenarios.items():
+        with redirect_stdout(io.StringIO()):
+            run = asyncio.run(run_load(lm_wrapper, args.requests, args.concurrency))
+        router = lm_wrapper.get_stats().get("router")
+        if router:
+            run["router"] = router
+        results["runs"][name] = run
+        spread = {b: s["requests"] for b, s in router["backends"].items()} if router else {}
+        extra = f"  hedges={router['hedges']} wins={router['hedge_wins']} failovers={router['failovers']}" if router else ""
+        print(f"{name:<10}{run['rps']:>8}{run['p50_ms']:>9}{run['p95_ms']:>9}{run['p99_ms']:>9}{run['errors']:>8}"
+              f"  {spread}{extra}")
+
+    for process in processes:
+        process.terminate()
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Load test of `/api/chat` with a mix of multi-turn conversations.
+
+The Flask and async servers are run against a fake LLM and a fake Go server.
+Each simulated user picks a conversation from MIX (by weight) and sends its
+turns one after another on the same `conversation_id`; the fake LLM answers
+every turn with the tool call its keywords ask for (or plain text), then with
+a summary of the tool result. `--stream-share` of the conversations use
+`/api/chat/stream` instead.
+
+Reported per server: throughput (turns/sec), p50/p95/p99 latency of all
+turns and per conversation type, the server's resident memory before and
+after the run, and the mean time per pipeline stage read from `/metrics`.
+The results can be saved with `--json`, and a previous results file passed
+as `--baseline` prints the change against it.
+
+Usage (from the repository root):
+    python -m benchmark.bench_load --conversations 200 --concurrency 16 --json load.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+
+from benchmark.BenchUtils import rss_mb, stage_breakdown, start_server, summarize
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+
+
+def _tool_call(tool: str, arguments: dict) -> str:
+    return f'<|channel|>commentary to=functions.{tool} <|constrain|>json<|message|>{json.dumps(arguments)}'
+
+
+# Keyword in the user turn -> what the fake model answers (the first match wins)
+SCRIPTED_OUTPUTS = {
+    "drones to clusters": _tool_call("dispatch_drones_to_clusters", {"cluster_ids": [2, 5, 9]}),
+    "send a drone": _tool_call("dispatch_drone_to_cluster", {"cluster_id": 4}),
+    "maintenance": _tool_call("get_panel_maintenance_history", {"cluster_id": 4, "panel_id": 2}),
+    "drone": _tool_call("get_drone_status", {"drone_id": 3}),
+    "thanks": "You're welcome. Let me know if anything else needs attention.",
+}
+
+# Conversation type -> (weight, user turns)
+MIX: Dict[str, Tuple[int, List[str]]] = {
+    "single lookup": (5, ["find all panels in cluster 3 that are dirty"]),
+    "inspect and dispatch": (3, ["which panels in cluster 4 are dirty?",
+                                 "show the maintenance history of panel 2 in cluster 4",
+                                 "send a drone to cluster 4",
+                                 "thanks"]),
+    "drone check": (2, ["where is drone 3 right now?", "thanks"]),
+    "batch dispatch": (1, ["list the dirty panels in cluster 2",
+                           "send drones to clusters 2, 5 and 9"]),
+}
+
+
+async def _post_turn(client: httpx.AsyncClient, base_url: str, body: dict, stream: bool) -> str:
+    """
+    Sends one turn and returns the conversation ID from the reply.
+    """
+    if not stream:
+        resp = await client.post(f"{base_url}/api/chat", json=body)
+        resp.raise_for_status()
+        return resp.json()["conversation_id"]
+    conversation_id = ""
+    async with client.stream("POST", f"{base_url}/api/chat/stream", json=body) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if line.startswith("data: ") and not conversation_id:
+                conversation_id = json.loads(line[6:]).get("conversation_id", "")
+    return conversation_id
+
+
+async def drive_mix(base_url: str, conversations: int, concurrency: int, stream_share: float,
+                    seed: int) -> dict:
+    """
+    Runs `conversations` conversations drawn from MIX with at most
+    `concurrency` of them in flight, and summarizes the latency of their turns.
+    """
+    rng = random.Random(seed)
+    names = list(MIX)
+    plan = [(name, rng.random() < stream_share)
+            for name in rng.choices(names, weights=[MIX[n][0] for n in names], k=conversations)]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def converse(name: str, stream: bool):
+            async with semaphore:
+                conversation_id = None
+                for turn in MIX[name][1]:
+                    body = {"messages": [{"role": "user", "content": turn}]}
+                    if conversation_id:
+                        body["conversation_id"] = conversation_id
+                    started = time.perf_counter()
+                    try:
+                        conversation_id = await _post_turn(client, base_url, body, stream)
+                        latencies[name].append(time.perf_counter() - started)
+                    except (httpx.HTTPError, KeyError, ValueError):
+                        errors[name] += 1
+                        return
+
+        started = time.perf_counter()
+        await asyncio.gather(*(converse(name, stream) for name, stream in plan))
+        elapsed = time.perf_counter() - started
+
+    run = summarize([l for ls in latencies.values() for l in ls], sum(errors.values()), elapsed)
+    run["conversations"] = conversations
+    run["streamed"] = sum(stream for _, stream in plan)
+    run["by_type"] = {name: summarize(latencies[name], errors[name], elapsed)
+                      for name in names if latencies[name] or errors[name]}
+    return run
+
+
+def compare(results: dict, baseline: dict):
+    print("change against the baseline:")
+    for kind, run in results["runs"].items():
+        before = baseline.get("runs", {}).get(kind)
+        if not before:
+            continue
+        changes = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms", "rss_growth_mb"):
+            if before.get(key):
+                changes.append(f"{key} {(run[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"  {kind:<7}" + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--servers", nargs="+", choices=["flask", "async"], default=["flask", "async"])
+    parser.add_argument("--stream-share", type=float, default=0.2,
+                        help="share of conversations sent to /api/chat/stream")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds to the first token")
+    parser.add_argument("--llm-tps", type=float, default=200.0, help="fake generation speed (tokens/sec)")
+    parser.add_argument("--go-latency", type=float, default=0.01, help="seconds per fake Go call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.llm_latency,
+                                           tokens_per_second=args.llm_tps, scripted_outputs=SCRIPTED_OUTPUTS)
+    go_process, go = start_in_subprocess(FakeGoServer, latency=args.go_latency)
+    config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json")
+
+    results = {"config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+               "mix": {name: {"weight": weight, "turns": len(turns)} for name, (weight, turns) in MIX.items()},
+               "runs": {}}
+    print(f"{'server':<8}{'turns/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+          f"{'rss MB':>9}{'growth MB':>11}")
+    for kind in args.servers:
+        process, base_url = start_server(kind, go.api_url, config_path)
+        asyncio.run(drive_mix(base_url, min(20, args.conversations), args.concurrency, 0.0, args.seed + 1))
+        rss_before = rss_mb(process.pid)
+        run = asyncio.run(drive_mix(base_url, args.conversations, args.concurrency, args.stream_share, args.seed))
+        run["rss_before_mb"] = rss_before
+        run["rss_after_mb"] = rss_mb(process.pid)
+        run["rss_growth_mb"] = round(run["rss_after_mb"] - rss_before, 1)
+        run["stage_ms"] = stage_breakdown(httpx.get(f"{base_url}/metrics").text)
+        process.terminate()
+        results["runs"][kind] = run
+        print(f"{kind:<8}{run['rps']:>9}{run['p50_ms']:>9}{run['p95_ms']:>9}{run['p99_ms']:>9}{run['errors']:>8}"
+              f"{run['rss_after_mb']:>9}{run['rss_growth_mb']:>11}")
+    llm_process.terminate()
+    go_process.terminate()
+
+    for kind, run in results["runs"].items():
+        print(f"p95 ms per conversation type ({kind}):",
+              {name: stats["p95_ms"] for name, stats in run["by_type"].items()})
+        print(f"mean ms per stage ({kind}):", run["stage_ms"])
+    if args.baseline:
+        compare(results, json.loads(args.baseline.read_text()))
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Shows the wall-clock savings of running every tool call of a model response
+in parallel, against a fake Go server with a fixed delay per request.
+
+Two measurements:
+  * executor: N tool calls run one after another vs. `execute_tools`
+    (thread pool) vs. `aexecute_tools` (asyncio).
+  * end-to-end: one `/api/chat` turn whose response contains N tool calls,
+    vs. N chat turns with one tool call each (the behaviour before batching).
+
+Usage (from the repository root):
+    python -m benchmark.bench_parallel_tools --calls 1 3 5 8 --go-latency 0.2
+"""
+import argparse
+import asyncio
+import io
+import json
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import start_server
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+from utils.GPTTools import GPTParsingUtils
+from utils.ToolExecutor import ToolExecutor
+
+
+def tool_call_text(n: int) -> str:
+    """
+    A harmony-format model response with `n` get_drone_status/find_panels calls.
+    """
+    calls = []
+    for i in range(n):
+        if i % 2:
+            name, args = "find_panels", {"cluster_id": i + 1, "status": "dirty"}
+        else:
+            name, args = "get_drone_status", {"destination_cluster_id": i + 1}
+        calls.append(f"<|start|>assistant<|channel|>commentary to=functions.{name} "
+                     f"<|constrain|>json<|message|>{json.dumps(args)}<|call|>")
+    return "".join(calls)
+
+
+def bench_executor(go_url: str, n: int, max_parallel: int) -> dict:
+    tool_calls = GPTParsingUtils().tool_calls_parsing(tool_call_text(n))
+    # No result cache: the sequential run would fill it, and the parallel runs would time cache hits
+    executor = ToolExecutor(go_server_base_url=go_url, max_parallel_tools=max_parallel,
+                            cache_config={"enabled": False})
+
+    started = time.perf_counter()
+    for call in tool_calls:
+        executor.execute_tool(call["tool_name"], call["parameters"])
+    sequential = time.perf_counter() - started
+
+    started = time.perf_counter()
+    executor.execute_tools(tool_calls)
+    threaded = time.perf_counter() - started
+
+    async def run_async():
+        started = time.perf_counter()
+        await executor.aexecute_tools(tool_calls)
+        return time.perf_counter() - started
+    asynchronous = asyncio.run(run_async())
+
+    return {"sequential_ms": round(sequential * 1000, 1), "thread_pool_ms": round(threaded * 1000, 1),
+            "asyncio_ms": round(asynchronous * 1000, 1)}
+
+
+def bench_end_to_end(go_url: str, n: int, llm_latency: float, server: str) -> dict:
+    body = {"messages": [{"role": "user", "content": "status of the drones and dirty panels"}]}
+
+    # One turn, N tool calls in one response
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=llm_latency, tool_call_output=tool_call_text(n))
+    config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json", tool_cache={"enabled": False})
+    process, url = start_server(server, go_url, config_path)
+    started = time.perf_counter()
+    httpx.post(f"{url}/api/chat", json=body, timeout=120).raise_for_status()
+    batched = time.perf_counter() - started
+    process.terminate()
+    llm_process.terminate()
+
+    # N turns, one tool call each
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=llm_latency, tool_call_output=tool_call_text(1))
+    # The turns repeat one call, which the result cache would answer after the first
+    config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json", tool_cache={"enabled": False})
+    process, url = start_server(server, go_url, config_path)
+    started = time.perf_counter()
+    conversation_id = None
+    for _ in range(n):
+        resp = httpx.post(f"{url}/api/chat", json=body | {"conversation_id": conversation_id}, timeout=120)
+        conversation_id = resp.json()["conversation_id"]
+    one_per_turn = time.perf_counter() - started
+    process.terminate()
+    llm_process.terminate()
+
+    return {"one_call_per_turn_ms": round(one_per_turn * 1000, 1), "batched_turn_ms": round(batched * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, nargs="+", default=[1, 3, 5, 8])
+    parser.add_argument("--go-latency", type=float, default=0.2, help="seconds per fake Go call")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds per fake completion")
+    parser.add_argument("--max-parallel", type=int, default=4, help="ToolExecutor.max_parallel_tools")
+    parser.add_argument("--server", choices=["flask", "async"], default="async")
+    parser.add_argument("--skip-end-to-end", action="store_true")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    go_process, go = start_in_subprocess(FakeGoServer, latency=args.go_latency)
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+
+    print(f"{'calls':>5}{'sequential':>12}{'threads':>10}{'asyncio':>10}{'N turns':>10}{'1 turn':>10}  (ms)")
+    for n in args.calls:
+        with redirect_stdout(io.StringIO()):
+            run = bench_executor(go.api_url, n, args.max_parallel)
+            if not args.skip_end_to_end:
+                run |= bench_end_to_end(go.api_url, n, args.llm_latency, args.server)
+        results["runs"][n] = run
+        print(f"{n:>5}{run['sequential_ms']:>12}{run['thread_pool_ms']:>10}{run['asyncio_ms']:>10}"
+              f"{run.get('one_call_per_turn_ms', '-'):>10}{run.get('batched_turn_ms', '-'):>10}")
+
+    go_process.terminate()
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
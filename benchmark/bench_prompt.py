@@ -0,0 +1,106 @@
+"""
+Compares the system-prompt renderings of PromptBuilder: prompt size in
+tokens, the cost of building it, and prefill time against a fake LLM.
+
+For every rendering the fake model is asked `--requests` times. The first
+request prefills the whole prompt; later ones hit the fake server's prefix
+cache as long as the system prompt is byte-identical. The "unstable" column
+changes one character of the prompt per request (as a timestamp or a
+re-ordered tool list would), so every request pays the full prefill.
+
+Usage (from the repository root):
+    python -m benchmark.bench_prompt --requests 10 --prefill-tps 1000
+"""
+import argparse
+import io
+import json
+import statistics
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from benchmark.FakeServers import FakeLLMServer, start_in_subprocess
+from utils.ContextWindow import TokenEstimator
+from utils.GPTTools import PromptBuilder
+from utils.LMWrapper import LMWrapper
+
+MODES = {
+    "pretty": {"tool_rendering": "pretty", "tool_descriptions": True},
+    "compact": {"tool_rendering": "compact", "tool_descriptions": True},
+    "compact, tool descriptions only": {"tool_rendering": "compact", "tool_descriptions": "tools"},
+    "compact, no descriptions": {"tool_rendering": "compact", "tool_descriptions": False},
+}
+USER_MESSAGE = [{"role": "user", "content": "Which panels in cluster 3 are dirty?"}]
+
+
+def time_completions(lm_wrapper: LMWrapper, prompt: str, requests: int, stable: bool) -> list:
+    latencies = []
+    for i in range(requests):
+        lm_wrapper.set_system_prompt(prompt if stable else f"{prompt}{i}")
+        started = time.perf_counter()
+        lm_wrapper.get_completion(USER_MESSAGE)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main():
+    with redirect_stdout(io.StringIO()):
+        from app.CoordinateServer import SYSTEM_PROMPT_TEMPLATE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--prefill-tps", type=float, default=1000.0, help="fake LLM prefill tokens/second")
+    parser.add_argument("--builds", type=int, default=2000, help="build_system_prompt calls to time")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    estimator = TokenEstimator()
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'rendering':<34}{'tokens':>8}{'rebuild us':>12}{'cached us':>11}"
+          f"{'cold ms':>9}{'warm ms':>9}{'unstable ms':>13}")
+
+    for name, options in MODES.items():
+        builder = PromptBuilder(SYSTEM_PROMPT_TEMPLATE, **options)
+        prompt = builder.build_system_prompt()
+
+        # The previous behaviour: read and render tools.json on every call
+        started = time.perf_counter()
+        for _ in range(args.builds):
+            SYSTEM_PROMPT_TEMPLATE.format(tool_definitions=builder.render_tools(builder._load_tools()))
+        rebuild = (time.perf_counter() - started) / args.builds
+        started = time.perf_counter()
+        for _ in range(args.builds):
+            builder.build_system_prompt()
+        cached = (time.perf_counter() - started) / args.builds
+
+        # Fresh fake server per rendering so its prefix cache starts cold
+        llm_process, llm = start_in_subprocess(FakeLLMServer, latency=0.01, tool_call_output="ok",
+                                               prefill_tokens_per_second=args.prefill_tps, prefix_cache=True)
+        config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json")
+        with redirect_stdout(io.StringIO()):
+            lm_wrapper = LMWrapper(config_path=config_path)
+            stable = time_completions(lm_wrapper, prompt, args.requests, stable=True)
+            unstable = time_completions(lm_wrapper, prompt, args.requests, stable=False)
+        llm_process.terminate()
+
+        run = {
+            "prompt_chars": len(prompt),
+            "prompt_tokens": estimator.count_text(prompt),
+            "rebuild_us": round(rebuild * 1e6, 1),
+            "cached_us": round(cached * 1e6, 2),
+            "cold_ms": round(stable[0] * 1000, 1),
+            "warm_ms": round(statistics.mean(stable[1:]) * 1000, 1) if len(stable) > 1 else None,
+            "unstable_ms": round(statistics.mean(unstable) * 1000, 1),
+        }
+        results["runs"][name] = run
+        print(f"{name:<34}{run['prompt_tokens']:>8}{run['rebuild_us']:>12}{run['cached_us']:>11}"
+              f"{run['cold_ms']:>9}{run['warm_ms']:>9}{run['unstable_ms']:>13}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
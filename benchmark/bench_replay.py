@@ -0,0 +1,126 @@
+"""
+Throughput and accuracy of the offline replay engine (`app/ReplayEvaluator.py`).
+
+A JSONL file of recorded conversations is generated from the conversation
+mix of `bench_load`: every user turn is answered with the tool call the fake
+LLM makes for it, a tool result and a summary. `--drift` of the recorded
+tool calls get other arguments (a cluster ID off by one), as if the model
+had answered differently when they were recorded. Runs:
+  * stub: the recorded-response stub with `--stub-latency` per completion,
+    at each `--concurrency`; scores 100%, so it measures the engine alone;
+  * model: the fake LLM (`--llm-latency`, `--malformed-rate` of its tool
+    calls garbled), at each `--concurrency`; argument accuracy should come
+    out near 1 - drift (on the cases with tool calls), tool-name accuracy
+    near 1 - malformed rate;
+  * resume: the model run at the highest concurrency, stopped after half of
+    the cases and resumed from its checkpoint; together they must cover the
+    same cases as the uninterrupted run.
+
+Usage (from the repository root):
+    python -m benchmark.bench_replay --conversations 500 --concurrency 1 8 32 --drift 0.1
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+from pathlib import Path
+
+from app.ReplayEvaluator import ReplayEvaluator, build_lm_wrapper, build_prompt_builder, iter_cases, \
+    read_conversations, run_fingerprint
+from benchmark.FakeServers import DEFAULT_SUMMARY_OUTPUT, DEFAULT_TOOL_CALL_OUTPUT, FakeLLMServer, \
+    start_in_subprocess
+from benchmark.bench_load import MIX, SCRIPTED_OUTPUTS, _tool_call
+from utils import load_config
+from utils.GPTTools import GPTParsingUtils
+
+
+def _recorded_reply(turn: str, drift: bool) -> str:
+    reply = next((output for keyword, output in SCRIPTED_OUTPUTS.items() if keyword in turn.lower()),
+                 DEFAULT_TOOL_CALL_OUTPUT)
+    call = GPTParsingUtils().tool_usage_parsing(reply)
+    if not call or not drift:
+        return reply
+    parameters = {key: value + 1 if isinstance(value, int) else value for key, value in call["parameters"].items()}
+    return _tool_call(call["tool_name"], parameters)
+
+
+def write_recordings(path: Path, conversations: int, drift: float, seed: int = 7):
+    rng = random.Random(seed)
+    names = list(MIX)
+    weights = [MIX[name][0] for name in names]
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(conversations):
+            messages = []
+            for turn in MIX[rng.choices(names, weights)[0]][1]:
+                reply = _recorded_reply(turn, rng.random() < drift)
+                messages += [{"role": "user", "content": turn}, {"role": "assistant", "content": reply}]
+                if "to=functions." in reply:
+                    messages += [{"role": "tool", "name": "tool", "content": '{"status": "success"}'},
+                                 {"role": "assistant", "content": DEFAULT_SUMMARY_OUTPUT}]
+            f.write(json.dumps({"conversation_id": f"rec-{i}", "messages": messages}) + "\n")
+
+
+def replay(config_path: str, recordings: Path, concurrency: int, stub_latency=None, checkpoint=None,
+           limit=None) -> dict:
+    prompt_builder = build_prompt_builder(load_config(config_path))
+    lm_wrapper = build_lm_wrapper(Path(config_path), prompt_builder, stub_latency=stub_latency)
+    fingerprint = run_fingerprint({"input": recordings, "config": config_path, "stub": stub_latency is not None},
+                                  prompt_builder)
+    evaluator = ReplayEvaluator(lm_wrapper, concurrency=concurrency, checkpoint=checkpoint, fingerprint=fingerprint)
+    cases = iter_cases(read_conversations(recordings), evaluator.parsing_utils)
+    return asyncio.run(evaluator.run(cases, limit=limit))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--drift", type=float, default=0.1, help="share of recorded calls with other arguments")
+    parser.add_argument("--stub-latency", type=float, default=0.02)
+    parser.add_argument("--llm-latency", type=float, default=0.02)
+    parser.add_argument("--malformed-rate", type=float, default=0.02)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp())
+    recordings = workdir / "recordings.jsonl"
+    write_recordings(recordings, args.conversations, args.drift)
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.llm_latency,
+                                           malformed_rate=args.malformed_rate, scripted_outputs=SCRIPTED_OUTPUTS)
+    config_path = llm.write_config(workdir / "configure.json")
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'run':<16}{'cases':>7}{'cases/s':>9}{'p50 ms':>8}{'p95 ms':>8}{'names':>8}{'args':>8}{'exact':>8}"
+          f"{'parse err':>11}")
+
+    def show(name: str, report: dict):
+        results["runs"][name] = report
+        accuracy, latency = report["accuracy"], report["latency_ms"]
+        print(f"{name:<16}{report['cases']:>7}{report['run']['cases_per_second']:>9}{latency['p50']:>8}"
+              f"{latency['p95']:>8}{accuracy['tool_names']:>8.1%}{accuracy['arguments']:>8.1%}"
+              f"{accuracy['exact']:>8.1%}{report['parse_errors']:>11}")
+
+    for concurrency in args.concurrency:
+        show(f"stub x{concurrency}", replay(config_path, recordings, concurrency, stub_latency=args.stub_latency))
+    for concurrency in args.concurrency:
+        show(f"model x{concurrency}", replay(config_path, recordings, concurrency))
+
+    # Stopped half-way and resumed: the combined report covers every case once
+    concurrency = max(args.concurrency)
+    checkpoint = workdir / "checkpoint.jsonl"
+    full = results["runs"][f"model x{concurrency}"]
+    replay(config_path, recordings, concurrency, checkpoint=checkpoint, limit=full["cases"] // 2)
+    resumed = replay(config_path, recordings, concurrency, checkpoint=checkpoint)
+    show("model, resumed", resumed)
+    print(f"resumed run: {resumed['resumed']} cases from the checkpoint, {resumed['run']['evaluated']} replayed; "
+          f"same cases as the uninterrupted run: {resumed['cases'] == full['cases']}")
+    llm_process.terminate()
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
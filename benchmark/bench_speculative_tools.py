@@ -0,0 +1,129 @@
+"""
+End-to-end latency of `/api/chat` with and without speculative tool execution.
+
+The fake LLM streams its replies at `--llm-tps` tokens/sec and the fake Go
+server answers panel queries after `--panels-latency` seconds and everything
+else after `--go-latency`; the tool-result cache is off, so every call
+reaches the Go server. Turn types:
+  * lookup: one read-only call (`find_panels`), which closes at the end of the
+    reply, so there is little to overlap;
+  * two lookups: `find_panels` and then `get_drone_status` in one reply, so the
+    slow panel query runs while the model still writes the second call;
+  * lookup + dispatch: `find_panels` and then `dispatch_drone_to_cluster`; the
+    dispatch must never run speculatively.
+Each turn type is run with `"speculative_tools"` off and on. Reported: turn
+latency, the speculative calls started/used/wasted and the tool time that
+overlapped with generation (from `/api/stats`), and the number of dispatches
+the Go server saw (must equal the number of dispatch turns in both runs).
+
+Usage (from the repository root):
+    python -m benchmark.bench_speculative_tools --requests 40 --concurrency 4 --panels-latency 0.3 --llm-tps 60
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import start_server, summarize
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+from benchmark.bench_load import _tool_call
+
+NEXT_CALL = "<|call|><|start|>assistant"
+SCRIPTED_OUTPUTS = {
+    "lookup and dispatch": _tool_call("find_panels", {"cluster_id": 4, "status": "dirty"}) + NEXT_CALL
+    + _tool_call("dispatch_drone_to_cluster", {"cluster_id": 4}),
+    "two lookups": _tool_call("find_panels", {"status": "dirty"}) + NEXT_CALL
+    + _tool_call("get_drone_status", {"destination_cluster_id": 3}),
+    "lookup": _tool_call("find_panels", {"cluster_id": 3, "status": "dirty"}),
+}
+TURNS = {
+    "lookup": "lookup: dirty panels in cluster 3",
+    "two lookups": "two lookups: dirty panels and the drones headed to cluster 3",
+    "lookup + dispatch": "lookup and dispatch: cluster 4",
+}
+
+
+async def drive_turns(url: str, message: str, total: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    body = {"messages": [{"role": "user", "content": message}]}
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(url, json=body)
+                    resp.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40, help="turns per turn type and run")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--server", choices=["flask", "async"], default="async")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-tps", type=float, default=60.0)
+    parser.add_argument("--go-latency", type=float, default=0.05)
+    parser.add_argument("--panels-latency", type=float, default=0.3, help="latency of the Go panel queries")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.llm_latency, tokens_per_second=args.llm_tps,
+                                           scripted_outputs=SCRIPTED_OUTPUTS)
+    workdir = Path(tempfile.mkdtemp())
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'turn':<19}{'run':<13}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}{'started':>9}{'used':>6}{'wasted':>8}"
+          f"{'overlap s':>11}{'dispatches':>12}")
+    for name, enabled in (("off", False), ("speculative", True)):
+        # A fresh Go server per run, so its dispatch counter belongs to this run
+        go_process, go = start_in_subprocess(FakeGoServer, latency=args.go_latency,
+                                             path_latency={"/api/panels": args.panels_latency})
+        config_path = llm.write_config(workdir / f"{name}.json", tool_cache={"enabled": False},
+                                       speculative_tools={"enabled": enabled})
+        process, base_url = start_server(args.server, go.api_url, config_path)
+        previous = httpx.get(f"{base_url}/api/stats").json()["speculative_tools"]
+        for turn, message in TURNS.items():
+            run = asyncio.run(drive_turns(f"{base_url}/api/chat", message, args.requests, args.concurrency))
+            stats = httpx.get(f"{base_url}/api/stats").json()["speculative_tools"]
+            run["speculation"] = {key: round(stats[key] - previous[key], 3)
+                                  for key in ("started", "used", "wasted", "overlap_seconds")}
+            previous = stats
+            results["runs"][f"{turn} / {name}"] = run
+            dispatched = httpx.get(f"{go.base_url}stats").json()["dispatches"]
+            speculation = run["speculation"]
+            print(f"{turn:<19}{name:<13}{run['p50_ms']:>9}{run['p95_ms']:>9}{run['errors']:>8}"
+                  f"{speculation['started']:>9}{speculation['used']:>6}{speculation['wasted']:>8}"
+                  f"{speculation['overlap_seconds']:>11}{dispatched:>12}")
+        process.terminate()
+        go_process.terminate()
+    llm_process.terminate()
+
+    for turn in TURNS:
+        off, on = results["runs"][f"{turn} / off"], results["runs"][f"{turn} / speculative"]
+        print(f"{turn}: p50 {off['p50_ms']} -> {on['p50_ms']} ms "
+              f"({round(off['p50_ms'] - on['p50_ms'], 1)} ms saved per turn)")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Cold start of the CoordinateServer: how long a freshly spawned server takes
+to listen, to be ready and to answer its first chat turn.
+
+Every run starts a new interpreter (so nothing is imported yet) against a fake
+LLM and a fake Go server, and times from the spawn:
+  * listening: `/api/health` answers;
+  * ready: `/api/ready` answers 200 (components built, connections open);
+  * first chat: the first `/api/chat` turn (a tool call and its summary) is answered.
+Modes:
+  * eager: every component is built and connected before the server listens,
+    as the server did before it built them lazily;
+  * lazy: `create_app()` listens at once and warms up in the background; the
+    first turn is sent as soon as the server listens;
+  * lazy, after ready: as lazy, but the first turn waits for `/api/ready`,
+    like a load balancer or the worker supervisor does.
+The medians over `--runs` runs are reported, followed by the modules that
+take longest to import (`python -X importtime`), by cumulative time.
+
+Usage (from the repository root):
+    python -m benchmark.bench_startup --runs 5 --server flask
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, free_port, start_in_subprocess
+
+# Run in a fresh interpreter: argv is the server kind, port, config path and "eager" or "lazy"
+SERVE = """
+import sys
+kind, port, config_path, mode = sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4]
+if kind == "flask":
+    import app.CoordinateServer as core
+    server_app = core.create_app(config_path, warm_up=mode == "lazy")
+else:
+    import app.AsyncCoordinateServer as server
+    import app.CoordinateServer as core
+    server_app = server.create_app(config_path, warm_up=mode == "lazy")
+if mode == "eager":
+    core._build_components()
+    core.tool_executor.warm_up()
+    core.lm_wrapper.warm_up()
+    core._begin_warm_up()
+    core._finish_warm_up()
+if kind == "flask":
+    from werkzeug.serving import make_server
+    make_server("127.0.0.1", port, server_app, threaded=True).serve_forever()
+else:
+    import uvicorn
+    uvicorn.run(server_app, host="127.0.0.1", port=port, log_level="warning")
+"""
+MODES = {"eager": ("eager", True), "lazy": ("lazy", False), "lazy, after ready": ("lazy", True)}
+CHAT = {"messages": [{"role": "user", "content": "Send a drone to clean cluster 3."}]}
+
+
+def _wait_for(client: httpx.Client, url: str, deadline: float) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            if client.get(url, timeout=1).status_code == 200:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(f"{url} did not answer in time")
+
+
+def cold_start(kind: str, mode: str, wait_ready: bool, go_url: str, config_path: str) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "GO_SERVER_URL": go_url, "LOG_LEVEL": "WARNING", "PYTHONPATH": os.getcwd()}
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", SERVE, kind, str(port), config_path, mode], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client() as client:
+            deadline = started + 60
+            listening = _wait_for(client, f"{base_url}/api/health", deadline)
+            ready = _wait_for(client, f"{base_url}/api/ready", deadline) if wait_ready else None
+            resp = client.post(f"{base_url}/api/chat", json=CHAT, timeout=60)
+            resp.raise_for_status()
+            first_chat = time.perf_counter()
+            if ready is None:
+                ready = _wait_for(client, f"{base_url}/api/ready", deadline)
+    finally:
+        process.terminate()
+        process.wait()
+    return {"listening_ms": (listening - started) * 1000, "ready_ms": (ready - started) * 1000,
+            "first_chat_ms": (first_chat - started) * 1000}
+
+
+def import_breakdown(module: str, top: int) -> list:
+    """
+    The modules with the longest cumulative import time while importing `module`.
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env={**os.environ, "PYTHONPATH": os.getcwd()}).stderr
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = (part.strip() for part in line.replace("import time:", "|").split("|"))
+        entries.append((name, int(self_us) / 1000, int(cumulative_us) / 1000))
+    return [{"module": name, "self_ms": round(self_ms, 1), "cumulative_ms": round(cumulative_ms, 1)}
+            for name, self_ms, cumulative_ms in sorted(entries, key=lambda entry: -entry[2])[:top]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts per mode")
+    parser.add_argument("--server", choices=["flask", "async"], default="flask")
+    parser.add_argument("--top", type=int, default=12, help="modules listed in the import breakdown")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=0.02)
+    go_process, go = start_in_subprocess(FakeGoServer, latency=0.005)
+    config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json")
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'mode':<20}{'listening ms':>14}{'ready ms':>10}{'first chat ms':>15}")
+    for name, (mode, wait_ready) in MODES.items():
+        runs = [cold_start(args.server, mode, wait_ready, go.api_url, config_path) for _ in range(args.runs)]
+        run = {key: round(statistics.median(r[key] for r in runs), 1) for key in runs[0]}
+        results["runs"][name] = run
+        print(f"{name:<20}{run['listening_ms']:>14}{run['ready_ms']:>10}{run['first_chat_ms']:>15}")
+    llm_process.terminate()
+    go_process.terminate()
+
+    module = "app.CoordinateServer" if args.server == "flask" else "app.AsyncCoordinateServer"
+    results["imports"] = import_breakdown(module, args.top)
+    print(f"\nSlowest imports of {module}:")
+    print(f"{'module':<40}{'self ms':>9}{'cumulative ms':>15}")
+    for entry in results["imports"]:
+        print(f"{entry['module']:<40}{entry['self_ms']:>9}{entry['cumulative_ms']:>15}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
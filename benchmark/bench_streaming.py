@@ -0,0 +1,108 @@
+"""
+Measures time-to-first-token (TTFT) of `/api/chat/stream` against the time
+the blocking `/api/chat` takes to return anything at all.
+
+The fake LLM models prefill with `--prefill` and generation with `--tps`
+(tokens per second). By default the first completion is a tool call, so the
+streamed turn still pays for the tool call before the summary starts; pass
+`--no-tool` to measure a direct answer instead.
+
+Usage (from the repository root):
+    python -m benchmark.bench_streaming --requests 20 --server async
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import percentile, start_server
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+
+LONG_SUMMARY = (
+    "Cluster 3 currently has two dirty panels, panel 4 and panel 7. Both were last cleaned "
+    "on 2025-04-30 and their latest status report is from this morning. Panel 4 shows the "
+    "larger efficiency drop, so it should be cleaned first; a drone can be dispatched to the "
+    "cluster if you want me to schedule the cleaning now."
+)
+
+
+def measure_blocking(client: httpx.Client, url: str, body: dict) -> float:
+    started = time.perf_counter()
+    client.post(f"{url}/api/chat", json=body).raise_for_status()
+    return time.perf_counter() - started
+
+
+def measure_streaming(client: httpx.Client, url: str, body: dict) -> tuple:
+    """
+    Returns (time to first delta event, time to the `done` event).
+    """
+    started = time.perf_counter()
+    first_token = None
+    event = None
+    with client.stream("POST", f"{url}/api/chat/stream", json=body) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:") and event == "delta" and first_token is None:
+                first_token = time.perf_counter() - started
+    total = time.perf_counter() - started
+    return (first_token if first_token is not None else total), total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--server", choices=["flask", "async"], default="async")
+    parser.add_argument("--prefill", type=float, default=0.3, help="fake time to first token, seconds")
+    parser.add_argument("--tps", type=float, default=40.0, help="fake generation speed, tokens/sec")
+    parser.add_argument("--no-tool", action="store_true", help="answer directly instead of calling a tool")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    fake_options = {"latency": args.prefill, "tokens_per_second": args.tps, "summary_output": LONG_SUMMARY}
+    if args.no_tool:
+        fake_options["tool_call_output"] = LONG_SUMMARY
+    llm_process, llm = start_in_subprocess(FakeLLMServer, **fake_options)
+    go_process, go = start_in_subprocess(FakeGoServer, latency=0.01)
+    config_path = llm.write_config(Path(tempfile.mkdtemp()) / "configure.json")
+    process, url = start_server(args.server, go.api_url, config_path)
+
+    body = {"messages": [{"role": "user", "content": "find all panels in cluster 3 that are dirty"}]}
+    blocking, ttft, streamed_total = [], [], []
+    with httpx.Client(timeout=120) as client:
+        for _ in range(args.requests):
+            blocking.append(measure_blocking(client, url, body))
+            first, total = measure_streaming(client, url, body)
+            ttft.append(first)
+            streamed_total.append(total)
+
+    process.terminate()
+    llm_process.terminate()
+    go_process.terminate()
+
+    def row(values):
+        return {f"p{p}_ms": round(percentile(values, p) * 1000, 1) for p in (50, 95, 99)}
+
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "blocking_first_byte": row(blocking),
+        "streaming_ttft": row(ttft),
+        "streaming_total": row(streamed_total),
+    }
+
+    print(f"{'measurement':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in ("blocking_first_byte", "streaming_ttft", "streaming_total"):
+        r = results[name]
+        print(f"{name:<22}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
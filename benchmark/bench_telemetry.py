@@ -0,0 +1,96 @@
+"""
+Overhead of the telemetry layer, and the per-stage breakdown it reports.
+
+The Flask and async servers are run against a fake LLM (which answers with
+a tool call first) and a fake Go server, with the "telemetry" section:
+  * off: `"enabled": false`;
+  * metrics: spans and Prometheus metrics only;
+  * traces: metrics plus every request written as an OTLP/JSON trace.
+Each is driven with the same concurrent `/api/chat` load, and the mean time
+per stage is read back from `/metrics` of the last run. The cost of one span
+is also timed in-process.
+
+Usage (from the repository root):
+    python -m benchmark.bench_telemetry --requests 300 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import timeit
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import stage_breakdown, start_server
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+from benchmark.bench_async_server import drive
+from utils.Telemetry import Telemetry
+
+def span_cost_us(enabled: bool) -> float:
+    telemetry = Telemetry()
+    telemetry.enabled = enabled
+
+    def one_request():
+        with telemetry.span("request", endpoint="/api/chat"):
+            with telemetry.span("completion"):
+                telemetry.record_tokens(100, 20)
+            with telemetry.span("tool", tool="find_panels"):
+                pass
+
+    number = 20000
+    return round(timeit.timeit(one_request, number=number) / number / 3 * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.02)
+    parser.add_argument("--go-latency", type=float, default=0.01)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.llm_latency)
+    go_process, go = start_in_subprocess(FakeGoServer, latency=args.go_latency)
+    workdir = Path(tempfile.mkdtemp())
+    settings = {
+        "off": {"enabled": False},
+        "metrics": {"enabled": True},
+        "traces": {"enabled": True, "traces": {"enabled": True, "path": str(workdir / "traces.jsonl")}},
+    }
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {},
+               "span_us": {"disabled": span_cost_us(False), "enabled": span_cost_us(True)}}
+    print(f"{'server':<8}{'telemetry':<11}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for kind in ("flask", "async"):
+        for name, telemetry_config in settings.items():
+            config_path = llm.write_config(workdir / f"{kind}-{name}.json", telemetry=telemetry_config)
+            process, base_url = start_server(kind, go.api_url, config_path)
+            url = f"{base_url}/api/chat"
+            asyncio.run(drive(url, min(20, args.requests), args.concurrency))  # warm-up
+            run = asyncio.run(drive(url, args.requests, args.concurrency))
+            if name != "off":
+                run["stage_ms"] = stage_breakdown(httpx.get(f"{base_url}/metrics").text)
+            process.terminate()
+            results["runs"][f"{kind} {name}"] = run
+            print(f"{kind:<8}{name:<11}{run['rps']:>8}{run['p50_ms']:>9}{run['p95_ms']:>9}{run['p99_ms']:>9}"
+                  f"{run['errors']:>8}")
+    llm_process.terminate()
+    go_process.terminate()
+
+    print("span cost (us):", results["span_us"])
+    for name, run in results["runs"].items():
+        if "stage_ms" in run:
+            print(f"mean ms per stage ({name}):", run["stage_ms"])
+    traces = workdir / "traces.jsonl"
+    if traces.exists():
+        print(f"traces written: {sum(1 for _ in traces.open())} ({traces})")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
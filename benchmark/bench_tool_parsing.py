@@ -0,0 +1,117 @@
+"""
+Times tool-call parsing on large and adversarial model outputs.
+
+Parsers compared:
+  * legacy: the original single `re.search(r"to=...(\\w+).*<|message|>(.*)")`
+    (it finds one call at most, and backtracks on outputs with many headers);
+  * scanner: `GPTParsingUtils.tool_calls_parsing` on the whole text;
+  * incremental: `ToolCallScanner` fed the output in 4-character deltas, as
+    while streaming;
+  * native: a `ModelReply` carrying structured calls, as returned with
+    native tool calling (nothing left to scan).
+
+Outputs are generated at every `--sizes` length (in characters):
+  * headers: 'to=x ' repeated, without any '<|message|>';
+  * prose: plain text with one tool call at the end;
+  * big_args: one call whose JSON arguments fill the output, with brackets
+    and escaped quotes inside strings;
+  * many_calls: as many small calls as fit;
+  * truncated: big_args cut off before the JSON object closes (repaired).
+
+Usage (from the repository root):
+    python -m benchmark.bench_tool_parsing --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+
+from benchmark.FakeServers import split_tokens
+from utils.GPTTools import GPTParsingUtils, ModelReply, ToolCallParseError, ToolCallScanner, render_tool_call
+
+LEGACY_PATTERN = r"to=(?:functions\.)?(\w+).*<\|message\|>(.*)"
+
+
+def legacy_parse(text: str):
+    match = re.search(LEGACY_PATTERN, text, re.DOTALL)
+    if not match:
+        return []
+    try:
+        return [{"tool_name": match.group(1), "parameters": json.loads(match.group(2).strip())}]
+    except ValueError:
+        return []
+
+
+def incremental_parse(deltas):
+    scanner = ToolCallScanner()
+    calls = []
+    for delta in deltas:
+        calls += scanner.feed(delta)
+    return calls + scanner.finish()
+
+
+def make_outputs(size: int) -> dict:
+    call = render_tool_call("find_panels", '{"cluster_id": 3, "status": "dirty"}')
+    rows = []
+    while sum(len(r) for r in rows) < size:
+        rows.append(json.dumps({"note": 'a "quoted" {brace} [x]', "id": len(rows)}))
+    big_args = render_tool_call("find_panels", '{"rows": [' + ", ".join(rows) + "]}")
+    return {
+        "headers": ("to=x " * (size // 5 + 1))[:size],
+        "prose": ("The panels look fine. " * (size // 22 + 1))[:size] + call,
+        "big_args": big_args,
+        "many_calls": call * max(1, size // len(call)),
+        "truncated": big_args[:len(big_args) * 3 // 4],
+    }
+
+
+def timed(fn, *args, repeat: int = 3):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+        except ToolCallParseError as e:
+            result = e
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-max-size", type=int, default=100_000,
+                        help="skip the legacy regex above this size on the 'headers' output (it is quadratic)")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    parsing_utils = GPTParsingUtils()
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": []}
+    print(f"{'output':<12}{'chars':>10}{'legacy ms':>11}{'scanner ms':>12}{'incr. ms':>10}{'native ms':>11}{'calls':>7}")
+    for size in args.sizes:
+        for name, text in make_outputs(size).items():
+            run = {"output": name, "chars": len(text)}
+            if name == "headers" and size > args.legacy_max_size:
+                run["legacy_ms"] = None
+            else:
+                run["legacy_ms"] = round(timed(legacy_parse, text, repeat=1)[0] * 1000, 2)
+            scanner_time, calls = timed(parsing_utils.tool_calls_parsing, text)
+            run["scanner_ms"] = round(scanner_time * 1000, 2)
+            run["incremental_ms"] = round(timed(incremental_parse, split_tokens(text))[0] * 1000, 2)
+            calls = calls if isinstance(calls, list) else []
+            reply = ModelReply(text, calls)
+            run["native_ms"] = round(timed(parsing_utils.tool_calls_parsing, reply)[0] * 1000, 3)
+            run["calls"] = len(calls)
+            results["runs"].append(run)
+            legacy = "skipped" if run["legacy_ms"] is None else run["legacy_ms"]
+            print(f"{name:<12}{run['chars']:>10}{legacy:>11}{run['scanner_ms']:>12}{run['incremental_ms']:>10}"
+                  f"{run['native_ms']:>11}{run['calls']:>7}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
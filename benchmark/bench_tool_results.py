@@ -0,0 +1,133 @@
+"""
+Prompt size and latency with and without shaping tool results.
+
+Conversations of three turns that each return many rows (every panel of the
+farm, the dirty panels, every drone) are run against a fake LLM whose
+prefill time grows with the prompt (`--prefill-tps`). Runs:
+  * raw: `"tool_results": {"enabled": false}`, results go into the history as JSON;
+  * shaped: the "result" entries of config/tools.json project, limit and
+    aggregate the rows and encode them as a table.
+Reported per run: turns/sec and latency, the prompt tokens sent to the model
+per turn (from `/metrics`), tokens saved per tool (from `/api/stats`) and
+whether the full result behind each reference could be fetched back.
+
+Usage (from the repository root):
+    python -m benchmark.bench_tool_results --conversations 60 --concurrency 8 --prefill-tps 20000
+"""
+import argparse
+import asyncio
+import json
+import re
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmark.BenchUtils import start_server, summarize
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, start_in_subprocess
+from benchmark.bench_load import _tool_call
+
+SCRIPTED_OUTPUTS = {
+    "every panel": _tool_call("find_panels", {}),
+    "dirty": _tool_call("find_panels", {"status": "dirty"}),
+    "drones": _tool_call("get_drone_status", {}),
+}
+TURNS = ["list every panel in the farm", "which of them are dirty?", "where are the drones?"]
+PROMPT_TOKENS = re.compile(r'coordinate_llm_tokens_total\{kind="prompt"\} (\S+)')
+
+
+async def drive_conversations(base_url: str, total: int, concurrency: int) -> dict:
+    """
+    Runs `total` conversations of TURNS and then fetches the full result
+    behind every reference found in their histories.
+    """
+    latencies, errors, conversation_ids = [], 0, []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def conversation():
+            nonlocal errors
+            async with semaphore:
+                conversation_id = None
+                for turn in TURNS:
+                    body = {"messages": [{"role": "user", "content": turn}], "conversation_id": conversation_id}
+                    started = time.perf_counter()
+                    try:
+                        resp = await client.post(f"{base_url}/api/chat", json=body)
+                        resp.raise_for_status()
+                    except httpx.HTTPError:
+                        errors += 1
+                        return
+                    latencies.append(time.perf_counter() - started)
+                    conversation_id = resp.json()["conversation_id"]
+                conversation_ids.append(conversation_id)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(conversation() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+        refs, fetched = 0, 0
+        for conversation_id in conversation_ids[:10]:
+            history = (await client.get(f"{base_url}/api/conversations/{conversation_id}",
+                                        params={"include_tool_results": "true"})).json()
+            for message in history["messages"]:
+                if message["role"] != "tool":
+                    continue
+                ref = json.loads(message["content"]).get("ref") if message["content"].startswith("{") else None
+                if ref:
+                    refs += 1
+                    resp = await client.get(f"{base_url}/api/conversations/{conversation_id}/tool_results/{ref}")
+                    fetched += resp.status_code == 200
+
+    run = summarize(latencies, errors, elapsed)
+    run.update(refs_checked=refs, refs_fetched=fetched)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--server", choices=["flask", "async"], default="async")
+    parser.add_argument("--llm-latency", type=float, default=0.02)
+    parser.add_argument("--prefill-tps", type=float, default=20000.0, help="prefill speed of the fake LLM")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.llm_latency,
+                                           prefill_tokens_per_second=args.prefill_tps,
+                                           scripted_outputs=SCRIPTED_OUTPUTS)
+    go_process, go = start_in_subprocess(FakeGoServer, latency=0.005)
+    workdir = Path(tempfile.mkdtemp())
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": {}}
+    print(f"{'run':<8}{'turns/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}{'prompt tok/turn':>17}{'refs ok':>9}")
+    for name, enabled in (("raw", False), ("shaped", True)):
+        config_path = llm.write_config(workdir / f"{name}.json", tool_results={"enabled": enabled})
+        process, base_url = start_server(args.server, go.api_url, config_path)
+        run = asyncio.run(drive_conversations(base_url, args.conversations, args.concurrency))
+        prompt_tokens = float(PROMPT_TOKENS.search(httpx.get(f"{base_url}/metrics").text).group(1))
+        run["tool_results"] = httpx.get(f"{base_url}/api/stats").json()["tool_results"]
+        process.terminate()
+
+        turns = run["requests"] - run["errors"]
+        run["prompt_tokens_per_turn"] = round(prompt_tokens / turns) if turns else 0
+        results["runs"][name] = run
+        print(f"{name:<8}{run['rps']:>9}{run['p50_ms']:>9}{run['p95_ms']:>9}{run['errors']:>8}"
+              f"{run['prompt_tokens_per_turn']:>17}{run['refs_fetched']:>5}/{run['refs_checked']:<3}")
+    llm_process.terminate()
+    go_process.terminate()
+
+    for tool, stats in results["runs"]["shaped"]["tool_results"]["tools"].items():
+        print(f"{tool}: {stats['shaped']} results shaped, {stats['raw_tokens']} -> {stats['tokens']} tokens "
+              f"({stats['tokens_saved']} saved)")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Measures tool-argument validation: its cost per call, and the Go round trips
+it saves when the model produces bad arguments.
+
+`--calls` tool calls are run through `ToolExecutor.execute_tool` against the
+fake Go server, with `--invalid-rate` of them carrying arguments that fail the
+tools.json schema (a non-numeric cluster_id, an unknown status, a missing
+required field). Calls that only need coercion ("3" for 3, "Dirty" for
+"dirty") are valid. The run is repeated without validators (an empty schema
+set), where every call reaches the Go server.
+
+Usage (from the repository root):
+    python -m benchmark.bench_tool_validation --calls 500 --invalid-rate 0.2
+"""
+import argparse
+import io
+import json
+import random
+import time
+import timeit
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from benchmark.FakeServers import FakeGoServer, start_in_subprocess
+from utils.ToolExecutor import ToolExecutor
+
+VALID_CALLS = [
+    ("find_panels", {"cluster_id": 3, "status": "dirty"}),
+    ("find_panels", {"cluster_id": "3", "status": "Dirty"}),
+    ("get_panel_maintenance_history", {"cluster_id": 2, "panel_id": "4"}),
+    ("get_drone_status", {"destination_cluster_id": 1}),
+]
+INVALID_CALLS = [
+    ("find_panels", {"cluster_id": "three", "status": "dirty"}),
+    ("find_panels", {"cluster_id": 3, "status": "clean"}),
+    ("get_panel_maintenance_history", {"cluster_id": 2}),
+    ("get_drone_status", {"drone_id": 1.5}),
+]
+
+
+def workload(calls: int, invalid_rate: float, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    return [rng.choice(INVALID_CALLS if rng.random() < invalid_rate else VALID_CALLS) for _ in range(calls)]
+
+
+def run(go_url: str, calls: list, validate: bool) -> dict:
+    with redirect_stdout(io.StringIO()):
+        executor = ToolExecutor(go_url, cache_config={"enabled": False}, tools=None if validate else [])
+    errors = 0
+    started = time.perf_counter()
+    for name, arguments in calls:
+        result = executor.execute_tool(name, arguments)
+        if isinstance(result, dict) and "error" in result:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    stats = executor.get_stats()
+    return {"elapsed_s": round(elapsed, 3), "go_requests": stats["requests"], "error_results": errors,
+            "mean_ms": round(elapsed / len(calls) * 1000, 2), "validation": stats["validation"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--invalid-rate", type=float, default=0.2)
+    parser.add_argument("--go-latency", type=float, default=0.01)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    go_process, go = start_in_subprocess(FakeGoServer, latency=args.go_latency)
+    calls = workload(args.calls, args.invalid_rate)
+    runs = {"without validation": run(go.api_url, calls, validate=False),
+            "with validation": run(go.api_url, calls, validate=True)}
+    go_process.terminate()
+
+    validator = ToolExecutor("http://127.0.0.1:9/", cache_config={"enabled": False}).validator
+    samples = {"valid": VALID_CALLS[0], "coerced": VALID_CALLS[1], "bad type": INVALID_CALLS[0],
+               "bad enum": INVALID_CALLS[1]}
+    per_call = {label: round(timeit.timeit(lambda: validator.validate(*call), number=5000) / 5000 * 1e6, 2)
+                for label, call in samples.items()}
+
+    print(f"{'run':<20}{'go requests':>13}{'errors':>8}{'mean ms':>9}{'total s':>9}")
+    for name, result in runs.items():
+        print(f"{name:<20}{result['go_requests']:>13}{result['error_results']:>8}{result['mean_ms']:>9}"
+              f"{result['elapsed_s']:>9}")
+    print("validation cost per call (us):", per_call)
+
+    if args.json:
+        results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "runs": runs,
+                   "validate_us": per_call}
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
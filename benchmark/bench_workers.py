@@ -0,0 +1,116 @@
+"""
+Scale-out of the CoordinateServer with `app/WorkerSupervisor.py`.
+
+For each worker count, the supervisor is started in a child process (router
+plus workers, with the conversation store and tool/completion caches shared
+through SQLite) against a fake LLM and a fake Go server, and driven with the
+multi-turn conversation mix of `bench_load`. Reported per worker count: the
+time until every worker is ready (warmed up), throughput and latency
+of the turns, the share of follow-up turns routed to the worker that holds
+the conversation, and how long the shutdown drain took.
+
+Throughput only grows with the workers while there are CPU cores left for
+them (and the fake LLM is not the bottleneck); on a single core the extra
+workers mostly add context switches.
+
+Usage (from the repository root):
+    python -m benchmark.bench_workers --workers 1 2 4 8 --conversations 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from benchmark.FakeServers import FakeGoServer, FakeLLMServer, free_port, start_in_subprocess
+from benchmark.bench_load import SCRIPTED_OUTPUTS, drive_mix
+
+
+def _supervise(config_path: str, workers: dict, go_url: str):
+    os.environ["GO_SERVER_URL"] = go_url
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.WorkerSupervisor import serve
+    serve(config_path, workers)
+
+
+def start_workers(config_path: str, workers: dict, go_url: str) -> tuple:
+    """
+    Starts the supervisor and waits until all its workers are ready.
+    Returns the process, the router's base URL and the startup time.
+    """
+    started = time.perf_counter()
+    process = multiprocessing.Process(target=_supervise, args=(config_path, workers, go_url))
+    process.start()
+    url = f"http://127.0.0.1:{workers['port']}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            stats = httpx.get(f"{url}/api/router/stats", timeout=1).json()
+            if all(w["ready"] for w in stats["workers"]):
+                break
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.05)
+    return process, url, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--server", choices=["flask", "async"], default="async")
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--stream-share", type=float, default=0.2)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--llm-tps", type=float, default=200.0)
+    parser.add_argument("--go-latency", type=float, default=0.01)
+    parser.add_argument("--no-affinity", action="store_true", help="route follow-up turns by hashing only")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    args = parser.parse_args()
+
+    llm_process, llm = start_in_subprocess(FakeLLMServer, latency=args.llm_latency,
+                                           tokens_per_second=args.llm_tps, scripted_outputs=SCRIPTED_OUTPUTS)
+    go_process, go = start_in_subprocess(FakeGoServer, latency=args.go_latency)
+    workdir = Path(tempfile.mkdtemp())
+    config_path = llm.write_config(workdir / "configure.json")
+
+    results = {"config": {k: v for k, v in vars(args).items() if k != "json"}, "cpus": os.cpu_count(), "runs": {}}
+    print(f"{'workers':>7}{'startup s':>11}{'turns/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+          f"{'affinity':>10}{'drain s':>9}")
+    for count in args.workers:
+        # The workers take the ports after the router's
+        workers = {"count": count, "server": args.server, "host": "127.0.0.1", "port": free_port(),
+                   "shared_state": str(workdir / f"shared-{count}"), "affinity": not args.no_affinity,
+                   "drain_timeout": 10.0}
+        process, base_url, startup = start_workers(config_path, workers, go.api_url)
+        asyncio.run(drive_mix(base_url, min(20, args.conversations), args.concurrency, 0.0, seed=1))
+        run = asyncio.run(drive_mix(base_url, args.conversations, args.concurrency, args.stream_share, seed=0))
+        router = httpx.get(f"{base_url}/api/router/stats").json()
+
+        stopping = time.perf_counter()
+        os.kill(process.pid, signal.SIGTERM)
+        process.join(60)
+        run.update(startup_s=round(startup, 2), drain_s=round(time.perf_counter() - stopping, 2),
+                   affinity_hit_rate=router["affinity_hit_rate"],
+                   requests_per_worker=[w["requests"] for w in router["workers"]])
+        results["runs"][str(count)] = run
+        print(f"{count:>7}{run['startup_s']:>11}{run['rps']:>9}{run['p50_ms']:>9}{run['p95_ms']:>9}"
+              f"{run['p99_ms']:>9}{run['errors']:>8}{run['affinity_hit_rate']:>10}{run['drain_s']:>9}")
+    llm_process.terminate()
+    go_process.terminate()
+
+    for count, run in results["runs"].items():
+        print(f"requests per worker ({count}):", run["requests_per_worker"])
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
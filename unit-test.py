@@ -1,7 +1,13 @@
 from utils.LMWrapper import LMWrapper
-from utils.GPTTools import GPTParsingUtils, PromptBuilder
+from utils.GPTTools import GPTParsingUtils, PromptBuilder, ToolCallStreamFilter
+from utils.ToolSchema import ToolArgumentValidator
+from utils.AdmissionControl import AdmissionController, AdmissionRejected
+import utils.ConversationStore as conversation_stores
+from utils.ToolSpeculation import ToolSpeculator
 from dotenv import load_dotenv
+import asyncio
 import os
+import tempfile
 
 # --- Setup ---
 load_dotenv()
@@ -94,5 +100,311 @@ Then, respond with the appropriate tool call in the specified format.
         print("  - The raw LLM response above for clues.")
 
 
+def test_stream_filter_hides_tool_call_after_prose():
+    """
+    A tool call that follows some prose must not reach the client: the prose
+    is streamed, the tool-call text is held back and the turn is a tool call,
+    also when the marker is split across deltas.
+    """
+    print("--- Running Test: Stream Filter, Tool Call After Prose ---")
+    prose = "Let me check the panels for you now. "
+    tool_call = "to=functions.find_panels<|message|>{}"
+    for deltas in ([prose, tool_call], list(prose + tool_call)):
+        stream_filter = ToolCallStreamFilter()
+        shown = "".join(stream_filter.feed(delta) for delta in deltas) + stream_filter.finish()
+        assert stream_filter.is_tool_call
+        assert "to=" not in shown and "<|" not in shown
+        assert shown == prose
+        assert stream_filter.text == prose + tool_call
+    print("\nAssertions passed!")
+
+
+def test_tool_argument_validation():
+    """
+    Arguments are coerced where it is lossless, enum values are case-folded,
+    unknown arguments are dropped, array bounds are enforced, and every
+    problem is described in one compact message.
+    """
+    print("--- Running Test: Tool Argument Validation ---")
+    validator = ToolArgumentValidator([{"name": "find_panels", "parameters": {
+        "type": "object",
+        "properties": {
+            "cluster_id": {"type": "integer"},
+            "status": {"type": "string", "enum": ["dirty", "clean"]},
+            "panel_ids": {"type": "array", "items": {"type": "integer"}, "minItems": 1, "maxItems": 2},
+        },
+        "required": ["cluster_id"],
+    }}])
+
+    def error(parameters):
+        arguments, problem = validator.validate("find_panels", parameters)
+        assert arguments is None
+        return problem.removeprefix("Invalid arguments for find_panels: ")
+
+    assert validator.validate("find_panels", {"cluster_id": "3", "status": " Dirty ", "color": "red"}) == \
+        ({"cluster_id": 3, "status": "dirty"}, None)
+    assert validator.validate("find_panels", {"cluster_id": 3, "panel_ids": ["4", 7]}) == \
+        ({"cluster_id": 3, "panel_ids": [4, 7]}, None)
+    assert error({"status": "dirty"}) == "cluster_id: required"
+    assert error({"cluster_id": "three"}) == "cluster_id: must be an integer (got 'three')"
+    assert error({"cluster_id": 3.5}) == "cluster_id: must be an integer (got 3.5)"
+    assert error({"cluster_id": 3, "status": "wet"}) == "status: must be one of 'dirty' or 'clean' (got 'wet')"
+    assert error({"cluster_id": 3, "panel_ids": []}) == "panel_ids: must have at least 1 items (got 0)"
+    assert error({"cluster_id": 3, "panel_ids": [1, 2, 3]}) == "panel_ids: must have at most 2 items (got 3)"
+    assert error({"cluster_id": "x", "status": "wet"}) == \
+        "cluster_id: must be an integer (got 'x'); status: must be one of 'dirty' or 'clean' (got 'wet')"
+    assert error([3]) == "expected a JSON object."
+    # Tools without a schema pass through unchanged
+    assert validator.validate("unknown_tool", {"a": "1"}) == ({"a": "1"}, None)
+    assert validator.get_stats() == {"validated": 2, "coerced": 2, "rejected": 8, "tools": 1}
+    print("\nAssertions passed!")
+
+
+def test_admission_priorities_and_rejections():
+    """
+    Waiting requests get slots highest priority first; a full queue evicts a
+    lower-priority request or answers 503, an empty token bucket answers 429,
+    and both carry a Retry-After estimate.
+    """
+    print("--- Running Test: Admission Priorities and Rejections ---")
+
+    async def admitted_order():
+        controller = AdmissionController(max_in_flight=1, max_queue=4)
+        order = []
+
+        async def request(priority):
+            with await controller.aacquire(priority):
+                order.append(priority)
+
+        holder = await controller.aacquire()
+        waiting = [asyncio.create_task(request(priority)) for priority in ("browse", "default", "dispatch")]
+        await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*waiting)
+        return order, controller
+
+    order, controller = asyncio.run(admitted_order())
+    assert order == ["dispatch", "default", "browse"]
+    assert controller._in_flight == 0 and controller._queued == 0
+
+    # A full queue: an equal or higher priority request is rejected, a lower one evicted
+    async def full_queue():
+        controller = AdmissionController(max_in_flight=1, max_queue=1)
+        holder = await controller.aacquire()
+        browse = asyncio.create_task(controller.aacquire("browse"))
+        await asyncio.sleep(0)
+        try:
+            await controller.aacquire("browse")
+        except AdmissionRejected as e:
+            rejected = e
+        dispatch = asyncio.create_task(controller.aacquire("dispatch"))
+        await asyncio.sleep(0)
+        try:
+            await browse
+        except AdmissionRejected as e:
+            evicted = e
+        holder.release()
+        (await dispatch).release()
+        return rejected, evicted, controller
+
+    rejected, evicted, controller = asyncio.run(full_queue())
+    assert (rejected.status, rejected.reason) == (503, "queue_full")
+    # One request queued ahead of the next, through one slot held for about a second
+    assert rejected.retry_after == 2
+    assert (evicted.status, evicted.reason) == (503, "evicted")
+    assert controller.stats["queue_full"] == 1 and controller.stats["evicted"] == 1
+    assert controller._in_flight == 0 and controller._queued == 0
+
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+    holder = controller.acquire()
+    try:
+        controller.acquire()
+        assert False, "expected a queue timeout"
+    except AdmissionRejected as e:
+        assert (e.status, e.reason, e.retry_after) == (503, "queue_timeout", 1)
+    holder.release()
+    assert controller._in_flight == 0 and controller._queued == 0
+
+    # The rate limit applies per key and is checked before queueing
+    controller = AdmissionController(rate_limit={"enabled": True, "requests_per_second": 0.5, "burst": 1})
+    controller.acquire(key="alice").release()
+    try:
+        controller.acquire(key="alice")
+        assert False, "expected a rate limit"
+    except AdmissionRejected as e:
+        assert (e.status, e.reason, e.retry_after) == (429, "rate_limited", 2)
+    controller.acquire(key="bob").release()
+    assert controller.stats["rate_limited"] == 1 and controller._in_flight == 0
+    print("\nAssertions passed!")
+
+
+def test_admission_slot_released_on_failure():
+    """
+    A chat turn that fails after it was admitted gives its slot back, on the
+    plain and on the streaming endpoint, so failures cannot leak capacity.
+    """
+    print("--- Running Test: Admission Slot Released on Failure ---")
+    import app.CoordinateServer as core
+
+    class FailingStore:
+        def exists(self, conversation_id):
+            raise RuntimeError("store unavailable")
+
+    saved = core.admission, core.conversation_store, core._refresh_system_prompt
+    controller = AdmissionController(max_in_flight=1, max_queue=0)
+    core.admission, core.conversation_store = controller, FailingStore()
+    core._refresh_system_prompt = lambda: None
+    try:
+        client = core.create_app(warm_up=False).test_client()
+        for endpoint in ("/api/chat", "/api/chat/stream"):
+            for _ in range(2):
+                response = client.post(endpoint, json={"messages": [{"role": "user", "content": "hi"}]})
+                # A leaked slot would turn the second request into a 503
+                assert response.status_code == 500
+                assert controller._in_flight == 0
+        assert controller.stats["admitted"] == 4 and controller.stats["queue_full"] == 0
+    finally:
+        core.admission, core.conversation_store, core._refresh_system_prompt = saved
+    print("\nAssertions passed!")
+
+
+def test_conversation_listing_pages():
+    """
+    Every conversation store pages through the listing in the same order, by
+    start time or last activity and ascending or descending, with ties broken
+    by ID, and `next_cursor` runs out exactly on the last page.
+    """
+    print("--- Running Test: Conversation Listing Pages ---")
+    # Creation and activity times with ties, handed out in this order
+    created = [("c5", "T1"), ("c2", "T1"), ("c7", "T2"), ("c1", "T2"), ("c4", "T2"), ("c3", "T3"), ("c6", "T1")]
+    appended = [("c6", "T4"), ("c1", "T4"), ("c3", "T3")]
+    activity = dict(created) | dict(appended)
+
+    def expected(sort, order):
+        key = dict(created) if sort == "start_time" else activity
+        return sorted(key, key=lambda conversation_id: (key[conversation_id], conversation_id),
+                      reverse=order == "desc")
+
+    def fill(store):
+        times = iter([time for _, time in created + appended])
+        saved_now = conversation_stores._now
+        conversation_stores._now = lambda: next(times)
+        try:
+            for conversation_id, _ in created:
+                store.create(conversation_id)
+            for conversation_id, _ in appended:
+                store.append(conversation_id, [{"role": "user", "content": conversation_id}])
+        finally:
+            conversation_stores._now = saved_now
+        return store
+
+    with tempfile.TemporaryDirectory() as directory:
+        stores = {"memory": conversation_stores.InMemoryConversationStore(),
+                  "sqlite": conversation_stores.SQLiteConversationStore(os.path.join(directory, "conversations.db"))}
+        try:
+            stores["mongodb"] = conversation_stores.MongoConversationStore(mock=True)
+        except ImportError:
+            print("mongomock is not installed, skipping the MongoDB store.")
+        for name, store in stores.items():
+            fill(store)
+            for sort in conversation_stores.SORT_KEYS:
+                for order in ("asc", "desc"):
+                    for limit in (1, 2, 3, 7, 50):
+                        listed, pages, cursor = [], 0, None
+                        while True:
+                            page = store.list_page(sort, order, limit, cursor)
+                            pages += 1
+                            listed.extend(conversation["id"] for conversation in page["conversations"])
+                            cursor = page["next_cursor"]
+                            if cursor is None:
+                                break
+                            assert len(page["conversations"]) == limit
+                        assert listed == expected(sort, order), (name, sort, order, limit, listed)
+                        assert pages == -(-len(created) // limit), (name, sort, order, limit, pages)
+        stores["sqlite"]._conn.close()
+    print("\nAssertions passed!")
+
+
+def test_speculative_tool_calls():
+    """
+    Speculative results answer the parsed calls with the same tool and
+    arguments, by position and each at most once; the parsed calls without
+    one run as usual, a failed speculative call fails on its own, and the
+    speculative calls nobody asked for are counted as wasted.
+    """
+    print("--- Running Test: Speculative Tool Calls ---")
+
+    class StubExecutor:
+        max_parallel_tools = 2
+
+        def __init__(self):
+            self.executed = []
+
+        def execute_tool(self, tool_name, parameters):
+            if tool_name == "get_drone_status":
+                raise ConnectionError("Go server unreachable")
+            return {"speculative": tool_name, **parameters}
+
+        async def aexecute_tool(self, tool_name, parameters):
+            return self.execute_tool(tool_name, parameters)
+
+        def execute_tools(self, tool_calls):
+            self.executed.extend(call["tool_name"] for call in tool_calls)
+            return [{"executed": call["tool_name"], **call["parameters"]} for call in tool_calls]
+
+        async def aexecute_tools(self, tool_calls):
+            return self.execute_tools(tool_calls)
+
+        @staticmethod
+        def failure_result(tool_name, error):
+            return {"error": f"{tool_name} failed: {error}"}
+
+    reply = ('to=functions.find_panels<|message|>{"cluster_id": 1}<|call|>'
+             'to=functions.find_panels<|message|>{"cluster_id": 1}<|call|>'
+             'to=functions.get_drone_status<|message|>{}<|call|>'
+             'to=functions.dispatch_drone<|message|>{"panel_id": 4}<|call|>'
+             'to=functions.find_panels<|message|>{"cluster_id": 9}<|call|>')
+    parsed = [{"tool_name": "find_panels", "parameters": {"cluster_id": 1}},
+              {"tool_name": "dispatch_drone", "parameters": {"panel_id": 4}},
+              {"tool_name": "find_panels", "parameters": {"cluster_id": 1}},
+              {"tool_name": "get_drone_status", "parameters": {}},
+              {"tool_name": "find_panels", "parameters": {"cluster_id": 1}}]
+    expected = [{"speculative": "find_panels", "cluster_id": 1},
+                {"executed": "dispatch_drone", "panel_id": 4},
+                {"speculative": "find_panels", "cluster_id": 1},
+                {"error": "get_drone_status failed: Go server unreachable"},
+                {"executed": "find_panels", "cluster_id": 1}]
+
+    async def run_async(run):
+        for delta in reply:
+            run.feed(delta)
+        run.finish()
+        return await run.aexecute_tools(parsed)
+
+    for asynchronous in (False, True):
+        executor = StubExecutor()
+        speculator = ToolSpeculator(executor, enabled=True)
+        run = speculator.start(asynchronous)
+        if asynchronous:
+            results = asyncio.run(run_async(run))
+        else:
+            for delta in reply:
+                run.feed(delta)
+            run.finish()
+            results = run.execute_tools(parsed)
+        assert results == expected, results
+        # Dispatches are never run speculatively, and the duplicate beyond the speculated two runs as usual
+        assert executor.executed == ["dispatch_drone", "find_panels"]
+        stats = speculator.get_stats()
+        assert (stats["completions"], stats["started"], stats["used"], stats["wasted"]) == (1, 4, 3, 1), stats
+    print("\nAssertions passed!")
+
+
 if __name__ == "__main__":
-    test_lm_wrapper_and_tool_parsing()
\ No newline at end of file
+    test_stream_filter_hides_tool_call_after_prose()
+    test_tool_argument_validation()
+    test_admission_priorities_and_rejections()
+    test_admission_slot_released_on_failure()
+    test_conversation_listing_pages()
+    test_speculative_tool_calls()
+    test_lm_wrapper_and_tool_parsing()
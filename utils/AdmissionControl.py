@@ -0,0 +1,365 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from utils.Telemetry import telemetry
+
+# Priority classes, highest first, and the keywords in the user's last message
+# that select them; anything else gets DEFAULT_PRIORITY.
+DEFAULT_PRIORITY_CLASSES = ["dispatch", "default", "browse"]
+DEFAULT_PRIORITY = "default"
+DEFAULT_PRIORITY_RULES = {
+    "dispatch": ["dispatch", "send a drone", "send drones", "send the rover", "rover"],
+    "browse": ["history", "list ", "show "],
+}
+
+WAITING, GRANTED, CANCELLED, EVICTED = range(4)
+
+
+class AdmissionRejected(Exception):
+    """
+    A chat request that was not admitted: `status` is 429 (the key's rate
+    limit) or 503 (overloaded), and `retry_after` the suggested wait in seconds.
+    """
+
+    def __init__(self, status: int, reason: str, message: str, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average and bursts of up to `burst`.
+    Not thread-safe on its own; AdmissionController holds its lock around it.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes one token. Returns 0.0 on success, otherwise the seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class _Ticket:
+    """A queued request, woken through an Event (threads) or a Future (asyncio)."""
+    __slots__ = ("priority", "state", "enqueued_at", "event", "loop", "future")
+
+    def __init__(self, priority: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.state = WAITING
+        self.enqueued_at = time.monotonic()
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class Slot:
+    """
+    An admitted request's in-flight slot. Released when the `with` block ends
+    or by `release()`, whichever comes first.
+    """
+
+    def __init__(self, controller: Optional["AdmissionController"]):
+        # None while admission control is disabled: there is nothing to release
+        self.controller = controller
+        self.admitted_at = time.monotonic()
+        self._released = controller is None
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(time.monotonic() - self.admitted_at)
+
+    def __enter__(self) -> "Slot":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.release()
+        return False
+
+
+class AdmissionController:
+    """
+    Keeps the local model from being flooded: at most `max_in_flight` chat
+    turns run at once, and up to `max_queue` more wait for a slot.
+
+    * Waiting requests are admitted by priority class (`priority_classes`,
+      highest first), FIFO within a class. A request still waiting after
+      `queue_timeout` seconds is rejected with 503.
+    * With a full queue, a request is rejected with 503 at once, unless a
+      lower-priority request is waiting; that one is evicted instead.
+    * With `rate_limit` enabled, every API key (or client address) has a
+      token bucket; a request over it is rejected with 429 before queueing.
+      `rate_limit.keys` overrides the rate and burst per key.
+
+    Rejections carry a Retry-After estimate, from the mean time a slot is held.
+    While disabled, `acquire`/`aacquire` admit everything.
+
+    `workers` is the number of server processes the configured limits are
+    shared by (see WorkerSupervisor); each process enforces its share of
+    `max_in_flight`, `max_queue` and every rate limit.
+    """
+
+    def __init__(self, enabled: bool = True, max_in_flight: int = 8, max_queue: int = 64,
+                 queue_timeout: float = 30.0, priorities: Optional[Dict] = None, rate_limit: Optional[Dict] = None,
+                 workers: int = 1):
+        priorities = priorities or {}
+        rate_limit = rate_limit or {}
+        self.enabled = enabled
+        self.workers = max(1, workers)
+        self.max_in_flight = self._share(max_in_flight, minimum=1)
+        self.max_queue = self._share(max_queue)
+        self.queue_timeout = queue_timeout
+        self.priority_classes: List[str] = priorities.get("classes", DEFAULT_PRIORITY_CLASSES)
+        self.default_priority = priorities.get("default", DEFAULT_PRIORITY)
+        self.priority_rules: Dict[str, List[str]] = priorities.get("rules", DEFAULT_PRIORITY_RULES)
+        self._ranks = {name: rank for rank, name in enumerate(self.priority_classes)}
+
+        self.rate_limited = rate_limit.get("enabled", False)
+        self.rate = rate_limit.get("requests_per_second", 1.0) / self.workers
+        self.burst = self._share(rate_limit.get("burst", 10), minimum=1)
+        self.key_limits: Dict[str, Dict] = rate_limit.get("keys", {})
+        self.max_keys = rate_limit.get("max_keys", 10000)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        # (rank, arrival number, ticket); cancelled tickets are skipped when popped
+        self._heap: list = []
+        self._arrivals = itertools.count()
+        self._mean_hold = 1.0
+        self.stats = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0, "queue_timeout": 0,
+                      "evicted": 0, "wait_seconds": 0.0}
+
+    def _share(self, limit: int, minimum: int = 0) -> int:
+        # This process's part of a limit shared by `workers` processes
+        return max(minimum, math.ceil(limit / self.workers))
+
+    # --- Classification ---
+
+    def classify(self, requested: Optional[str], messages: List[Dict]) -> str:
+        """
+        The priority class of a chat request: the one it asks for (e.g. the
+        X-Priority header) if known, else the first class whose keywords
+        appear in the last user message.
+        """
+        if requested in self._ranks:
+            return requested
+        text = next((str(m.get("content", "")).lower() for m in reversed(messages or [])
+                     if isinstance(m, dict) and m.get("role") == "user"), "")
+        for name in self.priority_classes:
+            if any(keyword in text for keyword in self.priority_rules.get(name, ())):
+                return name
+        return self.default_priority
+
+    def _rank(self, priority: str) -> int:
+        return self._ranks.get(priority, self._ranks.get(self.default_priority, len(self._ranks)))
+
+    # --- Admission ---
+
+    def acquire(self, priority: str = DEFAULT_PRIORITY, key: Optional[str] = None) -> Slot:
+        """
+        Blocks until the request may run; raises AdmissionRejected otherwise.
+        """
+        if not self.enabled:
+            return Slot(None)
+        ticket = self._enter(priority, key, None)
+        if ticket is not None:
+            try:
+                ticket.event.wait(self.queue_timeout)
+            except BaseException:
+                self._abandon(ticket)
+                raise
+            self._settle(ticket)
+        return Slot(self)
+
+    async def aacquire(self, priority: str = DEFAULT_PRIORITY, key: Optional[str] = None) -> Slot:
+        """
+        Async version of `acquire`: waits without blocking the event loop.
+        """
+        if not self.enabled:
+            return Slot(None)
+        ticket = self._enter(priority, key, asyncio.get_running_loop())
+        if ticket is not None:
+            try:
+                await asyncio.wait_for(ticket.future, self.queue_timeout)
+            except asyncio.TimeoutError:
+                pass
+            except BaseException:
+                # Cancelled, e.g. because the client went away
+                self._abandon(ticket)
+                raise
+            self._settle(ticket)
+        return Slot(self)
+
+    def _enter(self, priority: str, key: Optional[str], loop) -> Optional[_Ticket]:
+        """
+        Takes a slot (returns None) or queues a ticket for one.
+        """
+        rank = self._rank(priority)
+        with self._lock:
+            if self.rate_limited:
+                wait = self._bucket(key).take()
+                if wait:
+                    self._reject(priority, "rate_limited")
+                    raise AdmissionRejected(429, "rate_limited", "Rate limit exceeded for this API key.",
+                                            max(1, math.ceil(min(wait, 3600))))
+            if self._in_flight < self.max_in_flight and not self._queued:
+                self._in_flight += 1
+                self.stats["admitted"] += 1
+                self._record_admission(priority, 0.0)
+                return None
+            if self._queued >= self.max_queue:
+                victim = self._lowest_waiting()
+                if victim is None or self._rank(victim.priority) <= rank:
+                    self._reject(priority, "queue_full")
+                    raise AdmissionRejected(503, "queue_full", "Server is overloaded, please retry later.",
+                                            self._retry_after())
+                victim.state = EVICTED
+                self._queued -= 1
+                victim.wake()
+            ticket = _Ticket(priority, loop)
+            heapq.heappush(self._heap, (rank, next(self._arrivals), ticket))
+            self._queued += 1
+            self.stats["queued"] += 1
+            if len(self._heap) > 2 * self.max_queue + 16:
+                self._heap = [entry for entry in self._heap if entry[2].state == WAITING]
+                heapq.heapify(self._heap)
+            self._record_load()
+            return ticket
+
+    def _settle(self, ticket: _Ticket):
+        """
+        After waiting: returns if the ticket got a slot, raises AdmissionRejected if not.
+        """
+        with self._lock:
+            if ticket.state == GRANTED:
+                return
+            if ticket.state == WAITING:
+                ticket.state = CANCELLED
+                self._queued -= 1
+                self._record_load()
+            reason = "evicted" if ticket.state == EVICTED else "queue_timeout"
+            self._reject(ticket.priority, reason)
+            retry_after = self._retry_after()
+        raise AdmissionRejected(503, reason, "Server is overloaded, please retry later.", retry_after)
+
+    def _abandon(self, ticket: _Ticket):
+        """
+        Gives up a ticket whose waiter was interrupted, passing on a slot it was granted.
+        """
+        with self._lock:
+            granted = ticket.state == GRANTED
+            if ticket.state == WAITING:
+                ticket.state = CANCELLED
+                self._queued -= 1
+                self._record_load()
+        if granted:
+            self._release(0.0)
+
+    def _release(self, held: float):
+        with self._lock:
+            if held:
+                self._mean_hold = 0.9 * self._mean_hold + 0.1 * held
+            while self._heap:
+                _, _, ticket = heapq.heappop(self._heap)
+                if ticket.state == WAITING:
+                    # The slot passes straight to the next request; _in_flight stays the same
+                    ticket.state = GRANTED
+                    self._queued -= 1
+                    waited = time.monotonic() - ticket.enqueued_at
+                    self.stats["admitted"] += 1
+                    self.stats["wait_seconds"] += waited
+                    self._record_admission(ticket.priority, waited)
+                    ticket.wake()
+                    self._record_load()
+                    return
+            self._in_flight -= 1
+            self._record_load()
+
+    # --- Helpers (called with the lock held) ---
+
+    def _lowest_waiting(self) -> Optional[_Ticket]:
+        waiting = [entry for entry in self._heap if entry[2].state == WAITING]
+        return max(waiting, key=lambda entry: entry[:2])[2] if waiting else None
+
+    def _bucket(self, key: Optional[str]) -> TokenBucket:
+        key = key or "anonymous"
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            limits = self.key_limits.get(key, {})
+            bucket = TokenBucket(limits["requests_per_second"] / self.workers if "requests_per_second" in limits
+                                 else self.rate,
+                                 self._share(limits["burst"], minimum=1) if "burst" in limits else self.burst)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _retry_after(self) -> int:
+        # Until the requests ahead would have drained through the in-flight slots
+        return max(1, math.ceil((self._queued + 1) / max(1, self.max_in_flight) * self._mean_hold))
+
+    def _reject(self, priority: str, reason: str):
+        self.stats[reason] += 1
+        telemetry.record_admission(priority, reason)
+
+    def _record_admission(self, priority: str, waited: float):
+        telemetry.record_admission(priority, "admitted", waited)
+
+    def _record_load(self):
+        telemetry.record_load(self._in_flight, self._queued)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            admitted = self.stats["admitted"]
+            return {
+                "enabled": self.enabled,
+                "in_flight": self._in_flight,
+                "queued_now": self._queued,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                **{k: v for k, v in self.stats.items() if k != "wait_seconds"},
+                "mean_wait_ms": round(self.stats["wait_seconds"] / admitted * 1000, 2) if admitted else 0.0,
+                "rate_limit_keys": len(self._buckets),
+            }
+
+
+def create_admission_controller(config: Optional[Dict] = None) -> AdmissionController:
+    """
+    Builds the controller from the "admission" section of configure.json.
+    """
+    return AdmissionController(**(config or {}))
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+class CompletionCache:
+    """
+    Exact-match cache for model completions, keyed on a hash of the system
+    prompt, the messages and the request options. Message contents are used
+    exactly as sent: case and spacing can matter in IDs and free-text arguments.
+
+    * `deterministic_only`: only requests with temperature 0 are cached, since
+      any other temperature is asked to give varied answers.
+    * `scope`: "tool_calls" caches only completions that are tool calls (the
+      model's decision; the tool itself still runs live on a hit), "all"
+      caches every completion.
+    * Entries live in a bounded LRU, optionally backed by a SQLite file so
+      they survive restarts and are shared between worker processes.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = None,
+                 deterministic_only: bool = True, scope: str = "tool_calls", disk_path: Optional[str] = None,
+                 is_tool_call: Optional[Callable[[str], bool]] = None):
+        if scope not in ("tool_calls", "all"):
+            raise ValueError(f"Unsupported completion cache scope: {scope}")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.deterministic_only = deterministic_only
+        self.scope = scope
+        self.is_tool_call = is_tool_call or (lambda text: False)
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        if disk_path:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self._disk = sqlite3.connect(str(disk_path), check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("CREATE TABLE IF NOT EXISTS completions "
+                               "(key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL)")
+
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0}
+        self._miss_seconds = 0.0
+        self._timed_misses = 0
+
+    # --- Keys ---
+
+    @staticmethod
+    def _key_fields(message: Dict) -> Dict:
+        fields = {"role": message.get("role"), "content": message.get("content")}
+        if message.get("name"):
+            fields["name"] = message["name"]
+        return fields
+
+    def make_key(self, system_prompt: Optional[str], messages: List[Dict], request_options: Dict,
+                 model: str = "") -> str:
+        payload = {
+            "model": model,
+            "system": hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest(),
+            "messages": [self._key_fields(message) for message in messages],
+            "options": {k: v for k, v in request_options.items() if k != "stream"},
+        }
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def applies_to(self, request_options: Dict) -> bool:
+        if self.deterministic_only and request_options.get("temperature", 1.0) != 0:
+            with self._lock:
+                self.stats["bypassed"] += 1
+            return False
+        return True
+
+    # --- Lookup and storage ---
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                text, created = entry
+                if self.ttl_seconds is None or now - created < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return text
+                del self._entries[key]
+
+            if self._disk is not None:
+                row = self._disk.execute("SELECT text, created FROM completions WHERE key = ?", (key,)).fetchone()
+                if row and (self.ttl_seconds is None or now - row[1] < self.ttl_seconds):
+                    self._remember(key, row[0], row[1])
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, text: str, miss_seconds: Optional[float] = None):
+        """
+        Stores a completion; `miss_seconds` (the model call's duration) is used
+        to report the latency saved by hits.
+        """
+        with self._lock:
+            if miss_seconds is not None:
+                self._miss_seconds += miss_seconds
+                self._timed_misses += 1
+        if not text or text.startswith("Error:"):
+            return
+        if self.scope == "tool_calls" and not self.is_tool_call(text):
+            return
+        created = time.time()
+        with self._lock:
+            self._remember(key, text, created)
+            self.stats["stores"] += 1
+            if self._disk is not None:
+                self._disk.execute("INSERT OR REPLACE INTO completions (key, text, created) VALUES (?, ?, ?)",
+                                   (key, text, created))
+
+    def _remember(self, key: str, text: str, created: float):
+        # Callers hold self._lock
+        self._entries[key] = (text, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            lookups = stats["hits"] + stats["misses"]
+            mean_miss = self._miss_seconds / self._timed_misses if self._timed_misses else 0.0
+            return {
+                **stats,
+                "entries": len(self._entries),
+                "hit_rate": round(stats["hits"] / lookups, 3) if lookups else 0.0,
+                "mean_miss_ms": round(mean_miss * 1000, 1),
+                # Each hit skipped one model round trip of about the mean miss latency
+                "latency_saved_s": round(stats["hits"] * mean_miss, 3),
+            }
@@ -0,0 +1,321 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Pieces that BPE tokenizers (cl100k/o200k) usually encode as one token: a word
+# with its leading space, a group of up to three digits, or a short run of
+# punctuation. Used when no local tokenizer is available.
+_TOKEN_PIECE = re.compile(r" ?[A-Za-z]+| ?\d{1,3}| ?[^\sA-Za-z\d]{1,2}|\s+")
+
+SUMMARY_PREFIX = "[Summary of the earlier conversation]\n"
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between an operator and a solar panel "
+    "maintenance assistant. Update the summary with the new messages. Keep cluster/panel/drone IDs, "
+    "dispatched tasks and open questions; drop raw tool output. Answer with the summary only."
+)
+
+
+class TokenEstimator:
+    """
+    Counts prompt tokens. Uses tiktoken when it is installed and its encoding
+    can be loaded; otherwise a calibrated estimate that splits text the way
+    BPE tokenizers roughly do (within ~15% on English and JSON).
+    """
+
+    # Role markers and separators a chat template adds around every message
+    MESSAGE_OVERHEAD = 4
+    # Cached counts; an entry is a digest and a number, whatever the text's size
+    MAX_CACHED_COUNTS = 16384
+
+    def __init__(self, encoding: Optional[str] = "o200k_base"):
+        # Loaded on first use: tiktoken may have to download the encoding, which
+        # should not hold up a worker's startup
+        self._encoding_name = encoding if encoding and encoding != "estimate" else None
+        self._encoding = None
+        self._loaded = self._encoding_name is None
+        self._load_lock = threading.Lock()
+        # Histories are re-counted on every turn, so counts are cached by a digest
+        # of the text: keying on the text itself would keep large tool results alive
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self._counts_lock = threading.Lock()
+
+    def _load_encoding(self):
+        with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self._encoding_name)
+            except Exception:
+                # Not installed, or the encoding file cannot be downloaded
+                self._encoding = None
+            self._loaded = True
+
+    @property
+    def backend(self) -> str:
+        if not self._loaded:
+            self._load_encoding()
+        return "tiktoken" if self._encoding else "estimate"
+
+    def _count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        if not self._loaded:
+            self._load_encoding()
+        if self._encoding:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        tokens = 0
+        for piece in _TOKEN_PIECE.findall(text):
+            # Long words are split into several sub-word tokens
+            tokens += 1 + len(piece) // 8 if piece[-1].isalpha() else 1
+        return tokens
+
+    def count_text(self, text: str) -> int:
+        if not text:
+            return 0
+        key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        with self._counts_lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+        count = self._count_text(text)
+        with self._counts_lock:
+            self._counts[key] = count
+            if len(self._counts) > self.MAX_CACHED_COUNTS:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_message(self, message: Dict) -> int:
+        content = message.get("content")
+        if not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        return self.MESSAGE_OVERHEAD + self.count_text(content) + self.count_text(message.get("name") or "")
+
+    def count_messages(self, messages: List[Dict]) -> int:
+        return sum(self.count_message(message) for message in messages)
+
+
+def extractive_summary(previous: Optional[str], messages: List[Dict]) -> str:
+    """
+    Summarizes turns without a model call: one line per user request, the
+    tools that were run for it, and the first line of the final answer.
+    """
+    lines = previous.splitlines() if previous else []
+    for i, message in enumerate(messages):
+        role, content = message.get("role"), str(message.get("content") or "")
+        if role == "user":
+            lines.append(f"- User: {_shorten(content, 160)}")
+        elif role == "tool":
+            continue
+        elif i + 1 < len(messages) and messages[i + 1].get("role") == "tool":
+            names = []
+            for follower in messages[i + 1:]:
+                if follower.get("role") != "tool":
+                    break
+                names.append(follower.get("name") or "tool")
+            lines.append(f"  Tools: {', '.join(names)}")
+        else:
+            lines.append(f"  Assistant: {_shorten(content.split(chr(10))[0], 160)}")
+    return "\n".join(lines)
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+class ContextCompactor:
+    """
+    Fits a chat history into a prompt-token budget before each completion.
+
+    The system prompt and the last `keep_recent_turns` user turns are always
+    kept. Older messages are shrunk in order of cost until the prompt fits:
+      1. tool results larger than `max_tool_result_tokens` are cut short;
+      2. the oldest whole turns are folded into a rolling summary message
+         (or dropped when summaries are disabled);
+      3. large tool results of the recent turns are cut short as well,
+         except those of the latest turn.
+    Summaries are cached by the hash of the folded prefix, so each turn only
+    summarizes the messages folded since the previous one. The stored history
+    is never modified; only the messages sent to the model are.
+    """
+
+    def __init__(self, max_prompt_tokens: int = 8000, keep_recent_turns: int = 3,
+                 max_tool_result_tokens: int = 256, summary: Optional[Dict] = None,
+                 tokenizer: str = "o200k_base",
+                 summarizer: Optional[Callable[[Optional[str], List[Dict]], str]] = None):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.max_tool_result_tokens = max_tool_result_tokens
+        summary = summary or {}
+        self.summary_enabled = summary.get("enabled", True)
+        self.summary_mode = summary.get("mode", "extractive")
+        self.summary_max_tokens = summary.get("max_tokens", 512)
+        self.estimator = TokenEstimator(tokenizer)
+        self.summarizer = summarizer or extractive_summary
+
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "compacted": 0, "tokens_before": 0, "tokens_after": 0,
+                      "tool_results_elided": 0, "turns_folded": 0, "summaries_built": 0,
+                      "summary_cache_hits": 0, "seconds": 0.0}
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict], summarizer=None) -> Optional["ContextCompactor"]:
+        """
+        Builds a compactor from the "context_window" section of configure.json,
+        or returns None when the section is missing or disabled.
+        """
+        if not config or not config.get("enabled", True):
+            return None
+        options = {k: v for k, v in config.items() if k != "enabled"}
+        return cls(**options, summarizer=summarizer)
+
+    # --- Compaction ---
+
+    def compact(self, messages: List[Dict], system_prompt: Optional[str] = None) -> List[Dict]:
+        started = time.perf_counter()
+        count = self.estimator.count_messages
+        fixed = self.estimator.count_text(system_prompt or "")
+        before = fixed + count(messages)
+        compacted, after = messages, before
+        elided = folded = 0
+
+        if before > self.max_prompt_tokens:
+            split = self._recent_start(messages)
+            old, recent = messages[:split], messages[split:]
+
+            # 1. Cut large tool results of older turns short
+            old, elided = self._elide_tool_results(old)
+            after = fixed + count(old) + count(recent)
+
+            # 2. Fold the oldest whole turns into the rolling summary
+            if after > self.max_prompt_tokens and old:
+                cut = self._fold_point(old, fixed + count(recent))
+                folded = sum(1 for message in messages[:cut] if message.get("role") == "user")
+                summary = self._summary_message(messages[:cut]) if self.summary_enabled and cut else None
+                old = ([summary] if summary else []) + old[cut:]
+                after = fixed + count(old) + count(recent)
+
+            # 3. Still too large: shrink the recent turns' tool results too, but keep the latest turn intact
+            if after > self.max_prompt_tokens:
+                latest = self._recent_start(recent, turns=1)
+                shrunk, more = self._elide_tool_results(recent[:latest])
+                recent = shrunk + recent[latest:]
+                elided += more
+                after = fixed + count(old) + count(recent)
+
+            compacted = old + recent
+
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["compacted"] += compacted is not messages
+            self.stats["tokens_before"] += before
+            self.stats["tokens_after"] += after
+            self.stats["tool_results_elided"] += elided
+            self.stats["turns_folded"] += folded
+            self.stats["seconds"] += time.perf_counter() - started
+        return compacted
+
+    def _recent_start(self, messages: List[Dict], turns: Optional[int] = None) -> int:
+        """
+        Index of the first message of the last `turns` user turns.
+        """
+        turns = self.keep_recent_turns if turns is None else turns
+        seen = 0
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].get("role") == "user":
+                seen += 1
+                if seen >= turns:
+                    return i
+        return 0
+
+    def _fold_point(self, old: List[Dict], reserved: int) -> int:
+        """
+        The smallest turn boundary in `old` after which the rest fits next to
+        `reserved` tokens and a summary; everything before it is folded.
+        """
+        boundaries = [i for i, message in enumerate(old) if message.get("role") == "user" and i] + [len(old)]
+        summary_budget = self.summary_max_tokens if self.summary_enabled else 0
+        remaining = self.estimator.count_messages(old)
+        start = 0
+        for boundary in boundaries:
+            remaining -= self.estimator.count_messages(old[start:boundary])
+            start = boundary
+            if reserved + summary_budget + remaining <= self.max_prompt_tokens:
+                return boundary
+        return len(old)
+
+    def _elide_tool_results(self, messages: List[Dict]) -> Tuple[List[Dict], int]:
+        elided = 0
+        result = []
+        for message in messages:
+            content = message.get("content")
+            if message.get("role") == "tool" and isinstance(content, str):
+                tokens = self.estimator.count_text(content)
+                if tokens > self.max_tool_result_tokens:
+                    keep = int(len(content) * self.max_tool_result_tokens / tokens)
+                    message = {**message, "content": f"{content[:keep]} ...[{tokens - self.max_tool_result_tokens} "
+                                                     f"tokens of tool output elided]"}
+                    elided += 1
+            result.append(message)
+        return result, elided
+
+    # --- Rolling summary ---
+
+    @staticmethod
+    def _prefix_hashes(messages: List[Dict]) -> List[str]:
+        hashes, digest = [], hashlib.sha1()
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+            hashes.append(digest.copy().hexdigest())
+        return hashes
+
+    def _summary_message(self, folded: List[Dict]) -> Dict:
+        hashes = self._prefix_hashes(folded)
+        with self._lock:
+            summary = self._summaries.get(hashes[-1])
+            if summary is not None:
+                self._summaries.move_to_end(hashes[-1])
+                self.stats["summary_cache_hits"] += 1
+            else:
+                # Continue from the longest prefix that was summarized before
+                done, previous = 0, None
+                for i in range(len(hashes) - 2, -1, -1):
+                    if hashes[i] in self._summaries:
+                        done, previous = i + 1, self._summaries[hashes[i]]
+                        break
+
+        if summary is None:
+            summary = self._trim_summary(self.summarizer(previous, folded[done:]))
+            with self._lock:
+                self._summaries[hashes[-1]] = summary
+                while len(self._summaries) > 1024:
+                    self._summaries.popitem(last=False)
+                self.stats["summaries_built"] += 1
+        return {"role": "user", "content": SUMMARY_PREFIX + summary}
+
+    def _trim_summary(self, summary: str) -> str:
+        # Drop the oldest lines until the summary fits its own budget
+        lines = summary.splitlines()
+        while len(lines) > 1 and self.estimator.count_text("\n".join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        calls = stats["calls"]
+        return {
+            **{k: v for k, v in stats.items() if k != "seconds"},
+            "tokenizer": self.estimator.backend,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "tokens_saved": stats["tokens_before"] - stats["tokens_after"],
+            "mean_compaction_ms": round(stats["seconds"] / calls * 1000, 3) if calls else 0.0,
+        }
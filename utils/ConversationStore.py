@@ -0,0 +1,528 @@
+import base64
+import bisect
+import datetime
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Protocol, Tuple
+
+EMPTY_TITLE = "Empty Conversation"
+# Titles are the first message, cut to this many characters when it is stored
+TITLE_LENGTH = 80
+# Orders the conversation listing can be sorted by
+SORT_KEYS = ("start_time", "last_activity")
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _title_of(messages: List[Dict]) -> Optional[str]:
+    if not messages:
+        return None
+    title = messages[0].get("content")
+    if isinstance(title, str) and len(title) > TITLE_LENGTH:
+        return title[:TITLE_LENGTH - 1].rstrip() + "…"
+    return title
+
+
+def encode_cursor(sort: str, key: str, conversation_id: str) -> str:
+    """
+    An opaque cursor pointing just past the given listing entry.
+    """
+    return base64.urlsafe_b64encode(json.dumps([sort, key, conversation_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[str, str]:
+    """
+    The (sort key, ID) a cursor points past; raises ValueError if it is invalid
+    or was made for another sort order.
+    """
+    try:
+        cursor_sort, key, conversation_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor.") from e
+    if cursor_sort != sort:
+        raise ValueError(f"The cursor belongs to a listing sorted by '{cursor_sort}'.")
+    return key, conversation_id
+
+
+def _check_page(sort: str, order: str, limit: int):
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unsupported sort '{sort}', expected one of: {', '.join(SORT_KEYS)}.")
+    if order not in ("asc", "desc"):
+        raise ValueError(f"Unsupported order '{order}', expected 'asc' or 'desc'.")
+    if limit < 1:
+        raise ValueError("limit must be at least 1.")
+
+
+def _page(summaries: List[Dict], sort: str, limit: int) -> Dict:
+    """
+    Builds a listing page from up to `limit + 1` summaries in listing order.
+    """
+    next_cursor = None
+    if len(summaries) > limit:
+        summaries = summaries[:limit]
+        last = summaries[-1]
+        next_cursor = encode_cursor(sort, last[sort], last["id"])
+    return {"conversations": summaries, "next_cursor": next_cursor}
+
+
+class ConversationStore(Protocol):
+    """
+    Storage for chat histories. A conversation is a start time plus an
+    append-only list of messages; backends only ever append to it.
+    """
+
+    def create(self, conversation_id: Optional[str] = None) -> str:
+        """Starts a conversation and returns its ID (a new UUID if none is given)."""
+        ...
+
+    def exists(self, conversation_id: str) -> bool:
+        ...
+
+    def append(self, conversation_id: str, messages: List[Dict]) -> None:
+        """Appends messages to an existing conversation."""
+        ...
+
+    def get_messages(self, conversation_id: str) -> List[Dict]:
+        """The conversation's messages in order ([] for an unknown ID)."""
+        ...
+
+    def get(self, conversation_id: str) -> Optional[Dict]:
+        """`{"start_time": ..., "messages": [...]}` or None for an unknown ID."""
+        ...
+
+    def list_conversations(self) -> List[Dict]:
+        """`{"id", "start_time", "title"}` summaries, oldest first."""
+        ...
+
+    def list_page(self, sort: str = "start_time", order: str = "asc", limit: int = 50,
+                  cursor: Optional[str] = None) -> Dict:
+        """
+        One page of `{"id", "start_time", "last_activity", "title"}` summaries,
+        sorted by `sort` (see SORT_KEYS), as `{"conversations", "next_cursor"}`.
+        `next_cursor` continues the listing and is None on the last page.
+        Raises ValueError for an invalid sort, order or cursor.
+        """
+        ...
+
+    def get_range(self, conversation_id: str, since: int = 0, limit: Optional[int] = None) -> Optional[Dict]:
+        """
+        `{"start_time", "total", "messages"}` with up to `limit` messages from
+        index `since` on, or None for an unknown ID.
+        """
+        ...
+
+    def delete(self, conversation_id: str) -> bool:
+        ...
+
+    def get_stats(self) -> dict:
+        ...
+
+
+class InMemoryConversationStore:
+    """
+    Process-local store bounded by conversation count and idle time.
+
+    Conversations are kept in least-recently-used order, so both limits are
+    enforced by popping from the cold end: when more than `max_conversations`
+    exist, and for conversations idle longer than `idle_ttl_seconds`.
+
+    The listing is served from two sorted `(key, id)` indexes, by start time
+    and by last activity (the last append), kept up to date on every change,
+    so a page is a binary search and a slice rather than a scan.
+    """
+
+    def __init__(self, max_conversations: int = 10000, idle_ttl_seconds: Optional[float] = None):
+        self.max_conversations = max_conversations
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._conversations: "OrderedDict[str, Dict]" = OrderedDict()
+        self._indexes: Dict[str, List[Tuple[str, str]]] = {sort: [] for sort in SORT_KEYS}
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "appended_messages": 0, "evicted_lru": 0, "evicted_idle": 0}
+
+    def _unindex(self, conversation_id: str, conversation: Dict, sorts: Tuple[str, ...] = SORT_KEYS):
+        # Callers hold self._lock
+        for sort in sorts:
+            index = self._indexes[sort]
+            entry = (conversation[sort], conversation_id)
+            position = bisect.bisect_left(index, entry)
+            if position < len(index) and index[position] == entry:
+                del index[position]
+
+    def _evict(self):
+        # Callers hold self._lock
+        if self.idle_ttl_seconds:
+            cutoff = time.monotonic() - self.idle_ttl_seconds
+            while self._conversations:
+                oldest = next(iter(self._conversations.values()))
+                if oldest["last_access"] > cutoff:
+                    break
+                self._unindex(*self._conversations.popitem(last=False))
+                self.stats["evicted_idle"] += 1
+        while len(self._conversations) > self.max_conversations:
+            self._unindex(*self._conversations.popitem(last=False))
+            self.stats["evicted_lru"] += 1
+
+    def _touch(self, conversation_id: str) -> Optional[Dict]:
+        # Callers hold self._lock
+        self._evict()
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None:
+            conversation["last_access"] = time.monotonic()
+            self._conversations.move_to_end(conversation_id)
+        return conversation
+
+    def create(self, conversation_id: Optional[str] = None) -> str:
+        conversation_id = conversation_id or str(uuid.uuid4())
+        now = _now()
+        with self._lock:
+            previous = self._conversations.get(conversation_id)
+            if previous is not None:
+                self._unindex(conversation_id, previous)
+            self._conversations[conversation_id] = {
+                "start_time": now,
+                "last_activity": now,
+                "title": None,
+                "messages": [],
+                "last_access": time.monotonic(),
+            }
+            self._conversations.move_to_end(conversation_id)
+            for sort, index in self._indexes.items():
+                bisect.insort(index, (now, conversation_id))
+            self.stats["created"] += 1
+            self._evict()
+        return conversation_id
+
+    def exists(self, conversation_id: str) -> bool:
+        with self._lock:
+            return self._touch(conversation_id) is not None
+
+    def append(self, conversation_id: str, messages: List[Dict]) -> None:
+        with self._lock:
+            conversation = self._touch(conversation_id)
+            if conversation is None:
+                raise KeyError(f"Conversation '{conversation_id}' not found.")
+            if conversation["title"] is None:
+                conversation["title"] = _title_of(messages)
+            conversation["messages"].extend(messages)
+            self.stats["appended_messages"] += len(messages)
+            # Move the conversation to its new place in the last-activity index
+            self._unindex(conversation_id, conversation, ("last_activity",))
+            conversation["last_activity"] = _now()
+            bisect.insort(self._indexes["last_activity"], (conversation["last_activity"], conversation_id))
+
+    def get_messages(self, conversation_id: str) -> List[Dict]:
+        with self._lock:
+            conversation = self._touch(conversation_id)
+            return list(conversation["messages"]) if conversation else []
+
+    def get(self, conversation_id: str) -> Optional[Dict]:
+        with self._lock:
+            conversation = self._touch(conversation_id)
+            if conversation is None:
+                return None
+            return {"start_time": conversation["start_time"], "messages": list(conversation["messages"])}
+
+    def get_range(self, conversation_id: str, since: int = 0, limit: Optional[int] = None) -> Optional[Dict]:
+        with self._lock:
+            conversation = self._touch(conversation_id)
+            if conversation is None:
+                return None
+            messages = conversation["messages"]
+            end = len(messages) if limit is None else since + limit
+            return {"start_time": conversation["start_time"], "total": len(messages),
+                    "messages": messages[since:end]}
+
+    def list_conversations(self) -> List[Dict]:
+        with self._lock:
+            self._evict()
+            return [{"id": conv_id, "start_time": start_time,
+                     "title": self._conversations[conv_id]["title"] or EMPTY_TITLE}
+                    for start_time, conv_id in self._indexes["start_time"]]
+
+    def list_page(self, sort: str = "start_time", order: str = "asc", limit: int = 50,
+                  cursor: Optional[str] = None) -> Dict:
+        _check_page(sort, order, limit)
+        after = decode_cursor(cursor, sort) if cursor else None
+        with self._lock:
+            self._evict()
+            index = self._indexes[sort]
+            if order == "asc":
+                start = bisect.bisect_right(index, after) if after else 0
+                entries = index[start:start + limit + 1]
+            else:
+                end = bisect.bisect_left(index, after) if after else len(index)
+                entries = index[max(0, end - limit - 1):end][::-1]
+            summaries = []
+            for _, conv_id in entries:
+                details = self._conversations[conv_id]
+                summaries.append({"id": conv_id, "start_time": details["start_time"],
+                                  "last_activity": details["last_activity"],
+                                  "title": details["title"] or EMPTY_TITLE})
+        return _page(summaries, sort, limit)
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            conversation = self._conversations.pop(conversation_id, None)
+            if conversation is None:
+                return False
+            self._unindex(conversation_id, conversation)
+            return True
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "conversations": len(self._conversations), **self.stats}
+
+
+class SQLiteConversationStore:
+    """
+    Persistent store in a single SQLite file. Messages are rows of their own,
+    so appending a message is one INSERT instead of rewriting the history.
+    Several worker processes can share the same file. Listing pages are
+    keyset queries on the start-time and last-activity indexes.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id TEXT PRIMARY KEY,
+            start_time TEXT NOT NULL,
+            title TEXT,
+            last_activity TEXT
+        );
+        CREATE INDEX IF NOT EXISTS conversations_by_start_time ON conversations (start_time);
+        CREATE TABLE IF NOT EXISTS messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL,
+            body TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, seq);
+    """
+
+    def __init__(self, path: str = "data/conversations.db"):
+        self.path = str(path)
+        if self.path != ":memory:":
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            # WAL lets readers in other processes proceed while one process appends
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(conversations)")}
+            if "last_activity" not in columns:
+                # A file from before the last-activity column
+                self._conn.execute("ALTER TABLE conversations ADD COLUMN last_activity TEXT")
+                self._conn.execute("UPDATE conversations SET last_activity = start_time")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS conversations_by_last_activity "
+                               "ON conversations (last_activity, id)")
+
+    def create(self, conversation_id: Optional[str] = None) -> str:
+        conversation_id = conversation_id or str(uuid.uuid4())
+        now = _now()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO conversations (id, start_time, last_activity) VALUES (?, ?, ?)",
+                               (conversation_id, now, now))
+        return conversation_id
+
+    def exists(self, conversation_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        return row is not None
+
+    def append(self, conversation_id: str, messages: List[Dict]) -> None:
+        if not messages:
+            return
+        rows = [(conversation_id, json.dumps(message, ensure_ascii=False)) for message in messages]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                updated = self._conn.execute(
+                    "UPDATE conversations SET title = COALESCE(title, ?), last_activity = ? WHERE id = ?",
+                    (_title_of(messages), _now(), conversation_id),
+                ).rowcount
+                if not updated:
+                    raise KeyError(f"Conversation '{conversation_id}' not found.")
+                self._conn.executemany("INSERT INTO messages (conversation_id, body) VALUES (?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_messages(self, conversation_id: str) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT body FROM messages WHERE conversation_id = ? ORDER BY seq",
+                                      (conversation_id,)).fetchall()
+        return [json.loads(body) for (body,) in rows]
+
+    def get(self, conversation_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT start_time FROM conversations WHERE id = ?",
+                                     (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        return {"start_time": row[0], "messages": self.get_messages(conversation_id)}
+
+    def get_range(self, conversation_id: str, since: int = 0, limit: Optional[int] = None) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT start_time FROM conversations WHERE id = ?",
+                                     (conversation_id,)).fetchone()
+            if row is None:
+                return None
+            total = self._conn.execute("SELECT COUNT(*) FROM messages WHERE conversation_id = ?",
+                                       (conversation_id,)).fetchone()[0]
+            rows = self._conn.execute(
+                "SELECT body FROM messages WHERE conversation_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+                (conversation_id, -1 if limit is None else limit, since),
+            ).fetchall()
+        return {"start_time": row[0], "total": total, "messages": [json.loads(body) for (body,) in rows]}
+
+    def list_conversations(self) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, start_time, title FROM conversations ORDER BY start_time").fetchall()
+        return [{"id": conv_id, "start_time": start_time, "title": title or EMPTY_TITLE}
+                for conv_id, start_time, title in rows]
+
+    def list_page(self, sort: str = "start_time", order: str = "asc", limit: int = 50,
+                  cursor: Optional[str] = None) -> Dict:
+        _check_page(sort, order, limit)
+        direction, comparison = ("ASC", ">") if order == "asc" else ("DESC", "<")
+        # `sort` is one of SORT_KEYS, so it is safe to put into the statement
+        query = "SELECT id, start_time, last_activity, title FROM conversations"
+        params: list = []
+        if cursor:
+            query += f" WHERE ({sort}, id) {comparison} (?, ?)"
+            params.extend(decode_cursor(cursor, sort))
+        query += f" ORDER BY {sort} {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return _page([{"id": conv_id, "start_time": start_time, "last_activity": last_activity or start_time,
+                       "title": title or EMPTY_TITLE}
+                      for conv_id, start_time, last_activity, title in rows], sort, limit)
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            return self._conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount > 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            conversations = self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+            messages = self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "conversations": conversations, "messages": messages}
+
+
+class MongoConversationStore:
+    """
+    Store backed by a MongoDB collection, one document per conversation.
+    Messages are appended with `$push`, never by rewriting the document.
+    Pass `mock=True` to run against mongomock instead of a mongod.
+    """
+
+    def __init__(self, uri: str = "mongodb://localhost:27017", database: str = "coordinate_server",
+                 collection: str = "conversations", mock: bool = False, client=None):
+        if client is None:
+            if mock:
+                import mongomock
+                client = mongomock.MongoClient()
+            else:
+                import pymongo
+                client = pymongo.MongoClient(uri)
+        self.collection = client[database][collection]
+        self.collection.create_index("start_time")
+        self.collection.create_index([("last_activity", 1), ("_id", 1)])
+
+    def create(self, conversation_id: Optional[str] = None) -> str:
+        conversation_id = conversation_id or str(uuid.uuid4())
+        now = _now()
+        self.collection.replace_one(
+            {"_id": conversation_id},
+            {"_id": conversation_id, "start_time": now, "last_activity": now, "title": None, "messages": []},
+            upsert=True,
+        )
+        return conversation_id
+
+    def exists(self, conversation_id: str) -> bool:
+        return self.collection.count_documents({"_id": conversation_id}, limit=1) > 0
+
+    def append(self, conversation_id: str, messages: List[Dict]) -> None:
+        if not messages:
+            return
+        result = self.collection.update_one({"_id": conversation_id},
+                                            {"$push": {"messages": {"$each": list(messages)}},
+                                             "$set": {"last_activity": _now()}})
+        if not result.matched_count:
+            raise KeyError(f"Conversation '{conversation_id}' not found.")
+        # Only the first append of a conversation sets its title
+        self.collection.update_one({"_id": conversation_id, "title": None},
+                                   {"$set": {"title": _title_of(messages)}})
+
+    def get_messages(self, conversation_id: str) -> List[Dict]:
+        document = self.collection.find_one({"_id": conversation_id}, {"messages": 1})
+        return document["messages"] if document else []
+
+    def get(self, conversation_id: str) -> Optional[Dict]:
+        document = self.collection.find_one({"_id": conversation_id}, {"start_time": 1, "messages": 1})
+        if document is None:
+            return None
+        return {"start_time": document["start_time"], "messages": document["messages"]}
+
+    def get_range(self, conversation_id: str, since: int = 0, limit: Optional[int] = None) -> Optional[Dict]:
+        totals = list(self.collection.aggregate([{"$match": {"_id": conversation_id}},
+                                                 {"$project": {"total": {"$size": "$messages"}}}]))
+        if not totals:
+            return None
+        document = self.collection.find_one(
+            {"_id": conversation_id},
+            {"start_time": 1, "messages": {"$slice": [since, 2 ** 31 - 1 if limit is None else limit]}},
+        )
+        return {"start_time": document["start_time"], "total": totals[0]["total"], "messages": document["messages"]}
+
+    def list_conversations(self) -> List[Dict]:
+        cursor = self.collection.find({}, {"start_time": 1, "title": 1}).sort("start_time", 1)
+        return [{"id": doc["_id"], "start_time": doc["start_time"], "title": doc.get("title") or EMPTY_TITLE}
+                for doc in cursor]
+
+    def list_page(self, sort: str = "start_time", order: str = "asc", limit: int = 50,
+                  cursor: Optional[str] = None) -> Dict:
+        _check_page(sort, order, limit)
+        direction, comparison = (1, "$gt") if order == "asc" else (-1, "$lt")
+        query = {}
+        if cursor:
+            key, conversation_id = decode_cursor(cursor, sort)
+            query = {"$or": [{sort: {comparison: key}}, {sort: key, "_id": {comparison: conversation_id}}]}
+        documents = (self.collection.find(query, {"start_time": 1, "last_activity": 1, "title": 1})
+                     .sort([(sort, direction), ("_id", direction)]).limit(limit + 1))
+        return _page([{"id": doc["_id"], "start_time": doc["start_time"],
+                       "last_activity": doc.get("last_activity") or doc["start_time"],
+                       "title": doc.get("title") or EMPTY_TITLE} for doc in documents], sort, limit)
+
+    def delete(self, conversation_id: str) -> bool:
+        return self.collection.delete_one({"_id": conversation_id}).deleted_count > 0
+
+    def get_stats(self) -> dict:
+        return {"backend": "mongodb", "conversations": self.collection.estimated_document_count()}
+
+
+def create_conversation_store(config: Optional[Dict] = None) -> ConversationStore:
+    """
+    Builds the store selected by the "conversation_store" section of configure.json.
+    Defaults to the in-memory store.
+    """
+    config = config or {}
+    backend = config.get("backend", "memory")
+    options = config.get(backend, {})
+    if backend == "memory":
+        return InMemoryConversationStore(**options)
+    if backend == "sqlite":
+        return SQLiteConversationStore(**options)
+    if backend == "mongodb":
+        return MongoConversationStore(**options)
+    raise ValueError(f"Unsupported conversation store backend: '{backend}'")
@@ -0,0 +1,171 @@
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# What each source polls, and the read tool it answers
+SOURCES = {
+    "drones": ("api/drones", "get_drone_status"),
+    "panels": ("api/panels", "find_panels"),
+}
+
+# Tool argument -> row field it filters on, most selective first
+FILTERS = {
+    "get_drone_status": [("drone_id", "drone_id"), ("destination_cluster_id", "destination")],
+    "find_panels": [("panel_id", "panel_id"), ("cluster_id", "cluster_id"), ("status", "status")],
+}
+
+# Sources a successful write makes stale, as in ToolResultCache.invalidate_after_write
+WRITES = {
+    "dispatch_drone_to_cluster": ("drones", "panels"),
+    "dispatch_rover_to_panel": ("panels",),
+}
+
+# Oldest snapshot (in seconds) a tool may be answered from; older ones fall back to a live call
+DEFAULT_MAX_STALENESS = {"get_drone_status": 5.0, "find_panels": 30.0}
+
+
+class _Snapshot(NamedTuple):
+    rows: List[Dict[str, Any]]
+    # field -> str(value) -> rows with that value, in the order the Go server returned them
+    indexes: Dict[str, Dict[str, List[Dict[str, Any]]]]
+    fetched_at: float
+
+
+def _index(rows: List[Dict[str, Any]], fields: List[str]) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    indexes: Dict[str, Dict[str, List[Dict[str, Any]]]] = {field: {} for field in fields}
+    for row in rows:
+        for field in fields:
+            if field in row:
+                indexes[field].setdefault(str(row[field]), []).append(row)
+    return indexes
+
+
+class FleetState:
+    """
+    An in-memory snapshot of the drones and panels, refreshed by a background
+    thread that polls the Go server, so `get_drone_status` and `find_panels`
+    can be answered without a request on the chat turn's critical path.
+
+    * Every source is indexed by the fields the tools filter on (drone ID,
+      destination, cluster, panel, status); a query starts from the smallest
+      matching index and filters it exactly as the Go server does.
+    * A tool is only answered while its source is younger than the tool's
+      `max_staleness`; `answer` returns None otherwise and the caller makes
+      the live call. A write marks the sources it affects stale and wakes the
+      poller.
+    * `update` replaces a source from outside, e.g. from a push feed.
+    """
+
+    def __init__(self, client, poll_interval: float = 2.0, max_staleness: Optional[Dict[str, float]] = None,
+                 sources: Optional[List[str]] = None):
+        self.client = client
+        self.poll_interval = poll_interval
+        self.max_staleness = {**DEFAULT_MAX_STALENESS, **(max_staleness or {})}
+        self.sources = [source for source in (sources or list(SOURCES)) if source in SOURCES]
+        self._snapshots: Dict[str, _Snapshot] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._poller: Optional[threading.Thread] = None
+        self.stats = {"refreshes": 0, "refresh_errors": 0}
+        self.tool_stats = {SOURCES[source][1]: {"answered": 0, "stale": 0} for source in self.sources}
+
+    # --- Polling ---
+
+    def start(self):
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._poll, name="fleet-state-poller", daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _poll(self):
+        while not self._stopped.is_set():
+            self.refresh()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def refresh(self):
+        """
+        Fetches every source once. A failed fetch keeps the previous snapshot,
+        which ages out by itself; a fetch that overlapped a write is dropped.
+        """
+        for source in self.sources:
+            generation = self._generation
+            result = self.client.request("GET", SOURCES[source][0])
+            if isinstance(result, list):
+                self.update(source, result, generation)
+            else:
+                with self._lock:
+                    self.stats["refresh_errors"] += 1
+
+    def update(self, source: str, rows: List[Dict[str, Any]], generation: Optional[int] = None):
+        fields = [field for _, field in FILTERS[SOURCES[source][1]]]
+        snapshot = _Snapshot(rows, _index(rows, fields), time.monotonic())
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._snapshots[source] = snapshot
+            self.stats["refreshes"] += 1
+
+    def mark_stale(self, *sources: str):
+        """
+        Stops answering from the given sources until they are fetched again, and
+        wakes the poller to do so.
+        """
+        with self._lock:
+            self._generation += 1
+            for source in sources:
+                self._snapshots.pop(source, None)
+        self._wake.set()
+
+    def invalidate_after_write(self, tool_name: str):
+        sources = [source for source in WRITES.get(tool_name, ()) if source in self.sources]
+        if sources:
+            self.mark_stale(*sources)
+
+    # --- Queries ---
+
+    def answer(self, tool_name: str, arguments: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """
+        The tool's result from the snapshot, or None if the tool is not served
+        from it or its source is too old.
+        """
+        source = self._source_for(tool_name)
+        if source is None:
+            return None
+        with self._lock:
+            snapshot = self._snapshots.get(source)
+            fresh = snapshot is not None and time.monotonic() - snapshot.fetched_at <= self.max_staleness[tool_name]
+            self.tool_stats[tool_name]["answered" if fresh else "stale"] += 1
+        if not fresh:
+            return None
+
+        filters: List[Tuple[str, str]] = []
+        for argument, field in FILTERS[tool_name]:
+            value = arguments.get(argument)
+            if value is not None:
+                filters.append((field, str(value)))
+        if not filters:
+            return list(snapshot.rows)
+        rows = min((snapshot.indexes[field].get(value, []) for field, value in filters), key=len)
+        return [row for row in rows if all(field in row and str(row[field]) == value for field, value in filters)]
+
+    def _source_for(self, tool_name: str) -> Optional[str]:
+        for source in self.sources:
+            if SOURCES[source][1] == tool_name:
+                return source
+        return None
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                **self.stats,
+                "sources": {source: {"rows": len(snapshot.rows), "age_s": round(now - snapshot.fetched_at, 2)}
+                            for source, snapshot in self._snapshots.items()},
+                "tools": {tool: dict(counts) for tool, counts in self.tool_stats.items()},
+            }
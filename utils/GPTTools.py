@@ -1,77 +1,653 @@
 
 import re
 import json
+import logging
+import time
+import hashlib
+import threading
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
 
 
 class PromptBuilder:
     """
     This class is used to build the system prompt for the GPT model.
     It will load the tools in the json file.
+
+    The built prompt is cached and only rebuilt when tools.json changes (its
+    mtime/size is checked at most every `reload_check_interval` seconds, and its
+    content hash decides whether the prompt really changed). Returning the
+    identical string for every request keeps the prompt prefix byte-identical,
+    so the model server's KV/prefix cache can reuse it.
+
+    `tool_rendering` is "pretty" (indented JSON) or "compact" (one minified JSON
+    object per tool). `tool_descriptions` is True (all descriptions), "tools"
+    (only the tool-level descriptions) or False (none).
     """
 
-    def __init__(self, base_prompt_template: str):
+    def __init__(self, base_prompt_template: str, tools_config_path=None, tool_rendering: str = "pretty",
+                 tool_descriptions=True, reload_check_interval: float = 1.0):
         self.base_prompt_template = base_prompt_template
-        self.tools_config_path = Path(
+        self.tools_config_path = Path(tools_config_path) if tools_config_path else Path(
             __file__).parent.parent / "config" / "tools.json"
+        if tool_rendering not in ("pretty", "compact"):
+            raise ValueError(f"Unsupported tool rendering: {tool_rendering}")
+        self.tool_rendering = tool_rendering
+        self.tool_descriptions = tool_descriptions
+        self.reload_check_interval = reload_check_interval
+
+        self._lock = threading.Lock()
+        self._file_signature = None
+        self._content_hash = None
+        self._prompt: Optional[str] = None
+        self._tools: List[Dict[str, Any]] = []
+        self._checked_at = 0.0
+        self.stats = {"builds": 0, "cache_hits": 0, "reloads": 0}
 
     def _load_tools(self) -> List[Dict[str, Any]]:
         """
         Loads tool definitions from the config/tools.json file.
         """
         if not self.tools_config_path.exists():
-            print(
-                f"Warning: tools.json not found at {self.tools_config_path}. Returning empty tools list.")
+            logger.warning("tools.json not found at %s. Returning empty tools list.", self.tools_config_path)
             return []
 
         with open(self.tools_config_path, "r", encoding="utf-8") as f:
             return json.load(f)
 
+    def _signature(self):
+        try:
+            stat = self.tools_config_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def render_tools(self, tools: List[Dict[str, Any]]) -> str:
+        """
+        Formats the tool definitions for the prompt in the configured mode.
+        The "result" shaping entries are server settings and are left out.
+        """
+        tools = [{k: v for k, v in tool.items() if k != "result"} for tool in tools]
+        if self.tool_descriptions is not True:
+            tools = [self._strip_descriptions(tool) for tool in tools]
+        if self.tool_rendering == "compact":
+            return "\n".join(json.dumps(tool, separators=(",", ":"), ensure_ascii=False) for tool in tools)
+        # Format the tools into a pretty-printed JSON string for the prompt
+        return json.dumps(tools, indent=2)
+
+    def _strip_descriptions(self, tool: Dict[str, Any]) -> Dict[str, Any]:
+        def strip(value):
+            if isinstance(value, dict):
+                return {k: strip(v) for k, v in value.items() if k != "description"}
+            if isinstance(value, list):
+                return [strip(v) for v in value]
+            return value
+
+        stripped = {k: strip(v) if k != "description" else v for k, v in tool.items()}
+        if not self.tool_descriptions:
+            stripped.pop("description", None)
+        return stripped
+
     def build_system_prompt(self) -> str:
         """
         Builds the complete system prompt by injecting tool definitions.
+        Returns the cached prompt while tools.json is unchanged.
         """
-        tools = self._load_tools()
+        now = time.monotonic()
+        with self._lock:
+            if self._prompt is not None and now - self._checked_at < self.reload_check_interval:
+                self.stats["cache_hits"] += 1
+                return self._prompt
+            self._checked_at = now
 
-        # Format the tools into a pretty-printed JSON string for the prompt
-        tool_definitions_json_str = json.dumps(tools, indent=2)
+            signature = self._signature()
+            if self._prompt is not None and signature == self._file_signature:
+                self.stats["cache_hits"] += 1
+                return self._prompt
+
+            raw = self.tools_config_path.read_bytes() if signature else b""
+            content_hash = hashlib.sha256(raw).hexdigest()
+            self._file_signature = signature
+            if self._prompt is not None and content_hash == self._content_hash:
+                # Touched but not changed: keep the identical prompt string
+                self.stats["cache_hits"] += 1
+                return self._prompt
+
+            try:
+                tools = json.loads(raw) if signature else self._load_tools()
+            except ValueError as e:
+                if self._prompt is None:
+                    raise
+                # Probably caught mid-write; keep serving the previous prompt and retry later
+                logger.warning("Could not reload %s: %s", self.tools_config_path.name, e)
+                self._file_signature = None
+                return self._prompt
+            if self._prompt is not None:
+                self.stats["reloads"] += 1
+                logger.info("%s changed, rebuilding the system prompt", self.tools_config_path.name)
+
+            # Inject the formatted tool definitions into the base prompt template
+            self._prompt = self.base_prompt_template.format(tool_definitions=self.render_tools(tools))
+            self._tools = tools
+            self._content_hash = content_hash
+            self.stats["builds"] += 1
+            return self._prompt
+
+    def get_tools(self) -> List[Dict[str, Any]]:
+        """
+        The tool definitions of the current prompt, as loaded from tools.json;
+        the same list object until the file changes.
+        """
+        self.build_system_prompt()
+        return self._tools
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "tool_rendering": self.tool_rendering,
+                    "prompt_chars": len(self._prompt) if self._prompt else 0}
+
+
+class ToolCallParseError(ValueError):
+    """
+    A tool call whose arguments are not a JSON object, even after repair.
+    """
+
+    def __init__(self, tool_name: str, arguments: str, reason: str):
+        super().__init__(f"Error parsing tool usage response: arguments of '{tool_name}' are not valid JSON ({reason})")
+        self.tool_name = tool_name
+        self.arguments = arguments
+
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_UNQUOTED_KEY = re.compile(r"([{,]\s*)([A-Za-z_]\w*)\s*:")
+_PYTHON_LITERALS = re.compile(r"\b(True|False|None)\b")
+_JSON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _close_truncated(text: str) -> List[str]:
+    """
+    Ways to end a truncated JSON value: closing the open string and brackets
+    as they are, or cutting back to the last complete member first (for a
+    value cut off after a key or inside a number).
+    """
+    stack, in_string, escaped = [], False, False
+    cut, cut_stack = None, None
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+        elif char == ",":
+            cut, cut_stack = i, list(stack)
+    if escaped:
+        text = text[:-1]
+    candidates = [text + ('"' if in_string else "") + "".join(reversed(stack))]
+    if cut is not None:
+        candidates.append(text[:cut] + "".join(reversed(cut_stack)))
+    return candidates
+
+
+def repair_json_arguments(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Tries to fix the usual ways a model garbles tool arguments: code fences,
+    Python literals, single quotes, unquoted keys, trailing commas and a
+    truncated end. Returns the arguments, or None if they are beyond repair.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").strip()
+        if text.startswith("json"):
+            text = text[len("json"):]
+    fixes = [
+        lambda t: t,
+        lambda t: _PYTHON_LITERALS.sub(lambda m: _JSON_LITERALS[m.group(1)], t),
+        lambda t: t.replace("'", '"') if '"' not in t else t,
+        lambda t: _UNQUOTED_KEY.sub(r'\1"\2":', t),
+        lambda t: _TRAILING_COMMA.sub(r"\1", t),
+    ]
+    # Each fix is applied on top of the previous ones; closing a truncated value comes last
+    for fix in fixes:
+        text = fix(text)
+        value = _loads_object(text)
+        if value is not None:
+            return value
+    for candidate in _close_truncated(text):
+        value = _loads_object(_TRAILING_COMMA.sub(r"\1", candidate))
+        if value is not None:
+            return value
+    return None
+
+
+def _loads_object(text: str) -> Optional[Dict[str, Any]]:
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def decode_tool_arguments(tool_name: str, arguments: str) -> tuple:
+    """
+    Decodes the JSON arguments of a tool call, repairing them if needed.
+    Returns `(parameters, repaired)`; raises ToolCallParseError if they cannot be decoded.
+    """
+    try:
+        value = json.loads(arguments)
+        if isinstance(value, dict):
+            return value, False
+        reason = f"expected an object, got {type(value).__name__}"
+    except ValueError as e:
+        reason = str(e)
+    repaired = repair_json_arguments(arguments)
+    if repaired is None:
+        raise ToolCallParseError(tool_name, arguments, reason)
+    return repaired, True
+
+
+def render_tool_call(tool_name: str, arguments: str) -> str:
+    """
+    Writes a tool call in the harmony form the model would have emitted as text.
+    """
+    return f"<|channel|>commentary to=functions.{tool_name} <|constrain|>json<|message|>{arguments}<|call|>"
+
+
+class ModelReply(str):
+    """
+    A completion that came back with native (structured) tool calls. The text
+    is the calls rendered in the harmony form, so history, caches and the
+    stream filter treat it like any other completion; `tool_calls` spares the
+    parser from scanning it.
+    """
+
+    def __new__(cls, text: str, tool_calls: List[Dict[str, Any]]):
+        reply = super().__new__(cls, text)
+        reply.tool_calls = tool_calls
+        return reply
+
+    @classmethod
+    def from_native_calls(cls, calls: List[tuple]) -> str:
+        """
+        Builds the reply from `(tool_name, arguments)` pairs, where the arguments
+        are a JSON string (OpenAI) or an already decoded object (Gemini). If any
+        arguments cannot be decoded, the plain text is returned instead, so that
+        parsing it reports the malformed call.
+        """
+        tool_calls, rendered = [], []
+        for tool_name, arguments in calls:
+            if isinstance(arguments, dict):
+                parameters = arguments
+            else:
+                try:
+                    parameters, _ = decode_tool_arguments(tool_name, arguments or "{}")
+                except ToolCallParseError:
+                    parameters = None
+            if parameters is None:
+                rendered.append(render_tool_call(tool_name, arguments))
+            else:
+                rendered.append(render_tool_call(tool_name, json.dumps(parameters, ensure_ascii=False)))
+            tool_calls.append({"tool_name": tool_name, "parameters": parameters})
+        text = "".join(rendered)
+        if any(call["parameters"] is None for call in tool_calls):
+            return text
+        return cls(text, tool_calls)
+
+
+class ToolCallScanner:
+    """
+    Incremental scanner for tool calls in the harmony text format:
+    a 'to=tool_name' (or 'to=functions.tool_name') header, then '<|message|>'
+    and a JSON object. Text can be fed in pieces as it streams; every call is
+    returned as soon as its JSON object closes.
+
+    Scanning is linear in the length of the text: markers are found with
+    `str.find`, a complete JSON object is decoded in one pass (otherwise it is
+    delimited by counting brackets outside strings), and only a few characters
+    are carried over between pieces, so long or adversarial outputs cannot
+    make it backtrack.
+    """
+
+    HEADER = "to="
+    NAME_PATTERN = re.compile(r"(?:functions\.)?(\w+)")
+    _NAME_RUN = re.compile(r"[\w.]*")
+    # A longer run of name characters is not waited for across pieces
+    MAX_NAME_LENGTH = 256
+    MESSAGE_MARKER = "<|message|>"
+    END_MARKER = "<|"
+    _STRUCTURE = re.compile(r'[{}\[\]"]')
+    _STRING_END = re.compile(r'["\\]')
+    _DECODER = json.JSONDecoder()
+
+    SEEK_HEADER, SEEK_MESSAGE, SEEK_VALUE, IN_OBJECT, IN_RAW = range(5)
+
+    def __init__(self):
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.repaired = 0
+        self._state = self.SEEK_HEADER
+        self._pending = ""
+        self._name = None
+        self._parts: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Scans the next piece of text; returns the tool calls completed in it.
+        """
+        return self._scan(self._pending + text, final=False)
 
-        # Inject the formatted tool definitions into the base prompt template
-        return self.base_prompt_template.format(tool_definitions=tool_definitions_json_str)
+    def finish(self) -> List[Dict[str, Any]]:
+        """
+        Ends the text; a call whose JSON was cut off is repaired if possible.
+        """
+        completed = self._scan(self._pending, final=True)
+        if self._state in (self.IN_OBJECT, self.IN_RAW):
+            completed.append(self._complete("".join(self._parts)))
+        self._state = self.SEEK_HEADER
+        return completed
+
+    def _complete(self, arguments: str, decoded=None) -> Dict[str, Any]:
+        if isinstance(decoded, dict):
+            parameters = decoded
+        else:
+            parameters, repaired = decode_tool_arguments(self._name, arguments.strip())
+            self.repaired += repaired
+        call = {"tool_name": self._name, "parameters": parameters}
+        self.tool_calls.append(call)
+        self._parts, self._state = [], self.SEEK_HEADER
+        return call
+
+    def _scan(self, text: str, final: bool) -> List[Dict[str, Any]]:
+        self._pending = ""
+        completed, position = [], 0
+        while position < len(text):
+            if self._state == self.SEEK_HEADER:
+                found = text.find(self.HEADER, position)
+                if found == -1:
+                    # Keep a possible partial 'to' for the next piece
+                    self._pending = "" if final else text[max(position, len(text) - len(self.HEADER) + 1):]
+                    return completed
+                match = self.NAME_PATTERN.match(text, found + len(self.HEADER))
+                name_end = self._NAME_RUN.match(text, found + len(self.HEADER)).end()
+                if not final and name_end == len(text) and name_end - found <= self.MAX_NAME_LENGTH:
+                    # The name may continue in the next piece
+                    self._pending = text[found:]
+                    return completed
+                if not match:
+                    position = found + len(self.HEADER)
+                    continue
+                self._name = match.group(1).strip()
+                self._state, position = self.SEEK_MESSAGE, match.end()
+
+            elif self._state == self.SEEK_MESSAGE:
+                found = text.find(self.MESSAGE_MARKER, position)
+                if found == -1:
+                    self._pending = "" if final else text[max(position, len(text) - len(self.MESSAGE_MARKER) + 1):]
+                    return completed
+                self._state, position = self.SEEK_VALUE, found + len(self.MESSAGE_MARKER)
+
+            elif self._state == self.SEEK_VALUE:
+                while position < len(text) and text[position].isspace():
+                    position += 1
+                if position == len(text):
+                    return completed
+                if text[position] in "{[":
+                    self._state, self._depth, self._in_string, self._escaped = self.IN_OBJECT, 0, False, False
+                else:
+                    self._state = self.IN_RAW
+
+            elif self._state == self.IN_OBJECT:
+                if not self._parts:
+                    # Fast path: the whole object is already here and is valid JSON
+                    try:
+                        value, end = self._DECODER.raw_decode(text, position)
+                    except ValueError:
+                        pass
+                    else:
+                        completed.append(self._complete(text[position:end], value))
+                        position = end
+                        continue
+                end = self._scan_object(text, position)
+                if end is None:
+                    self._parts.append(text[position:])
+                    return completed
+                self._parts.append(text[position:end])
+                completed.append(self._complete("".join(self._parts)))
+                position = end
+
+            else:  # IN_RAW: not JSON; take everything up to the next harmony token
+                found = text.find(self.END_MARKER, position)
+                if found == -1:
+                    keep = 0 if final else len(self.END_MARKER) - 1
+                    self._parts.append(text[position:len(text) - keep])
+                    self._pending = text[len(text) - keep:]
+                    return completed
+                self._parts.append(text[position:found])
+                completed.append(self._complete("".join(self._parts)))
+                position = found
+        return completed
+
+    def _scan_object(self, text: str, position: int) -> Optional[int]:
+        """
+        Advances the bracket count over `text`; returns the index just past the
+        closing bracket, or None if the object continues in the next piece.
+        """
+        while True:
+            if self._in_string:
+                if self._escaped:
+                    if position >= len(text):
+                        return None
+                    self._escaped = False
+                    position += 1
+                match = self._STRING_END.search(text, position)
+                if not match:
+                    return None
+                position = match.end()
+                if match.group() == "\\":
+                    self._escaped = True
+                else:
+                    self._in_string = False
+                continue
+            match = self._STRUCTURE.search(text, position)
+            if not match:
+                return None
+            position = match.end()
+            char = match.group()
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return position
 
 
 class GPTParsingUtils:
     """
     This class is used to parse the response from the GPT model.
     For example, if the response is a JSON object, it will be parsed into a Python dictionary.
+
+    Replies with native tool calls (`ModelReply`) carry them already; text
+    replies are scanned with `ToolCallScanner`, and malformed JSON arguments
+    are repaired where possible or reported with `ToolCallParseError`.
     """
 
+    TOOL_NAME_PATTERN = re.compile(r"to=(?:functions\.)?(\w+)")
+    MESSAGE_MARKER = "<|message|>"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {"native": 0, "scanned": 0, "tool_calls": 0, "repaired": 0, "errors": 0}
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
     def tool_usage_parsing(self, response) -> dict:
         """
         Parse the tool usage response from the GPT model.
-        This regex is designed to handle both 'to=tool_name' and 'to=functions.tool_name' formats.
+        Handles both 'to=tool_name' and 'to=functions.tool_name' headers.
         Returns a dictionary with 'tool_name' and 'parameters' if a tool call is found,
         None if no tool call pattern is matched.
+        If the response contains several tool calls, only the first one is returned;
+        use `tool_calls_parsing` to get all of them.
         """
+        tool_calls = self.tool_calls_parsing(response)
+        return tool_calls[0] if tool_calls else None
 
-        # This single regex handles both cases:
-        # 1. to=functions.find_panels -> will capture 'find_panels'
-        # 2. to=find_panels -> will capture 'find_panels'
-        # The (?:functions\.)? is a non-capturing group that makes "functions." optional.
-        match = re.search(r"to=(?:functions\.)?(\w+).*<\|message\|>(.*)", response, re.DOTALL)
-        if match:
-            try:
-                tool_name = match.group(1).strip()
-                json_string = match.group(2).strip()
-                parameters = json.loads(json_string)
-
-                return {
-                    "tool_name": tool_name,
-                    "parameters": parameters
-                }
-            except Exception as e:
-                raise Exception(f"Error parsing tool usage response: {e}")
-
-        else:  # If no tool call pattern is matched, return None
-            return None
+    def tool_calls_parsing(self, response) -> List[Dict[str, Any]]:
+        """
+        Parse every tool call in the response, in the order they appear.
+        Each call is a 'to=tool_name' header followed by '<|message|>' and a JSON
+        object; trailing tokens such as '<|call|>' or a following call do not
+        break parsing.
+        Returns a list of dictionaries with 'tool_name' and 'parameters'
+        (empty if no tool call pattern is matched). Raises ToolCallParseError if
+        the arguments of a call are malformed beyond repair.
+        """
+        if isinstance(response, ModelReply):
+            self._count(native=1, tool_calls=len(response.tool_calls))
+            return [dict(call) for call in response.tool_calls]
+
+        scanner = ToolCallScanner()
+        try:
+            scanner.feed(response)
+            scanner.finish()
+        except ToolCallParseError:
+            self._count(scanned=1, errors=1)
+            raise
+        self._count(scanned=1, tool_calls=len(scanner.tool_calls), repaired=scanner.repaired)
+        return scanner.tool_calls
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+class ToolCallStreamFilter:
+    """
+    Decides, while a completion is still streaming, whether the output is a
+    `to=...<|message|>` tool call, so that tool-call text is never shown to the user.
+
+    `feed` returns the part of each delta that is safe to display (possibly empty),
+    and `finish` returns whatever was held back once the stream has ended.
+    The full raw text is always available in `text` for `tool_usage_parsing`.
+    Each delta is searched only together with the few characters before it, so
+    filtering a long output stays linear. Text that is already being shown is
+    still searched: a tool call after some prose stops the output there, and a
+    control token (`<|...`) switches back to waiting for a final channel.
+    """
+
+    TOOL_CALL_MARKER = re.compile(r"to=(?:functions\.)?\w")
+    FINAL_CHANNEL_MARKER = "<|channel|>final<|message|>"
+    CONTROL_TOKEN = "<|"
+    # Endings that may still grow into a tool-call marker or a control token
+    _PARTIAL_MARKERS = ("to=", "to", "t", "<")
+    # Enough characters before a delta to find a marker split across deltas
+    _OVERLAP = len(FINAL_CHANNEL_MARKER)
+
+    def __init__(self, lookahead: int = 24):
+        # Plain-text output is held back until this many characters have been
+        # seen without a tool-call marker; after that it is passed through,
+        # except for a trailing part that could start a marker.
+        self.lookahead = lookahead
+        self.is_tool_call = False
+        self._chunks: List[str] = []
+        self._length = 0
+        self._tail = ""
+        self._harmony: Optional[bool] = None
+        self._released = 0
+        self._passthrough = False
+
+    @property
+    def text(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def _release(self, end_text: Optional[str] = None, hold: bool = True) -> str:
+        """
+        Releases the text not shown yet. `end_text` is the end of the output,
+        at least everything not released yet (the whole text by default).
+        With `hold`, an ending that could start a marker stays held back.
+        """
+        if end_text is None:
+            end_text = self.text
+        held = next((len(partial) for partial in self._PARTIAL_MARKERS if end_text.endswith(partial)), 0) \
+            if hold else 0
+        end = self._length - held
+        if end <= self._released:
+            return ""
+        offset = len(end_text) - self._length
+        visible = end_text[offset + self._released:offset + end]
+        self._released = end
+        return visible
+
+    def feed(self, delta: str) -> str:
+        self._chunks.append(delta)
+        self._length += len(delta)
+        if self.is_tool_call:
+            return ""
+
+        window = self._tail + delta
+        self._tail = window[-self._OVERLAP:]
+        if self.TOOL_CALL_MARKER.search(window):
+            self.is_tool_call = True
+            return ""
+        # Where the text not released yet starts in the window
+        unreleased_at = max(0, len(window) - (self._length - self._released))
+
+        visible = ""
+        if self._passthrough:
+            control_at = window.find(self.CONTROL_TOKEN, unreleased_at)
+            if control_at == -1:
+                return self._release(window)
+            # Harmony control tokens after displayed text: show the text before
+            # them and hold the rest back until a final channel starts
+            visible = window[unreleased_at:control_at]
+            self._released = self._length - len(window) + control_at
+            unreleased_at = control_at
+            self._passthrough = False
+            self._harmony = True
+
+        if self._harmony is None:
+            # Decided by the first non-blank characters; until then the text is tiny
+            start = self.text.lstrip()
+            if len(start) >= 2 or (start and start[0] != "<"):
+                self._harmony = start.startswith(self.CONTROL_TOKEN)
+
+        if self._harmony:
+            # Harmony-formatted output: hold it back until the header shows it
+            # is the final answer, then stream only the message body.
+            marker_at = window.find(self.FINAL_CHANNEL_MARKER, unreleased_at)
+            if marker_at == -1:
+                return visible
+            self._released = self._length - len(window) + marker_at + len(self.FINAL_CHANNEL_MARKER)
+            self._passthrough = True
+            return visible + self._release(window)
+
+        if self._length >= self.lookahead:
+            self._passthrough = True
+            return self._release()
+        return ""
+
+    def finish(self) -> str:
+        if self.is_tool_call:
+            return ""
+        if self._harmony and not self._passthrough and self._released:
+            # Control tokens or another channel after the final answer was shown
+            return ""
+        return self._release(hold=False)
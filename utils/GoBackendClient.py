@@ -0,0 +1,360 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urljoin
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes worth retrying for idempotent requests: the Go server or a proxy
+# in front of it was briefly unavailable.
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+
+class Timeouts(NamedTuple):
+    connect: float
+    read: float
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the Go backend is unhealthy.
+
+    After `failure_threshold` consecutive failures (connection errors, timeouts
+    or 5xx responses) the circuit opens and requests are rejected without
+    touching the network. Once `reset_timeout` seconds have passed a single
+    trial request is let through (half-open); its outcome closes or re-opens
+    the circuit.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def available(self) -> bool:
+        """
+        Whether `allow_request` would currently let a request through, without
+        claiming the half-open trial.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return time.monotonic() - self._opened_at >= self.reset_timeout
+            return not self._trial_in_flight
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class LatencyStats:
+    """
+    Per-endpoint request counts and latency percentiles over a bounded window.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def summary(self) -> dict:
+        ordered = sorted(self.recent)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 2) if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class GoBackendClient:
+    """
+    HTTP client for the Go coordination server, owned by ToolExecutor.
+
+    Keeps a pooled keep-alive `requests.Session` (and an `httpx.AsyncClient` for
+    the async server), applies per-endpoint connect/read timeouts, retries
+    idempotent GETs with jittered exponential backoff, and trips a circuit
+    breaker while the backend is unhealthy. Results and errors keep the dict
+    shapes ToolExecutor has always returned to the LLM.
+    """
+
+    def __init__(self, base_url: str, pool_size: int = 20, timeouts: Optional[Dict] = None,
+                 retry: Optional[Dict] = None, circuit_breaker: Optional[Dict] = None):
+        self.base_url = base_url
+        self.pool_size = pool_size
+
+        # Timeouts are keyed by endpoint prefix; the longest matching prefix wins.
+        timeouts = timeouts or {}
+        default = timeouts.get("default", {})
+        self.default_timeouts = Timeouts(default.get("connect", 3.0), default.get("read", 10.0))
+        self.endpoint_timeouts = {
+            prefix.strip("/"): Timeouts(value.get("connect", self.default_timeouts.connect),
+                                        value.get("read", self.default_timeouts.read))
+            for prefix, value in timeouts.items() if prefix != "default"
+        }
+
+        retry = retry or {}
+        self.max_retries = retry.get("max_retries", 2)
+        self.backoff_base = retry.get("backoff_base", 0.1)
+        self.backoff_max = retry.get("backoff_max", 2.0)
+
+        self.breaker = CircuitBreaker(**(circuit_breaker or {}))
+
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        # Created on first async call so it binds to the serving event loop.
+        self._async_client: Optional[httpx.AsyncClient] = None
+
+        self._stats_lock = threading.Lock()
+        self._latency: Dict[str, LatencyStats] = {}
+        self._counters = {"requests": 0, "failures": 0, "retries": 0, "short_circuited": 0}
+        self._async_connections_opened = 0
+
+    # --- Configuration helpers ---
+
+    def timeouts_for(self, endpoint: str) -> Timeouts:
+        endpoint = endpoint.strip("/")
+        best, best_len = self.default_timeouts, -1
+        for prefix, value in self.endpoint_timeouts.items():
+            if endpoint.startswith(prefix) and len(prefix) > best_len:
+                best, best_len = value, len(prefix)
+        return best
+
+    def _attempts_for(self, method: str) -> int:
+        # Only idempotent reads are retried; a repeated dispatch could send a second drone.
+        return 1 + self.max_retries if method.upper() == "GET" else 1
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": a random delay up to the exponential cap
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    # --- Bookkeeping ---
+
+    @staticmethod
+    def _endpoint_key(endpoint: str) -> str:
+        # Collapse IDs so that e.g. every `api/drones/send/{id}` shares one entry
+        return re.sub(r"/\d+", "/{id}", "/" + endpoint.strip("/"))[1:]
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            self._counters[counter] += 1
+
+    def _record_latency(self, endpoint: str, started: float):
+        key = self._endpoint_key(endpoint)
+        with self._stats_lock:
+            self._latency.setdefault(key, LatencyStats()).add(time.perf_counter() - started)
+
+    def _circuit_open_error(self, endpoint: str) -> dict:
+        self._count("short_circuited")
+        return {
+            "error": f"Go backend is unavailable; skipped call to '{endpoint}' (circuit open).",
+            "retry_after_seconds": round(self.breaker.retry_after(), 1),
+        }
+
+    def _to_result(self, status_code: int, reason: str, text: str, json_loader) -> dict:
+        if status_code >= 400:
+            return {"error": f"HTTP error occurred: {status_code} {reason}", "details": text}
+        if status_code == 204:  # No Content
+            return {"status": "success", "message": "Request successful with no content returned."}
+        return json_loader()
+
+    def _record_outcome(self, status_code: int):
+        if status_code >= 500:
+            self._count("failures")
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    # --- Transport ---
+
+    def request(self, method: str, endpoint: str, params: dict = None, data: dict = None) -> dict:
+        url = urljoin(self.base_url, endpoint)
+        timeouts = self.timeouts_for(endpoint)
+        attempts = self._attempts_for(method)
+
+        for attempt in range(attempts):
+            if not self.breaker.allow_request():
+                return self._circuit_open_error(endpoint)
+            if attempt:
+                self._count("retries")
+            self._count("requests")
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, params=params, json=data,
+                                                timeout=(timeouts.connect, timeouts.read))
+            except requests.exceptions.RequestException as e:
+                self._record_latency(endpoint, started)
+                self._count("failures")
+                self.breaker.record_failure()
+                if attempt + 1 < attempts:
+                    time.sleep(self._backoff(attempt))
+                    continue
+                return {"error": f"Failed to call Go backend endpoint '{endpoint}': {e}"}
+
+            self._record_latency(endpoint, started)
+            self._record_outcome(response.status_code)
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt + 1 < attempts:
+                time.sleep(self._backoff(attempt))
+                continue
+            try:
+                return self._to_result(response.status_code, response.reason, response.text, response.json)
+            except ValueError as e:
+                return {"error": f"Failed to call Go backend endpoint '{endpoint}': {e}"}
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self._async_connections_opened += 1
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            self._async_client = httpx.AsyncClient(limits=limits)
+        return self._async_client
+
+    async def arequest(self, method: str, endpoint: str, params: dict = None, data: dict = None) -> dict:
+        url = urljoin(self.base_url, endpoint)
+        timeouts = self.timeouts_for(endpoint)
+        attempts = self._attempts_for(method)
+        client = self._get_async_client()
+
+        for attempt in range(attempts):
+            if not self.breaker.allow_request():
+                return self._circuit_open_error(endpoint)
+            if attempt:
+                self._count("retries")
+            self._count("requests")
+
+            started = time.perf_counter()
+            try:
+                response = await client.request(
+                    method, url, params=params, json=data,
+                    timeout=httpx.Timeout(timeouts.read, connect=timeouts.connect),
+                    extensions={"trace": self._trace},
+                )
+            except httpx.HTTPError as e:
+                self._record_latency(endpoint, started)
+                self._count("failures")
+                self.breaker.record_failure()
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+                return {"error": f"Failed to call Go backend endpoint '{endpoint}': {e}"}
+
+            self._record_latency(endpoint, started)
+            self._record_outcome(response.status_code)
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt + 1 < attempts:
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            try:
+                return self._to_result(response.status_code, response.reason_phrase, response.text, response.json)
+            except ValueError as e:
+                return {"error": f"Failed to call Go backend endpoint '{endpoint}': {e}"}
+
+    # --- Warm-up ---
+
+    def warm_up(self) -> bool:
+        """
+        Opens a pooled connection to the backend with a HEAD request, so the
+        first tool call does not pay for the connect. Neither the circuit
+        breaker nor the request counters see it. Returns whether it connected.
+        """
+        if not self.base_url:
+            return False
+        try:
+            self.session.head(self.base_url, timeout=(self.default_timeouts.connect, self.default_timeouts.read))
+            return True
+        except requests.exceptions.RequestException:
+            return False
+
+    async def awarm_up(self) -> bool:
+        """
+        Async version of `warm_up`, for the connection pool of the async client.
+        """
+        if not self.base_url:
+            return False
+        try:
+            await self._get_async_client().head(self.base_url, extensions={"trace": self._trace},
+                                                timeout=httpx.Timeout(self.default_timeouts.read,
+                                                                      connect=self.default_timeouts.connect))
+            return True
+        except httpx.HTTPError:
+            return False
+
+    # --- Stats ---
+
+    def get_stats(self) -> dict:
+        """
+        Connection reuse, retry/circuit-breaker counters and per-endpoint latency.
+        """
+        # urllib3 counts the connections each host pool has opened
+        pools = self._adapter.poolmanager.pools
+        sync_connections = sum(pools[key].num_connections for key in pools.keys())
+
+        with self._stats_lock:
+            counters = dict(self._counters)
+            latency = {key: stats.summary() for key, stats in self._latency.items()}
+
+        connections_opened = sync_connections + self._async_connections_opened
+        requests_sent = counters["requests"]
+        return {
+            **counters,
+            "connections_opened": connections_opened,
+            "connection_reuse_ratio": round(1 - connections_opened / requests_sent, 3) if requests_sent else 0.0,
+            "circuit_state": self.breaker.state,
+            "endpoints": latency,
+        }
@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from utils.GoBackendClient import CircuitBreaker, LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Backends report failures as text rather than raising, starting with this prefix.
+MODEL_ERROR_PREFIX = "Error: Model call failed"
+
+
+def is_model_error(text: str) -> bool:
+    return isinstance(text, str) and text.startswith(MODEL_ERROR_PREFIX)
+
+
+class RoutedBackend:
+    """
+    One replica behind the router: the wrapped chat backend plus its weight,
+    in-flight count and a circuit breaker that ejects it while it fails.
+    """
+
+    def __init__(self, name: str, backend, weight: float = 1.0, failure_threshold: int = 3,
+                 eject_seconds: float = 10.0):
+        self.name = name
+        self.backend = backend
+        self.weight = max(float(weight), 1e-6)
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=eject_seconds)
+        self.outstanding = 0
+        self.latency = LatencyStats()
+        self.counters = {"requests": 0, "failures": 0, "ejections": 0}
+
+    def load(self) -> float:
+        # Least outstanding requests, scaled by weight: a weight-2 replica takes twice the load
+        return (self.outstanding + 1) / self.weight
+
+
+class LLMRouter:
+    """
+    Spreads completions over several model replicas, implementing the same
+    chat/achat/stream/astream interface as a single backend.
+
+    * Balancing: the available replica with the fewest outstanding requests
+      relative to its weight is chosen (ties are broken at random).
+    * Ejection: after `failure_threshold` consecutive failures a replica is
+      skipped for `eject_seconds`; then a single request probes it and either
+      brings it back or ejects it again.
+    * Failover: a failed call is retried on the next best replica, up to
+      `max_failovers` times. Streams fail over only before their first delta.
+    * Hedging (optional, non-streaming calls): if a call takes longer than the
+      given latency percentile of recent calls, a duplicate is sent to a second
+      replica and whichever answers first successfully wins.
+    """
+
+    def __init__(self, backends: List[RoutedBackend], max_failovers: Optional[int] = None,
+                 hedge: Optional[Dict] = None):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend.")
+        self.backends = backends
+        self.max_failovers = len(backends) - 1 if max_failovers is None else max_failovers
+        hedge = hedge or {}
+        self.hedge_enabled = hedge.get("enabled", False) and len(backends) > 1
+        self.hedge_percentile = hedge.get("percentile", 95)
+        self.hedge_min_delay = hedge.get("min_delay", 0.05)
+        self.hedge_min_samples = hedge.get("min_samples", 20)
+
+        self._lock = threading.Lock()
+        self._latency = LatencyStats(window=512)
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        self.counters = {"requests": 0, "failovers": 0, "hedges": 0, "hedge_wins": 0, "exhausted": 0}
+
+    # --- Selection and bookkeeping ---
+
+    def _select(self, exclude) -> Optional[RoutedBackend]:
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude and b.breaker.available()]
+            if not candidates:
+                # Every replica is ejected: rather than failing outright, try the others anyway
+                candidates = [b for b in self.backends if b not in exclude]
+                if not candidates:
+                    return None
+                chosen = min(candidates, key=lambda b: b.breaker.retry_after())
+            else:
+                best = min(b.load() for b in candidates)
+                chosen = random.choice([b for b in candidates if b.load() == best])
+                # Claims the half-open probe if the replica is being tested again
+                chosen.breaker.allow_request()
+            chosen.outstanding += 1
+            chosen.counters["requests"] += 1
+        return chosen
+
+    def _finish(self, node: RoutedBackend, ok: bool, started: float):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            node.outstanding -= 1
+            if ok:
+                node.latency.add(elapsed)
+                self._latency.add(elapsed)
+            else:
+                node.counters["failures"] += 1
+        if ok:
+            node.breaker.record_success()
+        else:
+            was_open = node.breaker.state == CircuitBreaker.OPEN
+            node.breaker.record_failure()
+            if not was_open and node.breaker.state == CircuitBreaker.OPEN:
+                node.counters["ejections"] += 1
+                logger.warning("LLM backend '%s' ejected after repeated failures.", node.name)
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge_enabled:
+            return None
+        with self._lock:
+            recent = sorted(self._latency.recent)
+        if len(recent) < self.hedge_min_samples:
+            return None
+        index = min(len(recent) - 1, int(self.hedge_percentile / 100 * len(recent)))
+        return max(self.hedge_min_delay, recent[index])
+
+    def _call(self, node: RoutedBackend, messages, system_prompt):
+        started = time.perf_counter()
+        try:
+            result = node.backend.chat(messages, system_prompt=system_prompt)
+        except Exception as e:
+            result = f"{MODEL_ERROR_PREFIX}. Details: {e}"
+        ok = not is_model_error(result)
+        self._finish(node, ok, started)
+        return ok, result
+
+    async def _acall(self, node: RoutedBackend, messages, system_prompt):
+        started = time.perf_counter()
+        try:
+            result = await node.backend.achat(messages, system_prompt=system_prompt)
+        except asyncio.CancelledError:
+            # The hedge partner won; this says nothing about the replica's health
+            with self._lock:
+                node.outstanding -= 1
+            if node.breaker.state == CircuitBreaker.HALF_OPEN:
+                # An unfinished probe proves nothing; keep the replica ejected and probe again later
+                node.breaker.record_failure()
+            raise
+        except Exception as e:
+            result = f"{MODEL_ERROR_PREFIX}. Details: {e}"
+        ok = not is_model_error(result)
+        self._finish(node, ok, started)
+        return ok, result
+
+    def _no_backend_error(self, last_error: Optional[str]) -> str:
+        self._count("exhausted")
+        return last_error or f"{MODEL_ERROR_PREFIX}. Details: no LLM backend is available."
+
+    # --- IChatBackend ---
+
+    def chat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        self._count("requests")
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            tried, last_error = [], None
+            for attempt in range(self.max_failovers + 1):
+                node = self._select(tried)
+                if node is None:
+                    break
+                if attempt:
+                    self._count("failovers")
+                tried.append(node)
+                ok, result = self._call(node, messages, system_prompt)
+                if ok:
+                    return result
+                last_error = result
+            return self._no_backend_error(last_error)
+
+        if self._hedge_pool is None:
+            self._hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+        return self._hedged_chat(messages, system_prompt, hedge_delay)
+
+    def _hedged_chat(self, messages, system_prompt, hedge_delay: float) -> str:
+        tried, pending, last_error = [], {}, None
+        attempts = self.max_failovers + 1
+        hedged = False
+        while True:
+            if not pending:
+                if len(tried) >= attempts:
+                    break
+                node = self._select(tried)
+                if node is None:
+                    break
+                if tried:
+                    self._count("failovers")
+                tried.append(node)
+                pending[self._hedge_pool.submit(self._call, node, messages, system_prompt)] = False
+
+            timeout = hedge_delay if not hedged and len(tried) < attempts else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                node = self._select(tried)
+                if node is not None:
+                    self._count("hedges")
+                    tried.append(node)
+                    pending[self._hedge_pool.submit(self._call, node, messages, system_prompt)] = True
+                continue
+
+            for future in done:
+                is_hedge = pending.pop(future)
+                ok, result = future.result()
+                if ok:
+                    if is_hedge:
+                        self._count("hedge_wins")
+                    # A still-running duplicate finishes in the background and is discarded
+                    return result
+                last_error = result
+        return self._no_backend_error(last_error)
+
+    async def achat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        self._count("requests")
+        hedge_delay = self._hedge_delay()
+        tried, pending, last_error = [], {}, None
+        attempts = self.max_failovers + 1
+        hedged = hedge_delay is None
+        try:
+            while True:
+                if not pending:
+                    if len(tried) >= attempts:
+                        break
+                    node = self._select(tried)
+                    if node is None:
+                        break
+                    if tried:
+                        self._count("failovers")
+                    tried.append(node)
+                    pending[asyncio.ensure_future(self._acall(node, messages, system_prompt))] = False
+
+                timeout = hedge_delay if not hedged and len(tried) < attempts else None
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    node = self._select(tried)
+                    if node is not None:
+                        self._count("hedges")
+                        tried.append(node)
+                        pending[asyncio.ensure_future(self._acall(node, messages, system_prompt))] = True
+                    continue
+
+                for task in done:
+                    is_hedge = pending.pop(task)
+                    ok, result = task.result()
+                    if ok:
+                        if is_hedge:
+                            self._count("hedge_wins")
+                        return result
+                    last_error = result
+            return self._no_backend_error(last_error)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> Iterator[str]:
+        self._count("requests")
+        tried, last_error = [], None
+        for attempt in range(self.max_failovers + 1):
+            node = self._select(tried)
+            if node is None:
+                break
+            if attempt:
+                self._count("failovers")
+            tried.append(node)
+            started, ok, streamed = time.perf_counter(), True, False
+            try:
+                for delta in node.backend.stream(messages, system_prompt=system_prompt):
+                    if is_model_error(delta):
+                        ok = False
+                        if not streamed:
+                            last_error = delta
+                            break
+                    streamed = True
+                    yield delta
+            finally:
+                self._finish(node, ok, started)
+            if ok or streamed:
+                return
+        yield self._no_backend_error(last_error)
+
+    async def astream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        self._count("requests")
+        tried, last_error = [], None
+        for attempt in range(self.max_failovers + 1):
+            node = self._select(tried)
+            if node is None:
+                break
+            if attempt:
+                self._count("failovers")
+            tried.append(node)
+            started, ok, streamed = time.perf_counter(), True, False
+            try:
+                async for delta in node.backend.astream(messages, system_prompt=system_prompt):
+                    if is_model_error(delta):
+                        ok = False
+                        if not streamed:
+                            last_error = delta
+                            break
+                    streamed = True
+                    yield delta
+            finally:
+                self._finish(node, ok, started)
+            if ok or streamed:
+                return
+        yield self._no_backend_error(last_error)
+
+    # --- Stats ---
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            backends = {
+                node.name: {
+                    "weight": node.weight,
+                    "state": node.breaker.state,
+                    "outstanding": node.outstanding,
+                    **node.counters,
+                    "latency": node.latency.summary(),
+                }
+                for node in self.backends
+            }
+            counters = dict(self.counters)
+        hedge_delay = self._hedge_delay()
+        return {**counters, "hedge_delay_ms": round(hedge_delay * 1000, 1) if hedge_delay else None,
+                "backends": backends}
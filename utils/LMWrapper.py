@@ -1,12 +1,36 @@
-import openai
+import asyncio
+import contextvars
+import logging
 import requests
+import httpx
 import json
 import time
 import random
+import threading
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Protocol, List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from typing import Protocol, List, Dict, Optional, Iterator, AsyncIterator
 from types import SimpleNamespace
 
+from utils import CONFIG_PATH, load_config
+from utils.ContextWindow import ContextCompactor, SUMMARY_PROMPT, TokenEstimator, extractive_summary
+from utils.LLMRouter import LLMRouter, RoutedBackend, is_model_error
+from utils.CompletionCache import CompletionCache
+from utils.MicroBatcher import MicroBatcher
+from utils.GPTTools import GPTParsingUtils, ModelReply, ToolCallParseError
+from utils.Telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Token counts a backend read from the API's response, picked up by
+# `LMWrapper._record_usage` in place of its own estimate
+_reported_usage: contextvars.ContextVar[Optional[tuple]] = contextvars.ContextVar("reported_usage", default=None)
+
+
+def report_usage(prompt_tokens: int, completion_tokens: int):
+    _reported_usage.set((prompt_tokens, completion_tokens))
+
 
 # --- Gemini to OpenAI Conversion (remains the same) ---
 def gemini_to_openai_like(response_json) -> SimpleNamespace:
@@ -31,9 +55,248 @@ def gemini_to_openai_like(response_json) -> SimpleNamespace:
             )]
         )
     except (KeyError, IndexError, TypeError) as e:
-        print(f"[DEBUG] Error parsing Gemini response: {response_json}")
+        logger.debug("Error parsing Gemini response: %s", response_json)
         raise RuntimeError(f"Invalid Gemini response structure: {e}")
 
+
+def gemini_chunk_text(chunk_json) -> str:
+    """
+    Extracts the text delta from one `streamGenerateContent` chunk.
+    Chunks without candidates (e.g. trailing usage metadata) yield an empty string.
+    """
+    candidates = chunk_json.get("candidates") or []
+    if not candidates:
+        if "promptFeedback" in chunk_json and "blockReason" in chunk_json["promptFeedback"]:
+            raise RuntimeError(f"Content blocked by Gemini: {chunk_json['promptFeedback']['blockReason']}")
+        return ""
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join(part.get("text", "") for part in parts)
+
+def render_harmony_prompt(messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+    """
+    Renders a chat as a raw prompt in the harmony format of gpt-oss models, for
+    the plain `/v1/completions` endpoint. The prompt ends with an open assistant
+    turn, so the model's completion is what the chat endpoint would have returned.
+    """
+    parts = []
+    if system_prompt:
+        parts.append(f"<|start|>system<|message|>{system_prompt}<|end|>")
+    for message in messages:
+        role, content = message.get("role"), message.get("content") or ""
+        if role == "tool":
+            parts.append(f"<|start|>functions.{message.get('name', 'tool')} to=assistant"
+                         f"<|channel|>commentary<|message|>{content}<|end|>")
+        elif role == "assistant":
+            # Tool calls are stored in raw harmony form; plain answers went to the final channel
+            if content.startswith("<|channel|>"):
+                end = "" if content.endswith(("<|call|>", "<|end|>")) else "<|call|>" if " to=" in content else "<|end|>"
+                parts.append(f"<|start|>assistant{content}{end}")
+            else:
+                parts.append(f"<|start|>assistant<|channel|>final<|message|>{content}<|end|>")
+        else:
+            parts.append(f"<|start|>{role}<|message|>{content}<|end|>")
+    parts.append("<|start|>assistant")
+    return "".join(parts)
+
+
+HARMONY_END_TOKENS = ("<|end|>", "<|return|>", "<|call|>")
+
+
+def harmony_reply(text: str) -> str:
+    """
+    The reply in a raw harmony completion (what follows the open assistant turn
+    of `render_harmony_prompt`), as the chat endpoint would have returned it:
+    its tool calls in harmony text form, else the message of the final channel.
+    The analysis channel and control tokens are dropped; text without any
+    harmony header is returned as it is.
+    """
+    if "<|message|>" not in text:
+        return text
+    calls, final = [], None
+    for segment in text.split("<|start|>"):
+        header, marker, body = segment.partition("<|message|>")
+        if not marker:
+            continue
+        header = header[len("assistant"):] if header.startswith("assistant") else header
+        for token in HARMONY_END_TOKENS:
+            body = body.split(token, 1)[0]
+        if "to=" in header:
+            calls.append(f"{header}<|message|>{body}")
+        elif "<|channel|>final" in header:
+            final = body
+    if calls:
+        return "".join(calls)
+    # A completion cut off before its final channel has no answer yet
+    return final if final is not None else ""
+
+
+def openai_tool_definitions(tools: List[Dict]) -> List[Dict]:
+    """
+    The tools.json definitions in the `tools` format of the OpenAI chat API.
+    """
+    return [{"type": "function", "function": {"name": tool["name"], "description": tool.get("description", ""),
+                                              "parameters": tool.get("parameters", {"type": "object"})}}
+            for tool in tools]
+
+
+# JSON-schema keywords that Gemini's function declarations accept
+GEMINI_SCHEMA_KEYS = {"type", "description", "properties", "required", "enum", "items", "format", "nullable"}
+
+
+def gemini_function_declarations(tools: List[Dict]) -> List[Dict]:
+    """
+    The tools.json definitions as Gemini `functionDeclarations`.
+    """
+    def schema(value):
+        if isinstance(value, dict):
+            cleaned = {k: v for k, v in value.items() if k in GEMINI_SCHEMA_KEYS and v != []}
+            if "properties" in cleaned:
+                cleaned["properties"] = {name: schema(prop) for name, prop in cleaned["properties"].items()}
+            if "items" in cleaned:
+                cleaned["items"] = schema(cleaned["items"])
+            return cleaned
+        return value
+
+    declarations = []
+    for tool in tools:
+        declaration = {"name": tool["name"], "description": tool.get("description", "")}
+        if tool.get("parameters", {}).get("properties"):
+            declaration["parameters"] = schema(tool["parameters"])
+        declarations.append(declaration)
+    return declarations
+
+
+def _stored_tool_calls(message: Dict) -> List[Dict]:
+    """
+    The tool calls of an assistant message in the history, which are stored in
+    their harmony text form; empty if it is a plain answer.
+    """
+    try:
+        return GPTParsingUtils().tool_calls_parsing(message.get("content") or "")
+    except ToolCallParseError:
+        return []
+
+
+def to_openai_tool_messages(messages: List[Dict]) -> List[Dict]:
+    """
+    Rewrites the history for native tool calling: assistant tool calls become
+    `tool_calls` entries and tool results reference them by `tool_call_id`.
+    """
+    converted, open_ids = [], []
+    for i, message in enumerate(messages):
+        role = message.get("role")
+        calls = _stored_tool_calls(message) if role == "assistant" else []
+        if calls:
+            open_ids = [f"call_{i}_{j}" for j in range(len(calls))]
+            converted.append({"role": "assistant", "content": None, "tool_calls": [
+                {"id": call_id, "type": "function",
+                 "function": {"name": call["tool_name"], "arguments": json.dumps(call["parameters"])}}
+                for call_id, call in zip(open_ids, calls)]})
+        elif role == "tool" and open_ids:
+            converted.append({"role": "tool", "tool_call_id": open_ids.pop(0), "content": message.get("content", "")})
+        elif role == "tool":
+            # A result whose call is no longer in the history (e.g. folded into the summary)
+            converted.append({"role": "user", "content": f"Result of {message.get('name', 'a tool')}: "
+                                                         f"{message.get('content', '')}"})
+        else:
+            converted.append(message)
+    return converted
+
+
+def openai_reply(message) -> str:
+    """
+    The text of an OpenAI chat completion message; native tool calls are
+    returned as a ModelReply.
+    """
+    if getattr(message, "tool_calls", None):
+        return ModelReply.from_native_calls(
+            [(call.function.name, call.function.arguments) for call in message.tool_calls])
+    return message.content or ""
+
+
+def gemini_function_calls(response_json) -> List[tuple]:
+    """
+    The `(name, args)` of the native function calls in a Gemini response or stream chunk.
+    """
+    candidates = response_json.get("candidates") or []
+    parts = candidates[0].get("content", {}).get("parts", []) if candidates else []
+    return [(part["functionCall"]["name"], part["functionCall"].get("args", {}))
+            for part in parts if "functionCall" in part]
+
+
+def gemini_usage(response_json) -> Optional[tuple]:
+    """
+    `(prompt tokens, completion tokens)` from the `usageMetadata` of a Gemini
+    response or stream chunk, if it has one.
+    """
+    usage = response_json.get("usageMetadata")
+    if not usage:
+        return None
+    return usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0)
+
+
+def gemini_contents(messages: List[Dict], native_tools: bool) -> tuple:
+    """
+    Maps the history to Gemini `contents` and the extra system instruction
+    text of any system messages in it.
+
+    Tool results answer the model's `functionCall` parts with
+    `functionResponse` parts when tool calling is native; otherwise (or when
+    the call was folded into the summary) they are passed as user text.
+    Consecutive messages of one role are merged into one turn, as Gemini
+    expects all responses to one model turn's calls together.
+    """
+    contents, system_texts, open_calls = [], [], 0
+
+    def add(role: str, part: Dict):
+        if contents and contents[-1]["role"] == role:
+            contents[-1]["parts"].append(part)
+        else:
+            contents.append({"role": role, "parts": [part]})
+
+    for message in messages:
+        role, content = message.get("role"), message.get("content") or ""
+        calls = _stored_tool_calls(message) if native_tools and role == "assistant" else []
+        if role == "system":
+            system_texts.append(content)
+        elif calls:
+            for call in calls:
+                add("model", {"functionCall": {"name": call["tool_name"], "args": call["parameters"]}})
+            open_calls = len(calls)
+        elif role == "tool" and open_calls:
+            open_calls -= 1
+            try:
+                result = json.loads(content)
+            except ValueError:
+                result = content
+            # functionResponse needs an object; lists and strings are wrapped
+            response = result if isinstance(result, dict) else {"result": result}
+            add("user", {"functionResponse": {"name": message.get("name", "tool"), "response": response}})
+        elif role == "tool":
+            add("user", {"text": f"Result of {message.get('name', 'a tool')}: {content}"})
+        elif content:
+            # Gemini rejects empty text parts
+            open_calls = 0
+            add("model" if role == "assistant" else "user", {"text": content})
+    return contents, system_texts
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    The delay asked for by a `Retry-After` header, in seconds or as an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
         # --- Backend Protocol (remains the same) ---
 class IChatBackend(Protocol):
     def chat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
@@ -43,131 +306,857 @@ class IChatBackend(Protocol):
         """
         pass
 
+    async def achat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        """
+        Async counterpart of `chat`, used by the ASGI server so that a single
+        event loop can keep many conversations in flight.
+        """
+        pass
+
+    def stream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> Iterator[str]:
+        """
+        Yields the response text as it is generated, one delta at a time.
+        """
+        pass
+
+    def astream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Async counterpart of `stream`.
+        """
+        pass
+
 # --- OpenAI Wrapper (Slightly modified to return string) ---
 class OpenAIWrapper:
-    def __init__(self, api_key: str, base_url: str, model: str, request_options: Dict):
-        self.client = openai.OpenAI(api_key=api_key, base_url=base_url)
+    def __init__(self, api_key: str, base_url: str, model: str, request_options: Dict,
+                 client_options: Optional[Dict] = None):
+        # Local OpenAI-compatible servers ignore the key, but the SDK refuses an empty one
+        api_key = api_key or "not-needed"
+        # e.g. {"max_retries": 0, "timeout": 30}; passed to the OpenAI clients as-is
+        self.client_options = client_options or {}
+        # Imported here rather than at the top: the SDK takes about half a second
+        # to import, which a server using another provider should not pay
+        import openai
+        self._openai = openai
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url, **self.client_options)
+        self.api_key = api_key
+        self.base_url = base_url
         self.model = model
         self.request_options = request_options
+        # The async client binds its connection pool to the running event loop,
+        # so it is created on first use instead of here.
+        self._async_client = None
+        # Native tool definitions, set by `set_tools` when tool calling is native
+        self.tools: Optional[List[Dict]] = None
 
-    def chat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+    def set_tools(self, tools: Optional[List[Dict]]):
+        self.tools = openai_tool_definitions(tools) if tools else None
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = self._openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                                          **self.client_options)
+        return self._async_client
+
+    def warm_up(self):
+        """
+        Opens a pooled connection to the server with a cheap `GET models`, so
+        the first chat does not pay for the TCP/TLS handshake.
+        """
+        try:
+            # No retries: an unreachable server should not hold up readiness
+            self.client.with_options(max_retries=0).models.list()
+        except Exception as e:
+            # Many local servers have no models endpoint; the connection is open all the same
+            logger.debug("Model server warm-up request failed: %s", e)
+
+    async def aclose(self):
+        # Before its event loop ends; the next async call creates a new client
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+
+    async def awarm_up(self):
+        # Opens the async client's pool on the serving event loop
+        try:
+            await self.async_client.with_options(max_retries=0).models.list()
+        except Exception as e:
+            logger.debug("Model server warm-up request failed: %s", e)
+
+    def _request(self, messages: List[Dict], system_prompt: Optional[str]) -> tuple:
+        """
+        The messages and extra options of a chat request.
+        """
+        if self.tools:
+            messages = to_openai_tool_messages(messages)
         if system_prompt:
             messages = [{"role": "system", "content": system_prompt}] + messages
-        
+        return messages, ({"tools": self.tools} if self.tools else {})
+
+    def chat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        messages, tool_options = self._request(messages, system_prompt)
+
         try:
             completion = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
-                **self.request_options
+                **self.request_options,
+                **tool_options
+            )
+            if completion.choices and completion.choices[0].message:
+                return openai_reply(completion.choices[0].message)
+            return ""
+        except Exception as e:
+            logger.error("OpenAI API call failed: %s", e)
+            return f"Error: Model call failed. Details: {e}"
+
+    async def achat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        messages, tool_options = self._request(messages, system_prompt)
+
+        try:
+            completion = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                **self.request_options,
+                **tool_options
             )
             if completion.choices and completion.choices[0].message:
-                return completion.choices[0].message.content or ""
+                return openai_reply(completion.choices[0].message)
             return ""
         except Exception as e:
-            print(f"[ERROR] OpenAI API call failed: {e}")
+            logger.error("OpenAI API call failed: %s", e)
             return f"Error: Model call failed. Details: {e}"
 
 
+    def _batch_options(self) -> Dict:
+        return {k: v for k, v in self.request_options.items() if k != "stream"}
+
+    @staticmethod
+    def _batch_texts(completion, size: int) -> List[str]:
+        texts = [""] * size
+        for choice in completion.choices:
+            texts[choice.index] = harmony_reply(choice.text or "")
+        return texts
+
+    def chat_batch(self, requests: List[tuple]) -> List[str]:
+        """
+        Sends several `(messages, system_prompt)` chats as one `/v1/completions`
+        request with a list of prompts, which local servers (llama.cpp, vLLM)
+        decode as a single batch. Returns one reply per request, in order, cut
+        out of the raw harmony text as `chat` would have returned it.
+        """
+        prompts = [render_harmony_prompt(messages, system_prompt) for messages, system_prompt in requests]
+        try:
+            completion = self.client.completions.create(model=self.model, prompt=prompts, **self._batch_options())
+            return self._batch_texts(completion, len(prompts))
+        except Exception as e:
+            logger.error("OpenAI batch completion failed: %s", e, extra={"batch_size": len(prompts)})
+            return [f"Error: Model call failed. Details: {e}"] * len(prompts)
+
+    async def achat_batch(self, requests: List[tuple]) -> List[str]:
+        prompts = [render_harmony_prompt(messages, system_prompt) for messages, system_prompt in requests]
+        try:
+            completion = await self.async_client.completions.create(model=self.model, prompt=prompts,
+                                                                    **self._batch_options())
+            return self._batch_texts(completion, len(prompts))
+        except Exception as e:
+            logger.error("OpenAI batch completion failed: %s", e, extra={"batch_size": len(prompts)})
+            return [f"Error: Model call failed. Details: {e}"] * len(prompts)
+
+    @staticmethod
+    def _collect_tool_call_deltas(calls: Dict[int, list], delta) -> None:
+        # Native tool calls stream as fragments: the name first, then pieces of the arguments
+        for call in getattr(delta, "tool_calls", None) or []:
+            entry = calls.setdefault(call.index, ["", ""])
+            if call.function and call.function.name:
+                entry[0] += call.function.name
+            if call.function and call.function.arguments:
+                entry[1] += call.function.arguments
+
+    def stream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> Iterator[str]:
+        messages, tool_options = self._request(messages, system_prompt)
+
+        try:
+            chunks = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                **{**self.request_options, "stream": True},
+                **tool_options
+            )
+            tool_calls = {}
+            for chunk in chunks:
+                if chunk.choices:
+                    self._collect_tool_call_deltas(tool_calls, chunk.choices[0].delta)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            if tool_calls:
+                # Emitted in their text form, which the stream filter hides and the parser reads
+                yield str(ModelReply.from_native_calls([tuple(tool_calls[i]) for i in sorted(tool_calls)]))
+        except Exception as e:
+            logger.error("OpenAI API call failed: %s", e)
+            yield f"Error: Model call failed. Details: {e}"
+
+    async def astream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        messages, tool_options = self._request(messages, system_prompt)
+
+        try:
+            chunks = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                **{**self.request_options, "stream": True},
+                **tool_options
+            )
+            tool_calls = {}
+            async for chunk in chunks:
+                if chunk.choices:
+                    self._collect_tool_call_deltas(tool_calls, chunk.choices[0].delta)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            if tool_calls:
+                yield str(ModelReply.from_native_calls([tuple(tool_calls[i]) for i in sorted(tool_calls)]))
+        except Exception as e:
+            logger.error("OpenAI API call failed: %s", e)
+            yield f"Error: Model call failed. Details: {e}"
+
+
 # --- Gemini Wrapper (Slightly modified to align with protocol) ---
 class GeminiWrapper:
-    def __init__(self, api_key: str, model: str, request_options: Dict, max_retries: int = 3):
+    """
+    Client of the Gemini `generateContent` API.
+
+    Keeps a pooled keep-alive `requests.Session` (and an `httpx.AsyncClient` for
+    the async server) with connect/read timeouts. Rate-limited (429) and
+    failed (5xx) calls and connection errors are retried up to `max_retries`
+    times, waiting as long as a `Retry-After` header asks, or else with
+    jittered exponential backoff; a wait longer than `retry_after_max` is not
+    retried. A stream is only retried before its first chunk. The token
+    counts in `usageMetadata` are reported in place of estimates.
+    """
+
+    DEFAULT_API_URL = "https://generativelanguage.googleapis.com/v1beta/"
+    RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_key: str, model: str, request_options: Dict, max_retries: int = 3,
+                 api_url: Optional[str] = None, pool_size: int = 20, timeouts: Optional[Dict] = None,
+                 retry: Optional[Dict] = None):
         self.api_key = api_key
         self.model = model
         self.request_options = request_options
-        self.max_retries = max_retries
+        self.api_url = (api_url or self.DEFAULT_API_URL).rstrip("/") + "/"
+        self.pool_size = pool_size
+        timeouts = timeouts or {}
+        self.connect_timeout = timeouts.get("connect", 5.0)
+        self.read_timeout = timeouts.get("read", 120.0)
+        retry = retry or {}
+        self.max_retries = retry.get("max_retries", max_retries)
+        self.backoff_base = retry.get("backoff_base", 0.5)
+        self.backoff_max = retry.get("backoff_max", 8.0)
+        self.retry_after_max = retry.get("retry_after_max", 30.0)
 
-    def chat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
-        # Gemini API has a specific format for system instructions.
-        system_instruction = system_prompt or ""
-        
-        # Filter out any system messages from the main list as it's handled separately
-        contents = []
-        for m in messages:
-            if m["role"] == "user":
-                contents.append({"role": "user", "parts": [{"text": m["content"]}]})
-            elif m["role"] == "assistant":
-                 contents.append({"role": "model", "parts": [{"text": m["content"]}]})
-
-        payload = {
-            "contents": contents,
-            "systemInstruction": {"parts": [{"text": system_instruction}]},
-            "generationConfig": {
-                "temperature": self.request_options.get("temperature", 0.7),
-                "maxOutputTokens": self.request_options.get("max_tokens", 8192),
-            }
-        }
-        
-        headers = {"Content-Type": "application/json"}
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent?key={self.api_key}"
-        
-        # Using a simple requests call for now, retry logic can be added back if needed.
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        # The async client binds its connection pool to the running event loop,
+        # so it is created on first use instead of here.
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_connections_opened = 0
+        # Native function declarations, set by `set_tools` when tool calling is native
+        self.tools: Optional[List[Dict]] = None
+
+        self._stats_lock = threading.Lock()
+        self._counters = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0,
+                          "prompt_tokens": 0, "completion_tokens": 0}
+
+    def set_tools(self, tools: Optional[List[Dict]]):
+        self.tools = gemini_function_declarations(tools) if tools else None
+
+    def warm_up(self):
+        """
+        Opens a pooled connection to the API by reading the model's metadata.
+        """
         try:
-            resp = requests.post(url, headers=headers, data=json.dumps(payload))
+            self.session.get(f"{self.api_url}models/{self.model}", headers=self._headers,
+                             timeout=(self.connect_timeout, self.read_timeout))
+        except requests.RequestException as e:
+            logger.debug("Gemini warm-up request failed: %s", e)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _build_payload(self, messages: List[Dict], system_prompt: Optional[str] = None) -> Dict:
+        # Gemini takes the system prompt (and any system messages) as a separate instruction
+        contents, system_texts = gemini_contents(messages, native_tools=bool(self.tools))
+        system_instruction = "\n\n".join(text for text in [system_prompt or ""] + system_texts if text)
+
+        generation_config = {
+            "temperature": self.request_options.get("temperature", 0.7),
+            "maxOutputTokens": self.request_options.get("max_tokens", 8192),
+        }
+        if "top_p" in self.request_options:
+            generation_config["topP"] = self.request_options["top_p"]
+        if self.request_options.get("stop"):
+            stop = self.request_options["stop"]
+            generation_config["stopSequences"] = [stop] if isinstance(stop, str) else stop
+
+        payload = {"contents": contents, "generationConfig": generation_config}
+        if system_instruction:
+            payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        if self.tools:
+            payload["tools"] = [{"functionDeclarations": self.tools}]
+        return payload
+
+    @staticmethod
+    def _reply(response_json) -> str:
+        calls = gemini_function_calls(response_json)
+        if calls:
+            return ModelReply.from_native_calls(calls)
+        # Use the conversion function to get an OpenAI-like object, then extract text
+        return gemini_to_openai_like(response_json).choices[0].message.content
+
+    def _endpoint_url(self, method: str = "generateContent") -> str:
+        url = f"{self.api_url}models/{self.model}:{method}"
+        if method == "streamGenerateContent":
+            # Ask for Server-Sent Events instead of one long JSON array
+            url += "?alt=sse"
+        return url
+
+    @property
+    def _headers(self) -> Dict[str, str]:
+        # The key goes in a header rather than the query string, so it stays out of URL logs
+        return {"Content-Type": "application/json", "x-goog-api-key": self.api_key}
+
+    # --- Retries and accounting ---
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._stats_lock:
+            self._counters[counter] += amount
+
+    def _retry_delay(self, attempt: int, status_code: Optional[int], retry_after: Optional[str]) -> Optional[float]:
+        """
+        How long to wait before retrying, or None if the call should not be retried.
+        """
+        if attempt >= self.max_retries or (status_code is not None and
+                                           status_code not in self.RETRYABLE_STATUS_CODES):
+            return None
+        if status_code == 429:
+            self._count("rate_limited")
+        asked = retry_after_seconds(retry_after)
+        if asked is not None:
+            return asked if asked <= self.retry_after_max else None
+        # "Full jitter": a random delay up to the exponential cap
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _record_usage(self, usage: Optional[tuple]):
+        if usage:
+            self._count("prompt_tokens", usage[0])
+            self._count("completion_tokens", usage[1])
+            report_usage(*usage)
+
+    def _send(self, payload: Dict, method: str = "generateContent", stream: bool = False) -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count("retries")
+            self._count("requests")
+            try:
+                resp = self.session.post(self._endpoint_url(method), headers=self._headers, json=payload,
+                                         stream=stream, timeout=(self.connect_timeout, self.read_timeout))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._count("failures")
+                delay = self._retry_delay(attempt, None, None)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            if resp.status_code >= 400:
+                self._count("failures")
+                delay = self._retry_delay(attempt, resp.status_code, resp.headers.get("Retry-After"))
+                if delay is not None:
+                    resp.close()
+                    time.sleep(delay)
+                    continue
+            resp.raise_for_status()
+            return resp
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self._async_connections_opened += 1
+
+    async def _asend(self, payload: Dict, method: str = "generateContent", stream: bool = False) -> httpx.Response:
+        if self._async_client is None:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            self._async_client = httpx.AsyncClient(
+                limits=limits, timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout))
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count("retries")
+            self._count("requests")
+            request = self._async_client.build_request("POST", self._endpoint_url(method), headers=self._headers,
+                                                       json=payload, extensions={"trace": self._trace})
+            try:
+                resp = await self._async_client.send(request, stream=stream)
+            except httpx.TransportError:
+                self._count("failures")
+                delay = self._retry_delay(attempt, None, None)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            if resp.status_code >= 400:
+                self._count("failures")
+                delay = self._retry_delay(attempt, resp.status_code, resp.headers.get("Retry-After"))
+                if delay is not None:
+                    await resp.aclose()
+                    await asyncio.sleep(delay)
+                    continue
+                if stream:
+                    await resp.aread()
             resp.raise_for_status()
-            data = resp.json()
-            
-            # Use the conversion function to get an OpenAI-like object, then extract text
-            openai_like_response = gemini_to_openai_like(data)
-            return openai_like_response.choices[0].message.content
+            return resp
+
+    # --- Chat ---
+
+    def chat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        payload = self._build_payload(messages, system_prompt)
+        try:
+            response_json = self._send(payload).json()
+            self._record_usage(gemini_usage(response_json))
+            return self._reply(response_json)
+
+        except Exception as e:
+            logger.error("Gemini API call failed: %s", e)
+            return f"Error: Model call failed. Details: {e}"
+
+    async def achat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        payload = self._build_payload(messages, system_prompt)
+        try:
+            response_json = (await self._asend(payload)).json()
+            self._record_usage(gemini_usage(response_json))
+            return self._reply(response_json)
 
         except Exception as e:
-            print(f"[ERROR] Gemini API call failed: {e}")
+            logger.error("Gemini API call failed: %s", e)
             return f"Error: Model call failed. Details: {e}"
 
+    def stream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> Iterator[str]:
+        payload = self._build_payload(messages, system_prompt)
+        try:
+            with self._send(payload, "streamGenerateContent", stream=True) as resp:
+                calls, usage = [], None
+                for line in resp.iter_lines(decode_unicode=True):
+                    if line and line.startswith("data:"):
+                        chunk = json.loads(line[len("data:"):])
+                        calls += gemini_function_calls(chunk)
+                        # Every chunk carries the usage so far; the last one has the totals
+                        usage = gemini_usage(chunk) or usage
+                        text = gemini_chunk_text(chunk)
+                        if text:
+                            yield text
+                self._record_usage(usage)
+                if calls:
+                    yield str(ModelReply.from_native_calls(calls))
+        except Exception as e:
+            logger.error("Gemini API call failed: %s", e)
+            yield f"Error: Model call failed. Details: {e}"
+
+    async def astream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        payload = self._build_payload(messages, system_prompt)
+        try:
+            resp = await self._asend(payload, "streamGenerateContent", stream=True)
+            try:
+                calls, usage = [], None
+                async for line in resp.aiter_lines():
+                    if line.startswith("data:"):
+                        chunk = json.loads(line[len("data:"):])
+                        calls += gemini_function_calls(chunk)
+                        usage = gemini_usage(chunk) or usage
+                        text = gemini_chunk_text(chunk)
+                        if text:
+                            yield text
+            finally:
+                await resp.aclose()
+            self._record_usage(usage)
+            if calls:
+                yield str(ModelReply.from_native_calls(calls))
+        except Exception as e:
+            logger.error("Gemini API call failed: %s", e)
+            yield f"Error: Model call failed. Details: {e}"
+
+    def get_stats(self) -> dict:
+        """
+        Requests, retries (and how many were rate-limited), failed attempts,
+        connection reuse and the token counts Gemini reported.
+        """
+        pools = self._adapter.poolmanager.pools
+        connections_opened = sum(pools[key].num_connections for key in pools.keys()) + \
+            self._async_connections_opened
+        with self._stats_lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "connections_opened": connections_opened,
+            "connection_reuse_ratio": round(1 - connections_opened / counters["requests"], 3)
+            if counters["requests"] else 0.0,
+        }
+
 
 
 # --- Main LMWrapper (Refactored) ---
 class LMWrapper:
-    def __init__(self):
+    def __init__(self, config_path: Optional[Path] = None):
         self.backend: Optional[IChatBackend] = None
         self.system_prompt: Optional[str] = None
+        self.compactor: Optional[ContextCompactor] = None
+        self.completion_cache: Optional[CompletionCache] = None
+        self.request_options: Dict = {}
+        self.model_name = ""
+        self.tool_calling = "text"
+        self.tools: Optional[List[Dict]] = None
+        self.config_path = Path(config_path) if config_path else CONFIG_PATH
         self._load_config()
 
     def _load_config(self):
         try:
-            config_path = Path(__file__).parent.parent / "config" / "configure.json"
-            if not config_path.exists():
-                raise FileNotFoundError(f"Config file not found at {config_path}")
-            
-            with open(config_path, "r", encoding="utf-8") as f:
-                config = json.load(f)
+            config = load_config(self.config_path)
 
             provider = config.get("provider", "local").lower()
-            api_key = config.get("api_key", "")
-            model = config["model"]
-            request_options = config.get("request_options", {})
-
-            if provider in ["local", "openai", "grok"]:
-                self.backend = OpenAIWrapper(
-                    api_key=api_key,
-                    base_url=config["lm_api_url"],
-                    model=model,
-                    request_options=request_options
-                )
-            elif provider == "gemini":
-                self.backend = GeminiWrapper(
-                    api_key=api_key,
-                    model=model,
-                    request_options=request_options
-                )
+            self.request_options = config.get("request_options", {})
+            self.model_name = f"{provider}:{config.get('model', '')}"
+            # "native" passes tools.json to the API as tool definitions; "text" leaves
+            # them in the system prompt and parses tool calls out of the reply
+            self.tool_calling = config.get("tool_calling", {}).get("mode", "text")
+            if self.tool_calling not in ("text", "native"):
+                raise ValueError(f"Unsupported tool calling mode: {self.tool_calling}")
+            if config.get("backends"):
+                self.backend = self._build_router(config)
             else:
-                raise ValueError(f"Unsupported LLM provider: {provider}")
+                self.backend = self._build_backend(config)
+
+            # Token-budgeted history compaction before every completion (see "context_window")
+            context_config = config.get("context_window")
+            use_model_summary = (context_config or {}).get("summary", {}).get("mode") == "llm"
+            self.compactor = ContextCompactor.from_config(
+                context_config, summarizer=self._summarize_with_model if use_model_summary else None
+            )
+            # Token counts reported to telemetry use the compactor's tokenizer when there is one
+            self.token_estimator = self.compactor.estimator if self.compactor else \
+                TokenEstimator((context_config or {}).get("tokenizer", "o200k_base"))
 
-            print(f"--- LMWrapper initialized with '{provider}' provider ---")
+            # Optional exact-match cache of completions (see "completion_cache")
+            cache_config = config.get("completion_cache")
+            if cache_config and cache_config.get("enabled", True):
+                options = {k: v for k, v in cache_config.items() if k != "enabled"}
+                self.completion_cache = CompletionCache(**options, is_tool_call=self._is_tool_call)
+
+            logger.info("LMWrapper initialized with the '%s' provider", provider, extra={"model": self.model_name})
 
         except Exception as e:
-            print(f"[ERROR] Failed to initialize LMWrapper: {e}")
+            logger.error("Failed to initialize LMWrapper: %s", e)
             raise e
 
+    @staticmethod
+    def _build_backend(config: Dict) -> IChatBackend:
+        provider = config.get("provider", "local").lower()
+        api_key = config.get("api_key", "")
+        model = config["model"]
+        request_options = config.get("request_options", {})
+
+        if provider in ["local", "openai", "grok"]:
+            backend = OpenAIWrapper(
+                api_key=api_key,
+                base_url=config["lm_api_url"],
+                model=model,
+                request_options=request_options,
+                client_options=config.get("client_options")
+            )
+            # Concurrent completions are sent to the server as one batch (see "batching")
+            batching = config.get("batching")
+            if batching and batching.get("enabled", True):
+                options = {k: v for k, v in batching.items() if k not in ("enabled", "harmony")}
+                # Batches are raw harmony prompts: no native tool definitions, and only gpt-oss models read them
+                if config.get("tool_calling", {}).get("mode", "text") == "native":
+                    raise ValueError("Batching needs text tool calling; it cannot be combined with native mode.")
+                if not batching.get("harmony", "gpt-oss" in model.lower()):
+                    raise ValueError(f"Batching renders harmony prompts, which '{model}' does not take; "
+                                     f"set batching.harmony if it is a gpt-oss model.")
+                return MicroBatcher(backend, **options)
+            return backend
+        elif provider == "gemini":
+            # Endpoint, connection pool, timeouts and retries (see "gemini")
+            gemini = config.get("gemini", {})
+            return GeminiWrapper(
+                api_key=api_key,
+                model=model,
+                request_options=request_options,
+                api_url=gemini.get("api_url"),
+                pool_size=gemini.get("pool_size", 20),
+                timeouts=gemini.get("timeouts"),
+                retry=gemini.get("retry"),
+            )
+        raise ValueError(f"Unsupported LLM provider: {provider}")
+
+    def _build_router(self, config: Dict) -> LLMRouter:
+        """
+        Builds one backend per entry of "backends"; each entry inherits the
+        top-level provider/model/api_key/request_options unless it overrides them.
+        """
+        routing = config.get("routing", {})
+        shared = {k: v for k, v in config.items() if k not in ("backends", "routing")}
+        nodes = []
+        for i, entry in enumerate(config["backends"]):
+            backend_config = {**shared, **entry}
+            # The router fails over to another replica, so the SDK should not retry on its own first
+            backend_config.setdefault("client_options", {"max_retries": 0})
+            nodes.append(RoutedBackend(
+                name=entry.get("name") or entry.get("lm_api_url") or f"backend-{i}",
+                backend=self._build_backend(backend_config),
+                weight=entry.get("weight", 1.0),
+                failure_threshold=routing.get("failure_threshold", 3),
+                eject_seconds=routing.get("eject_seconds", 10.0),
+            ))
+        logger.info("LMWrapper routing over %d backends", len(nodes), extra={"backends": [node.name for node in nodes]})
+        return LLMRouter(nodes, max_failovers=routing.get("max_failovers"), hedge=routing.get("hedge"))
+
+    def _leaf_backends(self) -> List[IChatBackend]:
+        backends = [node.backend for node in self.backend.backends] if isinstance(self.backend, LLMRouter) \
+            else [self.backend]
+        return [backend.backend if isinstance(backend, MicroBatcher) else backend for backend in backends]
+
+    def set_tools(self, tools: List[Dict]):
+        """
+        Hands the tools.json definitions to the backends when tool calling is
+        native; in text mode they only appear in the system prompt.
+        """
+        self.tools = tools
+        if self.tool_calling != "native":
+            return
+        for backend in self._leaf_backends():
+            if hasattr(backend, "set_tools"):
+                backend.set_tools(tools)
+        logger.info("%d tools passed to the model as native tool definitions", len(tools))
+
     def set_system_prompt(self, system_prompt: str):
         self.system_prompt = system_prompt
-        print("--- System prompt has been set in LMWrapper ---")
+        logger.debug("System prompt has been set in LMWrapper")
+
+    def warm_up(self, prefill: bool = False):
+        """
+        Opens a connection to every backend, off the request path. With
+        `prefill`, one short completion is also run with the system prompt, so a
+        server with a KV prefix cache already holds the prompt's prefix.
+        """
+        for backend in self._leaf_backends():
+            if hasattr(backend, "warm_up"):
+                backend.warm_up()
+        if prefill and self.backend:
+            self.backend.chat([{"role": "user", "content": "Hello"}], system_prompt=self.system_prompt)
+
+    async def awarm_up(self, prefill: bool = False):
+        """
+        Async version of `warm_up`: the connections are opened in the pools of
+        the async clients, which the async server uses.
+        """
+        for backend in self._leaf_backends():
+            if hasattr(backend, "awarm_up"):
+                await backend.awarm_up()
+            elif hasattr(backend, "warm_up"):
+                await asyncio.to_thread(backend.warm_up)
+        if prefill and self.backend:
+            await self.backend.achat([{"role": "user", "content": "Hello"}], system_prompt=self.system_prompt)
+
+    async def aclose(self):
+        """
+        Closes the backends' async clients, for a caller whose event loop ends
+        (like `asyncio.run`) while the wrapper lives on.
+        """
+        for backend in self._leaf_backends():
+            if hasattr(backend, "aclose"):
+                await backend.aclose()
+
+    def _prepare_messages(self, messages: List[Dict]) -> List[Dict]:
+        """
+        Compacts the history to the configured prompt-token budget.
+        """
+        if not self.compactor:
+            return messages
+        return self.compactor.compact(messages, system_prompt=self.system_prompt)
+
+    async def _aprepare_messages(self, messages: List[Dict]) -> List[Dict]:
+        # A model-written summary is a blocking call, so keep it off the event loop
+        if self.compactor and self.compactor.summary_mode == "llm":
+            return await asyncio.to_thread(self._prepare_messages, messages)
+        return self._prepare_messages(messages)
+
+    def _summarize_with_model(self, previous: Optional[str], messages: List[Dict]) -> str:
+        """
+        Rolling-summary callback for `"summary": {"mode": "llm"}`: asks the model
+        to fold the newly dropped messages into the previous summary.
+        """
+        transcript = "\n".join(
+            f"{message.get('role')}: {str(message.get('content'))[:500]}" for message in messages
+        )
+        prompt = f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"
+        summary = self.backend.chat([{"role": "user", "content": prompt}], system_prompt=SUMMARY_PROMPT)
+        if summary.startswith("Error:"):
+            return extractive_summary(previous, messages)
+        return summary
+
+    @staticmethod
+    def _is_tool_call(text: str) -> bool:
+        try:
+            return bool(GPTParsingUtils().tool_calls_parsing(text))
+        except Exception:
+            return False
+
+    def _record_usage(self, messages: List[Dict], text: str):
+        """
+        Reports the prompt and completion tokens of one model call to telemetry
+        and the current span: the counts the backend read from the API's
+        response (see `report_usage`), else estimates.
+        """
+        reported = _reported_usage.get()
+        _reported_usage.set(None)
+        if not telemetry.enabled:
+            return
+        if reported:
+            telemetry.record_tokens(*reported)
+            return
+        estimator = self.token_estimator
+        prompt_tokens = estimator.count_messages(messages) + estimator.count_text(self.system_prompt or "")
+        telemetry.record_tokens(prompt_tokens, estimator.count_text(str(text)))
+
+    def _cache_key(self, messages: List[Dict]) -> Optional[str]:
+        if not self.completion_cache or not self.completion_cache.applies_to(self.request_options):
+            return None
+        return self.completion_cache.make_key(self.system_prompt, messages, self.request_options, self.model_name)
 
     def get_completion(self, messages: List[Dict]) -> str:
         if not self.backend:
             return "Error: LMWrapper backend is not initialized."
         if not self.system_prompt:
-            print("[WARNING] System prompt has not been set. Continuing without it.")
+            logger.warning("System prompt has not been set. Continuing without it.")
+
+        messages = self._prepare_messages(messages)
+        # A cached tool-call decision skips the model round trip; the tool itself still runs live
+        key = self._cache_key(messages)
+        if key:
+            cached = self.completion_cache.get(key)
+            if cached is not None:
+                telemetry.annotate(cached=True)
+                return cached
 
         # The backend's `chat` method is responsible for handling the system prompt
-        return self.backend.chat(messages, system_prompt=self.system_prompt)
+        started = time.perf_counter()
+        _reported_usage.set(None)
+        text = self.backend.chat(messages, system_prompt=self.system_prompt)
+        if key:
+            self.completion_cache.put(key, text, time.perf_counter() - started)
+        self._record_usage(messages, text)
+        return text
+
+    async def aget_completion(self, messages: List[Dict]) -> str:
+        if not self.backend:
+            return "Error: LMWrapper backend is not initialized."
+        if not self.system_prompt:
+            logger.warning("System prompt has not been set. Continuing without it.")
+
+        messages = await self._aprepare_messages(messages)
+        key = self._cache_key(messages)
+        if key:
+            cached = self.completion_cache.get(key)
+            if cached is not None:
+                telemetry.annotate(cached=True)
+                return cached
+
+        started = time.perf_counter()
+        _reported_usage.set(None)
+        text = await self.backend.achat(messages, system_prompt=self.system_prompt)
+        if key:
+            self.completion_cache.put(key, text, time.perf_counter() - started)
+        self._record_usage(messages, text)
+        return text
+
+    def stream_completion(self, messages: List[Dict]) -> Iterator[str]:
+        """
+        Streams the completion as text deltas. Joining the deltas gives the
+        same text `get_completion` would have returned.
+        """
+        if not self.backend:
+            yield "Error: LMWrapper backend is not initialized."
+            return
+        if not self.system_prompt:
+            logger.warning("System prompt has not been set. Continuing without it.")
+
+        messages = self._prepare_messages(messages)
+        key = self._cache_key(messages)
+        if key:
+            cached = self.completion_cache.get(key)
+            if cached is not None:
+                telemetry.annotate(cached=True)
+                yield cached
+                return
+
+        started, deltas = time.perf_counter(), []
+        _reported_usage.set(None)
+        for delta in self.backend.stream(messages, system_prompt=self.system_prompt):
+            deltas.append(delta)
+            yield delta
+        if key and not any(is_model_error(delta) for delta in deltas):
+            self.completion_cache.put(key, "".join(deltas), time.perf_counter() - started)
+        self._record_usage(messages, "".join(deltas))
+
+    async def astream_completion(self, messages: List[Dict]) -> AsyncIterator[str]:
+        if not self.backend:
+            yield "Error: LMWrapper backend is not initialized."
+            return
+        if not self.system_prompt:
+            logger.warning("System prompt has not been set. Continuing without it.")
+
+        messages = await self._aprepare_messages(messages)
+        key = self._cache_key(messages)
+        if key:
+            cached = self.completion_cache.get(key)
+            if cached is not None:
+                telemetry.annotate(cached=True)
+                yield cached
+                return
+
+        started, deltas = time.perf_counter(), []
+        _reported_usage.set(None)
+        async for delta in self.backend.astream(messages, system_prompt=self.system_prompt):
+            deltas.append(delta)
+            yield delta
+        if key and not any(is_model_error(delta) for delta in deltas):
+            self.completion_cache.put(key, "".join(deltas), time.perf_counter() - started)
+        self._record_usage(messages, "".join(deltas))
+
+    def get_stats(self) -> dict:
+        """
+        Prompt tokens before/after compaction and the time spent compacting, plus
+        per-backend load, health and hedging counters when several backends are routed,
+        the completion cache's hit rate, batch sizes when batching is enabled, and
+        the retry, connection and token counters of a Gemini backend (per routed
+        backend, like the batch sizes, when several are routed).
+        """
+        stats = {"context_window": self.compactor.get_stats() if self.compactor else {"enabled": False}}
+        if isinstance(self.backend, LLMRouter):
+            stats["router"] = self.backend.get_stats()
+        if self.completion_cache:
+            stats["completion_cache"] = self.completion_cache.get_stats()
+        if isinstance(self.backend, GeminiWrapper):
+            stats["gemini"] = self.backend.get_stats()
+        elif isinstance(self.backend, LLMRouter):
+            gemini = {node.name: node.backend.get_stats() for node in self.backend.backends
+                      if isinstance(node.backend, GeminiWrapper)}
+            if gemini:
+                stats["gemini"] = gemini
+        if isinstance(self.backend, MicroBatcher):
+            stats["batching"] = self.backend.get_stats()
+        elif isinstance(self.backend, LLMRouter):
+            batching = {node.name: node.backend.get_stats() for node in self.backend.backends
+                        if isinstance(node.backend, MicroBatcher)}
+            if batching:
+                stats["batching"] = batching
+        return stats
@@ -0,0 +1,72 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class LazyComponent:
+    """
+    A server component that is built on first use instead of at import time.
+
+    Attribute access is forwarded to the component, so code written against a
+    module-level instance (`lm_wrapper.get_completion(...)`) works unchanged.
+    The component is built once, under a lock, even when several requests need
+    it at the same moment; a build that raised is tried again on the next use.
+    With `namespace` (a module's `globals()`), the built component also
+    replaces the proxy under `name` there, so later lookups skip the proxy.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], namespace: Optional[Dict[str, Any]] = None):
+        # Underscored, so they cannot shadow attributes of the component
+        self._lazy_name = name
+        self._lazy_factory = factory
+        self._lazy_namespace = namespace
+        self._lazy_instance = None
+        self._lazy_lock = threading.RLock()
+        self._lazy_build_seconds: Optional[float] = None
+        self._lazy_error: Optional[str] = None
+
+    def __getattr__(self, attribute: str):
+        return getattr(resolve(self), attribute)
+
+    def __repr__(self) -> str:
+        state = "built" if self._lazy_instance is not None else "not built"
+        return f"<LazyComponent {self._lazy_name} ({state})>"
+
+
+def resolve(component):
+    """
+    The component behind a LazyComponent, built if necessary; anything else
+    is returned as it is.
+    """
+    if not isinstance(component, LazyComponent):
+        return component
+    instance = component._lazy_instance
+    if instance is not None:
+        return instance
+    with component._lazy_lock:
+        if component._lazy_instance is None:
+            started = time.perf_counter()
+            try:
+                instance = component._lazy_factory()
+            except Exception as e:
+                component._lazy_error = f"{type(e).__name__}: {e}"
+                raise
+            component._lazy_build_seconds = time.perf_counter() - started
+            component._lazy_error = None
+            component._lazy_instance = instance
+            if component._lazy_namespace is not None:
+                component._lazy_namespace[component._lazy_name] = instance
+        return component._lazy_instance
+
+
+def component_status(component: LazyComponent) -> dict:
+    """
+    Whether the component was built, how long that took, and the error of
+    the last failed build.
+    """
+    status = {"built": component._lazy_instance is not None}
+    if component._lazy_build_seconds is not None:
+        status["build_ms"] = round(component._lazy_build_seconds * 1000, 1)
+    if component._lazy_error:
+        status["error"] = component._lazy_error
+    return status
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+
+class _LoopQueue:
+    """Requests collected on one event loop, waiting to be flushed as a batch."""
+
+    def __init__(self):
+        self.pending: List[tuple] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """
+    Collects concurrent completions and sends them to the backend as one
+    batched request, implementing the same chat/achat/stream/astream interface
+    as a single backend.
+
+    * A batch is sent when `max_batch_size` requests are waiting, or
+      `window_ms` after its first request arrived, whichever comes first; so
+      no request waits longer than the window before it is sent.
+    * The wrapped backend must provide `chat_batch`/`achat_batch`, taking a
+      list of `(messages, system_prompt)` and returning one text per entry.
+    * A batch of one is sent through the ordinary `chat`/`achat`. Streams are
+      not batched.
+    """
+
+    def __init__(self, backend, window_ms: float = 5.0, max_batch_size: int = 16, max_inflight_batches: int = 8):
+        if not hasattr(backend, "chat_batch") or not hasattr(backend, "achat_batch"):
+            raise ValueError(f"{type(backend).__name__} does not support batched completions.")
+        self.backend = backend
+        self.window = window_ms / 1000
+        self.max_batch_size = max(1, max_batch_size)
+
+        # Sync callers (Flask worker threads) hand their requests to one collector thread
+        self._cond = threading.Condition()
+        self._queue: List[tuple] = []
+        self._collector: Optional[threading.Thread] = None
+        self._pool = ThreadPoolExecutor(max_workers=max_inflight_batches, thread_name_prefix="llm-batch")
+        # Async callers are batched per event loop
+        self._loop_queues: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopQueue]" = \
+            weakref.WeakKeyDictionary()
+
+        self._stats_lock = threading.Lock()
+        self.counters = {"requests": 0, "batches": 0, "batched_requests": 0, "full_batches": 0, "max_batch": 0}
+        self._wait_seconds = 0.0
+
+    def _record(self, size: int, waited: float):
+        with self._stats_lock:
+            self.counters["requests"] += size
+            self.counters["batches"] += 1
+            if size > 1:
+                self.counters["batched_requests"] += size
+            if size >= self.max_batch_size:
+                self.counters["full_batches"] += 1
+            self.counters["max_batch"] = max(self.counters["max_batch"], size)
+            self._wait_seconds += waited
+
+    # --- Sync path ---
+
+    def chat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        future = Future()
+        with self._cond:
+            self._queue.append((messages, system_prompt, future, time.perf_counter()))
+            if self._collector is None:
+                self._collector = threading.Thread(target=self._collect, name="llm-batch-collector", daemon=True)
+                self._collector.start()
+            self._cond.notify()
+        return future.result()
+
+    def _collect(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                deadline = self._queue[0][3] + self.window
+                while len(self._queue) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._queue[:self.max_batch_size]
+                del self._queue[:self.max_batch_size]
+            self._record(len(batch), time.perf_counter() - batch[0][3])
+            self._pool.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[tuple]):
+        try:
+            if len(batch) == 1:
+                messages, system_prompt, _, _ = batch[0]
+                results = [self.backend.chat(messages, system_prompt=system_prompt)]
+            else:
+                results = self.backend.chat_batch([(messages, system_prompt) for messages, system_prompt, _, _ in batch])
+        except Exception as e:
+            results = [f"Error: Model call failed. Details: {e}"] * len(batch)
+        for (_, _, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    # --- Async path ---
+
+    async def achat(self, messages: List[Dict], system_prompt: Optional[str] = None) -> str:
+        loop = asyncio.get_running_loop()
+        queue = self._loop_queues.get(loop)
+        if queue is None:
+            queue = self._loop_queues[loop] = _LoopQueue()
+
+        future = loop.create_future()
+        queue.pending.append((messages, system_prompt, future, time.perf_counter()))
+        if len(queue.pending) >= self.max_batch_size:
+            self._aflush(queue)
+        elif queue.flush_handle is None:
+            queue.flush_handle = loop.call_later(self.window, self._aflush, queue)
+        return await future
+
+    def _aflush(self, queue: _LoopQueue):
+        if queue.flush_handle is not None:
+            queue.flush_handle.cancel()
+            queue.flush_handle = None
+        batch, queue.pending = queue.pending, []
+        if batch:
+            self._record(len(batch), time.perf_counter() - batch[0][3])
+            asyncio.ensure_future(self._arun_batch(batch))
+
+    async def _arun_batch(self, batch: List[tuple]):
+        # Callers that were cancelled while waiting are left out of the batch
+        batch = [entry for entry in batch if not entry[2].done()]
+        if not batch:
+            return
+        try:
+            if len(batch) == 1:
+                messages, system_prompt, _, _ = batch[0]
+                results = [await self.backend.achat(messages, system_prompt=system_prompt)]
+            else:
+                results = await self.backend.achat_batch(
+                    [(messages, system_prompt) for messages, system_prompt, _, _ in batch])
+        except Exception as e:
+            results = [f"Error: Model call failed. Details: {e}"] * len(batch)
+        for (_, _, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    # --- Streams pass through ---
+
+    def stream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> Iterator[str]:
+        return self.backend.stream(messages, system_prompt=system_prompt)
+
+    def astream(self, messages: List[Dict], system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        return self.backend.astream(messages, system_prompt=system_prompt)
+
+    # --- Stats ---
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            counters = dict(self.counters)
+            wait = self._wait_seconds
+        batches = counters["batches"]
+        return {
+            **counters,
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+            "mean_batch_size": round(counters["requests"] / batches, 2) if batches else 0.0,
+            # How long the first request of a batch waited for the others
+            "mean_wait_ms": round(wait / batches * 1000, 2) if batches else 0.0,
+        }
@@ -0,0 +1,444 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds of the payload-size histogram buckets, in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name, self.help_text, self.label_names = name, help_text, label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self, lines: List[str]):
+        lines += [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value:g}")
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str):
+        self.name, self.help_text = name, help_text
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self, lines: List[str]):
+        lines += [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.value:g}"]
+
+
+class Histogram:
+    """
+    A Prometheus histogram with fixed buckets; observing a value is one bisect
+    and two additions under a lock.
+    """
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help_text, self.label_names = name, help_text, label_names
+        self.buckets = buckets
+        # label values -> [per-bucket counts (plus +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self, lines: List[str]):
+        lines += [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _format_labels(self.label_names, label_values, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {total:g}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+
+class _Trace:
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, sampled: bool):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+
+
+class Span:
+    """
+    One timed stage of a request. Used as a context manager; spans opened inside
+    it (in the same thread or task, or in a copied context) become its children.
+    """
+    __slots__ = ("telemetry", "name", "attributes", "trace", "span_id", "parent_id", "start_ns", "end_ns",
+                 "_started", "_token", "error")
+
+    def __init__(self, telemetry: "Telemetry", name: str, attributes: Dict[str, Any]):
+        self.telemetry = telemetry
+        self.name = name
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        if parent is None:
+            self.trace = _Trace(self.telemetry.sample())
+            self.parent_id = None
+        else:
+            self.trace = parent.trace
+            self.parent_id = parent.span_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._started
+        self.end_ns = self.start_ns + int(duration * 1e9)
+        if exc_type is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Ended in another context than it was started in (e.g. a generator)
+            _current_span.set(None)
+        self.telemetry._finish(self, duration)
+        return False
+
+
+class _NoopSpan:
+    """Returned while telemetry is disabled."""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _TraceWriter:
+    """
+    Serializes finished traces and appends them to a file as OTLP/JSON lines
+    from a background thread, so no request waits on either.
+    """
+
+    def __init__(self, path: Path, serialize):
+        self.path = path
+        self.serialize = serialize
+        self._queue: "queue.SimpleQueue[Optional[_Trace]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, trace: "_Trace"):
+        self._queue.put(trace)
+
+    def _run(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                trace = self._queue.get()
+                # Write everything already queued before flushing
+                while trace is not None:
+                    f.write(json.dumps(self.serialize(trace), separators=(",", ":")) + "\n")
+                    try:
+                        trace = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                f.flush()
+                if trace is None:
+                    return
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Telemetry:
+    """
+    Request tracing and Prometheus metrics for the chat pipeline.
+
+    * `span(name, **attributes)` times one stage (completion, parse, tool,
+      summary, response, ...). Every span feeds the `coordinate_stage_seconds`
+      histogram; tool spans also feed `coordinate_tool_seconds` per tool.
+    * With tracing enabled, each sampled request is written as one
+      OpenTelemetry (OTLP/JSON) line to `traces.path`, readable without a
+      collector (e.g. by the collector's file receiver or Jaeger's importer).
+    * `render_metrics()` returns the Prometheus text served on `/metrics`.
+
+    While disabled, `span` returns a shared no-op object and nothing is recorded.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.service_name = "coordinate-server"
+        self.sample_rate = 0.0
+        self._writer: Optional[_TraceWriter] = None
+        self.requests = Counter("coordinate_requests_total", "HTTP requests handled.",
+                                ("endpoint", "method", "status"))
+        self.request_seconds = Histogram("coordinate_request_seconds",
+                                         "HTTP request duration (until the response starts for streams).",
+                                         ("endpoint",))
+        self.stage_seconds = Histogram("coordinate_stage_seconds", "Time spent per stage of a request.", ("stage",))
+        self.tool_seconds = Histogram("coordinate_tool_seconds", "Tool call duration per tool.", ("tool",))
+        self.tokens = Counter("coordinate_llm_tokens_total", "Prompt and completion tokens (estimated).", ("kind",))
+        self.payload_bytes = Histogram("coordinate_payload_bytes", "Request, response and tool-result sizes.",
+                                       ("kind",), buckets=SIZE_BUCKETS)
+        self.tool_tokens_saved = Counter("coordinate_tool_result_tokens_saved_total",
+                                         "Prompt tokens saved by shaping tool results, per tool.", ("tool",))
+        self.admissions = Counter("coordinate_admission_total",
+                                  "Chat requests admitted or rejected by admission control.", ("priority", "outcome"))
+        self.queue_wait_seconds = Histogram("coordinate_queue_wait_seconds",
+                                            "Time admitted chat requests waited for an in-flight slot.", ("priority",))
+        self.in_flight = Gauge("coordinate_in_flight", "Chat requests holding an in-flight slot.")
+        self.queue_depth = Gauge("coordinate_queue_depth", "Chat requests waiting for an in-flight slot.")
+        self.traces_exported = 0
+
+    def configure(self, config: Optional[Dict]):
+        """
+        Applies the "telemetry" section of configure.json.
+        """
+        config = config or {}
+        self.enabled = config.get("enabled", True)
+        self.service_name = config.get("service_name", self.service_name)
+        traces = config.get("traces") or {}
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self.sample_rate = traces.get("sample_rate", 1.0) if traces.get("enabled", False) else 0.0
+        if self.enabled and self.sample_rate > 0:
+            self._writer = _TraceWriter(Path(traces.get("path", "data/traces.jsonl")), self._to_otlp)
+
+    # --- Spans ---
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def sample(self) -> bool:
+        return self.sample_rate >= 1.0 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current_span.get()
+
+    def annotate(self, **attributes):
+        """
+        Sets attributes on the span that is currently open, if any.
+        """
+        span = _current_span.get()
+        if span is not None:
+            span.attributes.update(attributes)
+
+    def _finish(self, span: Span, duration: float):
+        self.stage_seconds.observe(duration, span.name)
+        if span.name == "tool":
+            self.tool_seconds.observe(duration, str(span.attributes.get("tool", "")))
+        trace = span.trace
+        if not trace.sampled:
+            return
+        trace.spans.append(span)
+        if span.parent_id is None and self._writer:
+            self._writer.write(trace)
+            self.traces_exported += 1
+
+    def _to_otlp(self, trace: _Trace) -> dict:
+        spans = []
+        for span in trace.spans:
+            entry = {
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                # SPAN_KIND_SERVER for the request, SPAN_KIND_INTERNAL for its stages
+                "kind": 2 if span.parent_id is None else 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {},
+            }
+            if span.parent_id:
+                entry["parentSpanId"] = span.parent_id
+            spans.append(entry)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "coordinate-server"}, "spans": spans}],
+        }]}
+
+    # --- Metrics ---
+
+    def record_request(self, endpoint: str, method: str, status: int, seconds: float,
+                       request_bytes: Optional[int] = None, response_bytes: Optional[int] = None):
+        if not self.enabled:
+            return
+        self.requests.inc(endpoint, method, str(status))
+        self.request_seconds.observe(seconds, endpoint)
+        if request_bytes:
+            self.payload_bytes.observe(request_bytes, "request")
+        if response_bytes:
+            self.payload_bytes.observe(response_bytes, "response")
+
+    def record_tokens(self, prompt_tokens: int, completion_tokens: int):
+        if not self.enabled:
+            return
+        self.tokens.inc("prompt", amount=prompt_tokens)
+        self.tokens.inc("completion", amount=completion_tokens)
+        self.annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def record_payload(self, kind: str, size: int):
+        if self.enabled:
+            self.payload_bytes.observe(size, kind)
+
+    def record_tool_result_shaping(self, tool_name: str, tokens_saved: int):
+        if self.enabled:
+            self.tool_tokens_saved.inc(tool_name, amount=tokens_saved)
+
+    def record_admission(self, priority: str, outcome: str, waited: Optional[float] = None):
+        if not self.enabled:
+            return
+        self.admissions.inc(priority, outcome)
+        if waited is not None:
+            self.queue_wait_seconds.observe(waited, priority)
+
+    def record_load(self, in_flight: int, queued: int):
+        self.in_flight.set(in_flight)
+        self.queue_depth.set(queued)
+
+    def render_metrics(self) -> str:
+        lines: List[str] = []
+        for metric in (self.requests, self.request_seconds, self.stage_seconds, self.tool_seconds, self.tokens,
+                       self.payload_bytes, self.tool_tokens_saved, self.admissions, self.queue_wait_seconds,
+                       self.in_flight, self.queue_depth):
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+    def get_stats(self) -> dict:
+        return {"enabled": self.enabled, "trace_sample_rate": self.sample_rate,
+                "traces_exported": self.traces_exported}
+
+
+# Shared by the servers and the components they instrument, like a logging logger
+telemetry = Telemetry()
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- Logging ---
+
+class _TraceContextFilter(logging.Filter):
+    """Adds the IDs of the current span to every record, for log/trace correlation."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = _current_span.get()
+        record.trace_id = span.trace.trace_id if span is not None else None
+        record.span_id = span.span_id if span is not None else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the fields passed through `extra=`.
+    """
+
+    STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.STANDARD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(config: Optional[Dict] = None):
+    """
+    Sets up the root logger from the "telemetry" section: `log_level` (the
+    LOG_LEVEL environment variable takes precedence) and `log_format`
+    ("text" or "json"), written to stderr.
+    """
+    config = config or {}
+    level = os.getenv("LOG_LEVEL") or config.get("log_level", "INFO")
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(_TraceContextFilter())
+    if config.get("log_format", "text") == "json":
+        formatter = JsonFormatter()
+        formatter.converter = time.gmtime
+        handler.setFormatter(formatter)
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if getattr(existing, "_coordinate_handler", False):
+            root.removeHandler(existing)
+    handler._coordinate_handler = True
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
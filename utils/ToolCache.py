@@ -0,0 +1,276 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Read-only tools whose results may be cached, with their default TTL in seconds.
+# Drone positions change quickly; maintenance history rarely does.
+DEFAULT_TTLS = {
+    "get_drone_status": 5.0,
+    "find_panels": 30.0,
+    "get_panel_maintenance_history": 300.0,
+}
+
+
+class _Entry:
+    __slots__ = ("tool_name", "params", "value", "expires_at")
+
+    def __init__(self, tool_name: str, params: Dict[str, str], value: Any, expires_at: float):
+        self.tool_name = tool_name
+        self.params = params
+        self.value = value
+        self.expires_at = expires_at
+
+
+class ToolResultCache:
+    """
+    A bounded LRU + TTL read-through cache for read-only tool results.
+
+    Entries are keyed by tool name and normalized parameters. Concurrent misses
+    for the same key are collapsed into a single backend call (single-flight),
+    for both threads and asyncio tasks. Error results are never cached, and a
+    result that was in flight while a write invalidated the cache is not stored.
+
+    With `shared_path`, entries are also kept in a SQLite file that every worker
+    process of the server reads and writes, together with a generation counter:
+    a write in one worker invalidates the matching entries for all of them.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[Dict[str, float]] = None,
+                 shared_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttls = {**DEFAULT_TTLS, **(ttl_seconds or {})}
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._inflight: Dict[Tuple, Future] = {}
+        self._ainflight: Dict[Tuple, asyncio.Future] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "collapsed": 0, "evictions": 0, "expirations": 0,
+                      "invalidations": 0}
+        self._shared: Optional[sqlite3.Connection] = None
+        if shared_path:
+            Path(shared_path).parent.mkdir(parents=True, exist_ok=True)
+            self._shared = sqlite3.connect(str(shared_path), check_same_thread=False, isolation_level=None,
+                                           timeout=10)
+            self._shared.execute("PRAGMA journal_mode=WAL")
+            self._shared.execute("CREATE TABLE IF NOT EXISTS tool_results (key TEXT PRIMARY KEY, "
+                                 "tool_name TEXT NOT NULL, params TEXT NOT NULL, value TEXT NOT NULL, "
+                                 "expires_at REAL NOT NULL)")
+            self._shared.execute("CREATE TABLE IF NOT EXISTS tool_cache_generation (id INTEGER PRIMARY KEY, "
+                                 "generation INTEGER NOT NULL)")
+            self._shared.execute("INSERT OR IGNORE INTO tool_cache_generation (id, generation) VALUES (0, 0)")
+            self.stats["shared_hits"] = 0
+            self._sync_generation()
+
+    def is_cacheable(self, tool_name: str) -> bool:
+        return self.ttls.get(tool_name, 0) > 0
+
+    @staticmethod
+    def normalize(parameters: dict) -> Dict[str, str]:
+        """
+        Drops unset parameters and compares values as strings, so that
+        `{"cluster_id": 3}` and `{"cluster_id": "3", "status": null}` share an entry.
+        """
+        return {k: str(v).strip().lower() for k, v in (parameters or {}).items() if v is not None}
+
+    def make_key(self, tool_name: str, parameters: dict) -> Tuple:
+        return (tool_name.strip().lower(), tuple(sorted(self.normalize(parameters).items())))
+
+    # --- Lookup and storage (callers hold self._lock) ---
+
+    def _sync_generation(self):
+        """
+        Catches up with invalidations made by other workers: local entries
+        stored before the shared generation moved on are dropped.
+        """
+        generation = self._shared.execute("SELECT generation FROM tool_cache_generation WHERE id = 0").fetchone()[0]
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def _lookup(self, key: Tuple):
+        if self._shared is not None:
+            self._sync_generation()
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._shared_lookup(key)
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            self.stats["expirations"] += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, entry.value
+
+    def _shared_lookup(self, key: Tuple):
+        if self._shared is None:
+            return False, None
+        row = self._shared.execute("SELECT value, expires_at FROM tool_results WHERE key = ?",
+                                   (json.dumps(key),)).fetchone()
+        remaining = row[1] - time.time() if row else 0
+        if remaining <= 0:
+            return False, None
+        tool_name, params = key
+        value = json.loads(row[0])
+        self._entries[key] = _Entry(tool_name, dict(params), value, time.monotonic() + remaining)
+        self.stats["shared_hits"] += 1
+        return True, value
+
+    def _store(self, key: Tuple, value: Any, generation: int):
+        if self._shared is not None:
+            self._sync_generation()
+        if generation != self._generation or (isinstance(value, dict) and "error" in value):
+            return
+        tool_name, params = key
+        self._entries[key] = _Entry(tool_name, dict(params), value, time.monotonic() + self.ttls[tool_name])
+        self._entries.move_to_end(key)
+        if self._shared is not None:
+            self._shared.execute("INSERT OR REPLACE INTO tool_results (key, tool_name, params, value, expires_at) "
+                                 "VALUES (?, ?, ?, ?, ?)",
+                                 (json.dumps(key), tool_name, json.dumps(dict(params)), json.dumps(value),
+                                  time.time() + self.ttls[tool_name]))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    # --- Read-through ---
+
+    def get_or_load(self, tool_name: str, parameters: dict, loader: Callable[[], Any]) -> Any:
+        key = self.make_key(tool_name, parameters)
+        with self._lock:
+            hit, value = self._lookup(key)
+            if hit:
+                self.stats["hits"] += 1
+                return value
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                self.stats["misses"] += 1
+                future = self._inflight[key] = Future()
+                generation = self._generation
+            else:
+                self.stats["collapsed"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._store(key, value, generation)
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    async def aget_or_load(self, tool_name: str, parameters: dict, loader: Callable[[], Any]) -> Any:
+        """
+        Async counterpart of `get_or_load`; `loader` returns an awaitable.
+        """
+        key = self.make_key(tool_name, parameters)
+        with self._lock:
+            hit, value = self._lookup(key)
+            if hit:
+                self.stats["hits"] += 1
+                return value
+            future = self._ainflight.get(key)
+            leader = future is None
+            if leader:
+                self.stats["misses"] += 1
+                future = self._ainflight[key] = asyncio.get_running_loop().create_future()
+                generation = self._generation
+            else:
+                self.stats["collapsed"] += 1
+
+        if not leader:
+            return await asyncio.shield(future)
+
+        try:
+            value = await loader()
+        except BaseException as e:
+            with self._lock:
+                self._ainflight.pop(key, None)
+            future.set_exception(e)
+            # Followers re-raise it; mark it retrieved so the leader's own raise is not reported twice
+            future.exception()
+            raise
+        with self._lock:
+            self._store(key, value, generation)
+            self._ainflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    # --- Invalidation ---
+
+    def invalidate(self, predicate: Callable[[str, Dict[str, str]], bool]) -> int:
+        """
+        Removes every entry for which `predicate(tool_name, params)` is true.
+        Results still in flight are not stored afterwards.
+        """
+        with self._lock:
+            if self._shared is not None:
+                return self._invalidate_shared(predicate)
+            self._generation += 1
+            stale = [key for key, entry in self._entries.items() if predicate(entry.tool_name, entry.params)]
+            for key in stale:
+                del self._entries[key]
+            self.stats["invalidations"] += len(stale)
+        return len(stale)
+
+    def _invalidate_shared(self, predicate: Callable[[str, Dict[str, str]], bool]) -> int:
+        # Callers hold self._lock. Bumping the shared generation makes every worker
+        # drop its local entries and discard results that were in flight.
+        self._shared.execute("BEGIN IMMEDIATE")
+        try:
+            self._shared.execute("UPDATE tool_cache_generation SET generation = generation + 1 WHERE id = 0")
+            rows = self._shared.execute("SELECT key, tool_name, params FROM tool_results").fetchall()
+            stale = [(key,) for key, tool_name, params in rows if predicate(tool_name, json.loads(params))]
+            self._shared.executemany("DELETE FROM tool_results WHERE key = ?", stale)
+            self._shared.execute("DELETE FROM tool_results WHERE expires_at <= ?", (time.time(),))
+            self._shared.execute("COMMIT")
+        except BaseException:
+            self._shared.execute("ROLLBACK")
+            raise
+        self._sync_generation()
+        self.stats["invalidations"] += len(stale)
+        return len(stale)
+
+    def invalidate_after_write(self, tool_name: str, parameters: dict) -> int:
+        """
+        Drops the cached reads that a successful write tool makes stale.
+        """
+        params = self.normalize(parameters)
+        cluster_id, panel_id = params.get("cluster_id"), params.get("panel_id")
+
+        def matches(entry_params: Dict[str, str], key: str, value: Optional[str]) -> bool:
+            # An entry without that filter covers every cluster/panel, so it is stale too
+            return value is None or entry_params.get(key) in (None, value)
+
+        if tool_name == "dispatch_drone_to_cluster":
+            return self.invalidate(lambda name, p: name == "get_drone_status" or (
+                name == "find_panels" and matches(p, "cluster_id", cluster_id)))
+        if tool_name == "dispatch_rover_to_panel":
+            return self.invalidate(lambda name, p: name in ("find_panels", "get_panel_maintenance_history")
+                                   and matches(p, "cluster_id", cluster_id) and matches(p, "panel_id", panel_id))
+        return 0
+
+    def clear(self):
+        self.invalidate(lambda name, params: True)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"] + self.stats["collapsed"]
+            return {
+                **self.stats,
+                "entries": len(self._entries),
+                "shared": self._shared is not None,
+                "hit_rate": round((self.stats["hits"] + self.stats["collapsed"]) / lookups, 3) if lookups else 0.0,
+            }
@@ -1,51 +1,484 @@
-import requests
-import json
-from urllib.parse import urljoin
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, NamedTuple, Optional, Union, List, Dict
+
+from utils.FleetState import FleetState
+from utils.GoBackendClient import GoBackendClient
+from utils.ToolCache import ToolResultCache
+from utils.Telemetry import telemetry
+from utils.ToolSchema import ToolArgumentValidator
+
+logger = logging.getLogger(__name__)
+
+
+class ToolRequest(NamedTuple):
+    """
+    A prepared call to the Go backend. Tool handlers build these so that the
+    same argument handling can be sent through either the sync or async transport.
+    """
+    method: str
+    endpoint: str
+    params: Optional[dict] = None
+    data: Optional[dict] = None
+
+
+class BatchTool(NamedTuple):
+    """
+    A tool that takes a list and runs a single-item tool once per entry.
+    `item_arguments` turns a list entry into the arguments of `tool`, and
+    `summarize` reduces one successful result to a compact dict.
+    """
+    tool: str
+    items_arg: str
+    item_arguments: Callable[[Any], dict]
+    summarize: Callable[[dict, Any], dict]
+
+
+def _error_text(result) -> Optional[str]:
+    if isinstance(result, dict) and "error" in result:
+        details = f": {result['details']}" if result.get("details") else ""
+        return f"{result['error']}{details}"[:200]
+    return None
+
+
+def _summarize_dispatch(arguments: dict, result) -> dict:
+    summary = dict(arguments)
+    if isinstance(result, dict):
+        summary.update({k: result[k] for k in ("status", "drone_id") if k in result})
+    return summary
+
+
+def _summarize_maintenance(arguments: dict, result) -> dict:
+    """
+    The number of records per type and the most recent one, instead of the full history.
+    """
+    summary = dict(arguments)
+    if not isinstance(result, list):
+        summary["result"] = result
+        return summary
+    records = [record for record in result if isinstance(record, dict)]
+    types: Dict[str, int] = {}
+    for record in records:
+        types[record.get("type", "unknown")] = types.get(record.get("type", "unknown"), 0) + 1
+    summary["records"] = len(records)
+    summary["types"] = types
+    if records:
+        latest = max(records, key=lambda record: str(record.get("date", "")))
+        summary["latest"] = {k: latest[k] for k in ("type", "date", "status") if k in latest}
+    return summary
+
 
 class ToolExecutor:
-    def __init__(self, go_server_base_url: str):
+    def __init__(self, go_server_base_url: str, max_parallel_tools: int = 4, config: Optional[Dict] = None,
+                 cache_config: Optional[Dict] = None, tools: Optional[List[Dict]] = None,
+                 fleet_config: Optional[Dict] = None):
         """
         Initializes the ToolExecutor with the base URL of the Go backend server.
+        `max_parallel_tools` bounds how many tool calls of one batch run at the same time.
+        `config` is the "go_server" section of configure.json (pool size, timeouts,
+        retry and circuit-breaker settings); defaults are used when it is omitted.
+        `cache_config` is the "tool_cache" section; read-only tool results are
+        cached unless it sets `"enabled": false`.
+        `tools` are the tool definitions whose `parameters` schemas validate the
+        arguments of every call; config/tools.json is read when omitted.
+        The "batch" entry of `config` bounds how many requests a batch tool sends
+        at once (`max_fanout`) and maps single-item tools to a Go batch endpoint
+        (`endpoints`), used instead of the fan-out where one exists.
+        `fleet_config` is the "fleet_state" section; when it sets `"enabled": true`
+        drone and panel reads are answered from a background-polled snapshot.
         """
         self.base_url = go_server_base_url
+        self.max_parallel_tools = max_parallel_tools
+        config = config or {}
+        self.client = GoBackendClient(
+            go_server_base_url,
+            pool_size=config.get("pool_size", 20),
+            timeouts=config.get("timeouts"),
+            retry=config.get("retry"),
+            circuit_breaker=config.get("circuit_breaker"),
+        )
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+
+        batch_config = config.get("batch") or {}
+        self.max_fanout = max(1, batch_config.get("max_fanout", 8))
+        self.batch_endpoints: Dict[str, str] = batch_config.get("endpoints") or {}
+        self._fanout_pool: Optional[ThreadPoolExecutor] = None
+        self._batch_lock = threading.Lock()
+        self.batch_stats = {"calls": 0, "items": 0, "failed_items": 0, "batch_requests": 0}
+
+        cache_config = cache_config or {}
+        self.cache: Optional[ToolResultCache] = None
+        if cache_config.get("enabled", True):
+            self.cache = ToolResultCache(
+                max_entries=cache_config.get("max_entries", 1024),
+                ttl_seconds=cache_config.get("ttl_seconds"),
+                shared_path=cache_config.get("shared_path"),
+            )
+
+        fleet_config = fleet_config or {}
+        self.fleet_state: Optional[FleetState] = None
+        if fleet_config.get("enabled", False):
+            self.fleet_state = FleetState(
+                self.client,
+                poll_interval=fleet_config.get("poll_interval", 2.0),
+                max_staleness=fleet_config.get("max_staleness"),
+                sources=fleet_config.get("sources"),
+            )
+            self.fleet_state.start()
+
+        self.validator = ToolArgumentValidator(tools) if tools is not None else ToolArgumentValidator.from_file()
+        self._handlers = {
+            "find_panels": self._build_find_panels,
+            "get_panel_maintenance_history": self._build_get_panel_maintenance_history,
+            "dispatch_drone_to_cluster": self._build_dispatch_drone_to_cluster,
+            "dispatch_rover_to_panel": self._build_dispatch_rover_to_panel,
+            "get_drone_status": self._build_get_drone_status,
+        }
+        self._batch_tools = {
+            "dispatch_drones_to_clusters": BatchTool("dispatch_drone_to_cluster", "cluster_ids",
+                                                     lambda cluster_id: {"cluster_id": cluster_id},
+                                                     _summarize_dispatch),
+            "get_maintenance_history_batch": BatchTool("get_panel_maintenance_history", "panels", dict,
+                                                       _summarize_maintenance),
+        }
+
+    def set_tools(self, tools: List[Dict]):
+        """
+        Recompiles the argument validators after tools.json changed.
+        """
+        self.validator.set_tools(tools)
+
+    def _get_handler(self, tool_name: str):
+        return self._handlers.get(tool_name)
+
+    def _prepare(self, tool_name: str, parameters: dict) -> tuple:
+        """
+        Validates and coerces the arguments, then lets the handler build the
+        request. Returns `(arguments, prepared)`; invalid arguments come back as
+        an error dict without any request being made.
+        """
+        handler = self._get_handler(tool_name)
+        if not handler:
+            return parameters, {"error": f"Tool '{tool_name}' not found."}
+        arguments, error = self.validator.validate(tool_name, parameters)
+        if error:
+            return parameters, {"error": error}
+        return arguments, handler(arguments)
 
     def execute_tool(self, tool_name: str, parameters: dict):
         """
         Executes a tool call by dispatching to the appropriate handler function.
+        Arguments are validated against the tool's schema first.
+        Reads covered by the fleet-state snapshot are answered from it while it
+        is fresh enough; other read-only tools are served through the result
+        cache. Successful writes invalidate the cached reads they affect.
         """
-        tool_handlers = {
-            "find_panels": self.find_panels,
-            "get_panel_maintenance_history": self.get_panel_maintenance_history,
-            "dispatch_drone_to_cluster": self.dispatch_drone_to_cluster,
-            "dispatch_rover_to_panel": self.dispatch_rover_to_panel,
-            "get_drone_status": self.get_drone_status,
-        }
+        with telemetry.span("tool", tool=tool_name) as span:
+            result = self._execute_tool(tool_name, parameters)
+            span.set(failed=isinstance(result, dict) and "error" in result)
+        return result
 
-        handler = tool_handlers.get(tool_name)
-        if handler:
-            return handler(parameters)
+    def _execute_tool(self, tool_name: str, parameters: dict):
+        if tool_name in self._batch_tools:
+            return self._execute_batch(tool_name, parameters)
+        parameters, prepared = self._prepare(tool_name, parameters)
+        snapshot = self._from_snapshot(tool_name, parameters, prepared)
+        if not isinstance(prepared, ToolRequest):
+            # Validation errors and mock responses are returned as-is
+            result = prepared
+        elif snapshot is not None:
+            result = snapshot
+        elif self.cache and self.cache.is_cacheable(tool_name):
+            result = self.cache.get_or_load(tool_name, parameters, lambda: self._make_request(*prepared))
         else:
-            return {"error": f"Tool '{tool_name}' not found."}
+            result = self._make_request(*prepared)
 
+        self._invalidate_after_write(tool_name, parameters, result)
+        return result
 
-    def _make_request(self, method: str, endpoint: str, params: dict = None, data: dict = None) -> dict:
+    async def aexecute_tool(self, tool_name: str, parameters: dict):
+        """
+        Async counterpart of `execute_tool`; the Go backend is called with httpx
+        so the event loop is not blocked while waiting for it.
+        """
+        with telemetry.span("tool", tool=tool_name) as span:
+            result = await self._aexecute_tool(tool_name, parameters)
+            span.set(failed=isinstance(result, dict) and "error" in result)
+        return result
+
+    async def _aexecute_tool(self, tool_name: str, parameters: dict):
+        if tool_name in self._batch_tools:
+            return await self._aexecute_batch(tool_name, parameters)
+        parameters, prepared = self._prepare(tool_name, parameters)
+        snapshot = self._from_snapshot(tool_name, parameters, prepared)
+        if not isinstance(prepared, ToolRequest):
+            result = prepared
+        elif snapshot is not None:
+            result = snapshot
+        elif self.cache and self.cache.is_cacheable(tool_name):
+            result = await self.cache.aget_or_load(tool_name, parameters, lambda: self._amake_request(*prepared))
+        else:
+            result = await self._amake_request(*prepared)
+
+        self._invalidate_after_write(tool_name, parameters, result)
+        return result
+
+    def _from_snapshot(self, tool_name: str, parameters: dict, prepared):
+        if self.fleet_state is None or not isinstance(prepared, ToolRequest):
+            return None
+        return self.fleet_state.answer(tool_name, parameters)
+
+    def _invalidate_after_write(self, tool_name: str, parameters: dict, result):
+        if isinstance(result, dict) and "error" in result:
+            return
+        if self.cache:
+            self.cache.invalidate_after_write(tool_name, parameters)
+        if self.fleet_state:
+            self.fleet_state.invalidate_after_write(tool_name)
+
+    def execute_tools(self, tool_calls: List[Dict]) -> list:
+        """
+        Executes a batch of tool calls (as returned by `GPTParsingUtils.tool_calls_parsing`)
+        concurrently on a bounded thread pool. Calls in one batch are treated as
+        independent; results are returned in the same order as the calls, and a
+        call that raises gets an `{"error": ...}` result without failing the others.
+        """
+        if len(tool_calls) <= 1:
+            return [self._run_item(call["tool_name"], call["parameters"]) for call in tool_calls]
+
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.max_parallel_tools,
+                                                   thread_name_prefix="tool-executor")
+        # Each call runs in a copy of the caller's context, so its span joins the request's trace
+        futures = [
+            self._thread_pool.submit(contextvars.copy_context().run, self._run_item, call["tool_name"],
+                                     call["parameters"])
+            for call in tool_calls
+        ]
+        return [future.result() for future in futures]
+
+    async def aexecute_tools(self, tool_calls: List[Dict]) -> list:
+        """
+        Async counterpart of `execute_tools`, bounded by the same `max_parallel_tools`.
+        """
+        semaphore = asyncio.Semaphore(self.max_parallel_tools)
+
+        async def run(call):
+            async with semaphore:
+                return await self._arun_item(call["tool_name"], call["parameters"])
+
+        return await asyncio.gather(*(run(call) for call in tool_calls))
+
+    # --- Batch tools ---
+    # A batch tool runs its single-item tool for every list entry, either through
+    # one request to a Go batch endpoint or as a bounded concurrent fan-out.
+    # Every entry goes through the single tool's validation, cache and
+    # invalidation; the results are reduced to one compact summary.
+
+    def _batch_items(self, tool_name: str, parameters: dict) -> tuple:
         """
-        A helper function to make HTTP requests to the Go backend.
+        Validates the batch arguments; returns `(batch, items)` or `(None, error)`.
         """
-        url = urljoin(self.base_url, endpoint)
+        arguments, error = self.validator.validate(tool_name, parameters)
+        if error:
+            return None, {"error": error}
+        batch = self._batch_tools[tool_name]
+        entries = (arguments or {}).get(batch.items_arg)
+        if not isinstance(entries, list) or not entries:
+            return None, {"error": f"{batch.items_arg} must be a non-empty list."}
+        return batch, [batch.item_arguments(entry) for entry in entries]
+
+    def _execute_batch(self, tool_name: str, parameters: dict) -> dict:
+        batch, items = self._batch_items(tool_name, parameters)
+        if batch is None:
+            return items
+        if batch.tool in self.batch_endpoints:
+            results = self._run_batch_endpoint(batch.tool, items)
+        else:
+            if self._fanout_pool is None:
+                self._fanout_pool = ThreadPoolExecutor(max_workers=self.max_fanout, thread_name_prefix="tool-fanout")
+            futures = [self._fanout_pool.submit(contextvars.copy_context().run, self._run_item, batch.tool, item)
+                       for item in items]
+            results = [future.result() for future in futures]
+        return self._aggregate(batch, items, results)
+
+    async def _aexecute_batch(self, tool_name: str, parameters: dict) -> dict:
+        batch, items = self._batch_items(tool_name, parameters)
+        if batch is None:
+            return items
+        if batch.tool in self.batch_endpoints:
+            results = await self._arun_batch_endpoint(batch.tool, items)
+        else:
+            semaphore = asyncio.Semaphore(self.max_fanout)
+
+            async def run(item):
+                async with semaphore:
+                    return await self._arun_item(batch.tool, item)
+
+            results = await asyncio.gather(*(run(item) for item in items))
+        return self._aggregate(batch, items, results)
+
+    # Used for every call of `execute_tools` and of a fan-out, so that one call
+    # that raises does not discard the results of the others
+
+    def _run_item(self, tool_name: str, arguments: dict):
+        try:
+            return self.execute_tool(tool_name, arguments)
+        except Exception as e:
+            return self.failure_result(tool_name, e)
+
+    async def _arun_item(self, tool_name: str, arguments: dict):
         try:
-            response = requests.request(method, url, params=params, json=data, timeout=10)
-            response.raise_for_status()  # Raises an HTTPError for bad responses (4xx or 5xx)
-            if response.status_code == 204: # No Content
-                return {"status": "success", "message": "Request successful with no content returned."}
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            return {"error": f"HTTP error occurred: {e.response.status_code} {e.response.reason}", "details": e.response.text}
-        except requests.exceptions.RequestException as e:
-            return {"error": f"Failed to call Go backend endpoint '{endpoint}': {e}"}
-    
+            return await self.aexecute_tool(tool_name, arguments)
+        except Exception as e:
+            return self.failure_result(tool_name, e)
+
+    @staticmethod
+    def failure_result(tool_name: str, error: Exception) -> dict:
+        logger.error("Tool %s failed: %s", tool_name, error, extra={"tool": tool_name})
+        return {"error": f"{tool_name} failed: {error}"}
+
+    def _prepare_batch_request(self, tool_name: str, items: List[dict]) -> tuple:
+        """
+        Validates every item and builds the body of the batch endpoint request
+        from the valid ones. Returns `(results, valid_positions, request)` with
+        the validation errors already in `results`.
+        """
+        results: List[Any] = [None] * len(items)
+        valid, bodies = [], []
+        for position, item in enumerate(items):
+            arguments, prepared = self._prepare(tool_name, item)
+            if isinstance(prepared, ToolRequest):
+                valid.append(position)
+                bodies.append(arguments)
+            else:
+                results[position] = prepared
+        request = ToolRequest("POST", self.batch_endpoints[tool_name], data={"items": bodies})
+        return results, valid, request
+
+    def _spread_batch_response(self, tool_name: str, items: List[dict], results: list, valid: List[int],
+                               response) -> list:
+        """
+        Places the per-item results of a batch endpoint response (a list in item
+        order, or `{"results": [...]}`) and invalidates the cache after writes.
+        A failed batch request fails every item it carried.
+        """
+        if isinstance(response, dict) and "results" in response:
+            response = response["results"]
+        if not isinstance(response, list) or len(response) != len(valid):
+            error = response if _error_text(response) else {"error": "Unexpected batch endpoint response."}
+            response = [error] * len(valid)
+        for position, result in zip(valid, response):
+            results[position] = result
+            self._invalidate_after_write(tool_name, items[position], result)
+        return results
+
+    def _run_batch_endpoint(self, tool_name: str, items: List[dict]) -> list:
+        results, valid, request = self._prepare_batch_request(tool_name, items)
+        if not valid:
+            return results
+        self._count_batch(batch_requests=1)
+        return self._spread_batch_response(tool_name, items, results, valid, self._make_request(*request))
+
+    async def _arun_batch_endpoint(self, tool_name: str, items: List[dict]) -> list:
+        results, valid, request = self._prepare_batch_request(tool_name, items)
+        if not valid:
+            return results
+        self._count_batch(batch_requests=1)
+        response = await self._amake_request(*request)
+        return self._spread_batch_response(tool_name, items, results, valid, response)
+
+    def _aggregate(self, batch: BatchTool, items: List[dict], results: list) -> dict:
+        """
+        One compact result for the whole batch: counts, a short summary per
+        succeeded item and the error of every failed one.
+        """
+        succeeded, failed = [], []
+        for item, result in zip(items, results):
+            error = _error_text(result)
+            if error:
+                failed.append({**item, "error": error})
+            else:
+                succeeded.append(batch.summarize(item, result))
+        self._count_batch(calls=1, items=len(items), failed_items=len(failed))
+        summary = {"requested": len(items), "succeeded": len(succeeded), "failed": len(failed),
+                   "results": succeeded}
+        if failed:
+            summary["errors"] = failed
+        return summary
+
+    def _count_batch(self, **increments):
+        with self._batch_lock:
+            for key, value in increments.items():
+                self.batch_stats[key] += value
+
+
+    def _make_request(self, method: str, endpoint: str, params: dict = None, data: dict = None) -> dict:
+        """
+        A helper function to make HTTP requests to the Go backend through the pooled client.
+        """
+        return self.client.request(method, endpoint, params=params, data=data)
+
+    async def _amake_request(self, method: str, endpoint: str, params: dict = None, data: dict = None) -> dict:
+        """
+        Async version of `_make_request`, returning the same result and error shapes.
+        """
+        return await self.client.arequest(method, endpoint, params=params, data=data)
+
+    def warm_up(self) -> bool:
+        """
+        Opens a connection to the Go backend ahead of the first tool call.
+        """
+        return self.client.warm_up()
+
+    async def awarm_up(self) -> bool:
+        return await self.client.awarm_up()
+
+    def get_stats(self) -> dict:
+        """
+        Connection-reuse, retry, circuit-breaker and latency stats of the Go backend
+        client, plus hit/miss/eviction counters of the result cache, how many
+        calls were rejected by argument validation, batch tool counters and the
+        age and hit counts of the fleet-state snapshot.
+        """
+        stats = self.client.get_stats()
+        stats["cache"] = self.cache.get_stats() if self.cache else {"enabled": False}
+        stats["validation"] = self.validator.get_stats()
+        with self._batch_lock:
+            stats["batch"] = {**self.batch_stats, "max_fanout": self.max_fanout}
+        stats["fleet_state"] = self.fleet_state.get_stats() if self.fleet_state else {"enabled": False}
+        return stats
+
+
+    # --- Tool Handlers ---
+    # The public methods keep their original behaviour; the `_build_*` methods
+    # hold the argument handling and return either a ToolRequest or a result dict.
 
     def find_panels(self, parameters: dict) -> dict:
+        return self.execute_tool("find_panels", parameters)
+
+    def get_panel_maintenance_history(self, parameters: dict) -> dict:
+        return self.execute_tool("get_panel_maintenance_history", parameters)
+
+    def dispatch_drone_to_cluster(self, parameters: dict) -> dict:
+        return self.execute_tool("dispatch_drone_to_cluster", parameters)
+
+    def dispatch_rover_to_panel(self, parameters: dict) -> dict:
+        return self.execute_tool("dispatch_rover_to_panel", parameters)
+
+    def get_drone_status(self, parameters: dict) -> dict:
+        return self.execute_tool("get_drone_status", parameters)
+
+    def dispatch_drones_to_clusters(self, parameters: dict) -> dict:
+        return self.execute_tool("dispatch_drones_to_clusters", parameters)
+
+    def get_maintenance_history_batch(self, parameters: dict) -> dict:
+        return self.execute_tool("get_maintenance_history_batch", parameters)
+
+    def _build_find_panels(self, parameters: dict) -> Union[ToolRequest, dict]:
         """
         Handles the 'find_panels' tool by calling GET /api/panels with optional filters.
         """
@@ -57,9 +490,9 @@ class ToolExecutor:
         }
         # Filter out None values so they are not included in the query string
         cleaned_params = {k: v for k, v in query_params.items() if v is not None}
-        return self._make_request("GET", "api/panels", params=cleaned_params)
+        return ToolRequest("GET", "api/panels", params=cleaned_params)
 
-    def get_panel_maintenance_history(self, parameters: dict) -> dict:
+    def _build_get_panel_maintenance_history(self, parameters: dict) -> Union[ToolRequest, dict]:
         """
         Handles 'get_panel_maintenance_history' by calling GET /api/maintenance_requests.
         """
@@ -73,22 +506,22 @@ class ToolExecutor:
             "clusterid": cluster_id,
             "panelid": panel_id,
         }
-        return self._make_request("GET", "api/maintenance_requests", params=query_params)
+        return ToolRequest("GET", "api/maintenance_requests", params=query_params)
 
-    def dispatch_drone_to_cluster(self, parameters: dict) -> dict:
+    def _build_dispatch_drone_to_cluster(self, parameters: dict) -> Union[ToolRequest, dict]:
         """
         Handles 'dispatch_drone_to_cluster' by calling POST /api/drones/send/{cluster_id}.
         """
         cluster_id = parameters.get("cluster_id")
         if not cluster_id:
             return {"error": "cluster_id is a required parameter."}
-        
+
         endpoint = f"api/drones/send/{cluster_id}"
-        return self._make_request("POST", endpoint)
+        return ToolRequest("POST", endpoint)
 
 
 
-    def dispatch_rover_to_panel(self, parameters: dict) -> dict:
+    def _build_dispatch_rover_to_panel(self, parameters: dict) -> Union[ToolRequest, dict]:
         """
         Handles 'dispatch_rover_to_panel'.
         NOTE: This is a placeholder as the exact API endpoint needs confirmation.
@@ -102,12 +535,12 @@ class ToolExecutor:
         # This endpoint is an assumption based on `handlers.go` and needs to be verified.
         # For now, it returns a mock success message.
         # endpoint = f"api/rover/send/{cluster_id}/{panel_id}"
-        # return self._make_request("POST", endpoint)
-        
-        print(f"--- MOCK CALL ---: Dispatching rover to Cluster {cluster_id}, Panel {panel_id}")
+        # return ToolRequest("POST", endpoint)
+
+        logger.info("Mock call: dispatching rover to cluster %s, panel %s", cluster_id, panel_id)
         return {"status": "success", "message": f"Rover dispatched to cluster {cluster_id}, panel {panel_id}. (Mock Response)"}
 
-    def get_drone_status(self, parameters: dict) -> dict:
+    def _build_get_drone_status(self, parameters: dict) -> Union[ToolRequest, dict]:
         """
         Handles the 'get_drone_status' tool by calling GET /api/drones with optional filters.
         """
@@ -116,4 +549,4 @@ class ToolExecutor:
             "destination": parameters.get("destination_cluster_id"),
         }
         cleaned_params = {k: v for k, v in query_params.items() if v is not None}
-        return self._make_request("GET", "api/drones", params=cleaned_params)
\ No newline at end of file
+        return ToolRequest("GET", "api/drones", params=cleaned_params)
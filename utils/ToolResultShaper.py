@@ -0,0 +1,173 @@
+import json
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from utils.ContextWindow import TokenEstimator
+from utils.Telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Row encodings of a shaped result
+FORMATS = ("table", "json")
+
+
+class ToolResultShaper:
+    """
+    Shapes tool results before they are stored in the conversation history,
+    and so before they reach the model's context.
+
+    A tool opts in with a "result" entry next to its definition in tools.json:
+      * `fields`: the keys kept of every row (projection);
+      * `max_rows`: the rows kept; the number of the others is given as `omitted`;
+      * `aggregate`: fields whose values are counted over all rows when some were omitted;
+      * `format`: "table" (the default) sends `columns` once and every row as a
+        list of values, "json" sends the rows as objects;
+      * `rows_key`: for results that are an object, the key of their row list.
+    The rows are the result itself when it is a list of objects. Results of
+    other shapes, errors and tools without a "result" entry are stored as before.
+
+    Whenever rows or fields were dropped, the full result is kept in a bounded
+    LRU under a reference (`ref` in the shaped result), per conversation, so
+    clients can still fetch it. Prompt tokens saved are counted per tool.
+    """
+
+    def __init__(self, tools: Optional[List[Dict]] = None, enabled: bool = True, max_stored: int = 256,
+                 estimator: Optional[TokenEstimator] = None):
+        self.enabled = enabled
+        self.max_stored = max_stored
+        self.estimator = estimator or TokenEstimator()
+        self._specs: Dict[str, Dict] = {}
+        self._stored: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "evicted": 0, "lookups": 0, "lookup_misses": 0}
+        self.tool_stats: Dict[str, Dict[str, int]] = {}
+        self.set_tools(tools or [])
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict], tools: List[Dict],
+                    estimator: Optional[TokenEstimator] = None) -> "ToolResultShaper":
+        """
+        Builds the shaper from the "tool_results" section of configure.json.
+        """
+        config = config or {}
+        return cls(tools, enabled=config.get("enabled", True), max_stored=config.get("max_stored", 256),
+                   estimator=estimator)
+
+    def set_tools(self, tools: List[Dict]):
+        """
+        Picks up the "result" entries after tools.json changed.
+        """
+        specs = {}
+        for tool in tools:
+            spec = tool.get("result")
+            if not spec:
+                continue
+            if spec.get("format", "table") not in FORMATS:
+                logger.warning("Ignoring the result shaping of '%s': unsupported format '%s'",
+                               tool["name"], spec["format"])
+                continue
+            specs[tool["name"]] = spec
+        self._specs = specs
+
+    def shape(self, conversation_id: str, tool_name: str, result: Any) -> str:
+        """
+        The history content of one tool result: the shaped result as compact
+        JSON, or the result as it is when the tool declares no shaping.
+        """
+        content = json.dumps(result, ensure_ascii=False)
+        spec = self._specs.get(tool_name) if self.enabled else None
+        rows = self._rows(spec, result) if spec else None
+        if rows is None:
+            return content
+
+        shaped, lossy = self._shape_rows(spec, rows)
+        if spec.get("rows_key"):
+            shaped = {**{k: v for k, v in result.items() if k != spec["rows_key"]}, **shaped}
+        if lossy:
+            shaped["ref"] = self._store(conversation_id, tool_name, result)
+        shaped_content = json.dumps(shaped, ensure_ascii=False, separators=(",", ":"))
+
+        raw_tokens = self.estimator.count_text(content)
+        tokens = self.estimator.count_text(shaped_content)
+        with self._lock:
+            stats = self.tool_stats.setdefault(tool_name, {"shaped": 0, "raw_tokens": 0, "tokens": 0,
+                                                           "tokens_saved": 0})
+            stats["shaped"] += 1
+            stats["raw_tokens"] += raw_tokens
+            stats["tokens"] += tokens
+            stats["tokens_saved"] += raw_tokens - tokens
+        telemetry.record_tool_result_shaping(tool_name, raw_tokens - tokens)
+        return shaped_content
+
+    @staticmethod
+    def _rows(spec: Dict, result: Any) -> Optional[list]:
+        if spec.get("rows_key"):
+            result = result.get(spec["rows_key"]) if isinstance(result, dict) else None
+        if not isinstance(result, list) or not all(isinstance(row, dict) for row in result):
+            return None
+        return result
+
+    @staticmethod
+    def _shape_rows(spec: Dict, rows: List[Dict]) -> tuple:
+        """
+        Returns the shaped rows with their counts, and whether anything of the
+        original rows was left out.
+        """
+        fields = spec.get("fields")
+        if not fields:
+            # Every key, in the order of first appearance
+            fields = list(dict.fromkeys(key for row in rows for key in row))
+        max_rows = spec.get("max_rows")
+        kept = rows if max_rows is None else rows[:max_rows]
+        shaped: Dict[str, Any] = {"total": len(rows)}
+        if len(kept) < len(rows):
+            shaped["omitted"] = len(rows) - len(kept)
+        if spec.get("aggregate") and len(kept) < len(rows):
+            counts = {}
+            for field in spec["aggregate"]:
+                values: Dict[str, int] = {}
+                for row in rows:
+                    value = str(row.get(field))
+                    values[value] = values.get(value, 0) + 1
+                counts[field] = dict(sorted(values.items(), key=lambda item: -item[1]))
+            shaped["counts"] = counts
+        if spec.get("format", "table") == "table":
+            shaped["columns"] = fields
+            shaped["rows"] = [[row.get(field) for field in fields] for row in kept]
+        else:
+            shaped["rows"] = [{field: row[field] for field in fields if field in row} for row in kept]
+        lossy = len(kept) < len(rows) or any(key not in fields for row in rows for key in row)
+        return shaped, lossy
+
+    def _store(self, conversation_id: str, tool_name: str, result: Any) -> str:
+        ref = uuid.uuid4().hex[:16]
+        with self._lock:
+            self._stored[ref] = {"conversation_id": conversation_id, "tool_name": tool_name, "result": result}
+            self.stats["stored"] += 1
+            while len(self._stored) > self.max_stored:
+                self._stored.popitem(last=False)
+                self.stats["evicted"] += 1
+        return ref
+
+    def get_full_result(self, conversation_id: str, ref: str) -> Optional[Dict]:
+        """
+        The full result behind a reference of the conversation, as
+        `{"ref", "tool_name", "result"}`; None once it was evicted.
+        """
+        with self._lock:
+            self.stats["lookups"] += 1
+            entry = self._stored.get(ref)
+            if entry is None or entry["conversation_id"] != conversation_id:
+                self.stats["lookup_misses"] += 1
+                return None
+            self._stored.move_to_end(ref)
+            return {"ref": ref, "tool_name": entry["tool_name"], "result": entry["result"]}
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "enabled": self.enabled, "held": len(self._stored),
+                    "shaped_tools": sorted(self._specs),
+                    "tools": {name: dict(stats) for name, stats in self.tool_stats.items()}}
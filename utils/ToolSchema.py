@@ -0,0 +1,152 @@
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Annotated, Any, Dict, List, Literal, Optional, Tuple
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, ValidationError, create_model
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOOLS_PATH = Path(__file__).parent.parent / "config" / "tools.json"
+
+# JSON-Schema types and the Python types pydantic coerces them to
+JSON_TYPES = {"integer": int, "number": float, "string": str, "boolean": bool, "array": list, "object": dict}
+
+
+def _enum_case_folder(values: List[str]):
+    """
+    Maps a string to the enum member it matches case-insensitively ("Dirty" -> "dirty").
+    """
+    by_folded = {str(value).casefold(): value for value in values}
+
+    def fold(value):
+        if isinstance(value, str):
+            return by_folded.get(value.strip().casefold(), value)
+        return value
+
+    return fold
+
+
+def _field_type(schema: Dict[str, Any], model_name: str):
+    if "enum" in schema:
+        values = schema["enum"]
+        annotation = Literal[tuple(values)]
+        if all(isinstance(value, str) for value in values):
+            return Annotated[annotation, BeforeValidator(_enum_case_folder(values))]
+        return annotation
+    if schema.get("type") == "array" and "items" in schema:
+        item = _field_type(schema["items"], f"{model_name}_item")
+        return Annotated[List[item], Field(min_length=schema.get("minItems"), max_length=schema.get("maxItems"))]
+    if schema.get("type") == "object" and "properties" in schema:
+        return _compile_model(schema, model_name)
+    return JSON_TYPES.get(schema.get("type"), Any)
+
+
+def _compile_model(parameters: Dict[str, Any], model_name: str) -> type:
+    required = set(parameters.get("required", []))
+    fields = {}
+    for name, schema in (parameters.get("properties") or {}).items():
+        annotation = _field_type(schema, f"{model_name}_{name}")
+        fields[name] = (annotation, ...) if name in required else (Optional[annotation], None)
+    return create_model(model_name, __config__=ConfigDict(extra="ignore"), **fields)
+
+
+def compile_tool_model(tool: Dict[str, Any]) -> type:
+    """
+    Builds a pydantic model from the JSON-Schema `parameters` of one tool.
+    Arrays and nested objects are validated item by item. Arguments not in the
+    schema are dropped.
+    """
+    return _compile_model(tool.get("parameters") or {}, f"{tool['name']}_arguments")
+
+
+# Short wording for the pydantic errors the model usually runs into
+ERROR_WORDING = {
+    "int_type": "must be an integer", "int_parsing": "must be an integer", "int_from_float": "must be an integer",
+    "float_type": "must be a number", "float_parsing": "must be a number",
+    "bool_type": "must be true or false", "bool_parsing": "must be true or false",
+    "string_type": "must be a string", "list_type": "must be an array", "dict_type": "must be an object",
+    "model_type": "must be an object",
+}
+
+
+def _describe(error: Dict[str, Any]) -> str:
+    field = ".".join(str(part) for part in error["loc"]) or "arguments"
+    if error["type"] == "missing":
+        return f"{field}: required"
+    if error["type"] == "literal_error":
+        expected = error.get("ctx", {}).get("expected", "")
+        return f"{field}: must be one of {expected} (got {error['input']!r})"
+    if error["type"] in ("too_short", "too_long"):
+        bound = "at least" if error["type"] == "too_short" else "at most"
+        limit = error.get("ctx", {}).get("min_length" if error["type"] == "too_short" else "max_length")
+        return f"{field}: must have {bound} {limit} items (got {error.get('ctx', {}).get('actual_length')})"
+    wording = ERROR_WORDING.get(error["type"], error["msg"].lower())
+    return f"{field}: {wording} (got {error['input']!r})"
+
+
+class ToolArgumentValidator:
+    """
+    Validates and coerces tool arguments against the schemas in tools.json
+    before any request is sent: types are coerced where it is lossless ("3" ->
+    3), enum values are matched case-insensitively and required fields are
+    checked. The pydantic models are compiled once per tools.json version.
+    """
+
+    def __init__(self, tools: List[Dict[str, Any]]):
+        self._lock = threading.Lock()
+        self._models: Dict[str, type] = {}
+        self._tools = None
+        self.stats = {"validated": 0, "coerced": 0, "rejected": 0}
+        self.set_tools(tools)
+
+    @classmethod
+    def from_file(cls, path=None) -> "ToolArgumentValidator":
+        path = Path(path) if path else DEFAULT_TOOLS_PATH
+        if not path.exists():
+            logger.warning("%s not found. Tool arguments will not be validated.", path)
+            return cls([])
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def set_tools(self, tools: List[Dict[str, Any]]):
+        """
+        Recompiles the models when the tool definitions changed.
+        """
+        if tools is self._tools:
+            return
+        models = {tool["name"]: compile_tool_model(tool) for tool in tools}
+        with self._lock:
+            self._models, self._tools = models, tools
+
+    def validate(self, tool_name: str, parameters: Any) -> Tuple[Optional[dict], Optional[str]]:
+        """
+        Returns `(arguments, None)` with the coerced arguments, or `(None, error)`
+        with a compact description of every problem. Tools without a schema
+        pass through unchanged.
+        """
+        model: Optional[BaseModel] = self._models.get(tool_name)
+        if model is None:
+            return parameters, None
+        if not isinstance(parameters, dict):
+            self._count("rejected")
+            return None, f"Invalid arguments for {tool_name}: expected a JSON object."
+        try:
+            arguments = model.model_validate(parameters).model_dump(exclude_unset=True)
+        except ValidationError as e:
+            self._count("rejected")
+            problems = "; ".join(_describe(error) for error in e.errors(include_url=False))
+            return None, f"Invalid arguments for {tool_name}: {problems}"
+        self._count("validated")
+        if arguments != parameters:
+            self._count("coerced")
+        return arguments, None
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "tools": len(self._models)}
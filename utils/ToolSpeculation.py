@@ -0,0 +1,191 @@
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from utils.GPTTools import ToolCallScanner
+from utils.ToolCache import ToolResultCache
+
+logger = logging.getLogger(__name__)
+
+# Tools that only read from the Go server. Nothing else is ever run speculatively:
+# a dispatch the model did not end up asking for cannot be taken back.
+READ_ONLY_TOOLS = frozenset({"find_panels", "get_drone_status", "get_panel_maintenance_history"})
+
+
+def _call_key(tool_name: str, parameters: dict) -> Tuple[str, str]:
+    return tool_name, json.dumps(ToolResultCache.normalize(parameters), sort_keys=True)
+
+
+class _Speculation:
+    __slots__ = ("future", "started_at", "done_at")
+
+    def __init__(self, future):
+        self.future = future
+        self.started_at = time.perf_counter()
+        self.done_at: Optional[float] = None
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.done_at = time.perf_counter()
+        if not future.cancelled():
+            # Retrieved here, so a wasted call that raised is not reported as unhandled
+            future.exception()
+
+
+class SpeculativeRun:
+    """
+    The speculative tool calls of one completion. `feed` gets the streamed
+    deltas and starts every read-only call as soon as its arguments close;
+    `execute_tools` then answers the parsed calls, taking the result of an
+    identical speculative call where there is one.
+    """
+
+    def __init__(self, speculator: "ToolSpeculator", asynchronous: bool):
+        self.speculator = speculator
+        self.asynchronous = asynchronous
+        self._scanner = ToolCallScanner()
+        self._started: Dict[Tuple[str, str], List[_Speculation]] = {}
+        self._finished_at: Optional[float] = None
+
+    def feed(self, delta: str):
+        for call in self._scanner.feed(delta):
+            self._start(call)
+
+    def finish(self):
+        for call in self._scanner.finish():
+            self._start(call)
+        self._finished_at = time.perf_counter()
+
+    def _start(self, call: dict):
+        tool_name, parameters = call["tool_name"], call["parameters"]
+        if tool_name not in self.speculator.tools:
+            return
+        executor = self.speculator.tool_executor
+        if self.asynchronous:
+            future = asyncio.ensure_future(executor.aexecute_tool(tool_name, parameters))
+        else:
+            # In a copy of the caller's context, so the tool span joins the request's trace
+            future = self.speculator.pool().submit(contextvars.copy_context().run, executor.execute_tool,
+                                                   tool_name, parameters)
+        self._started.setdefault(_call_key(tool_name, parameters), []).append(_Speculation(future))
+        self.speculator.count(started=1)
+
+    def _take(self, tool_calls: List[Dict]) -> Dict[int, _Speculation]:
+        """
+        The speculative calls matching the parsed ones, by position. Whatever
+        is left over was not asked for in the end and is counted as wasted.
+        """
+        taken = {}
+        for position, call in enumerate(tool_calls):
+            started = self._started.get(_call_key(call["tool_name"], call["parameters"]))
+            if started:
+                taken[position] = started.pop(0)
+        wasted = sum(len(started) for started in self._started.values())
+        self._started.clear()
+        self.speculator.count(used=len(taken), wasted=wasted)
+        return taken
+
+    def _overlap(self, speculation: _Speculation) -> float:
+        # The part of the tool call that ran while the model was still generating
+        finished_at = self._finished_at or time.perf_counter()
+        done_at = speculation.done_at or finished_at
+        return max(0.0, min(done_at, finished_at) - speculation.started_at)
+
+    def _result(self, call: Dict, speculation: _Speculation):
+        # A speculative call that raised fails on its own, as in `execute_tools`
+        try:
+            return speculation.future.result()
+        except Exception as e:
+            return self.speculator.tool_executor.failure_result(call["tool_name"], e)
+
+    async def _aresult(self, call: Dict, speculation: _Speculation):
+        try:
+            return await speculation.future
+        except Exception as e:
+            return self.speculator.tool_executor.failure_result(call["tool_name"], e)
+
+    def execute_tools(self, tool_calls: List[Dict]) -> list:
+        taken = self._take(tool_calls)
+        rest = [call for position, call in enumerate(tool_calls) if position not in taken]
+        rest_results = iter(self.speculator.tool_executor.execute_tools(rest))
+        results = [self._result(call, taken[position]) if position in taken else next(rest_results)
+                   for position, call in enumerate(tool_calls)]
+        self.speculator.count(overlap_seconds=sum(self._overlap(s) for s in taken.values()))
+        return results
+
+    async def aexecute_tools(self, tool_calls: List[Dict]) -> list:
+        taken = self._take(tool_calls)
+        rest = [call for position, call in enumerate(tool_calls) if position not in taken]
+        rest_results = iter(await self.speculator.tool_executor.aexecute_tools(rest))
+        results = [await self._aresult(call, taken[position]) if position in taken else next(rest_results)
+                   for position, call in enumerate(tool_calls)]
+        self.speculator.count(overlap_seconds=sum(self._overlap(s) for s in taken.values()))
+        return results
+
+
+class ToolSpeculator:
+    """
+    Speculative execution of read-only tools while the model is still
+    generating. With it, the servers stream every completion of a chat turn
+    and hand the deltas to a `SpeculativeRun`, so the Go server is already
+    working on a lookup while the model writes the rest of its reply (further
+    calls, or the closing tokens), and the summary completion can start as
+    soon as the reply ends.
+
+    Only the configured tools that are in READ_ONLY_TOOLS are run this way;
+    dispatches never are. A speculative result is used only for a parsed call
+    with the same tool and arguments, so a reply that is corrected afterwards
+    (or whose call turns out different) just runs its calls as usual.
+    """
+
+    def __init__(self, tool_executor, enabled: bool = False, tools: Optional[List[str]] = None):
+        self.tool_executor = tool_executor
+        self.enabled = enabled
+        requested = set(tools) if tools is not None else set(READ_ONLY_TOOLS)
+        unsafe = requested - READ_ONLY_TOOLS
+        if unsafe:
+            logger.warning("Never running these tools speculatively, they are not read-only: %s",
+                           ", ".join(sorted(unsafe)))
+        self.tools = requested & READ_ONLY_TOOLS
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {"completions": 0, "started": 0, "used": 0, "wasted": 0, "overlap_seconds": 0.0}
+
+    @classmethod
+    def from_config(cls, tool_executor, config: Optional[Dict]) -> "ToolSpeculator":
+        """
+        Builds the speculator from the "speculative_tools" section of configure.json.
+        """
+        config = config or {}
+        return cls(tool_executor, enabled=config.get("enabled", False), tools=config.get("tools"))
+
+    def start(self, asynchronous: bool = False) -> SpeculativeRun:
+        """
+        A run for the next completion; with `asynchronous`, its calls are
+        started as tasks of the running event loop instead of on threads.
+        """
+        self.count(completions=1)
+        return SpeculativeRun(self, asynchronous)
+
+    def pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.tool_executor.max_parallel_tools,
+                                                thread_name_prefix="tool-speculation")
+            return self._pool
+
+    def count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["overlap_seconds"] = round(stats["overlap_seconds"], 3)
+        return {"enabled": self.enabled, "tools": sorted(self.tools), **stats}
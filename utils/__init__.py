@@ -1 +1,21 @@
 # General utility functions and helpers
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+# COORDINATE_CONFIG points every component at another configure.json, e.g. the one
+# the worker supervisor writes for its workers
+CONFIG_PATH = Path(os.getenv("COORDINATE_CONFIG") or Path(__file__).parent.parent / "config" / "configure.json")
+
+
+def load_config(config_path: Optional[Path] = None) -> dict:
+    """
+    Loads `config/configure.json` (or the given file) as a dictionary.
+    """
+    config_path = Path(config_path) if config_path else CONFIG_PATH
+    if not config_path.exists():
+        raise FileNotFoundError(f"Config file not found at {config_path}")
+
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)